@@ -1,12 +1,16 @@
 from .logger_config import logger  # Будем вести лог
 from collections import defaultdict, OrderedDict, deque  # Словари и очередь
 from datetime import datetime, date
+from threading import RLock  # Сделки обрабатываются из потока обратного вызова и из сверки после повторного подключения
 
 from backtrader import BrokerBase, Order, BuyOrder, SellOrder
 from backtrader.position import Position
 from backtrader.utils.py3 import with_metaclass
 
 from .QJStore import QKStore
+from .QuikJuniorPy import RequestTimeoutError  # Запрос к QUIK# не выполнен за отведенное время
+from .QJMetrics import metrics  # Метрики задержек
+from .QJOrderTracer import OrderTracer  # Трассировка заявок по номеру транзакции
 
 
 # noinspection PyArgumentList
@@ -26,6 +30,7 @@ class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
         ('slippage_steps', 10),  # Кол-во шагов цены для проскальзывания
         # По статье https://zen.yandex.ru/media/id/5e9a612424270736479fad54/bitva-s-finam-624f12acc3c38f063178ca95
         ('client_code_for_orders', None),  # Номер торгового терминала. У брокера Финам требуется для совершения торговых операций
+        ('trace_file', None),  # Журнал задержек завершенных заявок. CSV (разделитель табуляция) или .parquet
     )
 
     def __init__(self, **kwargs):
@@ -34,18 +39,25 @@ class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
         self.notifs = deque()  # Очередь уведомлений брокера о заявках
         self.startingcash = self.cash = 0  # Стартовые и текущие все свободные средства
         self.startingvalue = self.value = 0  # Стартовая и текущая стоимость всех позиций
-        self.trade_nums = {}  # Список номеров сделок по тикеру для фильтрации дублей сделок
+        self.trade_nums = {}  # Номера сделок по тикеру для фильтрации дублей сделок. Название тикера → set
+        self.trade_lock = RLock()  # Проверка дубля, запоминание номера сделки и исполнение заявки выполняются одним потоком
         self.positions = defaultdict(Position)  # Список позиций
         self.orders = OrderedDict()  # Список заявок, отправленных на биржу
         self.ocos = {}  # Список связанных заявок (One Cancel Others)
         self.pcs = defaultdict(deque)  # Очередь всех родительских/дочерних заявок (Parent - Children)
+        self.tracer = OrderTracer(self.p.trace_file)  # Трассировка заявок. Процентили задержек по тикерам: self.tracer.stats()
 
-        self.store.provider.on_trans_reply = self.on_trans_reply  # Ответ на транзакцию пользователя
-        self.store.provider.on_trade = self.on_trade  # Получение новой / изменение существующей сделки
-        self.accounts = self.store.provider.accounts
+    @property
+    def accounts(self):
+        """Счета. Берутся из провайдера, который подключается к QUIK при первом обращении"""
+        return self.store.provider.accounts
 
     def start(self):
         super(QKBroker, self).start()
+        self.store.provider.on_trans_reply = self.on_trans_reply  # Ответ на транзакцию пользователя
+        self.store.provider.on_trade = self.on_trade  # Получение новой / изменение существующей сделки
+        if self.store.supervisor and self.reconcile not in self.store.supervisor.on_reconnected:  # Если есть контроль соединения
+            self.store.supervisor.on_reconnected.append(self.reconcile)  # то после повторного подключения сверяем заявки, сделки и позиции
         self._datas = list(self.cerebro.datas)
         self.get_all_active_positions()  # Получаем все активные позиции
         
@@ -116,10 +128,9 @@ class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
             account = next((account for account in self.accounts if class_code in account['class_codes']), None)  # По коду режима находим счет
             if account_id is not None and account != self.accounts[account_id]:  # Если смотрим стоимость по счету, и это не заданный счет
                 continue  # то переходим к следующей позиции, дальше не продолжаем
-            if class_code != self.store.provider.futures_cls_code:
-                last_price = self.store.provider.quik_price_to_price(class_code, sec_code, float(self.store.provider.get_param_ex(class_code, sec_code, 'LAST')['data']['param_value']))  # Последняя цена сделки в рублях за штуку
-            else:
-                last_price = float(self.store.provider.get_param_ex(class_code, sec_code, 'LAST')['data']['param_value'])  # Последняя цена сделки в рублях
+            last_price = float(self.store.provider.get_param_ex(class_code, sec_code, 'LAST')['data']['param_value'])  # Последняя цена сделки
+            if class_code != self.store.provider.futures_cls_code:  # Для НЕ фьючерсов
+                last_price = self.store.provider.get_instrument_profile(class_code, sec_code).quik_price_to_price(last_price)  # переводим в цену в рублях за штуку
             value += abs(position.size) * last_price  # Добавляем стоимость позиции
         if datas is None and account_id is None and value:  # Если была получена стоимость всех позиций
             self.value = value  # то сохраняем стоимость всех позиций
@@ -157,6 +168,7 @@ class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
 
     def next(self):
         self.notifs.append(None)  # Добавляем в список уведомлений пустой элемент
+        self.store.provider.refresh_instrument_profiles()  # Стоимость шага цены фьючерсов, измененную по OnParam, обновляем в потоке ТС, а не в потоке обратного вызова
 
     def stop(self):
         super(QKBroker, self).stop()
@@ -164,13 +176,17 @@ class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
         self.store.provider.on_disconnected = self.store.provider.default_handler  # Отключение терминала от сервера QUIK
         self.store.provider.on_trans_reply = self.store.provider.default_handler  # Ответ на транзакцию пользователя
         self.store.provider.on_trade = self.store.provider.default_handler  # Получение новой / изменение существующей сделки
+        self.tracer.close()  # Закрываем журнал заявок
+        if self.store.supervisor and self.reconcile in self.store.supervisor.on_reconnected:  # Если сверка была включена
+            self.store.supervisor.on_reconnected.remove(self.reconcile)  # то выключаем ее
         self.store.BrokerCls = None  # Удаляем класс брокера из хранилища
 
     # Функции
 
     def get_all_active_positions(self):
-        """Все активные позиции"""
+        """Все активные позиции. Позиции, которых нет в QUIK, обнуляются"""
         logger.debug(f'Ищем начальные позиции ...')
+        positions = {}  # Позиции из QUIK. Название тикера → Position
         for account in self.accounts:  # Пробегаемся по всем счетам (Коды клиента/Фирма/Счет)
             if account['futures']:  # Для фьючерсов
                 fut_pos = [fh for fh in self.store.provider.get_futures_holdings()['data']
@@ -182,11 +198,11 @@ class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
                     sec_code = fh['sec_code']  # Код тикера
                     size = int(fh['totalnet'])  # Кол-во
                     if self.p.lots:  # Если входящий остаток в лотах
-                        size = self.store.provider.lots_to_size(class_code, sec_code, size)  # то переводим кол-во из лотов в штуки
+                        size = self.store.provider.get_instrument_profile(class_code, sec_code).lots_to_size(size)  # то переводим кол-во из лотов в штуки
                     # price = self.store.provider.quik_price_to_price(class_code, sec_code, float(fh['avrposnprice']))  # Переводим эффективную цену позиций (входа) в цену в рублях за штуку
                     price = float(fh['avrposnprice'])  # Переводим эффективную цену позиций (входа) в цену в рублях за штуку
                     dataname = self.store.provider.class_sec_codes_to_dataname(class_code, sec_code)  # Получаем название тикера по коду режима торгов и тикера
-                    self.positions[dataname] = Position(size, price)  # Сохраняем в списке открытых позиций
+                    positions[dataname] = Position(size, price)  # Сохраняем в списке открытых позиций
                     logger.info(f'Нашли начальную позицию на срочном рынке: {dataname}, {size = }, {price = }')
             else:  # Для остальных фирм
                 depo_limits = self.store.provider.get_all_depo_limits()['data']  # Все лимиты по бумагам (позиции по инструментам)
@@ -210,17 +226,20 @@ class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
                     if dl['currentbal'] == 0:  # пропускаем пустые позиции
                         continue
                     class_code, sec_code = self.store.provider.dataname_to_class_sec_codes(dl['sec_code'])
+                    profile = self.store.provider.get_instrument_profile(class_code, sec_code)  # Профиль инструмента
                     size = int(dl['currentbal'])
                     if self.p.lots:
-                        size = self.store.provider.lots_to_size(class_code, sec_code, size)
+                        size = profile.lots_to_size(size)
 
-                    price = self.store.provider.quik_price_to_price(
-                        class_code, sec_code,
-                        float(dl['wa_position_price']))
+                    price = profile.quik_price_to_price(float(dl['wa_position_price']))
 
                     dataname = self.store.provider.class_sec_codes_to_dataname(class_code, sec_code)
-                    self.positions[dataname] = Position(size, price)
+                    positions[dataname] = Position(size, price)
                     logger.info(f'Нашли начальную позицию на фондовом рынке: {dataname}, {size = }, {price = }')
+        with self.trade_lock:  # Сделки из потока обратного вызова не изменяют позиции во время замены
+            for dataname in list(self.positions):  # Позиции, закрытые в QUIK (например, за время простоя),
+                self.positions[dataname] = Position()  # обнуляем
+            self.positions.update(positions)  # Ставим позиции из QUIK
 
     def create_order(self, owner, data, size, price=None, plimit=None, exectype=None, valid=None, oco=None, parent=None, transmit=True, is_buy=True, **kwargs):
         """Создание заявки. Привязка параметров счета и тикера. Обработка связанных и родительской/дочерних заявок"""
@@ -230,7 +249,7 @@ class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
         order.addinfo(**kwargs)  # Передаем в заявку все дополнительные свойства из брокера, в т.ч. account_id
         class_code = data.class_code  # Код режима торгов
         sec_code = data.sec_code  # Тикер
-        logger.debug(f'BT {order.size = }, {order.data.derivative = }, {order.exectype = }')
+        logger.debug('BT order.size = %r, order.data.derivative = %r, order.exectype = %r', order.size, order.data.derivative, order.exectype)
         if order.exectype in (Order.Close, Order.StopTrail,
                               Order.StopTrailLimit, Order.Historical):
                             # Эти типы заявок не реализованы
@@ -250,12 +269,13 @@ class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
             order.reject(self)  # то отменяем заявку (статус Order.Rejected)
             return order  # Возвращаем отмененную заявку
         order.addinfo(account=account)  # Передаем в заявку счет
-        si = self.store.provider.get_symbol_info(class_code, sec_code)  # Получаем параметры тикера (min_price_step, scale)
-        if not si:  # Если тикер не найден
+        profile = self.store.provider.get_instrument_profile(class_code, sec_code)  # Получаем профиль тикера (min_price_step, scale, lot_size)
+        if not profile.found:  # Если тикер не найден
             logger.error(f'create_order: Постановка заявки {order.ref} по тикеру {class_code}.{sec_code} отменена. Тикер не найден')
             order.reject(self)  # то отменяем заявку (статус Order.Rejected)
             return order  # Возвращаем отмененную заявку
-        order.addinfo(min_price_step=float(si['min_price_step']))  # Передаем в заявку минимальный шаг цены
+        order.addinfo(min_price_step=float(profile.min_price_step))  # Передаем в заявку минимальный шаг цены
+        self.tracer.on_create(order)  # Начинаем трассировку заявки
 
         if oco:  # Если есть связанная заявка
             self.ocos[order.ref] = oco.ref  # то заносим в список связанных заявок
@@ -280,10 +300,13 @@ class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
         """Отправка заявки (транзакции) на биржу"""
         class_code = order.data.class_code  # Получаем из заявки код режима торгов
         sec_code = order.data.sec_code  # Получаем из заявки код тикера
-        quantity = abs(order.size if order.data.derivative else self.store.provider.size_to_lots(class_code, sec_code, order.size))  # Размер позиции в лотах. В QUIK всегда передается положительный размер лота
+        profile = self.store.provider.get_instrument_profile(class_code, sec_code)  # Профиль тикера. Функции конвертации выбраны заранее
+        grid = profile.grid  # Сетка цен тикера. Цены в заявке считаем в целых тиках
+        to_quik_raw = profile.same_price if order.data.derivative else profile.price_to_quik_raw  # Для деривативов цена только приводится к шагу цены
+        quantity = abs(order.size if order.data.derivative else profile.size_to_lots(order.size))  # Размер позиции в лотах. В QUIK всегда передается положительный размер лота
         # if order.data.derivative:  # Для деривативов
         #     order.size = self.store.provider.lots_to_size(class_code, sec_code, order.size)  # сохраняем в заявку размер позиции в штуках
-        logger.debug(f'Quantity for Quik - {quantity = }, BT size - {order.size = }')
+        logger.debug('Quantity for Quik - quantity = %r, BT size - order.size = %r', quantity, order.size)
         transaction = {  # Все значения должны передаваться в виде строк
             'TRANS_ID': str(order.ref),  # Номер транзакции задается клиентом
             # Если для заявок брокер устанавливает отдельный код клиента, то задаем его в параметре client_code_for_orders, и используем здесь
@@ -295,36 +318,29 @@ class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
             'OPERATION': 'B' if order.isbuy() else 'S',  # B = покупка, S = продажа
             'QUANTITY': str(quantity),  # Кол-во в лотах
             'ACTION': 'NEW_ORDER' if order.exectype in (Order.Market, Order.Limit) else 'NEW_STOP_ORDER'}  # Заявка или стоп заявка
-        min_price_step = order.info['min_price_step']  # Получаем из заявки минимальный шаг цены
-        slippage = min_price_step * self.p.slippage_steps  # Размер проскальзывания в деньгах для выставления рыночной цены фьючерсов
+        slippage_ticks = self.p.slippage_steps if order.isbuy() else -self.p.slippage_steps  # Проскальзывание в тиках для выставления рыночной цены фьючерсов. Покупаем дороже, продаем дешевле
         if order.exectype == Order.Market:  # Рыночная заявка
             transaction['TYPE'] = 'M'  # Рыночная заявка
             if order.data.derivative:  # Для деривативов
-                last_price = float(self.store.provider.get_param_ex(class_code, sec_code, 'LAST')['data']['param_value'])  # Последняя цена сделки
-                market_price = self.store.provider.price_to_valid_price(class_code, sec_code, last_price + slippage if order.isbuy() else last_price - slippage)  # Из документации QUIK: При покупке/продаже фьючерсов по рынку нужно ставить цену хуже последней сделки
+                transaction['PRICE'] = grid.ticks_to_str(grid.price_to_ticks(self.get_market_price(order, quantity)) + slippage_ticks)  # Из документации QUIK: При покупке/продаже фьючерсов по рынку нужно ставить цену хуже последней сделки
             else:  # Для остальных рынков
-                market_price = 0  # Цена рыночной заявки должна быть нулевой
-            transaction['PRICE'] = str(market_price)  # Рыночную цену QUIK ставим в заявку
+                transaction['PRICE'] = '0'  # Цена рыночной заявки должна быть нулевой
         elif order.exectype == Order.Limit:  # Лимитная заявка
             transaction['TYPE'] = 'L'  # Лимитная заявка
-            limit_price = self.store.provider.price_to_valid_price(class_code, sec_code, order.price) if order.data.derivative else self.store.provider.price_to_quik_price(class_code, sec_code, order.price)  # Лимитная цена
-            transaction['PRICE'] = str(limit_price)  # Лимитную цену QUIK Ставим в заявку
+            transaction['PRICE'] = grid.ticks_to_str(grid.price_to_ticks(to_quik_raw(order.price)))  # Лимитную цену QUIK, кратную шагу цены, ставим в заявку
             # if order.data.derivative:  # Для деривативов
             #     order.price = self.store.provider.quik_price_to_price(class_code, sec_code, order.price)  # Сохраняем в заявку лимитную цену заявки в рублях за штуку
         elif order.exectype == Order.Stop:  # Стоп заявка
-            stop_price = self.store.provider.price_to_valid_price(class_code, sec_code, order.price) if order.data.derivative else self.store.provider.price_to_quik_price(class_code, sec_code, order.price)  # Стоп цена
-            transaction['STOPPRICE'] = str(stop_price)  # Стоп цену QUIK ставим в заявкуСтавим в заявку
+            stop_ticks = grid.price_to_ticks(to_quik_raw(order.price))  # Стоп цена в тиках
+            transaction['STOPPRICE'] = grid.ticks_to_str(stop_ticks)  # Стоп цену QUIK ставим в заявку
             if order.data.derivative:  # Для деривативов
                 # order.price = self.store.provider.quik_price_to_price(class_code, sec_code, order.price)  # Сохраняем в заявку стоп цену заявки в рублях за штуку
-                market_price = self.store.provider.price_to_valid_price(class_code, sec_code, stop_price + slippage if order.isbuy() else stop_price - slippage)  # Из документации QUIK: При покупке/продаже фьючерсов по рынку нужно ставить цену хуже последней сделки
+                transaction['PRICE'] = grid.ticks_to_str(stop_ticks + slippage_ticks)  # Из документации QUIK: При покупке/продаже фьючерсов по рынку нужно ставить цену хуже последней сделки
             else:  # Для остальных рынков
-                market_price = 0  # Цена рыночной заявки должна быть нулевой
-            transaction['PRICE'] = str(market_price)  # Рыночную цену QUIK ставим в заявку
+                transaction['PRICE'] = '0'  # Цена рыночной заявки должна быть нулевой
         elif order.exectype == Order.StopLimit:  # Стоп-лимитная заявка
-            stop_price = self.store.provider.price_to_valid_price(class_code, sec_code, order.price) if order.data.derivative else self.store.provider.price_to_quik_price(class_code, sec_code, order.price)  # Стоп цена
-            transaction['STOPPRICE'] = str(stop_price)  # Стоп цену QUIK ставим в заявку
-            limit_price = self.store.provider.price_to_valid_price(class_code, sec_code, order.pricelimit) if order.data.derivative else self.store.provider.price_to_quik_price(class_code, sec_code, order.pricelimit)  # Лимитная цена
-            transaction['PRICE'] = str(limit_price)  # Лимитную цену QUIK Ставим в заявку
+            transaction['STOPPRICE'] = grid.ticks_to_str(grid.price_to_ticks(to_quik_raw(order.price)))  # Стоп цену QUIK ставим в заявку
+            transaction['PRICE'] = grid.ticks_to_str(grid.price_to_ticks(to_quik_raw(order.pricelimit)))  # Лимитную цену QUIK ставим в заявку
             # if order.data.derivative:  # Для деривативов
             #     order.price = self.store.provider.quik_price_to_price(class_code, sec_code, order.price)  # Сохраняем в заявку стоп цену заявки в рублях за штуку
             #     order.pricelimit = self.store.provider.quik_price_to_price(class_code, sec_code, order.pricelimit)  # Сохраняем в заявку лимитную цену заявки в рублях за штуку
@@ -335,14 +351,39 @@ class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
             elif isinstance(order.valid, date):  # Если заявка поставлена до даты
                 expiry_date = order.valid.strftime('%Y%m%d')  # то будем держать ее до указанной даты
             transaction['EXPIRY_DATE'] = expiry_date  # Срок действия стоп заявки
-        response = self.store.provider.send_transaction(transaction)  # Отправляем транзакцию на биржу
         order.submit(self)  # Отправляем заявку на биржу (Order.Submitted)
+        self.orders[order.ref] = order  # Сохраняем заявку в списке заявок до отправки. Ответ на транзакцию может прийти раньше, чем send_transaction вернет результат
+        self.tracer.on_send(order)  # Время отправки заявки
+        try:
+            response = self.store.provider.send_transaction(transaction)  # Отправляем транзакцию на биржу
+        except RequestTimeoutError as e:  # Если QUIK# не ответил за отведенное время
+            logger.error(f'place_order: {e}')
+            if not e.sent:  # Если транзакция не отправлена
+                order.reject(self)  # то отклоняем заявку (Order.Rejected)
+                self.tracer.on_done(order)  # Завершаем трассировку заявки
+            return order  # Отправленная заявка ждет ответа на транзакцию OnTransReply
         if response['cmd'] == 'lua_transaction_error':  # Если возникла ошибка при постановке заявки на уровне QUIK
             logger.error(f'place_order: Ошибка отправки заявки в QUIK {response["data"]["CLASSCODE"]}.{response["data"]["SECCODE"]} {response["lua_error"]}')  # то заявка не отправляется на биржу, выводим сообщение об ошибке
             order.reject(self)  # Отклоняем заявку (Order.Rejected)
-        self.orders[order.ref] = order  # Сохраняем заявку в списке заявок, отправленных на биржу
+            self.tracer.on_done(order)  # Завершаем трассировку заявки
         return order  # Возвращаем заявку
 
+    def get_market_price(self, order, quantity):
+        """Цена QUIK, от которой считаем защитную цену рыночной заявки на деривативы
+
+        :param Order order: Заявка
+        :param int quantity: Кол-во в лотах
+        :return: Цена уровня стакана, покрывающего заявку. Если стакана нет, то цена последней сделки
+        """
+        class_code = order.data.class_code  # Код режима торгов
+        sec_code = order.data.sec_code  # Код тикера
+        book = self.store.books.get_book(class_code, sec_code)  # Стакан по подписке. None, если подписки нет, или стакан устарел
+        if book is not None:  # Если стакан есть
+            price = book.sweep_price(order.isbuy(), quantity)  # Цена уровня противоположной стороны стакана, на котором заявка исполнится полностью
+            if price is not None:  # Если противоположная сторона стакана не пустая
+                return price
+        return float(self.store.provider.get_param_ex(class_code, sec_code, 'LAST')['data']['param_value'])  # Последняя цена сделки
+
     def cancel_order(self, order):
         """Отмена заявки"""
         if not order.alive():  # Если заявка уже была завершена
@@ -389,28 +430,29 @@ class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
 
     def on_trans_reply(self, data):
         """Обработчик события ответа на транзакцию пользователя"""
-        logger.debug(f'data={data}')  # Для отладки
+        logger.debug('data=%s', data)  # Для отладки
         qk_trans_reply = data['data']  # Ответ на транзакцию
         order_num = int(qk_trans_reply['order_num'])  # Номер заявки на бирже
         trans_id = int(qk_trans_reply['trans_id'])  # Номер транзакции заявки
         if trans_id == 0:  # Заявки, выставленные не из автоторговли / только что (с нулевыми номерами транзакции)
-            logger.debug(f'Заявка с номером {order_num} выставлена не из автоторговли / только что. Выход')
+            logger.debug('Заявка с номером %s выставлена не из автоторговли / только что. Выход', order_num)
             return  # не обрабатываем, пропускаем
         if trans_id not in self.orders:  # Пришла заявка не из автоторговли
-            logger.debug(f'Заявка с номером {order_num}. Номер транзакции {trans_id}. Заявка была выставлена не из торговой системы. Выход')
+            logger.debug('Заявка с номером %s. Номер транзакции %s. Заявка была выставлена не из торговой системы. Выход', order_num, trans_id)
             return  # не обрабатываем, пропускаем
         order: Order = self.orders[trans_id]  # Ищем заявку по номеру транзакции
         order.addinfo(order_num=order_num)  # Передаем в заявку номер заявки на бирже
+        self.tracer.on_ack(order, data.get('t'))  # Время ответа на транзакцию и время QUIK
         # logger.debug(f'Заявка {order.ref} с номером {order_num}. Номер транзакции {trans_id}. order={order}')
         # TODO Есть поле flags, но оно не документировано. Лучше вместо текстового результата транзакции разбирать по нему
         result_msg = str(qk_trans_reply['result_msg']).lower()  # По результату исполнения транзакции (очень плохое решение)
         status = int(qk_trans_reply['status'])  # Статус транзакции
         if status == 15 or 'зарегистрирован' in result_msg:  # Если пришел ответ по новой заявке
-            logger.debug(f'Заявка {order.ref} переведена в статус принята на бирже (Order.Accepted)')
+            logger.debug('Заявка %s переведена в статус принята на бирже (Order.Accepted)', order.ref)
             order.accept(self)  # Заявка принята на бирже (Order.Accepted)
         elif 'снят' in result_msg:  # Если пришел ответ по отмене существующей заявки
             try:
-                logger.debug(f'Заявка {order.ref} переведена в статус отменена (Order.Canceled)')
+                logger.debug('Заявка %s переведена в статус отменена (Order.Canceled)', order.ref)
                 order.cancel()  # Отменяем существующую заявку (Order.Canceled)
             except (KeyError, IndexError):  # При ошибке
                 order.status = Order.Canceled  # все равно ставим статус заявки Order.Canceled
@@ -420,90 +462,121 @@ class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
             # - Превышен лимит отправки транзакций для данного логина
             if status == 4 and 'не найдена заявка' in result_msg or \
                status == 5 and 'не можете снять' in result_msg or 'превышен лимит' in result_msg:
-                logger.debug(f'Заявка {order.ref}. Ошибка. Выход')
+                logger.debug('Заявка %s. Ошибка. Выход', order.ref)
                 return  # то заявку не отменяем, выходим, дальше не продолжаем
             try:
-                logger.debug(f'Заявка {order.ref} переведена в статус отклонена (Order.Rejected)')
+                logger.debug('Заявка %s переведена в статус отклонена (Order.Rejected)', order.ref)
                 order.reject(self)  # Отклоняем заявку (Order.Rejected)
             except (KeyError, IndexError):  # При ошибке
                 order.status = Order.Rejected  # все равно ставим статус заявки Order.Rejected
         elif status == 6:  # Транзакция не прошла проверку лимитов сервера QUIK
             try:
-                logger.debug(f'Заявка {order.ref} переведена в статус не прошла проверку лимитов (Order.Margin)')
+                logger.debug('Заявка %s переведена в статус не прошла проверку лимитов (Order.Margin)', order.ref)
                 order.margin()  # Для заявки не хватает средств (Order.Margin)
             except (KeyError, IndexError):  # При ошибке
                 order.status = Order.Margin  # все равно ставим статус заявки Order.Margin
+        if not order.alive():  # Если заявка отменена/отклонена
+            self.tracer.on_done(order)  # то завершаем трассировку заявки
         self.notifs.append(order.clone())  # Уведомляем брокера о заявке
         if order.status != Order.Accepted:  # Если новая заявка не зарегистрирована
-            logger.debug(f'Заявка {order.ref}. Проверка связанных и родительских/дочерних заявок')
+            logger.debug('Заявка %s. Проверка связанных и родительских/дочерних заявок', order.ref)
             self.oco_pc_check(order)  # то проверяем связанные и родительскую/дочерние заявки (Canceled, Rejected, Margin)
-        logger.debug(f'Заявка {order.ref}. Выход')
+        logger.debug('Заявка %s. Выход', order.ref)
 
     def on_trade(self, data):
         """Обработчик события получения новой / изменения существующей сделки.
         Выполняется до события изменения существующей заявки. Нужен для определения цены исполнения заявок.
         """
-        logger.debug(f'data={data}')  # Для отладки
+        logger.debug('data=%s', data)  # Для отладки
         qk_trade = data['data']  # Сделка в QUIK
         trade_num = int(qk_trade['trade_num'])  # Номер сделки (дублируется 3 раза)
         order_num = int(qk_trade['order_num'])  # Номер заявки на бирже
         trans_id = int(qk_trade['trans_id'])  # Номер транзакции из заявки на бирже. Не используем GetOrderByNumber, т.к. он может вернуть 0
         if trans_id == 0:  # Заявки, выставленные не из автоторговли / только что (с нулевыми номерами транзакции)
-            logger.debug(f'Заявка с номером {order_num} выставлена не из автоторговли / только что. Выход')
+            logger.debug('Заявка с номером %s выставлена не из автоторговли / только что. Выход', order_num)
             return  # выходим, дальше не продолжаем
         if trans_id not in self.orders:  # Пришла заявка не из автоторговли
-            logger.debug(f'Заявка с номером {order_num}. Номер транзакции {trans_id}. Заявка была выставлена не из торговой системы. Выход')
+            logger.debug('Заявка с номером %s. Номер транзакции %s. Заявка была выставлена не из торговой системы. Выход', order_num, trans_id)
             return  # выходим, дальше не продолжаем
         order: Order = self.orders[trans_id]  # Ищем заявку по номеру транзакции
         order.addinfo(order_num=order_num)  # Сохраняем номер заявки на бирже (может быть переход от стоп заявки к лимитной с изменением номера на бирже)
-        logger.debug(f'Заявка {order.ref} с номером {order_num}. Номер транзакции {trans_id}. Номер сделки {trade_num}')
+        logger.debug('Заявка %s с номером %s. Номер транзакции %s. Номер сделки %s', order.ref, order_num, trans_id, trade_num)
         class_code = qk_trade['class_code']  # Код режима торгов
         sec_code = qk_trade['sec_code']  # Код тикера
         dataname = self.store.provider.class_sec_codes_to_dataname(class_code, sec_code)  # Получаем название тикера по коду режима торгов и коду тикера
-        if dataname not in self.trade_nums.keys():  # Если это первая сделка по тикеру
-            self.trade_nums[dataname] = []  # то ставим пустой список сделок
-        elif trade_num in self.trade_nums[dataname]:  # Если номер сделки есть в списке (фильтр для дублей)
-            logger.debug(f'Заявка {order.ref}. Номер сделки {trade_num} есть в списке сделок (дубль). Выход')
-            return  # то выходим, дальше не продолжаем
-        self.trade_nums[dataname].append(trade_num)  # Запоминаем номер сделки по тикеру, чтобы в будущем ее не обрабатывать (фильтр для дублей)
-        size = int(qk_trade['qty'])  # Абсолютное кол-во
-        logger.debug(f'on_trade()_1: from QUIK {size = }, from QUIK {qk_trade["price"] = }')
-        # if self.p.lots:  # Если входящий остаток в лотах
-        if not order.data.derivative:  # Для НЕ деривативов
-            size = self.store.provider.lots_to_size(class_code, sec_code, size)  # то переводим кол-во из лотов в штуки
-        if qk_trade['flags'] & 0b100 == 0b100:  # Если сделка на продажу (бит 2)
-            size *= -1  # то кол-во ставим отрицательным
-        if class_code != self.store.provider.futures_cls_code:
-            price = self.store.provider.quik_price_to_price(class_code, sec_code, float(qk_trade['price']))  # Переводим цену QUIK в цену в рублях за штуку
-        else:
-            price = float(qk_trade['price'])
-        logger.debug(f'on_trade()_2: for upd pos in BT {size = }, {price = }')
-        logger.debug(f'Заявка {order.ref}. size={size}, price={price}')
-        try:
-            dt = order.data.datetime[0]  # Дата и время исполнения заявки. Последняя известная
-            logger.debug(f'Заявка {order.ref}. Дата/время исполнения заявки по бару {dt}')
-        except (KeyError, IndexError):  # При ошибке
-            dt = datetime.now(self.store.provider.tz_msk)  # Берем текущее время на бирже из локального
-            logger.debug(f'Заявка {order.ref}. Дата/время исполнения заявки по текущему {dt}')
-        position = self.getposition(order.data)  # Получаем позицию по тикеру или нулевую позицию если тикера в списке позиций нет
-        psize, pprice, opened, closed = position.update(size, price)  # Обновляем размер/цену позиции на размер/цену сделки
-        order.execute(dt, size, price, closed, 0, 0, opened, 0, 0, 0, 0, psize, pprice)  # Исполняем заявку в BackTrader
-        if order.executed.remsize:  # Если заявка исполнена частично (осталось что-то к исполнению)
-            logger.debug(f'Заявка {order.ref} исполнилась частично. Остаток к исполнения {order.executed.remsize}')
-            if order.status != order.Partial:  # Если заявка переходит в статус частичного исполнения (может исполняться несколькими частями)
-                logger.debug(f'Заявка {order.ref} переведена в статус частично исполнена (Order.Partial)')
-                order.partial()  # Переводим заявку в статус Order.Partial
-                self.notifs.append(order.clone())  # Уведомляем брокера о частичном исполнении заявки
-        else:  # Если заявка исполнена полностью (ничего нет к исполнению)
-            logger.debug(f'Заявка {order.ref} переведена в статус полностью исполнена (Order.Completed)')
-            order.completed()  # Переводим заявку в статус Order.Completed
-            self.notifs.append(order.clone())  # Уведомляем брокера о полном исполнении заявки
-            # Снимаем oco-заявку только после полного исполнения заявки
-            # Если нужно снять oco-заявку на частичном исполнении, то прописываем это правило в ТС
-            logger.debug(f'Заявка {order.ref}. Проверка связанных и родительских/дочерних заявок')
-            self.oco_pc_check(order)  # Проверяем связанные и родительскую/дочерние заявки (Completed)
-        logger.debug(f'Заявка {order.ref}. Выход')
+        with self.trade_lock:  # Сделку по заявке одновременно могут обрабатывать поток обратного вызова и сверка
+            trade_nums = self.trade_nums.setdefault(dataname, set())  # Номера сделок по тикеру
+            if trade_num in trade_nums:  # Если номер сделки уже есть (фильтр для дублей)
+                logger.debug('Заявка %s. Номер сделки %s есть в списке сделок (дубль). Выход', order.ref, trade_num)
+                return  # то выходим, дальше не продолжаем
+            trade_nums.add(trade_num)  # Запоминаем номер сделки по тикеру, чтобы в будущем ее не обрабатывать (фильтр для дублей)
+            self.tracer.on_fill(order, data.get('t'))  # Время сделки и время QUIK
+            if metrics.enabled:  # Если метрики включены
+                metrics.inc('trades', instrument=dataname)  # Кол-во сделок
+            size = int(qk_trade['qty'])  # Абсолютное кол-во
+            logger.debug('on_trade()_1: from QUIK size = %r, from QUIK qk_trade["price"] = %r', size, qk_trade["price"])
+            # if self.p.lots:  # Если входящий остаток в лотах
+            profile = self.store.provider.get_instrument_profile(class_code, sec_code)  # Профиль тикера
+            if not order.data.derivative:  # Для НЕ деривативов
+                size = profile.lots_to_size(size)  # то переводим кол-во из лотов в штуки
+            if qk_trade['flags'] & 0b100 == 0b100:  # Если сделка на продажу (бит 2)
+                size *= -1  # то кол-во ставим отрицательным
+            if class_code != self.store.provider.futures_cls_code:
+                price = profile.quik_price_to_price(float(qk_trade['price']))  # Переводим цену QUIK в цену в рублях за штуку
+            else:
+                price = float(qk_trade['price'])
+            logger.debug('on_trade()_2: for upd pos in BT size = %r, price = %r', size, price)
+            logger.debug('Заявка %s. size=%s, price=%s', order.ref, size, price)
+            try:
+                dt = order.data.datetime[0]  # Дата и время исполнения заявки. Последняя известная
+                logger.debug('Заявка %s. Дата/время исполнения заявки по бару %s', order.ref, dt)
+            except (KeyError, IndexError):  # При ошибке
+                dt = datetime.now(self.store.provider.tz_msk)  # Берем текущее время на бирже из локального
+                logger.debug('Заявка %s. Дата/время исполнения заявки по текущему %s', order.ref, dt)
+            position = self.getposition(order.data)  # Получаем позицию по тикеру или нулевую позицию если тикера в списке позиций нет
+            psize, pprice, opened, closed = position.update(size, price)  # Обновляем размер/цену позиции на размер/цену сделки
+            order.execute(dt, size, price, closed, 0, 0, opened, 0, 0, 0, 0, psize, pprice)  # Исполняем заявку в BackTrader
+            if order.executed.remsize:  # Если заявка исполнена частично (осталось что-то к исполнению)
+                logger.debug('Заявка %s исполнилась частично. Остаток к исполнения %s', order.ref, order.executed.remsize)
+                if order.status != order.Partial:  # Если заявка переходит в статус частичного исполнения (может исполняться несколькими частями)
+                    logger.debug('Заявка %s переведена в статус частично исполнена (Order.Partial)', order.ref)
+                    order.partial()  # Переводим заявку в статус Order.Partial
+                    self.notifs.append(order.clone())  # Уведомляем брокера о частичном исполнении заявки
+            else:  # Если заявка исполнена полностью (ничего нет к исполнению)
+                logger.debug('Заявка %s переведена в статус полностью исполнена (Order.Completed)', order.ref)
+                order.completed()  # Переводим заявку в статус Order.Completed
+                self.tracer.on_done(order)  # Завершаем трассировку заявки
+                self.notifs.append(order.clone())  # Уведомляем брокера о полном исполнении заявки
+                # Снимаем oco-заявку только после полного исполнения заявки
+                # Если нужно снять oco-заявку на частичном исполнении, то прописываем это правило в ТС
+                logger.debug('Заявка %s. Проверка связанных и родительских/дочерних заявок', order.ref)
+                self.oco_pc_check(order)  # Проверяем связанные и родительскую/дочерние заявки (Completed)
+        logger.debug('Заявка %s. Выход', order.ref)
         
+    def reconcile(self):
+        """Сверка после повторного подключения к QUIK: сделки по активным заявкам, пропущенные за время простоя, снятые заявки, позиции"""
+        logger.info('Сверка заявок, сделок и позиций после повторного подключения')
+        for order in list(self.orders.values()):  # Пробегаемся по всем заявкам, отправленным на биржу
+            if not order.alive() or 'order_num' not in order.info:  # Если заявка завершена или ответа на транзакцию еще не было
+                continue  # то сверять нечего
+            order_num = order.info['order_num']  # Номер заявки на бирже
+            trades = self.store.provider.get_trades_by_order_number(order_num)['data']  # Сделки по заявке
+            for trade in trades if isinstance(trades, list) else []:  # Пробегаемся по сделкам
+                self.on_trade({'data': trade})  # Уже обработанные сделки отфильтруются по номеру сделки
+            if not order.alive():  # Если заявка исполнилась по пропущенным сделкам
+                continue  # то дальше не сверяем
+            qk_order = self.store.provider.get_order_by_number(order_num)['data']  # Заявка в QUIK
+            if isinstance(qk_order, dict) and 'flags' in qk_order and not qk_order['flags'] & 0b1 and qk_order['flags'] & 0b10:  # Если заявка не активна и снята (биты 0 и 1)
+                with self.trade_lock:  # Сделки по заявке могут прийти в потоке обратного вызова во время сверки
+                    if not order.alive():  # Если заявка уже исполнилась
+                        continue  # то не отменяем ее
+                    logger.debug('Заявка %s снята за время простоя (Order.Canceled)', order.ref)
+                    order.cancel()  # Отменяем заявку (Order.Canceled)
+                    self.tracer.on_done(order)  # Завершаем трассировку заявки
+                    self.notifs.append(order.clone())  # Уведомляем брокера об отмене заявки
+                    self.oco_pc_check(order)  # Проверяем связанные и родительскую/дочерние заявки
+        self.get_all_active_positions()  # Позиции берем из QUIK
+
     def check_data_names(self, data_name):
         '''
         Проверяет наличие в Quik связки "код класса" - "инструмент",
@@ -537,7 +610,7 @@ class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
             )
 
         # доходит до сюда → всё ок
-        self.store.provider.get_symbol_info(cls, sec)
+        self.store.provider.get_instrument_profile(cls, sec)  # Заранее создаем профиль инструмента для заявок и сделок
         logger.info(f'Запрошен источник данных {data_name}. Инструмент {sec} '
                     f'найден в Quik Junior. Работаем!)')
         logger.debug(f'Информация о счетах на аккаунте Quik - {self.accounts = }')
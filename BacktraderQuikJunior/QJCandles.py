@@ -0,0 +1,242 @@
+from collections import deque  # Очередь новых бар данных
+from datetime import datetime, timedelta  # Границы бар старшего интервала
+from threading import Lock, Event  # Подписки меняются из потоков данных. Ожидание подписки, которую оформляет другой поток
+from time import perf_counter_ns  # Время получения бара для метрик
+
+from backtrader import TimeFrame
+
+from .QJMetrics import metrics  # Метрики задержек
+
+
+class CandleManager:
+    """Подписки на новые свечи с подсчетом подписчиков. Сколько бы данных ни было подписано на тикер/интервал,
+    в QUIK одна подписка (один источник данных Lua). Каждая свеча NewCandle раздается в очереди всех подписанных данных
+    Состояние подписок хранится локально, поэтому is_subscribed в QUIK не запрашивается
+    """
+
+    def __init__(self, provider, open_date_time, boundary=False):
+        """Инициализация
+
+        :param QuikPy provider: Провайдер QuikPy. Задается при подключении
+        :param open_date_time: Функция даты и времени открытия бара по свече QUIK
+        :param bool boundary: Внутридневные свечи приходят сразу после окончания интервала по времени сервера QUIK. Поздние сделки приходят исправлениями
+        """
+        self.provider = provider  # Провайдер QuikPy
+        self.open_date_time = open_date_time  # Дата и время открытия бара по свече QUIK
+        self.boundary = boundary  # Закрытие свечей по времени сервера
+        self.queues = {}  # Очереди новых бар подписчиков. (class_code, sec_code, interval, param) → [deque]
+        self.keys = {}  # Подписка очереди. id(deque) → (class_code, sec_code, interval, param)
+        self.lock = Lock()  # Подписки меняются из потоков данных. Запросы в QUIK выполняются без блокировки
+        self.pending = {}  # Подписки, которые оформляются в QUIK. (class_code, sec_code, interval, param) → Event
+        self.history = {}  # История бар базовых интервалов для производных данных. (class_code, sec_code, interval) → [бар]
+        self.history_locks = {}  # История загружается один раз, остальные данные этого тикера/интервала ее ждут. (class_code, sec_code, interval) → Lock
+
+    def subscribe(self, class_code, sec_code, interval, param='-') -> deque:
+        """Подписка на новые свечи. В QUIK подписываемся только для первого подписчика
+
+        :param str class_code: Код режима торгов
+        :param str sec_code: Тикер
+        :param int interval: Временной интервал QUIK в минутах
+        :param str param: Параметр источника данных. '-' - по таблице обезличенных сделок
+        :return: Очередь новых бар подписчика: dict(data=бар[, closed=закрыт в QUIK][, correction=исправление][, received_ns=время получения])
+        """
+        key = (class_code, sec_code, interval, param)  # Ключ подписки
+        queue = deque()  # Очередь новых бар подписчика
+        while True:
+            with self.lock:
+                pending = self.pending.get(key)  # Подписка, которую оформляет другой поток
+                if pending is None:  # Если подписку никто не оформляет
+                    if key in self.queues:  # Если подписка в QUIK уже есть
+                        self.add_queue(key, queue)  # то только добавляем подписчика
+                        return queue
+                    pending = self.pending[key] = Event()  # Подписку оформляем сами
+                    self.add_queue(key, queue)  # Очередь ставим до запроса, чтобы не пропустить первые свечи
+                    break
+            pending.wait()  # Ждем подписку другого потока. Если она не удалась, то оформляем сами
+        try:
+            result = self.provider.subscribe_to_candles(class_code, sec_code, interval, param, boundary=self.boundary)  # Подписываемся в QUIK без блокировки. Раздача свечей не ждет ответа
+            if result['cmd'] == 'lua_create_data_source_error':  # Если источник данных не создан
+                raise ConnectionError(f'Подписка на свечи {class_code}.{sec_code} {interval} не создана: {result.get("lua_error")}')
+        except Exception:  # Если подписаться не удалось
+            with self.lock:
+                self.remove_queue(queue)  # то подписки нет. Следующий подписчик попробует снова
+            raise
+        finally:
+            with self.lock:
+                del self.pending[key]
+            pending.set()  # Ожидающие подписчики продолжают
+        return queue
+
+    def add_queue(self, key, queue) -> None:
+        """Добавление очереди подписчика. Вызывается под блокировкой"""
+        self.queues[key] = self.queues.get(key, []) + [queue]  # Новый список, чтобы раздача в потоке обратного вызова шла по неизменному списку
+        self.keys[id(queue)] = key
+
+    def remove_queue(self, queue):
+        """Удаление очереди подписчика. Вызывается под блокировкой
+
+        :return: Ключ подписки, если ушел последний подписчик. Иначе None
+        """
+        key = self.keys.pop(id(queue), None)  # Подписка очереди
+        if key is None:  # Если подписки нет
+            return None
+        queues = [q for q in self.queues[key] if q is not queue]  # Остальные подписчики
+        if queues:  # Если остались подписчики
+            self.queues[key] = queues  # то подписку не отменяем
+            return None
+        del self.queues[key]
+        return key
+
+    def unsubscribe(self, queue) -> None:
+        """Отмена подписки на новые свечи. Подписка в QUIK отменяется после ухода последнего подписчика
+
+        :param deque queue: Очередь новых бар подписчика
+        """
+        with self.lock:
+            key = self.remove_queue(queue)  # Подписка, если ушел последний подписчик
+        if key is not None:  # Если подписчиков не осталось
+            if key[3] == '-':  # Если подписка по таблице обезличенных сделок
+                self.history.pop(key[:3], None)  # то история без подписки больше не дополняется. Следующие данные загрузят ее снова
+            self.provider.unsubscribe_from_candles(*key)  # то отменяем подписку в QUIK без блокировки
+
+    def get_history(self, class_code, sec_code, interval, loader) -> list[dict]:
+        """История бар базового интервала. Загружается один раз для всех производных данных тикера/интервала
+
+        :param str class_code: Код режима торгов
+        :param str sec_code: Тикер
+        :param int interval: Временной интервал QUIK в минутах
+        :param loader: Функция загрузки истории из файла и QUIK. Вызывается только для первых данных
+        :return: Бары базового интервала по возрастанию даты и времени открытия: история и пришедшие после ее загрузки бары подписки.
+        Бары подписки могут повторять последние бары истории, повторы отсекаются при сборке
+        """
+        key = (class_code, sec_code, interval)  # Ключ истории
+        with self.lock:
+            history_lock = self.history_locks.setdefault(key, Lock())  # Блокировка только этого тикера/интервала. История других тикеров загружается параллельно
+        with history_lock:
+            history = self.history.get(key)  # История, загруженная раньше
+            if history is None:  # Если историю еще не загружали
+                history = self.history[key] = []  # то бары подписки, пришедшие во время загрузки, попадут сюда
+                try:
+                    history[:0] = loader()  # Историю ставим перед ними одной операцией
+                except Exception:  # Если история не загрузилась
+                    del self.history[key]  # то следующие данные загрузят ее снова
+                    raise
+            return list(history)  # Снимок. Бары, пришедшие после него, данные получат из своей подписки
+
+    def subscribers(self, class_code, sec_code, interval, param='-') -> int:
+        """Кол-во подписчиков на свечи"""
+        return len(self.queues.get((class_code, sec_code, interval, param), ()))
+
+    def on_new_candle(self, data) -> None:
+        """Обработчик новой свечи (NewCandle). Выполняется в потоке обратного вызова"""
+        self.publish(data['data'])
+
+    def on_candle_correction(self, data) -> None:
+        """Обработчик исправления свечи, отправленной по времени закрытия (CandleCorrection). Выполняется в потоке обратного вызова"""
+        self.publish(data['data'], correction=True)
+
+    def publish(self, candle, correction=False) -> None:
+        """Раздача свечи QUIK в очереди подписчиков
+
+        :param dict candle: Свеча QUIK
+        :param bool correction: Исправление ранее отправленной свечи
+        """
+        queues = self.queues.get((candle['class'], candle['sec'], candle['interval'], candle.get('param', '-')))  # Очереди подписчиков
+        if not queues:  # Если на свечи никто не подписан
+            return  # то выходим, дальше не продолжаем
+        bar = dict(datetime=self.open_date_time(candle),  # Собираем дату и время открытия бара
+                   open=candle['open'], high=candle['high'], low=candle['low'], close=candle['close'],  # Цены QUIK
+                   volume=int(candle['volume']))  # Объем в лотах. Бар из подписки
+        item = dict(data=bar)  # Признаки и время получения бара храним рядом с баром. В файл они не попадают
+        if candle.get('closed'):  # Если QUIK отметил свечу закрытой
+            item['closed'] = True  # то время закрытия не проверяем
+        if correction:  # Если свеча исправлена поздними сделками
+            item['correction'] = True
+        if metrics.enabled:  # Если метрики включены
+            item['received_ns'] = perf_counter_ns()  # то запоминаем время получения бара
+        if not correction and candle.get('param', '-') == '-':  # Если это новый бар по таблице обезличенных сделок
+            history = self.history.get((candle['class'], candle['sec'], candle['interval']))  # История базового интервала для производных данных
+            if history is not None:  # Если история загружена или загружается
+                history.append(bar)  # то дополняем ее, чтобы данные, подписанные позже, собирали бары без разрыва
+        for queue in queues:  # Один и тот же бар раздаем всем подписчикам. Бар не изменяется
+            queue.append(item)
+
+
+class BarResampler:
+    """Сборка бар старшего интервала из бар базового интервала. Бары добавляются по одному по мере поступления
+    Границы бар считаются от начала дня, поэтому внутридневной бар не переходит через сутки (торговые сессии)
+    """
+
+    def __init__(self, timeframe, compression=1, base_minutes=1):
+        """Инициализация
+
+        :param TimeFrame timeframe: Временной интервал собираемых бар: минуты, дни, недели, месяцы
+        :param int compression: Размер временнОго интервала
+        :param int base_minutes: Длительность базового бара в минутах. Бар закрывается сразу, как только базовый бар дошел до его конца
+        """
+        self.timeframe = timeframe  # Временной интервал собираемых бар
+        self.compression = compression  # Размер временнОго интервала
+        self.base = timedelta(minutes=base_minutes)  # Длительность базового бара
+        self.bar = None  # Открытый бар
+        self.end = None  # Дата и время закрытия открытого бара
+        self.last_open = datetime.min  # Дата и время открытия последнего учтенного базового бара. Повторы пропускаем
+
+    def bounds(self, dt) -> tuple[datetime, datetime]:
+        """Дата и время открытия и закрытия бара старшего интервала, в который попадает базовый бар
+
+        :param datetime dt: Дата и время открытия базового бара
+        :return: Дата и время открытия и закрытия бара
+        """
+        day = datetime(dt.year, dt.month, dt.day)  # Начало дня
+        if self.timeframe == TimeFrame.Minutes:  # Минутный временной интервал
+            minutes = (dt.hour * 60 + dt.minute) // self.compression * self.compression  # Минута открытия бара от начала дня
+            start = day + timedelta(minutes=minutes)
+            return start, min(start + timedelta(minutes=self.compression), day + timedelta(days=1))  # Бар закрывается не позже конца дня
+        if self.timeframe == TimeFrame.Days:  # Дневной временной интервал
+            return day, day + timedelta(days=1)
+        if self.timeframe == TimeFrame.Weeks:  # Недельный временной интервал
+            start = day - timedelta(days=day.weekday())  # Неделя начинается с понедельника
+            return start, start + timedelta(weeks=1)
+        if self.timeframe == TimeFrame.Months:  # Месячный временной интервал
+            start = day.replace(day=1)
+            return start, datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+        raise NotImplementedError  # С остальными временнЫми интервалами не работаем
+
+    def update(self, bar) -> list[dict]:
+        """Добавление базового бара
+
+        :param dict bar: Закрытый бар базового интервала
+        :return: Закрытые бары старшего интервала
+        """
+        dt = bar['datetime']  # Дата и время открытия базового бара
+        if dt <= self.last_open:  # Если бар уже учтен (история и подписка пересекаются)
+            return []  # то пропускаем его
+        self.last_open = dt
+        bars = []  # Закрытые бары
+        start, end = self.bounds(dt)  # Границы бара старшего интервала
+        if self.bar is not None and self.bar['datetime'] != start:  # Если начался новый бар
+            bars.append(self.bar)  # то закрываем открытый
+            self.bar = None
+        if self.bar is None:  # Если открытого бара нет
+            self.bar = dict(datetime=start, open=bar['open'], high=bar['high'], low=bar['low'], close=bar['close'], volume=int(bar['volume']))  # то открываем бар
+            self.end = end
+        else:  # Если базовый бар продолжает открытый бар
+            self.bar['high'] = max(self.bar['high'], bar['high'])
+            self.bar['low'] = min(self.bar['low'], bar['low'])
+            self.bar['close'] = bar['close']
+            self.bar['volume'] += int(bar['volume'])
+        if dt + self.base >= self.end:  # Если базовый бар закрылся вместе с баром старшего интервала
+            bars.append(self.bar)  # то закрываем бар, не дожидаясь следующего базового бара
+            self.bar = None
+        return bars
+
+    def close_due(self, now) -> list[dict]:
+        """Закрытие бара по времени, если базовых бар после окончания бара не было
+
+        :param datetime now: Текущая дата и время МСК
+        :return: Закрытый бар или пустой список
+        """
+        if self.bar is None or self.end > now:  # Если открытого бара нет, или его время еще не закончилось
+            return []
+        bar, self.bar = self.bar, None  # Закрываем бар
+        return [bar]
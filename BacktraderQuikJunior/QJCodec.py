@@ -0,0 +1,84 @@
+from functools import partial  # Параметры кодирования стандартной библиотеки
+import json  # Библиотека JSON по умолчанию
+
+try:
+    import orjson  # Самая быстрая библиотека JSON. Необязательная зависимость
+except ImportError:
+    orjson = None
+try:
+    import ujson  # Быстрая библиотека JSON. Необязательная зависимость
+except ImportError:
+    ujson = None
+
+
+class JsonCodec:
+    """Кодирование запросов и разбор ответов/функций обратного вызова QUIK# в формате JSON
+    Библиотека выбирается по наличию: orjson → ujson → json. QUIK# работает в кодировке Windows 1251,
+    поэтому строки не экранируются в \\uXXXX (их не поймет QUIK), а вся строка JSON переводится в cp1251
+    """
+    encoding = 'cp1251'  # Кодировка QUIK#
+    cached_commands = {'ping', 'getInfoParam', 'getParamEx', 'getParamEx2', 'getSecurityInfo', 'getSecurityClass', 'isConnected'}  # Запросы с неизменными данными. Кодируются один раз
+    cache_size = 4096  # Максимальное кол-во закодированных запросов в кэше
+
+    def __init__(self, backend=None):
+        """Инициализация кодировщика
+
+        :param str backend: Библиотека JSON: orjson, ujson или json. По умолчанию, самая быстрая из установленных
+        """
+        if backend is None:  # Если библиотека не задана
+            backend = 'orjson' if orjson is not None else 'ujson' if ujson is not None else 'json'  # то берем самую быструю из установленных
+        if backend == 'orjson' and orjson is not None:
+            self.loads = orjson.loads  # Разбор строки JSON
+            self.dumps = lambda obj: orjson.dumps(obj).decode()  # Строка JSON. orjson возвращает UTF-8 без экранирования
+        elif backend == 'ujson' and ujson is not None:
+            self.loads = ujson.loads
+            self.dumps = partial(ujson.dumps, ensure_ascii=False, escape_forward_slashes=False)
+        elif backend == 'json':
+            self.loads = json.loads
+            self.dumps = partial(json.dumps, ensure_ascii=False, separators=(',', ':'))
+        else:  # Если библиотека не установлена
+            raise ValueError(f'Библиотека JSON {backend} не установлена или не поддерживается')
+        self.backend = backend  # Библиотека JSON
+        self.suffixes = {}  # Неизменные окончания запросов. Команда → ,"cmd":"<команда>","t":""}
+        self.requests = {}  # Закодированные запросы. (команда, данные, код транзакции) → байты
+
+    def encode_request(self, request) -> bytes:
+        """Запрос QUIK# {data, id, cmd, t} в строку JSON с переводом строки в кодировке Windows 1251
+        Окончание запроса кэшируется по команде, запросы с неизменными данными (cached_commands) кэшируются целиком
+
+        :param dict request: Запрос в виде словаря
+        :return: Запрос для отправки в QUIK#
+        """
+        cmd = request.get('cmd')  # Команда
+        if len(request) != 4 or request.get('t') != '' or 'data' not in request or 'id' not in request:  # Если запрос не стандартного вида
+            return f'{self.dumps(request)}\r\n'.encode(self.encoding)  # то кодируем его целиком
+        data = request['data']  # Данные запроса
+        trans_id = request['id']  # Код транзакции
+        key = None  # Ключ кэша запросов
+        if cmd in self.cached_commands and isinstance(data, str):  # Если запрос с неизменными данными
+            key = (cmd, data, trans_id)
+            raw_data = self.requests.get(key)
+            if raw_data is not None:  # Если запрос уже кодировали
+                return raw_data  # то берем его из кэша
+        suffix = self.suffixes.get(cmd)  # Окончание запроса
+        if suffix is None:  # Если окончание еще не кодировали
+            suffix = self.suffixes[cmd] = f',"cmd":{self.dumps(cmd)},"t":""}}\r\n'
+        raw_data = f'{{"data":{self.dumps(data)},"id":{self.dumps(trans_id)}{suffix}'.encode(self.encoding)
+        if key is not None:  # Если запрос нужно кэшировать
+            if len(self.requests) >= self.cache_size:  # Если кэш заполнен
+                self.requests.clear()  # то начинаем заново
+            self.requests[key] = raw_data
+        return raw_data
+
+    def decode(self, line):
+        """Разбор строки JSON от QUIK#
+
+        :param bytes|str line: Строка в кодировке Windows 1251 или уже переведенная строка
+        :return: Ответ/функция обратного вызова в виде словаря
+        """
+        if isinstance(line, (bytes, bytearray)) and not line.isascii():  # Строку с русскими буквами
+            line = line.decode(self.encoding)  # переводим из Windows 1251. Строку ASCII библиотеки JSON разбирают без перевода
+        return self.loads(line)
+
+
+codec = JsonCodec()  # Кодировщик пакета. Другую библиотеку можно задать так: QuikPy.codec = JsonCodec('json')
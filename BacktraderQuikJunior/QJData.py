@@ -2,15 +2,22 @@ from .logger_config import logger # Будем вести лог
 from datetime import datetime, timedelta, time
 from time import sleep
 from uuid import uuid4  # Номера расписаний должны быть уникальными во времени и пространстве
-from threading import Thread, Event  # Поток и событие остановки потока получения новых бар по расписанию биржи
 import os.path
+import io  # Чтение файла истории с найденного места
 import csv
+from collections import deque  # Очереди новых бар
+
+import numpy as np  # Конвертация цен исторических бар столбцами
 
 from backtrader.feed import AbstractDataBase
 from backtrader.utils.py3 import with_metaclass
 from backtrader import TimeFrame, date2num
 
 from .QJStore import QKStore
+from .QuikJuniorPy import RequestTimeoutError  # Запрос к QUIK# не уложился в срок
+from .QJMetrics import metrics  # Метрики задержек
+from .QJTicks import TickBuffer, TickAggregator, datetime_to_us  # Бары из обезличенных сделок
+from .QJCandles import BarResampler  # Бары старшего интервала из бар базового интервала
 
 
 class MetaQKData(AbstractDataBase.__class__):
@@ -25,10 +32,15 @@ class QKData(with_metaclass(MetaQKData, AbstractDataBase)):
         ('four_price_doji', True),  # False - не пропускать дожи 4-х цен, True - пропускать
         ('schedule', None),  # Расписание работы биржи. Если не задано, то берем из подписки
         ('live_bars', False),  # False - только история, True - история и новые бары
+        ('order_book', False),  # False - без стакана, True - подписка на стакан. Стакан доступен в свойстве order_book
+        ('base', None),  # Базовый интервал (TimeFrame, compression), из бар которого собираются бары данных. Одна подписка и одна загрузка истории базового интервала на все данные тикера. None - бары своего интервала из QUIK
+        ('warmup_bars', None),  # Кол-во последних исторических бар для разогрева индикаторов. Из файла читаются только они. None - вся история
+        ('deadline', None),  # Крайний срок запросов к QUIK при обработке нового бара и получении бар по расписанию в секундах. Не уложившиеся в срок запросы прерываются. None - без ограничения
     )
     datapath = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'Data', 'QUIK', '')  # Путь сохранения файла истории
     delimiter = '\t'  # Разделитель значений в файле истории. По умолчанию табуляция
     dt_format = '%d.%m.%Y %H:%M'  # Формат представления даты и времени в файле истории. По умолчанию русский формат
+    block_size = 65536  # Размер блока в байтах при чтении файла истории с конца
     sleep_time_sec = 0.000_01  # Время ожидания в секундах, если не пришел новый бар. Для снижения нагрузки/энергопотребления процессора
     delta = 3  # Корректировка в секундах при проверке времени окончания бара
 
@@ -40,20 +52,45 @@ class QKData(with_metaclass(MetaQKData, AbstractDataBase)):
         self.store = QKStore(**kwargs)  # Хранилище QUIK
         # self.class_code, self.sec_code = self.store.provider.dataname_to_class_sec_codes(self.p.dataname)  # По тикеру получаем код режима торгов и тикер
         self.class_code, self.sec_code = self.p.dataname.split('.')  # По тикеру получаем код режима торгов и тикер
-        # self.derivative = self.class_code == 'SPBFUT'  # Для деривативов не используем конвертацию цен и кол-ва
-        self.derivative = self.class_code == self.store.provider.futures_cls_code  # Для деривативов не используем конвертацию цен и кол-ва
         self.quik_timeframe = self.bt_timeframe_to_quik_timeframe(self.p.timeframe, self.p.compression)  # Конвертируем временной интервал из BackTrader в QUIK
         self.tf = self.bt_timeframe_to_tf(self.p.timeframe, self.p.compression)  # Конвертируем временной интервал из BackTrader для имени файла истории и расписания
+        self.tick_mode = self.p.timeframe in (TimeFrame.Ticks, TimeFrame.Seconds)  # Тиковые и секундные бары собираем из обезличенных сделок
+        if self.tick_mode:  # Для тиковых и секундных бар
+            self.dt_format = '%d.%m.%Y %H:%M:%S.%f' if self.p.timeframe == TimeFrame.Ticks else '%d.%m.%Y %H:%M:%S'  # в файле истории храним время с секундами
         self.file = f'{self.class_code}.{self.sec_code}_{self.tf}'  # Имя файла истории
         # self.logger = logging.getLogger(f'QKData.{self.file}')  # Будем вести лог
         self.file_name = f'{self.datapath}{self.file}.txt'  # Полное имя файла истории
         os.makedirs(os.path.dirname(self.file_name), exist_ok=True)
+        self.resampler = None  # Сборка бар из бар базового интервала
+        if self.p.base:  # Если бары собираем из бар базового интервала
+            base_timeframe, base_compression = self.p.base  # Базовый интервал
+            self.base_interval = self.bt_timeframe_to_quik_timeframe(base_timeframe, base_compression)  # Базовый интервал QUIK
+            if self.tick_mode or base_timeframe not in (TimeFrame.Minutes, TimeFrame.Days) or self.base_interval >= self.quik_timeframe or \
+                    self.p.timeframe == TimeFrame.Minutes and self.p.compression % base_compression:  # Базовый интервал должен быть меньше и укладываться в интервал данных целое число раз
+                raise ValueError(f'Бары {self.tf} нельзя собрать из бар {self.bt_timeframe_to_tf(base_timeframe, base_compression)}')
+            self.base_file_name = f'{self.datapath}{self.class_code}.{self.sec_code}_{self.bt_timeframe_to_tf(base_timeframe, base_compression)}.txt'  # Файл истории базового интервала
+            self.resampler = BarResampler(self.p.timeframe, self.p.compression, self.base_interval)
         self.history_bars = []  # Исторические бары из файла и истории после проверки на соответствие условиям выборки
-        self.guid = None  # Идентификатор подписки/расписания на историю цен
-        self.exit_event = Event()  # Определяем событие выхода из потока
+        self.history_prices = []  # Цены open/high/low/close исторических бар в рублях за штуку. Конвертируются все сразу перед отправкой в ТС
+        self.history_index = 0  # Номер следующего исторического бара для отправки в ТС
+        self.guid = None  # Идентификатор расписания на историю цен
+        self.new_bars = deque()  # Новые бары из QUIK по подписке/расписанию. При подписке очередь выдает менеджер свечей хранилища
         self.dt_last_open = datetime.min  # Дата и время открытия последнего полученного бара
         self.last_bar_received = False  # Получен последний бар
         self.live_mode = False  # Режим получения баров. False = История, True = Новые бары
+        self.profile = None  # Профиль инструмента
+        self.to_price = None  # Функция перевода цены QUIK в цену в рублях за штуку. Выбирается при старте по профилю инструмента
+        self.order_book = None  # Стакан по подписке
+        self.tick_buffer = None  # Кольцевой буфер обезличенных сделок по подписке
+        self.tick_cursor = 0  # Номер следующей непрочитанной сделки в буфере
+        self.tick_aggregator = None  # Сборка бар из обезличенных сделок
+        self.corrections = []  # Бары, исправленные поздними сделками после отправки в ТС по времени закрытия
+        self.built_bars = deque()  # Собранные из сделок / бар базового интервала проверенные новые бары
+
+    @property
+    def derivative(self):
+        """Для деривативов не используем конвертацию цен и кол-ва. Провайдер создается при первом обращении, поэтому код режима берем при обращении"""
+        return self.class_code == self.store.provider.futures_cls_code
 
     def setenvironment(self, env):
         """Добавление хранилища QUIK в cerebro"""
@@ -63,56 +100,97 @@ class QKData(with_metaclass(MetaQKData, AbstractDataBase)):
     def start(self):
         super(QKData, self).start()
         self.put_notification(self.DELAYED)  # Отправляем уведомление об отправке исторических (не новых) баров
-        self.get_bars_from_file()  # Получаем бары из файла
-        self.get_bars_from_history()  # Получаем бары из истории
+        self.profile = self.store.provider.get_instrument_profile(self.class_code, self.sec_code)  # Профиль инструмента создается один раз
+        self.to_price = self.profile.same_price if self.derivative else self.profile.quik_price_to_price  # Для деривативов цена без изменения. Для остальных цена в рублях за штуку
+        if not self.resampler:  # Бары, собранные из бар базового интервала, в файл не пишем
+            self.get_bars_from_file()  # Получаем бары из файла
+        if self.tick_mode:  # Если бары собираем из обезличенных сделок
+            self.tick_aggregator = TickAggregator(seconds=self.p.compression) if self.p.timeframe == TimeFrame.Seconds else TickAggregator(ticks=self.p.compression)
+            if self.p.live_bars:  # Если получаем новые бары
+                self.tick_buffer = self.store.ticks.subscribe(self.class_code, self.sec_code)  # то подписываемся на сделки до получения истории, чтобы не было разрыва
+                self.tick_cursor = self.tick_buffer.seq  # Читаем сделки, пришедшие после подписки. Повторы с историей отсекаются по номеру сделки
+            self.get_bars_from_trades()  # Получаем бары из обезличенных сделок текущей сессии
+        elif self.resampler:  # Если бары собираем из бар базового интервала
+            if self.p.live_bars:  # Если получаем новые бары
+                self.new_bars = self.store.candles.subscribe(self.class_code, self.sec_code, self.base_interval)  # то подписываемся на базовый интервал до получения истории, чтобы не было разрыва
+            self.get_bars_from_base()  # Собираем бары из истории базового интервала
+        else:  # Если бары получаем из QUIK
+            self.get_bars_from_history()  # Получаем бары из истории
+        if self.p.warmup_bars and len(self.history_bars) > self.p.warmup_bars:  # Если исторических бар больше, чем нужно для разогрева
+            self.history_bars = self.history_bars[-self.p.warmup_bars:]  # то оставляем только последние
+        self.convert_history_prices()  # Переводим цены всех исторических бар за один проход
+        if self.p.order_book:  # Если нужен стакан
+            self.order_book = self.store.books.subscribe(self.class_code, self.sec_code)  # то подписываемся на него
         if len(self.history_bars) > 0:  # Если был получен хотя бы 1 бар
             self.put_notification(self.CONNECTED)  # то отправляем уведомление о подключении и начале получения исторических бар
-        if self.p.live_bars:  # Если получаем историю и новые бары
+        if self.p.live_bars and not self.tick_mode and not self.resampler:  # Если получаем историю и новые бары из QUIK
             if self.p.schedule:  # Если получаем новые бары по расписанию
                 self.guid = str(uuid4())  # guid расписания
-                Thread(target=self.stream_bars).start()  # Создаем и запускаем получение новых бар по расписанию в потоке
+                self.store.scheduler.add(self)  # Бары получает поток расписания хранилища вместе с барами остальных данных
             else:  # Если получаем новые бары по подписке
-                self.guid = (self.class_code, self.sec_code, self.quik_timeframe)  # guid подписки
                 logger.debug('Запуск подписки на новые бары')
-                if not self.store.provider.is_subscribed(self.class_code, self.sec_code, self.quik_timeframe)['data']:  # Если не было подписки на тикер/интервал
-                    self.store.provider.subscribe_to_candles(self.class_code, self.sec_code, self.quik_timeframe)  # Подписываемся на новые бары
+                self.new_bars = self.store.candles.subscribe(self.class_code, self.sec_code, self.quik_timeframe)  # Одна подписка QUIK на тикер/интервал для всех данных. Каждые данные получают все бары
 
     def _load(self):
         """Загрузка бара из истории или нового бара"""
-        if len(self.history_bars) > 0:  # Если есть исторические данные
-            bar = self.history_bars.pop(0)  # Берем и удаляем первый бар из хранилища исторических данных. С ним будем работать
+        if self.history_index < len(self.history_bars):  # Если есть исторические данные
+            bar = self.history_bars[self.history_index]  # Берем следующий бар из хранилища исторических данных. С ним будем работать
+            open_price, high_price, low_price, close_price = self.history_prices[self.history_index]  # Цены уже переведены при старте
+            self.history_index += 1  # Переходим к следующему бару
+            if self.history_index == len(self.history_bars):  # Если отправили все исторические бары
+                self.history_bars, self.history_prices, self.history_index = [], [], 0  # то освобождаем память
         elif not self.p.live_bars:  # Если получаем только историю (self.history_bars) и исторических данных нет / все исторические данные получены
             self.put_notification(self.DISCONNECTED)  # Отправляем уведомление об окончании получения исторических бар
             logger.debug('Бары из файла/истории отправлены в ТС. Новые бары получать не нужно. Выход')
             return False  # Больше сюда заходить не будем
-        else:  # Если получаем историю и новые бары (self.store.new_bars)
-            new_bars = [new_bar for new_bar in self.store.new_bars if new_bar['guid'] == self.guid]  # Получаем новые бары из хранилища по guid
-            if len(new_bars) == 0:  # Если новый бар еще не появился
-                # logger.debug(f'Новых бар нет. Ожидание {self.sleep_time_sec} с')  # Для отладки. Грузит процессор.
-                sleep(self.sleep_time_sec)  # Ждем для снижения нагрузки/энергопотребления процессора
-                return None  # то нового бара нет, будем заходить еще
-            self.last_bar_received = len(new_bars) == 1  # Если в хранилище остался 1 бар, то мы будем получать последний возможный бар
-            if self.last_bar_received:  # Получаем последний возможный бар
-                logger.debug('Получение последнего возможного на данный момент бара')
-            bar = new_bars[0]  # Берем первый бар из хранилища новых бар. С ним будем работать
-            self.store.new_bars.remove(bar)  # Удаляем этот бар из хранилища новых бар
-            bar = bar['data']  # Данные бара
-            if not self.is_bar_valid(bar):  # Если бар не соответствует всем условиям выборки
-                return None  # то пропускаем бар, будем заходить еще
-            logger.debug(f'Сохранение нового бара с {bar["datetime"].strftime(self.dt_format)} в файл')
-            self.save_bar_to_file(bar)  # Сохраняем бар в конец файла
+        else:  # Если получаем историю и новые бары (self.new_bars / self.built_bars)
+            if self.tick_mode or self.resampler:  # Если бары собираем из обезличенных сделок / бар базового интервала
+                if not self.built_bars:  # Если собранных бар нет
+                    if self.tick_mode:  # Если бары собираем из обезличенных сделок
+                        self.pull_tick_bars()  # то собираем новые бары из сделок подписки
+                    else:  # Если бары собираем из бар базового интервала
+                        self.pull_base_bars()  # то собираем новые бары из бар базового интервала подписки
+                if not self.built_bars:  # Если новый бар еще не появился
+                    sleep(self.sleep_time_sec)  # Ждем для снижения нагрузки/энергопотребления процессора
+                    return None  # то нового бара нет, будем заходить еще
+                self.last_bar_received = len(self.built_bars) == 1  # Если остался 1 бар, то мы будем получать последний возможный бар
+                bar = self.built_bars.popleft()  # Бар уже проверен
+            else:  # Если бары получаем из QUIK
+                if not self.new_bars:  # Если новый бар еще не появился
+                    # logger.debug(f'Новых бар нет. Ожидание {self.sleep_time_sec} с')  # Для отладки. Грузит процессор.
+                    sleep(self.sleep_time_sec)  # Ждем для снижения нагрузки/энергопотребления процессора
+                    return None  # то нового бара нет, будем заходить еще
+                self.last_bar_received = len(self.new_bars) == 1  # Если в очереди остался 1 бар, то мы будем получать последний возможный бар
+                if self.last_bar_received:  # Получаем последний возможный бар
+                    logger.debug('Получение последнего возможного на данный момент бара')
+                item = self.new_bars.popleft()  # Берем первый бар из очереди новых бар. С ним будем работать
+                if item.get('correction'):  # Если пришло исправление бара, отправленного по времени закрытия
+                    self.on_bar_correction(item['data'])  # то исправляем файл истории
+                    return None  # Бар уже в ТС, будем заходить еще
+                if metrics.enabled and 'received_ns' in item:  # Если метрики включены, и известно время получения бара
+                    metrics.observe_ns('bar_delivery', item['received_ns'], data=self.p.dataname)  # Время от получения бара из QUIK до выдачи в ТС
+                bar = item['data']  # Данные бара
+                if not self.is_bar_valid(bar, item.get('closed', False)):  # Если бар не соответствует всем условиям выборки
+                    return None  # то пропускаем бар, будем заходить еще
+                logger.debug('Сохранение нового бара с %s в файл', bar['datetime'])
+                self.save_bar_to_file(bar)  # Сохраняем бар в конец файла
+                if metrics.enabled:  # Если метрики включены
+                    dt_now = datetime.now(self.store.provider.tz_msk).replace(tzinfo=None)  # Текущее время МСК
+                    metrics.observe('bar_boundary', (dt_now - self.get_bar_close_date_time(bar['datetime'])) / timedelta(microseconds=1), data=self.p.dataname)  # Время от окончания бара до выдачи в ТС
             if self.last_bar_received and not self.live_mode:  # Если получили последний бар и еще не находимся в режиме получения новых бар (LIVE)
                 self.put_notification(self.LIVE)  # Отправляем уведомление о получении новых бар
                 self.live_mode = True  # Переходим в режим получения новых бар (LIVE)
             elif self.live_mode and not self.last_bar_received:  # Если находимся в режиме получения новых бар (LIVE)
                 self.put_notification(self.DELAYED)  # Отправляем уведомление об отправке исторических (не новых) бар
                 self.live_mode = False  # Переходим в режим получения истории
+            to_price = self.to_price  # Функция конвертации цены из профиля инструмента
+            open_price, high_price, low_price, close_price = to_price(bar['open']), to_price(bar['high']), to_price(bar['low']), to_price(bar['close'])  # Для деривативов цена без изменения. Для остальных цена в рублях за штуку
         # Все проверки пройдены. Записываем полученный исторический/новый бар
         self.lines.datetime[0] = date2num(bar['datetime'])  # Переводим в формат хранения даты/времени в BackTrader
-        self.lines.open[0] = bar['open'] if self.derivative else self.store.provider.quik_price_to_price(self.class_code, self.sec_code, bar['open'])  # Для деривативов
-        self.lines.high[0] = bar['high'] if self.derivative else self.store.provider.quik_price_to_price(self.class_code, self.sec_code, bar['high'])  # цена без изменения
-        self.lines.low[0] = bar['low'] if self.derivative else self.store.provider.quik_price_to_price(self.class_code, self.sec_code, bar['low'])  # Для остальных
-        self.lines.close[0] = bar['close'] if self.derivative else self.store.provider.quik_price_to_price(self.class_code, self.sec_code, bar['close'])  # цена в рублях за штуку
+        self.lines.open[0] = open_price
+        self.lines.high[0] = high_price
+        self.lines.low[0] = low_price
+        self.lines.close[0] = close_price
         # self.lines.volume[0] = int(bar['volume']) if self.derivative else self.store.provider.lots_to_size(self.class_code, self.sec_code, int(bar['volume']))  # Для деривативов кол-во лотов. Для остальных кол-во штук
         self.lines.volume[0] = int(bar['volume'])
         self.lines.openinterest[0] = 0  # Открытый интерес в QUIK не учитывается
@@ -121,12 +199,20 @@ class QKData(with_metaclass(MetaQKData, AbstractDataBase)):
     def stop(self):
         super(QKData, self).stop()
         if self.p.live_bars:  # Если была подписка/расписание
-            if self.p.schedule:  # Если получаем новые бары по расписанию
-                self.exit_event.set()  # то отменяем расписание
+            if self.tick_mode:  # Если получаем новые бары из обезличенных сделок
+                self.store.ticks.unsubscribe(self.class_code, self.sec_code)  # то отменяем подписку на сделки
+                self.tick_buffer = None
+            elif self.resampler:  # Если получаем новые бары из бар базового интервала
+                self.store.candles.unsubscribe(self.new_bars)  # то отменяем подписку на базовый интервал
+            elif self.p.schedule:  # Если получаем новые бары по расписанию
+                self.store.scheduler.remove(self)  # то отменяем расписание
             else:  # Если получаем новые бары по подписке
-                logger.debug(f'Отмена подписки {self.guid} на новые бары')
-                self.store.provider.unsubscribe_from_candles(self.class_code, self.sec_code, self.quik_timeframe)  # то отменяем подписку
+                logger.debug(f'Отмена подписки {self.p.dataname} на новые бары')
+                self.store.candles.unsubscribe(self.new_bars)  # то отменяем подписку. В QUIK она отменяется после последних данных
             self.put_notification(self.DISCONNECTED)  # Отправляем уведомление об окончании получения новых бар
+        if self.order_book is not None:  # Если была подписка на стакан
+            self.store.books.unsubscribe(self.class_code, self.sec_code)  # то отменяем ее
+            self.order_book = None
         self.store.DataCls = None  # Удаляем класс данных в хранилище
 
     # Получение/сохранение бар
@@ -136,25 +222,96 @@ class QKData(with_metaclass(MetaQKData, AbstractDataBase)):
         if not os.path.isfile(self.file_name):  # Если файл не существует
             return  # то выходим, дальше не продолжаем
         logger.debug(f'Получение бар из файла {self.file_name}')
-        with open(self.file_name) as file:  # Открываем файл на последовательное чтение
-            reader = csv.reader(file, delimiter=self.delimiter)  # Данные в строке разделены табуляцией
-            next(reader, None)  # Пропускаем первую строку с заголовками
-            for csv_row in reader:  # Последовательно получаем все строки файла
-                bar = dict(datetime=datetime.strptime(csv_row[0], self.dt_format),
-                           open=float(csv_row[1]), high=float(csv_row[2]), low=float(csv_row[3]), close=float(csv_row[4]),
-                           volume=int(csv_row[5]))  # Бар из файла
-                if self.is_bar_valid(bar):  # Если исторический бар соответствует всем условиям выборки
-                    self.history_bars.append(bar)  # то добавляем бар
+        for bar in self.read_bars_from_file(self.file_name, self.p.fromdate, self.p.warmup_bars):  # Последовательно получаем бары файла с даты начала / последние бары для разогрева
+            if self.is_bar_valid(bar):  # Если исторический бар соответствует всем условиям выборки
+                self.history_bars.append(bar)  # то добавляем бар
         if len(self.history_bars) > 0:  # Если были получены бары из файла
             logger.debug(f'Получено бар из файла: {len(self.history_bars)} с {self.history_bars[0]["datetime"].strftime(self.dt_format)} по {self.history_bars[-1]["datetime"].strftime(self.dt_format)}')
         else:  # Бары из файла не получены
             logger.debug('Из файла новых бар не получено')
 
+    def read_bars_from_file(self, file_name, dt_from=None, count=None):
+        """Бары из файла истории по одному. Начало чтения ищется без чтения всего файла
+
+        :param str file_name: Полное имя файла истории
+        :param datetime dt_from: Дата и время открытия первого бара. Строка ищется двоичным поиском по смещениям в файле
+        :param int count: Кол-во последних бар. Строки отсчитываются блоками с конца файла
+        """
+        with open(file_name, 'rb') as file:  # Открываем файл на чтение байтов, чтобы переходить по смещениям
+            file.readline()  # Пропускаем первую строку с заголовками
+            start = file.tell()  # Смещение первой строки с баром
+            size = file.seek(0, os.SEEK_END)  # Размер файла
+            if dt_from:  # Если задана дата и время первого бара
+                start = self.seek_date_time(file, dt_from, start, size)  # то переходим к ней
+            if count:  # Если нужны только последние бары
+                start = max(start, self.seek_last_rows(file, count, start, size))  # то переходим к ним
+            file.seek(start)
+            reader = csv.reader(io.TextIOWrapper(file, newline=''), delimiter=self.delimiter)  # Данные в строке разделены табуляцией
+            for csv_row in reader:  # Последовательно получаем строки файла с найденной
+                yield dict(datetime=datetime.strptime(csv_row[0], self.dt_format),
+                           open=float(csv_row[1]), high=float(csv_row[2]), low=float(csv_row[3]), close=float(csv_row[4]),
+                           volume=int(csv_row[5]))  # Бар из файла
+
+    def seek_date_time(self, file, dt, start, size) -> int:
+        """Смещение первой строки файла истории с датой и временем открытия бара не раньше заданных. Двоичный поиск по смещениям строк
+        Строки в файле идут по возрастанию даты и времени, т.к. бары только дописываются в конец
+
+        :param file: Файл истории, открытый на чтение байтов
+        :param datetime dt: Дата и время открытия бара
+        :param int start: Смещение первой строки с баром
+        :param int size: Размер файла
+        :return: Смещение строки. Размер файла, если таких бар нет
+        """
+        lo, hi = start, size  # Строки до lo раньше dt, строки с hi не раньше dt
+        while lo < hi:
+            mid = (lo + hi) // 2
+            file.seek(mid - 1)
+            file.readline()  # Дочитываем строку, в которую попали
+            pos = file.tell()  # Начало первой строки не раньше середины
+            if pos >= hi:  # Если между серединой и hi строк нет
+                hi = mid
+                continue
+            line = file.readline()  # Строка с баром
+            if datetime.strptime(line.split(self.delimiter.encode(), 1)[0].decode(), self.dt_format) < dt:  # Если бар раньше
+                lo = file.tell()  # то ищем после этой строки
+            else:  # Если бар не раньше
+                hi = pos  # то ищем до этой строки включительно
+        return lo
+
+    def seek_last_rows(self, file, count, start, size) -> int:
+        """Смещение первой из последних count строк файла истории. Файл читается блоками с конца
+
+        :param file: Файл истории, открытый на чтение байтов
+        :param int count: Кол-во последних строк
+        :param int start: Смещение первой строки с баром
+        :param int size: Размер файла
+        :return: Смещение строки. Смещение первой строки, если строк в файле меньше
+        """
+        newlines = 0  # Кол-во найденных переводов строк
+        pos = size  # Начало прочитанного блока
+        while pos > start:  # Пока не дошли до первой строки с баром
+            block_size = min(self.block_size, pos - start)
+            pos -= block_size
+            file.seek(pos)
+            block = file.read(block_size)  # Блок файла
+            i = len(block)
+            while (i := block.rfind(b'\n', 0, i)) >= 0:  # Пробегаемся по переводам строк блока с конца
+                if pos + i == size - 1:  # Перевод строки в конце файла
+                    continue  # новую строку не начинает
+                newlines += 1
+                if newlines == count:  # Если отсчитали все строки
+                    return pos + i + 1  # то начинаем со следующей за переводом строки
+        return start
+
     def get_bars_from_history(self) -> None:
         """Получение бар из истории"""
         file_history_bars_len = len(self.history_bars)  # Кол-во полученных бар из файла для лога
         logger.debug(f'Получение всех бар из истории')
-        history_bars = self.store.provider.get_candles_from_data_source(self.class_code, self.sec_code, self.quik_timeframe)['data']  # Получаем все бары из QUIK
+        response = self.store.provider.get_candles_from_data_source(self.class_code, self.sec_code, self.quik_timeframe)  # Получаем все бары из QUIK
+        if response['cmd'] == 'lua_create_data_source_error':  # Если источник данных не создан / не заполнился
+            logger.error(f'Бары из истории не получены: {response["lua_error"]}')
+            return  # то выходим, дальше не продолжаем
+        history_bars = response['data']  # Бары из QUIK
         for history_bar in history_bars:  # Пробегаемся по всем полученным барам
             bar = dict(datetime=self.store.get_bar_open_date_time(history_bar),  # Собираем дату и время открытия бара
                        open=history_bar['open'], high=history_bar['high'], low=history_bar['low'], close=history_bar['close'],  # Цены QUIK
@@ -167,10 +324,128 @@ class QKData(with_metaclass(MetaQKData, AbstractDataBase)):
         else:  # Бары из истории не получены
             logger.debug('Из истории новых бар не получено')
 
-    def is_bar_valid(self, bar) -> bool:
-        """Проверка бара на соответствие условиям выборки"""
+    def get_bars_from_base(self) -> None:
+        """Сборка бар из истории базового интервала. История загружается хранилищем один раз на все данные тикера"""
+        base_bars = self.store.candles.get_history(self.class_code, self.sec_code, self.base_interval, self.load_base_history)  # Бары базового интервала
+        bars = []  # Собранные бары
+        for base_bar in base_bars:  # Пробегаемся по всем барам базового интервала
+            bars += self.resampler.update(base_bar)  # Собираем закрытые бары. Последний бар остается открытым до новых бар подписки
+        if not self.p.live_bars:  # Если новые бары получать не будем
+            bars += self.resampler.close_due(self.get_quik_date_time_now())  # то закрываем последний бар, если его время закончилось
+        self.history_bars.extend(bar for bar in bars if self.is_bar_valid(bar))  # Добавляем бары, соответствующие всем условиям выборки
+        if self.history_bars:  # Если бары собраны
+            logger.debug(f'Собрано бар из {len(base_bars)} бар базового интервала: {len(self.history_bars)} с {self.history_bars[0]["datetime"].strftime(self.dt_format)} по {self.history_bars[-1]["datetime"].strftime(self.dt_format)}')
+        else:  # Бары не собраны
+            logger.debug('Из истории базового интервала бар не собрано')
+
+    def load_base_history(self) -> list[dict]:
+        """Закрытые бары базового интервала из файла и истории QUIK. Новые бары из истории дописываются в файл базового интервала"""
+        bars = []  # Бары базового интервала
+        if os.path.isfile(self.base_file_name):  # Если файл базового интервала существует
+            for bar in self.read_bars_from_file(self.base_file_name):  # Пробегаемся по всем барам файла
+                if not bars or bar['datetime'] > bars[-1]['datetime']:  # Повторы пропускаем
+                    bars.append(bar)
+        logger.debug(f'Получение бар базового интервала {self.base_interval} из истории')
+        response = self.store.provider.get_candles_from_data_source(self.class_code, self.sec_code, self.base_interval)  # Получаем все бары базового интервала из QUIK
+        if response['cmd'] == 'lua_create_data_source_error':  # Если источник данных не создан / не заполнился
+            logger.error(f'Бары базового интервала из истории не получены: {response["lua_error"]}')
+            return bars  # то собираем бары только из файла
+        dt_last_open = bars[-1]['datetime'] if bars else datetime.min  # Дата и время открытия последнего бара из файла
+        dt_now = self.get_quik_date_time_now() + timedelta(seconds=self.delta)  # Текущая дата и время на бирже с корректировкой
+        period = timedelta(minutes=self.base_interval)  # Длительность базового бара
+        new_bars = []  # Новые закрытые бары из истории
+        for history_bar in response['data']:  # Пробегаемся по всем полученным барам
+            dt_open = self.store.get_bar_open_date_time(history_bar)  # Дата и время открытия бара
+            if dt_open > dt_last_open and dt_open + period <= dt_now:  # Если бара нет в файле, и он закрыт
+                new_bars.append(dict(datetime=dt_open, open=history_bar['open'], high=history_bar['high'], low=history_bar['low'], close=history_bar['close'], volume=int(history_bar['volume'])))
+                dt_last_open = dt_open
+        self.save_bars_to_file(new_bars, self.base_file_name)  # Сохраняем новые бары в файл базового интервала одной записью
+        logger.debug(f'Получено бар базового интервала: из файла {len(bars)}, из истории {len(new_bars)}')
+        return bars + new_bars
+
+    def get_bars_from_trades(self) -> None:
+        """Получение бар из обезличенных сделок текущей сессии"""
+        file_history_bars_len = len(self.history_bars)  # Кол-во полученных бар из файла для лога
+        logger.debug('Получение бар из обезличенных сделок')
+        trades = self.store.provider.get_trade(self.class_code, self.sec_code)['data']  # Получаем все обезличенные сделки по тикеру из QUIK
+        if not isinstance(trades, list):  # Если сделок нет, то QUIK может вернуть пустой словарь
+            trades = []
+        buffer = TickBuffer(self.class_code, self.sec_code, max(len(trades), 1))  # Буфер под все сделки
+        buffer.extend(trades)  # Раскладываем сделки по столбцам
+        _, (times, prices, quantities, trade_nums) = buffer.read(0)  # Столбцы сделок
+        if self.history_bars:  # Если были бары из файла
+            dt_last_open = self.history_bars[-1]['datetime']  # Дата и время открытия последнего бара из файла
+            if self.p.timeframe == TimeFrame.Seconds:  # Для секундных бар
+                new = times >= datetime_to_us(self.get_bar_close_date_time(dt_last_open))  # берем сделки после закрытия последнего бара
+            else:  # Для тиковых бар
+                new = np.arange(len(times)) >= self.last_tick_bar_end(self.history_bars[-1], times, prices, quantities)  # берем сделки после последней сделки последнего бара
+            times, prices, quantities, trade_nums = times[new], prices[new], quantities[new], trade_nums[new]
+        bars = self.tick_aggregator.update(times, prices, quantities, trade_nums)  # Собираем закрытые бары
+        if not self.p.live_bars:  # Если новые бары получать не будем
+            bars += self.tick_aggregator.close_due(datetime_to_us(self.get_quik_date_time_now()))  # то закрываем последний бар, если его время закончилось
+        bars = [bar for bar in bars if self.is_bar_valid(bar)]  # Бары, соответствующие всем условиям выборки
+        self.history_bars.extend(bars)  # Добавляем бары
+        self.save_bars_to_file(bars)  # и сохраняем их в конец файла
+        if len(self.history_bars) - file_history_bars_len > 0:  # Если получены бары из сделок
+            logger.debug(f'Получено бар из сделок: {len(self.history_bars) - file_history_bars_len} с {self.history_bars[file_history_bars_len]["datetime"].strftime(self.dt_format)} по {self.history_bars[-1]["datetime"].strftime(self.dt_format)}')
+        else:  # Бары из сделок не получены
+            logger.debug('Из сделок новых бар не получено')
+
+    def last_tick_bar_end(self, bar, times, prices, quantities) -> int:
+        """Индекс первой сделки после тикового бара из файла. Тиковый бар открывается временем первой сделки и содержит compression сделок,
+        поэтому бар ищется среди сделок с его временем открытия по цене открытия, цене закрытия и объему
+
+        :param dict bar: Последний бар из файла
+        :param np.ndarray times: Время сделок в микросекундах по возрастанию
+        :param np.ndarray prices: Цены сделок QUIK
+        :param np.ndarray quantities: Кол-во в лотах
+        :return: Индекс сделки. Если бар не найден (например, он из прошлой сессии), то первая сделка после его открытия
+        """
+        dt_us = datetime_to_us(bar['datetime'])  # Время открытия бара
+        ticks = self.p.compression  # Кол-во сделок в баре
+        for start in np.flatnonzero(times == dt_us).tolist():  # Сделки, с которых мог начаться бар. В одну микросекунду может быть несколько сделок
+            end = start + ticks  # Индекс сделки после бара
+            if end <= len(times) and prices[start] == bar['open'] and prices[end - 1] == bar['close'] and int(quantities[start:end].sum()) == bar['volume']:  # Если сделки совпадают с баром
+                return end
+        return int(np.searchsorted(times, dt_us, side='right'))
+
+    def pull_tick_bars(self) -> None:
+        """Сборка новых бар из обезличенных сделок подписки"""
+        self.tick_cursor, ticks = self.tick_buffer.read(self.tick_cursor)  # Все новые сделки пачкой
+        bars = self.tick_aggregator.update(*ticks) if len(ticks[0]) else []  # Собираем закрытые бары
+        now_us = datetime_to_us(datetime.now(self.store.provider.tz_msk).replace(tzinfo=None) - timedelta(seconds=self.delta))  # Текущее время МСК с корректировкой на задержку сделок
+        bars += self.tick_aggregator.close_due(now_us)  # Закрываем секундный бар, если его время закончилось
+        bars = [bar for bar in bars if self.is_bar_valid(bar)]  # Бары, соответствующие всем условиям выборки
+        if bars:  # Если есть новые бары
+            self.save_bars_to_file(bars)  # то сохраняем их в конец файла одной записью
+            self.built_bars.extend(bars)  # и ставим в очередь на отправку в ТС
+
+    def pull_base_bars(self) -> None:
+        """Сборка новых бар из бар базового интервала подписки"""
+        bars = []  # Собранные бары
+        while self.new_bars:  # Пока есть новые бары базового интервала
+            item = self.new_bars.popleft()  # Бар базового интервала
+            if not item.get('correction'):  # Исправления базовых бар в собранные бары не попадают
+                bars += self.resampler.update(item['data'])  # Собираем закрытые бары
+        bars += self.resampler.close_due(datetime.now(self.store.provider.tz_msk).replace(tzinfo=None) - timedelta(seconds=self.delta))  # Закрываем бар, если его время закончилось, а новых базовых бар не было
+        self.built_bars.extend(bar for bar in bars if self.is_bar_valid(bar))  # Ставим бары, соответствующие всем условиям выборки, в очередь на отправку в ТС
+
+    def convert_history_prices(self) -> None:
+        """Перевод цен QUIK всех исторических бар в цены в рублях за штуку столбцами open/high/low/close за один проход"""
+        columns = ('open', 'high', 'low', 'close')  # Столбцы цен
+        prices = np.fromiter((bar[column] for bar in self.history_bars for column in columns), dtype=np.float64, count=len(columns) * len(self.history_bars)).reshape(-1, len(columns))  # Матрица цен QUIK
+        if not self.derivative:  # Для деривативов цена без изменения
+            prices = self.profile.quik_prices_to_prices(prices)  # Для остальных цена в рублях за штуку
+        self.history_prices = prices.tolist()  # Строки цен для быстрой выдачи в _load
+
+    def is_bar_valid(self, bar, closed=False) -> bool:
+        """Проверка бара на соответствие условиям выборки
+
+        :param dict bar: Бар
+        :param bool closed: Бар закрыт по времени сервера в QUIK. Время закрытия не проверяем
+        """
         dt_open = bar['datetime']  # Дата и время открытия бара МСК
-        if dt_open <= self.dt_last_open:  # Если пришел бар из прошлого (дата открытия меньше последней даты открытия)
+        if dt_open < self.dt_last_open or dt_open == self.dt_last_open and self.p.timeframe != TimeFrame.Ticks:  # Тиковые бары могут открываться в одно время  # Если пришел бар из прошлого (дата открытия меньше последней даты открытия)
             # logger.debug(f'Дата/время открытия бара {dt_open} <= последней даты/времени открытия {self.dt_last_open}')  # Для отладки, т.к. идет замедление при обработке старых бар на возобновлении подписки
             return False  # то бар не соответствует условиям выборки
         if self.p.fromdate and dt_open < self.p.fromdate or self.p.todate and dt_open > self.p.todate:  # Если задан диапазон, а бар за его границами
@@ -181,15 +456,18 @@ class QKData(with_metaclass(MetaQKData, AbstractDataBase)):
             # logger.debug(f'Дата/время открытия бара {dt_open} до начала торговой сессии {self.p.sessionstart}')
             self.dt_last_open = dt_open  # Запоминаем дату/время открытия пришедшего бара для будущих сравнений
             return False  # то бар не соответствует условиям выборки
-        dt_close = self.get_bar_close_date_time(dt_open)  # Дата и время закрытия бара
+        dt_close = self.get_bar_close_date_time(dt_open) or dt_open  # Дата и время закрытия бара. У тиковых бар совпадает с открытием
         if self.p.sessionend != time(23, 59, 59, 999990) and dt_close.time() > self.p.sessionend:  # Если задано время окончания сессии и закрытие бара после этого времени
             # logger.debug(f'Дата/время открытия бара {dt_open} после окончания торговой сессии {self.p.sessionend}')
             self.dt_last_open = dt_open  # Запоминаем дату/время открытия пришедшего бара для будущих сравнений
             return False  # то бар не соответствует условиям выборки
         if not self.p.four_price_doji and bar['high'] == bar['low']:  # Если не пропускаем дожи 4-х цен, но такой бар пришел
-            logger.debug(f'Бар {dt_open} - дожи 4-х цен')
+            logger.debug('Бар %s - дожи 4-х цен', dt_open)
             self.dt_last_open = dt_open  # Запоминаем дату/время открытия пришедшего бара для будущих сравнений
             return False  # то бар не соответствует условиям выборки
+        if self.tick_mode or self.resampler or closed:  # Бары из обезличенных сделок и бар базового интервала собираются только закрытыми. Бары, закрытые по времени, QUIK отправляет закрытыми
+            self.dt_last_open = dt_open  # Запоминаем дату/время открытия пришедшего бара для будущих сравнений
+            return True  # Время закрытия бара не проверяем
         dt_market_now = self.get_quik_date_time_now()  # Текущая дата и время из QUIK
         dt_market_now_corrected = dt_market_now + timedelta(seconds=self.delta)  # Текущая дата и время из QUIK с корректировкой
         if dt_close > dt_market_now_corrected and dt_market_now_corrected.time() < self.p.sessionend:  # Если время закрытия бара еще не наступило на бирже, и сессия еще не закончилась
@@ -198,38 +476,59 @@ class QKData(with_metaclass(MetaQKData, AbstractDataBase)):
         self.dt_last_open = dt_open  # Запоминаем дату/время открытия пришедшего бара для будущих сравнений
         return True  # В остальных случаях бар соответствуем условиям выборки
 
-    def stream_bars(self) -> None:
-        """Поток получения новых бар по расписанию биржи"""
-        logger.debug('Запуск получения новых бар по расписанию')
-        while True:
-            market_datetime_now = self.p.schedule.utc_to_msk_datetime(datetime.utcnow())  # Текущее время на бирже
-            trade_bar_request_datetime = self.p.schedule.trade_bar_request_datetime(market_datetime_now, self.tf)  # Дата и время запроса бара на бирже
-            sleep_time_secs = (trade_bar_request_datetime - market_datetime_now).total_seconds()  # Время ожидания в секундах
-            logger.debug(f'Получение последнего бара по расписанию в {trade_bar_request_datetime.strftime(self.dt_format)}. Ожидание {sleep_time_secs} с')
-            exit_event_set = self.exit_event.wait(sleep_time_secs)  # Ждем нового бара или события выхода из потока
-            if exit_event_set:  # Если произошло событие выхода из потока
-                logger.debug('Отмена получения новых бар по расписанию')
-                return  # Выходим из потока, дальше не продолжаем
-            bars = self.store.provider.get_candles_from_data_source(self.class_code, self.sec_code, self.quik_timeframe, count=1)['data']  # Получаем последний бар из QUIK
-            stream_bar = bars[0]  # Последний бар
-            bar = dict(datetime=self.store.get_bar_open_date_time(stream_bar),  # Собираем дату и время открытия бара
-                       open=stream_bar['open'], high=stream_bar['high'], low=stream_bar['low'], close=stream_bar['close'],  # Цены QUIK
-                       volume=int(stream_bar['volume']))  # Объем в лотах. Бар по расписанию
-            logger.debug('Получен бар по расписанию')
-            self.store.new_bars.append(dict(guid=self.guid, data=bar))  # Добавляем в хранилище новых бар
+    def on_schedule_bar(self, response) -> None:
+        """Последний бар из QUIK по расписанию биржи. Вызывается из потока расписания хранилища
+
+        :param dict response: Ответ на запрос последнего бара
+        """
+        if response['cmd'] == 'lua_create_data_source_error' or not response['data']:  # Если бар не получен
+            logger.warning(f'Бар по расписанию не получен: {response.get("lua_error", "нет бар")}')
+            return  # то ждем следующего бара
+        stream_bar = response['data'][0]  # Последний бар
+        bar = dict(datetime=self.store.get_bar_open_date_time(stream_bar),  # Собираем дату и время открытия бара
+                   open=stream_bar['open'], high=stream_bar['high'], low=stream_bar['low'], close=stream_bar['close'],  # Цены QUIK
+                   volume=int(stream_bar['volume']))  # Объем в лотах. Бар по расписанию
+        logger.debug('Получен бар по расписанию')
+        self.new_bars.append(dict(data=bar))  # Добавляем в очередь новых бар
+
+    def on_bar_correction(self, bar) -> None:
+        """Исправление бара, отправленного по времени закрытия, поздними сделками. В ТС бар уже ушел, поэтому исправляем файл истории"""
+        logger.warning(f'Бар {bar["datetime"]:{self.dt_format}} исправлен поздними сделками: {bar}')
+        self.corrections.append(bar)  # Запоминаем исправление
+        if metrics.enabled:  # Если метрики включены
+            metrics.inc('bar_corrections', data=self.p.dataname)  # Кол-во исправленных бар
+        if bar['datetime'] != self.dt_last_open or not os.path.isfile(self.file_name):  # Если исправлен не последний записанный бар
+            return  # то файл не меняем
+        with open(self.file_name, 'rb+') as file:  # Открываем файл на чтение и запись байтов
+            file.readline()  # Пропускаем первую строку с заголовками
+            start = file.tell()  # Смещение первой строки с баром
+            file.truncate(self.seek_last_rows(file, 1, start, file.seek(0, os.SEEK_END)))  # Удаляем последнюю строку
+        self.save_bar_to_file(bar)  # Записываем исправленный бар
 
     def save_bar_to_file(self, bar) -> None:
         """Сохранение бара в конец файла"""
-        if not os.path.isfile(self.file_name):  # Существует ли файл
-            logger.debug(f'Файл {self.file_name} не найден и будет создан')
-            with open(self.file_name, 'w', newline='') as file:  # Создаем файл
+        self.save_bars_to_file([bar])
+
+    def save_bars_to_file(self, bars, file_name=None) -> None:
+        """Сохранение бар в конец файла за одно открытие файла
+
+        :param list bars: Бары
+        :param str file_name: Полное имя файла истории. По умолчанию, файл истории данных
+        """
+        if not bars:  # Если бар нет
+            return  # то выходим, дальше не продолжаем
+        file_name = file_name or self.file_name  # Файл истории
+        if not os.path.isfile(file_name):  # Существует ли файл
+            logger.debug(f'Файл {file_name} не найден и будет создан')
+            with open(file_name, 'w', newline='') as file:  # Создаем файл
                 writer = csv.writer(file, delimiter=self.delimiter)  # Данные в строке разделены табуляцией
-                writer.writerow(bar.keys())  # Записываем заголовок в файл
-        with open(self.file_name, 'a', newline='') as file:  # Открываем файл на добавление в конец. Ставим newline, чтобы в Windows не создавались пустые строки в файле
+                writer.writerow(bars[0].keys())  # Записываем заголовок в файл
+        with open(file_name, 'a', newline='') as file:  # Открываем файл на добавление в конец. Ставим newline, чтобы в Windows не создавались пустые строки в файле
             writer = csv.writer(file, delimiter=self.delimiter)  # Данные в строке разделены табуляцией
-            csv_row = bar.copy()  # Копируем бар для того, чтобы изменить формат даты
-            csv_row['datetime'] = csv_row['datetime'].strftime(self.dt_format)  # Приводим дату к формату файла
-            writer.writerow(csv_row.values())  # Записываем бар в конец файла
+            for bar in bars:  # Пробегаемся по всем барам
+                csv_row = bar.copy()  # Копируем бар для того, чтобы изменить формат даты
+                csv_row['datetime'] = csv_row['datetime'].strftime(self.dt_format)  # Приводим дату к формату файла
+                writer.writerow(csv_row.values())  # Записываем бар в конец файла
             # logger.debug(f'В файл {self.file_name} записан бар на {csv_row["datetime"]}')
 
     # Функции
@@ -242,7 +541,9 @@ class QKData(with_metaclass(MetaQKData, AbstractDataBase)):
         :param int compression: Размер временнОго интервала
         :return: Временной интервал QUIK
         """
-        if timeframe == TimeFrame.Minutes:  # Минутный временной интервал
+        if timeframe in (TimeFrame.Ticks, TimeFrame.Seconds):  # Тиковый и секундный временной интервал. Бары собираются из обезличенных сделок
+            return 0  # INTERVAL_TICK
+        elif timeframe == TimeFrame.Minutes:  # Минутный временной интервал
             return compression  # Кол-во минут
         elif timeframe == TimeFrame.Days:  # Дневной временной интервал (по умолчанию)
             return 1440  # В минутах
@@ -260,7 +561,11 @@ class QKData(with_metaclass(MetaQKData, AbstractDataBase)):
         :param int compression: Размер временнОго интервала
         :return: Временной интервал для имени файла истории и расписания
         """
-        if timeframe == TimeFrame.Minutes:  # Минутный временной интервал
+        if timeframe == TimeFrame.Ticks:  # Тиковый временной интервал
+            return f'T{compression}'
+        elif timeframe == TimeFrame.Seconds:  # Секундный временной интервал
+            return f'S{compression}'
+        elif timeframe == TimeFrame.Minutes:  # Минутный временной интервал
             return f'M{compression}'
         # Часовой график f'H{compression}' заменяем минутным. Пример: H1 = M60
         elif timeframe == TimeFrame.Days:  # Дневной временной интервал
@@ -296,8 +601,9 @@ class QKData(with_metaclass(MetaQKData, AbstractDataBase)):
         if not self.live_mode:  # Если не находимся в режиме получения новых баров
             return datetime.now(self.store.provider.tz_msk).replace(tzinfo=None)  # То время МСК получаем из локального времени
         try:  # Проверяем, можно ли привести полученные строки в дату и время
-            d = self.store.provider.get_info_param('TRADEDATE')['data']  # Дата на сервере в виде строки dd.mm.yyyy. Может прийти неверная дата
-            t = self.store.provider.get_info_param('SERVERTIME')['data']  # Время на сервере в виде строки hh:mi:ss
+            with self.store.provider.deadline(self.p.deadline):  # Бар обрабатываем в срок
+                d = self.store.provider.get_info_param('TRADEDATE')['data']  # Дата на сервере в виде строки dd.mm.yyyy. Может прийти неверная дата
+                t = self.store.provider.get_info_param('SERVERTIME')['data']  # Время на сервере в виде строки hh:mi:ss
             return datetime.strptime(f'{d} {t}', '%d.%m.%Y %H:%M:%S')  # Переводим строки в дату и время и возвращаем ее
-        except ValueError:  # Если нельзя привести полученные строки в дату и время
+        except (ValueError, RequestTimeoutError):  # Если нельзя привести полученные строки в дату и время, или QUIK не ответил в срок
             return datetime.now(self.store.provider.tz_msk).replace(tzinfo=None)  # То время МСК получаем из локального времени
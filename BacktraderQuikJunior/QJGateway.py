@@ -0,0 +1,539 @@
+from socket import socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR, IPPROTO_TCP, TCP_NODELAY, SHUT_RDWR  # Шлюз принимает клиентов так же, как скрипт QUIK#
+from threading import Thread, Event, Lock  # Потоки клиентов. Блокировка подписок
+from queue import Queue, Empty  # Очередь функций обратного вызова клиента
+from time import time  # Начальный номер транзакции шлюза
+from uuid import uuid4  # Код сессии клиента
+import argparse  # Запуск из командной строки
+import logging  # Лог в консоль при запуске из командной строки
+
+from .logger_config import logger  # Будем вести лог
+from .QuikJuniorPy import QuikPy
+from .QJSupervisor import ConnectionSupervisor
+from .QJMetrics import metrics  # Метрики задержек
+
+
+class GatewaySession:
+    """Клиент шлюза: соединения запросов и функций обратного вызова, подписки и фильтры клиента"""
+
+    def __init__(self, session_id, request_socket):
+        """Инициализация
+
+        :param str session_id: Код сессии. Клиент передает его в обоих соединениях
+        :param socket request_socket: Соединение для запросов
+        """
+        self.id = session_id  # Код сессии
+        self.request_socket = request_socket  # Соединение для запросов
+        self.callback_socket = None  # Соединение для функций обратного вызова. Приходит отдельно с тем же кодом сессии
+        self.outbox = Queue()  # Закодированные функции обратного вызова к отправке. Копятся, пока соединение не пришло
+        self.closed = Event()  # Сессия закрыта
+        self.candles = set()  # Подписки на свечи. (class_code, sec_code, interval, param)
+        self.quotes = set()  # Подписки на стаканы. (class_code, sec_code)
+        self.params = set()  # Заказанные текущие параметры. (class_code, sec_code, param_name)
+        self.filters = {}  # Фильтры функций обратного вызова. Событие → {(class_code, sec_code)}. Без фильтра - все инструменты
+
+    def allowed(self, event, class_code, sec_code) -> bool:
+        """Нужно ли отправлять клиенту событие по инструменту"""
+        instruments = self.filters.get(event)  # Фильтр события
+        return instruments is None or (class_code, sec_code) in instruments
+
+    def close(self) -> None:
+        """Закрытие соединений сессии"""
+        self.closed.set()
+        for connection in (self.request_socket, self.callback_socket):
+            if connection is not None:
+                try:
+                    connection.shutdown(SHUT_RDWR)  # Поток сессии выйдет из ожидания recv
+                except OSError:  # Соединение уже разорвано
+                    pass
+                connection.close()
+
+
+class QuikGateway:
+    """Шлюз: одно подключение к скрипту QUIK# на много процессов с ТС
+    Клиенты подключаются к шлюзу так же, как к скрипту QUIK#, по протоколу QUIK# (QuikGatewayClient). Запросы передаются в QUIK через одно подключение,
+    подписки на свечи, стаканы и параметры считаются по клиентам: в QUIK одна подписка на всех. Функции обратного вызова раздаются только подписанным клиентам,
+    номера транзакций клиентов заменяются номерами шлюза, поэтому ответы на транзакции, заявки и сделки приходят только отправившему клиенту
+    """
+    static_commands = {'getTradeAccounts', 'getClassesList', 'getClassInfo', 'getClassSecurities', 'getSecurityInfo', 'getSecurityClass'}  # Справочники не меняются за сессию. Ответы кэшируются для всех клиентов
+    order_callbacks = {'OnTransReply', 'OnOrder', 'OnTrade', 'OnStopOrder'}  # Функции обратного вызова с номером транзакции
+    order_commands = {'getOrder_by_Number', 'get_Trades_by_OrderNumber'}  # Запросы, в ответах на которые есть номер транзакции
+    hello_timeout = 5  # Сколько секунд ждать код сессии в соединении для функций обратного вызова
+    buffer_size = 1048576  # Размер буфера приема в байтах (1 МБайт)
+
+    def __init__(self, provider=None, host='127.0.0.1', requests_port=34150, callbacks_port=34151,
+                 quik_host='127.0.0.1', quik_requests_port=34130, quik_callbacks_port=34131, callback_batch=10, heartbeat=5):
+        """Инициализация шлюза
+
+        :param QuikPy provider: Готовое подключение к скрипту QUIK#. Если не задано, то создается при старте
+        :param str host: IP адрес или название хоста шлюза
+        :param int requests_port: Порт шлюза для запросов и ответов
+        :param int callbacks_port: Порт шлюза для функций обратного вызова
+        :param str quik_host: IP адрес или название хоста скрипта QUIK#
+        :param int quik_requests_port: Порт скрипта QUIK# для запросов и ответов
+        :param int quik_callbacks_port: Порт скрипта QUIK# для функций обратного вызова
+        :param int callback_batch: Окно объединения OnQuote и OnParam в скрипте QUIK# в мс. 0 - без объединения
+        :param float heartbeat: Период проверки соединения с QUIK# в секундах. None - без контроля соединения и повторного подключения
+        """
+        self.provider = provider  # Подключение к скрипту QUIK#
+        self.external_provider = provider is not None  # Подключение задано снаружи и не закрывается шлюзом
+        self.host = host  # IP адрес или название хоста шлюза
+        self.requests_port = requests_port  # Порт шлюза для запросов
+        self.callbacks_port = callbacks_port  # Порт шлюза для функций обратного вызова
+        self.quik = (quik_host, quik_requests_port, quik_callbacks_port)  # Скрипт QUIK#
+        self.callback_batch = callback_batch  # Окно объединения OnQuote и OnParam
+        self.supervisor = ConnectionSupervisor(heartbeat) if heartbeat else None  # Контроль соединения с QUIK#
+        self.sessions = {}  # Сессии клиентов. Код сессии → GatewaySession
+        self.pending_callbacks = {}  # Соединения для функций обратного вызова, сессии которых еще не представились. Код сессии → соединение
+        self.lock = Lock()  # Сессии, подписки и фильтры меняются из потоков клиентов
+        self.cache = {}  # Ответы на запросы справочников. (команда, данные) → ответ
+        self.trans_id = int(time()) % 86400 * 10000  # Последний номер транзакции шлюза. От секунды дня, чтобы не повторять номера после перезапуска шлюза
+        self.transactions = {}  # Транзакции клиентов. Номер транзакции шлюза → (сессия, номер транзакции клиента)
+        self.exit_event = Event()  # Событие остановки шлюза
+        self.servers = []  # Серверные соединения
+        self.threads = []  # Потоки приема подключений
+        self.handlers = {  # Запросы, которые шлюз обрабатывает сам
+            'gateway_hello': self.hello,
+            'subscribe_to_candles': self.subscribe_to_candles,
+            'unsubscribe_from_candles': self.unsubscribe_from_candles,
+            'is_subscribed': lambda session, msg: dict(msg, data=self.candle_key(msg['data']) in session.candles),
+            'Subscribe_Level_II_Quotes': self.subscribe_quotes,
+            'Unsubscribe_Level_II_Quotes': self.unsubscribe_quotes,
+            'IsSubscribed_Level_II_Quotes': lambda session, msg: dict(msg, data=tuple(msg['data'].split('|')[:2]) in session.quotes),
+            'paramRequest': lambda session, msg: dict(msg, data=self.request_params(session, [msg['data']])[0]),
+            'cancelParamRequest': lambda session, msg: dict(msg, data=self.cancel_params(session, [msg['data']])[0]),
+            'paramRequestBulk': lambda session, msg: dict(msg, data=self.request_params(session, msg['data'])),
+            'cancelParamRequestBulk': lambda session, msg: dict(msg, data=self.cancel_params(session, msg['data'])),
+            'set_callback_filter': self.set_callback_filter,
+            'reset_callback_filter': self.reset_callback_filter,
+            'set_callback_batch': lambda session, msg: dict(msg, data=True),  # Объединением событий в скрипте QUIK# управляет шлюз
+            'sendTransaction': self.send_transaction,
+        }
+
+    def __enter__(self):
+        """Вход в класс, например, с with. Запуск шлюза"""
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Выход из класса, например, с with. Остановка шлюза"""
+        self.stop()
+
+    # Запуск и остановка
+
+    def start(self) -> None:
+        """Подключение к скрипту QUIK# и прием клиентов"""
+        if self.provider is None:  # Если подключение не задано
+            host, requests_port, callbacks_port = self.quik
+            self.provider = QuikPy(host=host, requests_port=requests_port, callbacks_port=callbacks_port)  # то подключаемся к скрипту QUIK#
+        for name in [name for name in vars(self.provider) if name.startswith('on_')]:  # Все функции обратного вызова QUIK#
+            setattr(self.provider, name, self.publish)  # раздаем клиентам
+        for event in ('OnAllTrade', 'OnQuote', 'OnParam'):  # Пока клиентов нет, события по инструментам не нужны
+            self.apply_filter(event)
+        if self.callback_batch:  # Из изменений стакана/текущих параметров нужно только последнее
+            self.provider.set_callback_batch(self.callback_batch)
+        if self.supervisor:  # Если нужен контроль соединения
+            self.supervisor.start(self.provider)  # то запускаем его. Подписки и фильтры возобновит QuikPy
+        self.exit_event.clear()
+        for port, target in ((self.requests_port, self.accept_requests), (self.callbacks_port, self.accept_callbacks)):
+            server = socket(AF_INET, SOCK_STREAM)
+            server.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)  # Порт можно занять сразу после остановки предыдущего шлюза
+            server.bind((self.host, port))
+            server.listen()  # В отличие от скрипта QUIK#, клиентов много
+            server.settimeout(0.1)  # Чтобы поток мог проверять событие остановки
+            self.servers.append(server)
+            thread = Thread(target=target, args=(server,), name=f'GatewayAccept{port}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        logger.info(f'Шлюз QUIK# {self.host}:{self.requests_port}/{self.callbacks_port} запущен')
+
+    def stop(self) -> None:
+        """Остановка шлюза: закрытие соединений клиентов и подключения к QUIK#"""
+        self.exit_event.set()
+        for server in self.servers:
+            server.close()
+        for thread in self.threads:
+            thread.join(timeout=1)
+        self.servers, self.threads = [], []
+        for session in list(self.sessions.values()):
+            session.close()
+        if self.supervisor:
+            self.supervisor.stop()
+        if not self.external_provider and self.provider is not None:  # Если подключение создавал шлюз
+            self.provider.close()  # то закрываем его
+            self.provider = None
+        logger.info('Шлюз QUIK# остановлен')
+
+    # Подключения клиентов
+
+    def accept(self, server):
+        """Ожидание подключения клиента. Результат: соединение или None, если шлюз остановлен"""
+        while not self.exit_event.is_set():
+            try:
+                client, _ = server.accept()
+            except TimeoutError:  # Если клиент еще не подключился
+                continue  # то ждем дальше
+            except OSError:  # Если серверное соединение закрыто
+                return None
+            client.settimeout(None)  # Клиентское соединение блокирующее
+            client.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)  # Ответы и функции обратного вызова отправляем без задержки
+            return client
+        return None
+
+    def accept_requests(self, server) -> None:
+        """Поток приема соединений для запросов. На каждого клиента свой поток"""
+        while (client := self.accept(server)) is not None:
+            session = GatewaySession(uuid4().hex, client)  # Код сессии заменится кодом клиента в gateway_hello
+            with self.lock:
+                self.sessions[session.id] = session
+            Thread(target=self.serve, args=(session,), name='GatewaySession', daemon=True).start()
+
+    def accept_callbacks(self, server) -> None:
+        """Поток приема соединений для функций обратного вызова. Первой строкой клиент присылает код сессии"""
+        while (client := self.accept(server)) is not None:
+            Thread(target=self.attach_callbacks, args=(client,), name='GatewayCallbacks', daemon=True).start()
+
+    def attach_callbacks(self, client) -> None:
+        """Привязка соединения для функций обратного вызова к сессии по коду сессии"""
+        client.settimeout(self.hello_timeout)
+        line = b''
+        try:
+            while not line.endswith(b'\n') and len(line) < 256:  # Код сессии - одна короткая строка
+                fragment = client.recv(256 - len(line))
+                if not fragment:
+                    break
+                line += fragment
+        except OSError:  # Код сессии не пришел
+            pass
+        session_id = line.strip().decode(errors='replace')
+        if not line.endswith(b'\n') or not session_id:  # Клиент не представился. Например, обычный QuikPy
+            logger.warning('Соединение для функций обратного вызова без кода сессии закрыто. Подключайтесь к шлюзу через QuikGatewayClient')
+            client.close()
+            return
+        client.settimeout(None)
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None:  # Если сессия еще не представилась в соединении для запросов
+                self.pending_callbacks[session_id] = client  # то привяжем соединение в gateway_hello
+                return
+        self.start_writer(session, client)
+
+    def start_writer(self, session, client) -> None:
+        """Запуск потока отправки функций обратного вызова клиенту"""
+        session.callback_socket = client
+        Thread(target=self.write_callbacks, args=(session,), name='GatewayWriter', daemon=True).start()
+
+    def write_callbacks(self, session) -> None:
+        """Поток отправки функций обратного вызова клиенту. Накопившиеся сообщения отправляются одним пакетом, медленный клиент не задерживает остальных"""
+        while not session.closed.is_set():
+            try:
+                batch = [session.outbox.get(timeout=0.1)]  # Ждем первое сообщение
+            except Empty:
+                continue
+            while len(batch) < 1000:  # Добираем накопившиеся сообщения
+                try:
+                    batch.append(session.outbox.get_nowait())
+                except Empty:
+                    break
+            try:
+                session.callback_socket.sendall(b''.join(batch))
+            except OSError:  # Если клиент отключился
+                break
+
+    def serve(self, session) -> None:
+        """Поток запросов клиента. Запросы выполняются по очереди, как в скрипте QUIK#"""
+        tail = b''  # Неполная последняя строка
+        try:
+            while not self.exit_event.is_set():
+                fragment = session.request_socket.recv(self.buffer_size)
+                if not fragment:  # Если клиент закрыл соединение
+                    break
+                *lines, tail = (tail + fragment).split(b'\n')
+                for line in lines:
+                    if line.strip():  # Пустые строки пропускаем
+                        session.request_socket.sendall(self.process(session, line))
+        except OSError:  # Если соединение разорвано
+            pass
+        self.close_session(session)
+
+    def close_session(self, session) -> None:
+        """Закрытие сессии клиента. Подписки, которые больше никому не нужны, отменяются в QUIK"""
+        with self.lock:
+            if self.sessions.get(session.id) is not session:  # Если сессию уже закрыли
+                return
+            del self.sessions[session.id]
+            if not self.exit_event.is_set():  # При остановке шлюза подключение к QUIK# закрывается целиком, подписки отменять не нужно
+                try:
+                    self.release(session)
+                except OSError as e:  # Если соединение с QUIK# потеряно
+                    logger.warning(f'Подписки клиента шлюза {session.id} не отменены: {e}')
+        session.close()
+        logger.info(f'Клиент шлюза {session.id} отключен. Клиентов: {len(self.sessions)}')
+
+    def release(self, session) -> None:
+        """Отмена в QUIK подписок закрытой сессии, на которые не подписаны другие клиенты. Фильтры пересчитываются без сессии"""
+        for key in session.candles:
+            if not self.candle_subscribers(key):
+                self.provider.unsubscribe_from_candles(*key)
+        for key in session.quotes:
+            if not any(key in other.quotes for other in self.sessions.values()):
+                self.provider.unsubscribe_level2_quotes(*key)
+        for key in session.params:
+            if not any(key in other.params for other in self.sessions.values()):
+                self.provider.cancel_param_request(*key)
+        for event in ('OnAllTrade', 'OnQuote', 'OnParam'):
+            self.apply_filter(event)
+
+    # Запросы
+
+    @staticmethod
+    def encode(msg) -> bytes:
+        """Сообщение QUIK# в кодировке Windows 1251 с переводом строки"""
+        return f'{QuikPy.codec.dumps(msg)}\n'.encode(QuikPy.codec.encoding)
+
+    def process(self, session, line) -> bytes:
+        """Обработка запроса клиента
+
+        :param GatewaySession session: Сессия клиента
+        :param bytes line: Запрос в кодировке Windows 1251
+        :return: Ответ в кодировке Windows 1251 с переводом строки
+        """
+        try:
+            msg = QuikPy.codec.decode(line)
+        except ValueError as e:  # Ошибки разбора всех библиотек JSON - наследники ValueError
+            logger.error(f'Запрос клиента шлюза не разобран: {e}')
+            return self.encode({'cmd': 'lua_error', 'lua_error': f'QuikGateway: {e}', 'data': '', 'id': 0, 't': ''})
+        cmd = msg.get('cmd')
+        try:
+            handler = self.handlers.get(cmd)
+            if handler is not None:  # Если запрос шлюз обрабатывает сам
+                result = handler(session, msg)
+            elif cmd in self.static_commands:  # Если запрос справочника
+                result = self.cached(msg)
+            else:  # Остальные запросы передаем в QUIK
+                result = self.provider.process_request(msg)
+                if cmd in self.order_commands:  # Если в ответе есть номера транзакций
+                    result['data'] = self.restore_trans_ids(session, result.get('data'))  # то возвращаем клиенту его номера
+        except OSError as e:  # Соединение с QUIK# потеряно или запрос не выполнен за отведенное время
+            result = dict(msg, cmd='lua_error', lua_error=f'QuikGateway: {e}')
+        return self.encode(result)
+
+    def cached(self, msg) -> dict:
+        """Ответ на запрос справочника. В QUIK запрашивается один раз для всех клиентов"""
+        key = (msg['cmd'], str(msg.get('data')))
+        result = self.cache.get(key)
+        if result is None:  # Если запрос еще не выполняли
+            result = self.provider.process_request(msg)
+            if result.get('cmd') != 'lua_error':  # Ошибки не кэшируем
+                self.cache[key] = result
+        return dict(result, id=msg.get('id'))  # Код транзакции клиента
+
+    def hello(self, session, msg) -> dict:
+        """Клиент представился кодом сессии. Соединение для функций обратного вызова могло прийти раньше"""
+        with self.lock:
+            if self.sessions.get(session.id) is session:
+                del self.sessions[session.id]
+            session.id = msg['data']
+            previous = self.sessions.get(session.id)  # Сессия клиента до повторного подключения
+            self.sessions[session.id] = session
+            client = self.pending_callbacks.pop(session.id, None)
+            for event in ('OnAllTrade', 'OnQuote', 'OnParam'):  # У нового клиента фильтров нет. Ему нужны все события
+                self.apply_filter(event)
+        if previous is not None and previous is not session:  # Если клиент переподключился, а старая сессия еще не закрыта
+            previous.close()  # то закрываем ее соединения. Подписки клиент возобновит сам
+        if client is not None:
+            self.start_writer(session, client)
+        logger.info(f'Клиент шлюза {session.id} подключен. Клиентов: {len(self.sessions)}')
+        return dict(msg, data=True)
+
+    @staticmethod
+    def candle_key(data) -> tuple:
+        """Подписка на свечи по данным запроса: (class_code, sec_code, interval, param)"""
+        class_code, sec_code, interval, param = (data.split('|') + ['-'])[:4]
+        return class_code, sec_code, int(interval), param
+
+    def candle_subscribers(self, key) -> int:
+        """Кол-во клиентов, подписанных на свечи"""
+        return sum(key in session.candles for session in self.sessions.values())
+
+    def subscribe_to_candles(self, session, msg) -> dict:
+        """Подписка клиента на свечи. В QUIK подписываемся только для первого клиента"""
+        key = self.candle_key(msg['data'])
+        with self.lock:
+            result = dict(msg)  # Как и скрипт QUIK#, возвращаем запрос
+            if not self.candle_subscribers(key):  # Если подписки в QUIK еще нет
+                result = self.provider.subscribe_to_candles(*key, trans_id=msg['id'], boundary=msg['data'].split('|')[4:5] == ['1'])  # Режим закрытия задает первый клиент
+                if result.get('cmd') == 'lua_create_data_source_error':  # Если подписку создать не удалось
+                    return result
+            session.candles.add(key)
+        return result
+
+    def unsubscribe_from_candles(self, session, msg) -> dict:
+        """Отмена подписки клиента на свечи. В QUIK отменяем после ухода последнего клиента"""
+        key = self.candle_key(msg['data'])
+        with self.lock:
+            session.candles.discard(key)
+            if not self.candle_subscribers(key):
+                return self.provider.unsubscribe_from_candles(*key, trans_id=msg['id'])
+        return dict(msg)
+
+    def subscribe_quotes(self, session, msg) -> dict:
+        """Подписка клиента на стакан. В QUIK подписываемся только для первого клиента"""
+        key = tuple(msg['data'].split('|')[:2])
+        with self.lock:
+            result = dict(msg, data=True)
+            if not any(key in other.quotes for other in self.sessions.values()):
+                result = self.provider.subscribe_level2_quotes(*key, trans_id=msg['id'])
+            session.quotes.add(key)
+        return result
+
+    def unsubscribe_quotes(self, session, msg) -> dict:
+        """Отмена подписки клиента на стакан. В QUIK отменяем после ухода последнего клиента"""
+        key = tuple(msg['data'].split('|')[:2])
+        with self.lock:
+            session.quotes.discard(key)
+            if not any(key in other.quotes for other in self.sessions.values()):
+                return self.provider.unsubscribe_level2_quotes(*key, trans_id=msg['id'])
+        return dict(msg, data=True)
+
+    def request_params(self, session, items) -> list:
+        """Заказ текущих параметров клиентом. В QUIK заказываются только параметры, которые еще никто не заказывал
+
+        :param list[str] items: Параметры class_code|sec_code|param_name
+        :return: Результаты в порядке параметров
+        """
+        with self.lock:
+            keys = [tuple(item.split('|')[:3]) for item in items]
+            new = sorted({key for key in keys if not any(key in other.params for other in self.sessions.values())})  # Еще не заказанные параметры
+            results = dict(zip(new, self.provider.param_request_bulk(['|'.join(key) for key in new])['data'])) if new else {}
+            session.params.update(keys)
+        return [results.get(key, True) for key in keys]
+
+    def cancel_params(self, session, items) -> list:
+        """Отмена заказа текущих параметров клиентом. В QUIK отменяются только параметры, которые больше никому не нужны
+
+        :param list[str] items: Параметры class_code|sec_code|param_name
+        :return: Результаты в порядке параметров
+        """
+        with self.lock:
+            keys = [tuple(item.split('|')[:3]) for item in items]
+            session.params.difference_update(keys)
+            unused = sorted({key for key in keys if not any(key in other.params for other in self.sessions.values())})  # Параметры, которые больше никому не нужны
+            results = dict(zip(unused, self.provider.cancel_param_request_bulk(['|'.join(key) for key in unused])['data'])) if unused else {}
+        return [results.get(key, True) for key in keys]
+
+    def set_callback_filter(self, session, msg) -> dict:
+        """Фильтр функции обратного вызова клиента. В скрипте QUIK# ставится объединение фильтров всех клиентов"""
+        event, *codes = msg['data'].split('|')
+        with self.lock:
+            session.filters[event] = set(zip(codes[::2], codes[1::2]))
+            self.apply_filter(event)
+        return dict(msg, data=True)
+
+    def reset_callback_filter(self, session, msg) -> dict:
+        """Отмена фильтра функции обратного вызова клиента"""
+        with self.lock:
+            session.filters.pop(msg['data'], None)
+            self.apply_filter(msg['data'])
+        return dict(msg, data=True)
+
+    def apply_filter(self, event) -> None:
+        """Фильтр события в скрипте QUIK#: объединение фильтров клиентов. Если хотя бы у одного клиента фильтра нет, то событие не фильтруется"""
+        filters = [session.filters.get(event) for session in self.sessions.values()]  # Фильтры клиентов
+        if all(instruments is not None for instruments in filters):  # Если фильтры есть у всех клиентов (или клиентов нет)
+            self.provider.set_callback_filter(event, set().union(*filters))  # то отправляем события только по их инструментам
+        elif event in self.provider.callback_filters:  # Если фильтр в скрипте QUIK# стоит, а клиенту нужны все события
+            self.provider.reset_callback_filter(event)  # то снимаем его
+
+    def send_transaction(self, session, msg) -> dict:
+        """Отправка транзакции клиента. Номер транзакции клиента заменяется номером шлюза: номера разных клиентов могут совпадать"""
+        transaction = msg['data']  # Транзакция. Все значения строками
+        with self.lock:
+            self.trans_id += 1
+            trans_id = self.trans_id  # Номер транзакции шлюза
+            self.transactions[trans_id] = (session, int(transaction.get('TRANS_ID', 0)))
+        return self.provider.process_request(dict(msg, data=dict(transaction, TRANS_ID=str(trans_id))))
+
+    def restore_trans_ids(self, session, data):
+        """Номера транзакций клиента в заявке/сделке или их списке. Чужие номера заменяются на 0, как у заявок не из автоторговли"""
+        if isinstance(data, list):
+            return [self.restore_trans_ids(session, item) for item in data]
+        if isinstance(data, dict) and data.get('trans_id'):
+            owner, trans_id = self.transactions.get(int(data['trans_id']), (None, 0))
+            return dict(data, trans_id=trans_id if owner is session else 0)
+        return data
+
+    # Функции обратного вызова
+
+    def publish(self, data) -> None:
+        """Раздача функции обратного вызова QUIK# клиентам. Выполняется в потоке обратного вызова подключения к QUIK#"""
+        cmd = data['cmd']
+        item = data.get('data')
+        sessions = list(self.sessions.values())  # Клиенты
+        if cmd in self.order_callbacks and isinstance(item, dict):  # Ответ на транзакцию, заявка, сделка, стоп заявка
+            owner, trans_id = self.transactions.get(int(item.get('trans_id') or 0), (None, 0))  # Клиент транзакции
+            data = dict(data, data=dict(item, trans_id=trans_id))  # Номер транзакции клиента. Заявки не клиентов шлюза - с номером 0
+            targets = [owner] if owner is not None else sessions  # Свои заявки получает только клиент, остальные - все
+        elif cmd in ('NewCandle', 'CandleCorrection'):  # Свечи получают только подписанные клиенты
+            key = (item['class'], item['sec'], item['interval'], item.get('param', '-'))
+            targets = [session for session in sessions if key in session.candles]
+        elif cmd == 'OnQuote':  # Стаканы получают только подписанные клиенты
+            key = (item['class_code'], item['sec_code'])
+            targets = [session for session in sessions if key in session.quotes]
+        elif cmd in ('OnAllTrade', 'OnParam'):  # Сделки и параметры - по фильтрам клиентов
+            targets = [session for session in sessions if session.allowed(cmd, item['class_code'], item['sec_code'])]
+        else:  # Состояние счетов, соединения, ошибки - всем
+            targets = sessions
+        if not targets:  # Если событие никому не нужно
+            return  # то его не кодируем
+        raw = self.encode(data)  # Кодируем один раз для всех клиентов
+        for session in targets:
+            session.outbox.put(raw)
+        if metrics.enabled:  # Если метрики включены
+            metrics.inc('gateway_callbacks', len(targets), cmd=cmd)  # Кол-во отправленных клиентам функций обратного вызова
+
+
+class QuikGatewayClient(QuikPy):
+    """Подключение к шлюзу QuikGateway вместо скрипта QUIK#. Провайдер хранилища: QKStore(provider=QuikGatewayClient())
+    В оба соединения клиент передает код сессии, по нему шлюз связывает запросы и функции обратного вызова клиента
+    """
+
+    def __init__(self, host='127.0.0.1', requests_port=34150, callbacks_port=34151, timeout=30):
+        """Инициализация
+
+        :param str host: IP адрес или название хоста шлюза
+        :param int requests_port: Порт шлюза для запросов и ответов
+        :param int callbacks_port: Порт шлюза для функций обратного вызова
+        :param float timeout: Таймаут запросов по умолчанию в секундах. None - без таймаута
+        """
+        self.session_id = uuid4().hex  # Код сессии. До подключения, т.к. подключаемся при инициализации QuikPy
+        super().__init__(host=host, requests_port=requests_port, callbacks_port=callbacks_port, timeout=timeout)
+
+    def connect(self):
+        """Подключение к шлюзу с передачей кода сессии. Вызывается и при повторном подключении под блокировкой запросов, поэтому без process_request"""
+        super().connect()
+        self.socket_requests.sendall(self.codec.encode_request({'data': self.session_id, 'id': 0, 'cmd': 'gateway_hello', 't': ''}))
+        self.receive_response('gateway_hello', self.expires(None))
+
+    def callbacks_connected(self, callbacks):
+        """Передача кода сессии в соединении для функций обратного вызова"""
+        callbacks.sendall(f'{self.session_id}\n'.encode())
+
+
+if __name__ == '__main__':  # Точка входа при запуске этого скрипта: python -m BacktraderQuikJunior.QJGateway
+    parser = argparse.ArgumentParser(description='Шлюз QUIK#: одно подключение к QUIK на много процессов с ТС')
+    parser.add_argument('--host', default='127.0.0.1', help='IP адрес или название хоста шлюза')
+    parser.add_argument('--requests-port', type=int, default=34150, help='Порт шлюза для запросов и ответов')
+    parser.add_argument('--callbacks-port', type=int, default=34151, help='Порт шлюза для функций обратного вызова')
+    parser.add_argument('--quik-host', default='127.0.0.1', help='IP адрес или название хоста скрипта QUIK#')
+    parser.add_argument('--quik-requests-port', type=int, default=34130, help='Порт скрипта QUIK# для запросов и ответов')
+    parser.add_argument('--quik-callbacks-port', type=int, default=34131, help='Порт скрипта QUIK# для функций обратного вызова')
+    parser.add_argument('--callback-batch', type=int, default=10, help='Окно объединения OnQuote и OnParam в мс. 0 - без объединения')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    gateway = QuikGateway(host=args.host, requests_port=args.requests_port, callbacks_port=args.callbacks_port, quik_host=args.quik_host,
+                          quik_requests_port=args.quik_requests_port, quik_callbacks_port=args.quik_callbacks_port, callback_batch=args.callback_batch)
+    gateway.start()
+    try:
+        gateway.exit_event.wait()
+    except KeyboardInterrupt:  # Остановка по Ctrl+C
+        gateway.stop()
@@ -0,0 +1,315 @@
+from decimal import Decimal  # Точное представление шага цены
+from time import monotonic  # Время последнего обновления профиля
+from typing import Union  # Объединение типов
+
+import numpy as np  # Конвертация столбцов цен истории за один проход
+
+from .logger_config import logger  # Будем вести лог
+
+
+class TickGrid:
+    """Сетка цен инструмента. Цена хранится целым числом шагов цены (тиков)
+    Шаг цены переводится в целое число минимальных единиц цены (10 ** -scale) через Decimal один раз.
+    Округление, проскальзывание и перевод в строку для заявки после этого выполняются целочисленно
+    """
+    FLOOR = 'floor'  # Округление вниз (так QUIK принимает цену в заявке)
+    CEIL = 'ceil'  # Округление вверх
+    NEAREST = 'nearest'  # Округление до ближайшего шага цены
+
+    def __init__(self, min_price_step, scale):
+        """Инициализация
+
+        :param float min_price_step: Шаг цены
+        :param int scale: Кол-во десятичных знаков цены
+        """
+        step = Decimal(str(min_price_step)).normalize()  # Шаг цены без погрешности float. Например, 0.01, а не 0.01000000000000000020816681711721685
+        self.scale = max(int(scale), -step.as_tuple().exponent, 0)  # Кол-во десятичных знаков должно вмещать шаг цены
+        self.factor = 10 ** self.scale  # Кол-во минимальных единиц цены в 1 пункте
+        self.step_units = int(step * self.factor) if step > 0 else 1  # Шаг цены в минимальных единицах. Если шаг не задан, то 1 единица
+
+    def price_to_units(self, price) -> int:
+        """Перевод цены в целое число минимальных единиц цены. Цена QUIK не точнее 10 ** -scale,
+        поэтому остаток меньше половины единицы - погрешность float (10029.999999999998 вместо 10030)
+
+        :param float price: Цена в QUIK
+        :return: Цена в минимальных единицах
+        """
+        return round(price * self.factor)
+
+    def units_to_ticks(self, units, rounding=FLOOR) -> int:
+        """Округление цены в минимальных единицах до целого кол-ва тиков целочисленным делением
+
+        :param int units: Цена в минимальных единицах
+        :param str rounding: Округление: FLOOR - вниз, CEIL - вверх, NEAREST - до ближайшего шага цены
+        :return: Кол-во тиков
+        """
+        ticks, rest = divmod(units, self.step_units)  # Тики с округлением вниз и остаток в минимальных единицах (всегда неотрицательный)
+        if rest == 0 or rounding == self.FLOOR:  # Если цена на сетке или округляем вниз
+            return ticks
+        if rounding == self.CEIL:  # Округление вверх
+            return ticks + 1
+        half = 2 * rest - self.step_units  # Сравнение остатка с половиной шага цены без деления
+        return ticks + 1 if half > 0 or half == 0 and ticks % 2 else ticks  # Округление до ближайшего. Половину шага округляем до четного тика, как round
+
+    def price_to_ticks(self, price, rounding=FLOOR) -> int:
+        """Перевод цены в кол-во тиков
+
+        :param float price: Цена в QUIK
+        :param str rounding: Округление: FLOOR - вниз, CEIL - вверх, NEAREST - до ближайшего шага цены
+        :return: Кол-во тиков
+        """
+        return self.units_to_ticks(self.price_to_units(price), rounding)
+
+    def ticks_to_price(self, ticks) -> Union[int, float]:
+        """Перевод кол-ва тиков в цену. Для цен без десятичных знаков возвращается целое число
+
+        :param int ticks: Кол-во тиков
+        :return: Цена в QUIK
+        """
+        units = ticks * self.step_units  # Цена в минимальных единицах
+        if self.factor == 1:  # Если цена без десятичных знаков
+            return units  # то возвращаем целое число
+        return units / self.factor  # Деление целых чисел дает ближайший к десятичной цене float
+
+    def ticks_to_str(self, ticks) -> str:
+        """Перевод кол-ва тиков в строку цены для транзакции без погрешности float
+
+        :param int ticks: Кол-во тиков
+        :return: Цена в QUIK в виде строки. Например, '100.30'
+        """
+        units = ticks * self.step_units  # Цена в минимальных единицах
+        if self.factor == 1:  # Если цена без десятичных знаков
+            return str(units)
+        sign = '-' if units < 0 else ''  # Знак цены (бывает у спредов)
+        integer, fraction = divmod(abs(units), self.factor)  # Целая и дробная части цены
+        return f'{sign}{integer}.{fraction:0{self.scale}d}'
+
+    def is_on_grid(self, price) -> bool:
+        """Цена кратна шагу цены
+
+        :param float price: Цена в QUIK
+        """
+        return self.price_to_units(price) % self.step_units == 0
+
+    # Пакетные функции для лестниц цен
+
+    def prices_to_ticks(self, prices, rounding=FLOOR) -> np.ndarray:
+        """Перевод массива цен в массив кол-ва тиков
+
+        :param prices: Цены в QUIK
+        :param str rounding: Округление: FLOOR - вниз, CEIL - вверх, NEAREST - до ближайшего шага цены
+        :return: Массив кол-ва тиков
+        """
+        units = np.rint(np.asarray(prices, dtype=np.float64) * self.factor).astype(np.int64)  # Цены в минимальных единицах
+        ticks, rest = np.divmod(units, self.step_units)  # Тики с округлением вниз и остатки в минимальных единицах
+        if rounding == self.CEIL:  # Округление вверх
+            ticks += rest > 0
+        elif rounding == self.NEAREST:  # Округление до ближайшего. Половину шага округляем до четного тика
+            half = 2 * rest - self.step_units  # Сравнение остатка с половиной шага цены без деления
+            ticks += (half > 0) | (half == 0) & (ticks % 2 == 1)
+        return ticks
+
+    def ticks_to_prices(self, ticks) -> np.ndarray:
+        """Перевод массива кол-ва тиков в массив цен
+
+        :param ticks: Кол-во тиков
+        :return: Массив цен в QUIK
+        """
+        return np.asarray(ticks, dtype=np.int64) * self.step_units / self.factor
+
+    def valid_prices(self, prices, rounding=FLOOR) -> np.ndarray:
+        """Перевод массива цен в массив цен, которые примет QUIK в заявке
+
+        :param prices: Цены в QUIK
+        :param str rounding: Округление: FLOOR - вниз, CEIL - вверх, NEAREST - до ближайшего шага цены
+        :return: Массив цен, кратных шагу цены
+        """
+        return self.ticks_to_prices(self.prices_to_ticks(prices, rounding))
+
+    def ladder(self, price, levels, step_ticks=1, rounding=FLOOR) -> list:
+        """Лестница цен от заданной цены через заданное кол-во тиков
+
+        :param float price: Начальная цена в QUIK
+        :param int levels: Кол-во уровней
+        :param int step_ticks: Расстояние между уровнями в тиках. Отрицательное - лестница вниз
+        :param str rounding: Округление начальной цены
+        :return: Список цен уровней
+        """
+        start_ticks = self.price_to_ticks(price, rounding)  # Начальная цена в тиках
+        return self.ticks_to_prices(start_ticks + step_ticks * np.arange(levels, dtype=np.int64)).tolist()
+
+
+class InstrumentProfile:
+    """Профиль инструмента. Создается один раз на (class_code, sec_code)
+    Хранит шаг цены, кол-во десятичных знаков, лот, номинал, стоимость шага цены и выбранные функции конвертации,
+    чтобы горячие пути (заявки, сделки, бары) не запрашивали спецификацию тикера и STEPPRICE на каждый вызов
+    """
+    bond_cls_codes = ('TQOB', 'TQCB', 'TQRD', 'TQIR')  # Облигации (Т+ Гособлигации, Т+ Облигации, Т+ Облигации Д, Т+ Облигации ПИР)
+    refresh_interval = 60  # Не чаще, чем раз в столько секунд, обновляем стоимость шага цены после OnParam
+
+    def __init__(self, provider, class_code, sec_code):
+        """Инициализация
+
+        :param QuikPy provider: Провайдер QuikPy
+        :param str class_code: Код режима торгов
+        :param str sec_code: Тикер
+        """
+        self.provider = provider  # Провайдер, из которого получаем спецификацию тикера и стоимость шага цены
+        self.class_code = class_code  # Код режима торгов
+        self.sec_code = sec_code  # Тикер
+        self.found = False  # Тикер найден в QUIK
+        self.kind = 'other'  # Вид инструмента: bond - облигация, futures - фьючерс, other - остальные
+        self.min_price_step = 0  # Шаг цены
+        self.scale = 0  # Кол-во десятичных знаков
+        self.lot_size = 0  # Кол-во штук в лоте
+        self.face_value = 0  # Номинал
+        self.step_price = 0  # Стоимость шага цены
+        self.grid = None  # Сетка цен инструмента
+        self.stale = False  # Параметры изменились (OnParam), профиль нужно обновить
+        self.refreshed_at = 0  # Время последнего обновления профиля
+        self.quik_price_to_price = self.same_price  # Выбранная функция перевода цены QUIK в цену в рублях за штуку
+        self.price_to_quik_raw = self.same_price  # Выбранная функция перевода цены в рублях за штуку в цену QUIK без приведения к шагу цены
+        self.quik_prices_to_prices = self.same_price  # Выбранная функция перевода массива цен QUIK в цены в рублях за штуку
+        self.refresh()  # Заполняем профиль
+
+    def refresh(self, reload=False) -> None:
+        """Обновление профиля. Выбор функций конвертации по виду инструмента
+
+        :param bool reload: Получить спецификацию тикера из QUIK заново
+        """
+        self.stale = False  # Профиль актуален
+        self.refreshed_at = monotonic()  # Запоминаем время обновления
+        futures = self.class_code == self.provider.futures_cls_code  # Рынок фьючерсов
+        try:
+            si = self.provider.get_symbol_info(self.class_code, self.sec_code, reload)  # Спецификация тикера
+            step_price = float(self.provider.get_param_ex(self.class_code, self.sec_code, 'STEPPRICE')['data']['param_value']) if si and futures else self.step_price  # Стоимость шага цены
+        except (OSError, KeyError, TypeError, ValueError) as e:  # Если QUIK не ответил, или вернул ошибку вместо параметра
+            logger.warning(f'Профиль {self.class_code}.{self.sec_code} не обновлен: {e}')
+            self.stale = True  # Попробуем обновить после следующего интервала. Пока работаем с прежними параметрами
+            return  # Выходим, дальше не продолжаем
+        self.found = bool(si)  # Тикер найден
+        if not si:  # Если тикер не найден
+            self.quik_price_to_price = self.price_to_quik_raw = self.quik_prices_to_prices = self.same_price  # то цены не изменяются
+            return  # Выходим, дальше не продолжаем
+        self.min_price_step = si['min_price_step']  # Шаг цены
+        self.scale = si['scale']  # Кол-во десятичных знаков
+        self.lot_size = si['lot_size']  # Кол-во штук в лоте
+        self.face_value = si.get('face_value', 0)  # Номинал
+        self.grid = TickGrid(self.min_price_step, self.scale)  # Сетка цен инструмента
+        if self.class_code in self.bond_cls_codes:  # Для облигаций
+            self.kind = 'bond'
+            self.quik_price_to_price = self.bond_quik_price_to_price
+            self.price_to_quik_raw = self.bond_price_to_quik_raw
+            self.quik_prices_to_prices = self.bond_quik_prices_to_prices
+        elif futures:  # Для рынка фьючерсов
+            self.kind = 'futures'
+            self.step_price = step_price  # Стоимость шага цены
+            self.quik_price_to_price = self.futures_quik_price_to_price
+            self.price_to_quik_raw = self.futures_price_to_quik_raw
+            self.quik_prices_to_prices = self.same_price  # Цены деривативов в истории остаются в пунктах
+        else:  # Для остальных рынков
+            self.kind = 'other'
+            self.quik_price_to_price = self.same_price
+            self.price_to_quik_raw = self.same_price
+            self.quik_prices_to_prices = self.same_price
+        logger.debug(f'Профиль {self.class_code}.{self.sec_code}: {self.kind}, {self.min_price_step = }, {self.scale = }, {self.lot_size = }, {self.face_value = }, {self.step_price = }')
+
+    def check_refresh(self) -> None:
+        """Обновление стоимости шага цены, если после OnParam прошло достаточно времени. Делает запросы в QUIK, поэтому из потока обратного вызова не вызывается"""
+        if self.stale and monotonic() - self.refreshed_at >= self.refresh_interval:  # Если параметры изменились, и профиль давно не обновляли
+            self.refresh()  # то обновляем профиль
+
+    # Функции конвертации цен
+
+    @staticmethod
+    def same_price(price) -> Union[int, float]:
+        """Цена не изменяется"""
+        return price
+
+    def valid_price(self, quik_price) -> Union[int, float]:
+        """Перевод цены в цену, которую примет QUIK в заявке
+
+        :param float quik_price: Цена в QUIK
+        :return: Цена, которую примет QUIK в заявке
+        """
+        if not self.found:  # Если тикер не найден
+            return quik_price  # то цена не изменяется
+        return self.grid.ticks_to_price(self.grid.price_to_ticks(quik_price))  # Цена должна быть кратна шагу цены. Округляем вниз
+
+    def valid_prices(self, quik_prices) -> np.ndarray:
+        """Перевод массива цен в массив цен, которые примет QUIK в заявке
+
+        :param quik_prices: Цены в QUIK
+        :return: Массив цен, кратных шагу цены
+        """
+        if not self.found:  # Если тикер не найден
+            return np.asarray(quik_prices, dtype=np.float64)  # то цены не изменяются
+        return self.grid.valid_prices(quik_prices)
+
+    def price_to_quik_price(self, price) -> Union[int, float]:
+        """Перевод цены в рублях за штуку в цену, которую примет QUIK в заявке
+
+        :param float price: Цена в рублях за штуку
+        :return: Цена в QUIK
+        """
+        return self.valid_price(self.price_to_quik_raw(price))
+
+    def price_to_quik_ticks(self, price, rounding=TickGrid.FLOOR) -> int:
+        """Перевод цены в рублях за штуку в цену QUIK в тиках
+
+        :param float price: Цена в рублях за штуку
+        :param str rounding: Округление: TickGrid.FLOOR - вниз, TickGrid.CEIL - вверх, TickGrid.NEAREST - до ближайшего шага цены
+        :return: Кол-во тиков
+        """
+        return self.grid.price_to_ticks(self.price_to_quik_raw(price), rounding)
+
+    def bond_quik_price_to_price(self, quik_price) -> float:
+        """Пункты цены для котировок облигаций представляют собой проценты номинала облигации"""
+        return quik_price / 100 * self.face_value
+
+    def bond_price_to_quik_raw(self, price) -> float:
+        """Цена в рублях за штуку в проценты номинала облигации"""
+        return price * 100 / self.face_value
+
+    def futures_quik_price_to_price(self, quik_price) -> float:
+        """Цена фьючерса в пунктах в цену в рублях за штуку через стоимость шага цены"""
+        if self.lot_size > 1 and self.step_price:  # Если есть лот и стоимость шага цены
+            lot_price = self.grid.price_to_ticks(quik_price) * self.step_price  # Цена за лот
+            return lot_price / self.lot_size  # Цена за штуку
+        return quik_price  # В остальных случаях цена не изменяется
+
+    def futures_price_to_quik_raw(self, price) -> float:
+        """Цена фьючерса в рублях за штуку в цену в пунктах через стоимость шага цены"""
+        if self.lot_size > 1 and self.step_price:  # Если есть лот и стоимость шага цены
+            lot_price = price * self.lot_size  # Цена в рублях за лот
+            return lot_price * self.min_price_step / self.step_price  # Цена в пунктах
+        return price  # В остальных случаях цена не изменяется
+
+    # Функции конвертации массивов цен
+
+    def bond_quik_prices_to_prices(self, quik_prices: np.ndarray) -> np.ndarray:
+        """Массив цен облигации в процентах номинала в массив цен в рублях за штуку"""
+        return quik_prices / 100 * self.face_value
+
+    # Функции конвертации кол-ва
+
+    def lots_to_size(self, lots) -> int:
+        """Перевод лотов в штуки
+
+        :param int lots: Кол-во лотов
+        :return: Кол-во штук
+        """
+        if self.lot_size:  # Если задано кол-во штук в лоте
+            return int(lots * self.lot_size)  # то возвращаем кол-во в штуках
+        return lots  # В остальных случаях возвращаем кол-во в лотах
+
+    def size_to_lots(self, size) -> int:
+        """Перевод штук в лоты
+
+        :param int size: Кол-во штук
+        :return: Кол-во лотов
+        """
+        lot_size = int(self.lot_size)  # Кол-во штук в лоте
+        if lot_size:  # Если задано кол-во штук
+            return size // lot_size  # то возвращаем кол-во в лотах
+        return size  # В остальных случаях возвращаем кол-во в штуках
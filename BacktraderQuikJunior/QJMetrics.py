@@ -0,0 +1,208 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # Выдача метрик по HTTP
+from threading import Thread, Lock  # Поток HTTP сервера. Блокировка создания метрик
+from time import perf_counter_ns  # Замеры времени в наносекундах
+import os  # Атомарная замена файла метрик
+
+from .logger_config import logger  # Будем вести лог
+
+
+class Histogram:
+    """Гистограмма задержек в стиле HDR: логарифмические интервалы, каждый разбит на 32 равные части (точность ~3%)
+    Значения хранятся в микросекундах. Запись значения - несколько целочисленных операций без выделения памяти
+    """
+    sub_bits = 5  # Кол-во бит на части интервала
+    sub_count = 1 << sub_bits  # Кол-во частей интервала
+    size = 64 * sub_count  # Кол-во ячеек. Хватает на значения до 2^63 микросекунд
+
+    def __init__(self):
+        self.counts = [0] * self.size  # Кол-во значений в ячейках
+        self.count = 0  # Кол-во значений
+        self.total = 0  # Сумма значений
+        self.min = None  # Минимальное значение
+        self.max = 0  # Максимальное значение
+
+    def record(self, value) -> None:
+        """Запись значения
+
+        :param int value: Значение в микросекундах
+        """
+        value = int(value) if value > 0 else 0  # Отрицательные значения (сдвиг часов) считаем нулевыми
+        shift = value.bit_length() - self.sub_bits - 1  # Номер логарифмического интервала
+        if shift < 0:  # Малые значения
+            shift = 0  # храним точно
+        self.counts[(shift << self.sub_bits) + (value >> shift)] += 1  # Ячейка значения
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        if self.min is None or value < self.min:
+            self.min = value
+
+    def bucket_value(self, index) -> int:
+        """Нижняя граница ячейки в микросекундах"""
+        if index < 2 * self.sub_count:  # Малые значения хранятся точно
+            return index
+        shift = (index >> self.sub_bits) - 1  # Номер логарифмического интервала
+        return (index - (shift << self.sub_bits)) << shift
+
+    def percentile(self, q) -> int:
+        """Процентиль значений
+
+        :param float q: Процентиль от 0 до 100
+        :return: Значение в микросекундах
+        """
+        if not self.count:  # Если значений нет
+            return 0
+        rank = max(1, round(q / 100 * self.count))  # Номер значения по порядку
+        seen = 0
+        for index, count in enumerate(self.counts):  # Пробегаемся по ячейкам по возрастанию
+            seen += count
+            if seen >= rank:  # Если набрали нужное кол-во значений
+                return min(self.bucket_value(index), self.max)
+        return self.max
+
+    def snapshot(self) -> dict:
+        """Сводка по гистограмме. Значения в микросекундах"""
+        return dict(count=self.count, sum=self.total, min=self.min or 0, max=self.max,
+                    mean=self.total / self.count if self.count else 0,
+                    p50=self.percentile(50), p90=self.percentile(90), p99=self.percentile(99), p999=self.percentile(99.9))
+
+
+class Metrics:
+    """Реестр метрик: гистограммы задержек и счетчики с метками
+    По умолчанию выключен. В местах замеров проверяется только флаг enabled, поэтому выключенные метрики почти ничего не стоят
+    """
+    prefix = 'qj'  # Префикс названий метрик в формате Prometheus
+    quantiles = (0.5, 0.9, 0.99, 0.999)  # Процентили в формате Prometheus
+
+    def __init__(self):
+        self.enabled = False  # Метрики выключены
+        self.histograms = {}  # Гистограммы. (название, метки) → Histogram
+        self.counters = {}  # Счетчики. (название, метки) → значение
+        self.lock = Lock()  # Блокировка создания метрик из разных потоков
+        self.http_server = None  # HTTP сервер метрик
+
+    def enable(self, enabled=True) -> None:
+        """Включение/выключение метрик"""
+        self.enabled = enabled
+
+    def reset(self) -> None:
+        """Сброс всех метрик"""
+        with self.lock:
+            self.histograms = {}
+            self.counters = {}
+
+    def histogram(self, name, **labels) -> Histogram:
+        """Гистограмма по названию и меткам. Создается при первом обращении"""
+        key = (name, tuple(labels.items()))  # Ключ гистограммы
+        histogram = self.histograms.get(key)
+        if histogram is None:  # Если гистограммы еще нет
+            with self.lock:
+                histogram = self.histograms.setdefault(key, Histogram())  # то создаем ее
+        return histogram
+
+    def observe(self, name, value_us, **labels) -> None:
+        """Запись значения в гистограмму
+
+        :param str name: Название гистограммы
+        :param int value_us: Значение в микросекундах
+        """
+        self.histogram(name, **labels).record(value_us)
+
+    def observe_ns(self, name, start_ns, end_ns=None, **labels) -> None:
+        """Запись интервала между замерами perf_counter_ns в гистограмму
+
+        :param str name: Название гистограммы
+        :param int start_ns: Начало интервала
+        :param int end_ns: Окончание интервала. По умолчанию, текущее время
+        """
+        self.histogram(name, **labels).record(((perf_counter_ns() if end_ns is None else end_ns) - start_ns) // 1000)
+
+    def inc(self, name, value=1, **labels) -> None:
+        """Увеличение счетчика
+
+        :param str name: Название счетчика
+        :param int value: Приращение
+        """
+        key = (name, tuple(labels.items()))  # Ключ счетчика
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def snapshot(self) -> dict:
+        """Все метрики в виде словаря: {'histograms': {название: [{labels, ...сводка}]}, 'counters': {название: [{labels, value}]}}"""
+        histograms, counters = {}, {}
+        for (name, labels), histogram in list(self.histograms.items()):
+            histograms.setdefault(name, []).append(dict(labels=dict(labels), **histogram.snapshot()))
+        for (name, labels), value in list(self.counters.items()):
+            counters.setdefault(name, []).append(dict(labels=dict(labels), value=value))
+        return dict(histograms=histograms, counters=counters)
+
+    def prometheus(self) -> str:
+        """Все метрики в текстовом формате Prometheus. Гистограммы выдаются как summary в секундах"""
+        lines = []
+        by_name = {}
+        for (name, labels), histogram in list(self.histograms.items()):
+            by_name.setdefault(name, []).append((labels, histogram))
+        for name, items in sorted(by_name.items()):
+            metric = f'{self.prefix}_{name}_seconds'
+            lines.append(f'# TYPE {metric} summary')
+            for labels, histogram in items:
+                for quantile in self.quantiles:
+                    lines.append(f'{metric}{self.labels_text(labels + (("quantile", str(quantile)),))} {histogram.percentile(quantile * 100) / 1e6}')
+                lines.append(f'{metric}_sum{self.labels_text(labels)} {histogram.total / 1e6}')
+                lines.append(f'{metric}_count{self.labels_text(labels)} {histogram.count}')
+        by_name = {}
+        for (name, labels), value in list(self.counters.items()):
+            by_name.setdefault(name, []).append((labels, value))
+        for name, items in sorted(by_name.items()):
+            metric = f'{self.prefix}_{name}_total'
+            lines.append(f'# TYPE {metric} counter')
+            for labels, value in items:
+                lines.append(f'{metric}{self.labels_text(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def labels_text(labels) -> str:
+        """Метки в формате Prometheus"""
+        if not labels:
+            return ''
+        escaped = (f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for key, value in labels)
+        return '{' + ','.join(escaped) + '}'
+
+    def dump(self, file_name) -> None:
+        """Сохранение метрик в файл в формате Prometheus (например, для node_exporter textfile collector)"""
+        temp_file_name = f'{file_name}.tmp'  # Пишем во временный файл, чтобы сборщик не прочитал файл наполовину
+        with open(temp_file_name, 'w', encoding='utf-8') as file:
+            file.write(self.prometheus())
+        os.replace(temp_file_name, file_name)
+
+    def serve(self, port=9108, host='127.0.0.1') -> None:
+        """Запуск HTTP сервера метрик в формате Prometheus на http://host:port/metrics"""
+        if self.http_server is not None:  # Если сервер уже запущен
+            return  # то выходим, дальше не продолжаем
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):  # Запросы сборщика метрик не логируем
+                pass
+
+        self.http_server = ThreadingHTTPServer((host, port), Handler)
+        Thread(target=self.http_server.serve_forever, name='MetricsThread', daemon=True).start()
+        logger.info(f'Метрики доступны на http://{host}:{port}/metrics')
+
+    def stop_serving(self) -> None:
+        """Остановка HTTP сервера метрик"""
+        if self.http_server is not None:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+            self.http_server = None
+
+
+metrics = Metrics()  # Метрики пакета. Включаются metrics.enable()
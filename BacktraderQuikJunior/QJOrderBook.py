@@ -0,0 +1,261 @@
+from threading import Thread, Lock, Condition  # Поток обновления стаканов. Блокировки стакана и очереди обновлений
+from time import monotonic  # Время последнего обновления стакана
+from typing import Union  # Объединение типов
+
+import numpy as np  # Уровни стакана храним в массивах
+
+from .logger_config import logger  # Будем вести лог
+
+
+class OrderBook:
+    """Стакан котировок инструмента. Хранит лучшие depth уровней покупки/продажи в массивах
+    Уровни с индексом 0 - лучшие цены: максимальная цена покупки (bid) и минимальная цена продажи (offer).
+    Цены в стакане - цены QUIK (для фьючерсов в пунктах, для облигаций в процентах номинала)
+    """
+
+    def __init__(self, class_code, sec_code, depth=20):
+        """Инициализация
+
+        :param str class_code: Код режима торгов
+        :param str sec_code: Тикер
+        :param int depth: Кол-во хранимых уровней с каждой стороны стакана
+        """
+        self.class_code = class_code  # Код режима торгов
+        self.sec_code = sec_code  # Тикер
+        self.depth = depth  # Кол-во хранимых уровней с каждой стороны стакана
+        self.bid_prices = np.zeros(depth, dtype=np.float64)  # Цены покупки. Лучшая первая
+        self.bid_quantities = np.zeros(depth, dtype=np.float64)  # Кол-во в лотах на уровнях покупки
+        self.offer_prices = np.zeros(depth, dtype=np.float64)  # Цены продажи. Лучшая первая
+        self.offer_quantities = np.zeros(depth, dtype=np.float64)  # Кол-во в лотах на уровнях продажи
+        self.bid_count = self.offer_count = 0  # Кол-во заполненных уровней покупки/продажи
+        self.server_time = ''  # Время сервера QUIK последнего снимка стакана
+        self.updated_at = 0  # Время получения последнего снимка стакана
+        self.updates = 0  # Кол-во полученных снимков стакана
+        self.raw = None  # Последний полученный и еще не разобранный снимок стакана. Промежуточные снимки не разбираем
+        self.lock = Lock()  # Снимки приходят из потока обратного вызова, а читаются из потока ТС
+
+    def put_snapshot(self, quote) -> None:
+        """Прием снимка стакана из QUIK. Разбор откладывается до первого чтения
+
+        :param dict quote: Стакан в формате QUIK (bid_count, offer_count, bid, offer)
+        """
+        with self.lock:
+            self.raw = quote  # Запоминаем только последний снимок. Предыдущий неразобранный снимок устарел
+            self.updated_at = monotonic()  # Время получения снимка
+            self.updates += 1  # Кол-во полученных снимков
+
+    def parse(self) -> None:
+        """Разбор последнего полученного снимка стакана в массивы"""
+        with self.lock:
+            quote, self.raw = self.raw, None  # Забираем последний снимок
+            if quote is None:  # Если нового снимка нет
+                return  # то массивы актуальны, выходим, дальше не продолжаем
+            bids = quote.get('bid') or []  # Уровни покупки. Отсортированы по возрастанию цены. Если их нет, то QUIK передает пустую строку
+            offers = quote.get('offer') or []  # Уровни продажи. Отсортированы по возрастанию цены
+            bids = bids[:-self.depth - 1:-1]  # Лучшие уровни покупки находятся в конце списка. Разворачиваем
+            offers = offers[:self.depth]  # Лучшие уровни продажи находятся в начале списка
+            self.bid_count, self.offer_count = len(bids), len(offers)  # Кол-во заполненных уровней
+            self.bid_prices[:self.bid_count] = [float(level['price']) for level in bids]
+            self.bid_quantities[:self.bid_count] = [float(level['quantity']) for level in bids]
+            self.offer_prices[:self.offer_count] = [float(level['price']) for level in offers]
+            self.offer_quantities[:self.offer_count] = [float(level['quantity']) for level in offers]
+            self.server_time = quote.get('server_time', '')  # Время сервера QUIK
+
+    def age(self) -> float:
+        """Время в секундах с получения последнего снимка стакана"""
+        return monotonic() - self.updated_at
+
+    @property
+    def best_bid(self) -> Union[float, None]:
+        """Лучшая цена покупки или None, если покупателей нет"""
+        self.parse()
+        return float(self.bid_prices[0]) if self.bid_count else None
+
+    @property
+    def best_ask(self) -> Union[float, None]:
+        """Лучшая цена продажи или None, если продавцов нет"""
+        self.parse()
+        return float(self.offer_prices[0]) if self.offer_count else None
+
+    @property
+    def spread(self) -> Union[float, None]:
+        """Спред между лучшими ценами продажи и покупки"""
+        best_bid, best_ask = self.best_bid, self.best_ask
+        return best_ask - best_bid if best_bid is not None and best_ask is not None else None
+
+    def bids(self) -> tuple[np.ndarray, np.ndarray]:
+        """Цены и кол-во уровней покупки. Лучший уровень первый"""
+        self.parse()
+        return self.bid_prices[:self.bid_count].copy(), self.bid_quantities[:self.bid_count].copy()
+
+    def offers(self) -> tuple[np.ndarray, np.ndarray]:
+        """Цены и кол-во уровней продажи. Лучший уровень первый"""
+        self.parse()
+        return self.offer_prices[:self.offer_count].copy(), self.offer_quantities[:self.offer_count].copy()
+
+    def sweep_price(self, is_buy, quantity) -> Union[float, None]:
+        """Цена уровня, на котором рыночная заявка будет исполнена полностью
+
+        :param bool is_buy: Покупка (снимаем уровни продажи) / продажа (снимаем уровни покупки)
+        :param float quantity: Кол-во в лотах
+        :return: Цена уровня. Если объема в стакане не хватает, то цена последнего видимого уровня. None, если сторона стакана пустая
+        """
+        self.parse()
+        with self.lock:
+            prices, quantities, count = (self.offer_prices, self.offer_quantities, self.offer_count) if is_buy else (self.bid_prices, self.bid_quantities, self.bid_count)
+            if not count:  # Если сторона стакана пустая
+                return None  # то цену по стакану не определить
+            level = int(np.searchsorted(np.cumsum(quantities[:count]), quantity))  # Первый уровень, на котором накопленный объем покрывает заявку
+            return float(prices[min(level, count - 1)])  # Если объема не хватает, то берем последний видимый уровень
+
+
+class OrderBookManager:
+    """Локальный кэш стаканов по подпискам. Снимки стаканов приходят в OnQuote
+    Если в OnQuote снимка нет, то стакан запрашивается из QUIK в отдельном потоке:
+    не более одного запроса на инструмент одновременно, промежуточные изменения пропускаются
+    """
+
+    def __init__(self, provider, depth=20, max_age=5):
+        """Инициализация
+
+        :param QuikPy provider: Провайдер QuikPy
+        :param int depth: Кол-во хранимых уровней с каждой стороны стакана
+        :param float max_age: Время в секундах, после которого стакан считается устаревшим
+        """
+        self.provider = provider  # Провайдер QuikPy
+        self.depth = depth  # Кол-во хранимых уровней с каждой стороны стакана
+        self.max_age = max_age  # Время в секундах, после которого стакан считается устаревшим
+        self.books = {}  # Стаканы по подпискам. (class_code, sec_code) → OrderBook
+        self.subscribers = {}  # Кол-во подписчиков на стакан. (class_code, sec_code) → кол-во
+        self.pending = {}  # Очередь стаканов на обновление из QUIK. Словарь сохраняет порядок и не допускает дублей
+        self.in_flight = set()  # Стаканы, запрос по которым уже отправлен в QUIK
+        self.dirty = set()  # Стаканы, изменившиеся во время запроса. Обновим еще раз после ответа
+        self.condition = Condition()  # Блокировка очереди обновлений и пробуждение потока обновлений
+        self.refresh_thread = None  # Поток обновления стаканов из QUIK. Запускается при первой необходимости
+        self.running = False  # Поток обновления стаканов работает
+
+    def subscribe(self, class_code, sec_code) -> OrderBook:
+        """Подписка на стакан. Повторная подписка увеличивает кол-во подписчиков
+
+        :param str class_code: Код режима торгов
+        :param str sec_code: Тикер
+        :return: Стакан
+        """
+        key = (class_code, sec_code)  # Ключ стакана
+        with self.condition:  # Блокировка реентерабельная, поэтому refresh внутри нее не зависнет
+            self.subscribers[key] = self.subscribers.get(key, 0) + 1  # Добавляем подписчика
+            if key not in self.books:  # Если стакана еще нет
+                self.books[key] = OrderBook(class_code, sec_code, self.depth)  # то создаем его
+                self.apply_filter()  # Изменения стакана отправляются только по подпискам
+                self.provider.subscribe_level2_quotes(class_code, sec_code)  # Подписываемся на стакан в QUIK
+                self.refresh(class_code, sec_code)  # Получаем первый снимок, не дожидаясь изменения стакана
+            return self.books[key]
+
+    def unsubscribe(self, class_code, sec_code) -> None:
+        """Отмена подписки на стакан. Подписка в QUIK отменяется после ухода последнего подписчика
+
+        :param str class_code: Код режима торгов
+        :param str sec_code: Тикер
+        """
+        key = (class_code, sec_code)  # Ключ стакана
+        with self.condition:
+            if key not in self.subscribers:  # Если подписки нет
+                return  # то выходим, дальше не продолжаем
+            self.subscribers[key] -= 1  # Убираем подписчика
+            if self.subscribers[key] > 0:  # Если остались подписчики
+                return  # то подписку не отменяем
+            del self.subscribers[key]
+            del self.books[key]
+            self.pending.pop(key, None)  # Обновлять удаленный стакан не нужно
+            self.dirty.discard(key)
+            self.provider.unsubscribe_level2_quotes(class_code, sec_code)  # Отменяем подписку на стакан в QUIK
+            self.apply_filter()
+
+    def apply_filter(self) -> None:
+        """Фильтр OnQuote в скрипте QUIK#: изменения отправляются только по стаканам подписок, а не по всем открытым в терминале"""
+        self.provider.set_callback_filter('OnQuote', list(self.books))
+
+    def get_book(self, class_code, sec_code, max_age=None) -> Union[OrderBook, None]:
+        """Стакан по подписке
+
+        :param str class_code: Код режима торгов
+        :param str sec_code: Тикер
+        :param float max_age: Время в секундах, после которого стакан считается устаревшим. По умолчанию, из настроек менеджера
+        :return: Стакан или None, если подписки нет, или стакан устарел
+        """
+        book = self.books.get((class_code, sec_code))  # Ищем стакан
+        if book is None or not book.updates:  # Если подписки нет, или снимков еще не было
+            return None
+        if book.age() > (self.max_age if max_age is None else max_age):  # Если стакан устарел
+            return None
+        return book
+
+    def best_bid(self, class_code, sec_code) -> Union[float, None]:
+        """Лучшая цена покупки или None, если стакана нет"""
+        book = self.get_book(class_code, sec_code)
+        return book.best_bid if book else None
+
+    def best_ask(self, class_code, sec_code) -> Union[float, None]:
+        """Лучшая цена продажи или None, если стакана нет"""
+        book = self.get_book(class_code, sec_code)
+        return book.best_ask if book else None
+
+    def on_quote(self, data) -> None:
+        """Обработчик события изменения стакана котировок (OnQuote). Выполняется в потоке обратного вызова"""
+        quote = data['data']  # Стакан или только коды инструмента
+        book = self.books.get((quote['class_code'], quote['sec_code']))  # Ищем стакан по подписке
+        if book is None:  # Если на стакан не подписаны
+            return  # то выходим, дальше не продолжаем
+        if 'bid' in quote or 'offer' in quote:  # Если в событии пришел снимок стакана
+            book.put_snapshot(quote)  # то сохраняем его без разбора
+        else:  # Если пришли только коды инструмента
+            self.refresh(quote['class_code'], quote['sec_code'])  # то ставим стакан в очередь на обновление из QUIK
+
+    def refresh(self, class_code, sec_code) -> None:
+        """Постановка стакана в очередь на обновление из QUIK
+
+        :param str class_code: Код режима торгов
+        :param str sec_code: Тикер
+        """
+        key = (class_code, sec_code)  # Ключ стакана
+        with self.condition:
+            if key in self.in_flight:  # Если запрос по стакану уже отправлен
+                self.dirty.add(key)  # то после ответа запросим еще раз. Все промежуточные изменения пропускаем
+                return
+            self.pending[key] = None  # Ставим стакан в очередь. Повторная постановка ничего не меняет
+            if self.refresh_thread is None:  # Если поток обновлений еще не запущен
+                self.running = True
+                self.refresh_thread = Thread(target=self.refresh_loop, name='OrderBookThread', daemon=True)  # то создаем
+                self.refresh_thread.start()  # и запускаем его
+            self.condition.notify()  # Будим поток обновлений
+
+    def refresh_loop(self) -> None:
+        """Поток обновления стаканов из QUIK"""
+        while True:
+            with self.condition:
+                while self.running and not self.pending:  # Пока очередь пустая
+                    self.condition.wait()  # ждем постановки стакана в очередь
+                if not self.running:  # Если поток остановлен
+                    return  # то выходим, дальше не продолжаем
+                key = next(iter(self.pending))  # Первый стакан в очереди
+                del self.pending[key]
+                self.in_flight.add(key)  # Запрос по стакану отправлен
+            try:
+                quote = self.provider.get_quote_level2(*key)['data']  # Снимок стакана из QUIK
+                book = self.books.get(key)  # Стакан мог быть удален во время запроса
+                if book is not None and isinstance(quote, dict):  # Если стакан есть, и QUIK вернул снимок
+                    book.put_snapshot(quote)  # то сохраняем снимок
+            except Exception as e:  # Ошибка запроса не должна останавливать поток
+                logger.error(f'Ошибка получения стакана {key[0]}.{key[1]}: {e}')
+            with self.condition:
+                self.in_flight.discard(key)  # Запрос по стакану завершен
+                if key in self.dirty:  # Если стакан изменился во время запроса
+                    self.dirty.discard(key)
+                    self.pending[key] = None  # то ставим его в очередь еще раз
+
+    def stop(self) -> None:
+        """Остановка потока обновлений стаканов"""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()  # Будим поток обновлений, чтобы он завершился
+        self.refresh_thread = None
@@ -0,0 +1,183 @@
+from threading import Lock  # Блокировка из потока функций обратного вызова и потока ТС
+from time import time, perf_counter_ns  # Время стадий заявки
+import csv
+import os.path
+
+from .logger_config import logger  # Будем вести лог
+from .QJMetrics import Histogram, metrics  # Гистограммы задержек. Метрики пакета
+
+
+class OrderTrace:
+    """Замеры одной заявки по стадиям: создание → отправка → ответ на транзакцию → первая сделка → завершение
+    Интервалы считаются по perf_counter_ns. Время QUIK t приходит в функциях обратного вызова в мс с 01.01.1970
+    """
+    fields = ('ref', 'instrument', 'side', 'size', 'created', 'status', 'fills',
+              'submit_us', 'ack_us', 'first_fill_us', 'completed_us', 'quik_ack_us', 'quik_fill_us')  # Поля журнала заявок
+
+    def __init__(self, ref, instrument, side, size):
+        self.ref = ref  # Номер заявки BackTrader = номер транзакции TRANS_ID
+        self.instrument = instrument  # Тикер
+        self.side = side  # Покупка/продажа
+        self.size = size  # Кол-во
+        self.created = time()  # Время создания заявки в секундах с 01.01.1970
+        self.created_ns = perf_counter_ns()  # Стадии заявки
+        self.sent_ns = self.ack_ns = self.first_fill_ns = self.completed_ns = None
+        self.sent_time = None  # Время отправки заявки в секундах с 01.01.1970. Для сравнения со временем QUIK
+        self.quik_ack_ms = self.quik_fill_ms = None  # Время QUIK t из OnTransReply и первого OnTrade
+        self.status = None  # Статус завершения заявки
+        self.fills = 0  # Кол-во сделок по заявке
+
+    @staticmethod
+    def interval_us(start_ns, end_ns):
+        """Интервал между стадиями в микросекундах. Если стадии не было, то None"""
+        return None if start_ns is None or end_ns is None else (end_ns - start_ns) // 1000
+
+    def quik_us(self, quik_ms):
+        """Время от отправки заявки до функции обратного вызова по часам QUIK в микросекундах. Если времени QUIK нет, то None"""
+        return None if quik_ms is None or self.sent_time is None else int(quik_ms * 1000 - self.sent_time * 1_000_000)
+
+    def intervals(self) -> dict:
+        """Интервалы по стадиям заявки в микросекундах"""
+        return dict(submit_us=self.interval_us(self.created_ns, self.sent_ns),  # Создание → отправка
+                    ack_us=self.interval_us(self.sent_ns, self.ack_ns),  # Отправка → ответ на транзакцию
+                    first_fill_us=self.interval_us(self.sent_ns, self.first_fill_ns),  # Отправка → первая сделка
+                    completed_us=self.interval_us(self.sent_ns, self.completed_ns),  # Отправка → завершение
+                    quik_ack_us=self.quik_us(self.quik_ack_ms),  # Отправка → ответ на транзакцию по часам QUIK
+                    quik_fill_us=self.quik_us(self.quik_fill_ms))  # Отправка → первая сделка по часам QUIK
+
+    def as_dict(self) -> dict:
+        """Строка журнала заявок"""
+        return dict(ref=self.ref, instrument=self.instrument, side=self.side, size=self.size, created=self.created,
+                    status=self.status, fills=self.fills, **self.intervals())
+
+
+class OrderTracer:
+    """Трассировка заявок по номеру транзакции TRANS_ID
+    Процентили интервалов по тикерам, интервалы в order.info['latency'], журнал завершенных заявок в CSV/Parquet
+    """
+    def __init__(self, file_name=None):
+        """Инициализация трассировки
+
+        :param str file_name: Журнал завершенных заявок. Если оканчивается на .parquet, то пишется при закрытии (нужен pyarrow). Иначе CSV
+        """
+        self.file_name = file_name  # Журнал заявок
+        self.parquet = file_name is not None and file_name.endswith('.parquet')  # Журнал в формате Parquet
+        self.rows = []  # Строки журнала Parquet до закрытия
+        self.traces = {}  # Трассировки незавершенных заявок. Номер транзакции → OrderTrace
+        self.histograms = {}  # Гистограммы интервалов. (тикер, интервал) → Histogram
+        self.lock = Lock()  # Блокировка журнала и гистограмм
+
+    def on_create(self, order) -> None:
+        """Заявка создана"""
+        self.traces[order.ref] = OrderTrace(order.ref, order.data.p.dataname, 'buy' if order.isbuy() else 'sell', order.size)
+
+    def on_send(self, order) -> None:
+        """Заявка отправляется в QUIK"""
+        trace = self.traces.get(order.ref)
+        if trace is None:  # Если заявка не трассируется
+            return  # то выходим, дальше не продолжаем
+        trace.sent_ns = perf_counter_ns()
+        trace.sent_time = time()
+        self.record(order, trace, 'submit_us')
+
+    def on_ack(self, order, quik_ms=None) -> None:
+        """Ответ на транзакцию OnTransReply
+
+        :param Order order: Заявка
+        :param int quik_ms: Время QUIK t в мс с 01.01.1970
+        """
+        trace = self.traces.get(order.ref)
+        if trace is None or trace.sent_ns is None or trace.ack_ns is not None:  # Если заявка не трассируется / не отправлена / ответ уже был (например, при отмене)
+            return  # то выходим, дальше не продолжаем
+        trace.ack_ns = perf_counter_ns()
+        trace.quik_ack_ms = quik_ms
+        self.record(order, trace, 'ack_us', 'quik_ack_us')
+
+    def on_fill(self, order, quik_ms=None) -> None:
+        """Сделка по заявке OnTrade
+
+        :param Order order: Заявка
+        :param int quik_ms: Время QUIK t в мс с 01.01.1970
+        """
+        trace = self.traces.get(order.ref)
+        if trace is None:  # Если заявка не трассируется
+            return  # то выходим, дальше не продолжаем
+        trace.fills += 1
+        if trace.first_fill_ns is not None or trace.sent_ns is None:  # Замеряем только первую сделку отправленной заявки
+            return  # Выходим, дальше не продолжаем
+        trace.first_fill_ns = perf_counter_ns()
+        trace.quik_fill_ms = quik_ms
+        self.record(order, trace, 'first_fill_us', 'quik_fill_us')
+
+    def on_done(self, order) -> None:
+        """Заявка завершена (исполнена, отменена, отклонена). Трассировка пишется в журнал"""
+        trace = self.traces.pop(order.ref, None)
+        if trace is None:  # Если заявка не трассируется
+            return  # то выходим, дальше не продолжаем
+        trace.completed_ns = perf_counter_ns()
+        trace.status = order.getstatusname()
+        self.record(order, trace, 'completed_us')
+        if self.file_name is not None:  # Если ведем журнал заявок
+            self.write(trace.as_dict())
+
+    def record(self, order, trace, *names) -> None:
+        """Запись интервалов в гистограммы тикера, метрики и order.info['latency']"""
+        intervals = trace.intervals()
+        with self.lock:
+            for name in names:
+                value = intervals[name]
+                if value is None:  # Если интервала нет (например, QUIK не передал время)
+                    continue  # то пропускаем его
+                key = (trace.instrument, name)
+                histogram = self.histograms.get(key)
+                if histogram is None:  # Если гистограммы еще нет
+                    histogram = self.histograms[key] = Histogram()  # то создаем ее
+                histogram.record(value)
+                if metrics.enabled:  # Если метрики включены
+                    metrics.observe(f'order_{name[:-3]}', value, instrument=trace.instrument)
+        order.addinfo(latency=intervals)  # Интервалы видны в ТС в уведомлениях о заявке
+
+    def stats(self, instrument=None) -> dict:
+        """Процентили интервалов по тикерам
+
+        :param str instrument: Тикер. Если не задан, то все тикеры
+        :return: {тикер: {интервал: {count, min, max, mean, p50, p90, p99, p999}}}. Значения в микросекундах
+        """
+        result = {}
+        with self.lock:
+            for (name, interval), histogram in self.histograms.items():
+                if instrument is None or name == instrument:
+                    result.setdefault(name, {})[interval] = histogram.snapshot()
+        return result
+
+    def write(self, row) -> None:
+        """Запись строки в журнал заявок"""
+        with self.lock:
+            if self.parquet:  # Parquet не дописывается построчно
+                self.rows.append(row)  # Копим строки до закрытия
+                return
+            new_file = not os.path.isfile(self.file_name)  # Файла еще нет
+            with open(self.file_name, 'a', newline='', encoding='utf-8') as file:
+                writer = csv.DictWriter(file, OrderTrace.fields, delimiter='\t')
+                if new_file:  # Для нового файла
+                    writer.writeheader()  # пишем заголовок
+                writer.writerow(row)
+
+    def close(self) -> None:
+        """Закрытие журнала. Для Parquet пишется весь файл"""
+        if not self.parquet or not self.rows:  # Если журнал не Parquet или писать нечего
+            return  # то выходим, дальше не продолжаем
+        import pandas as pd  # Есть в зависимостях пакета
+        df = pd.DataFrame(self.rows, columns=OrderTrace.fields)
+        if os.path.isfile(self.file_name):  # Если журнал уже есть
+            try:
+                df = pd.concat([pd.read_parquet(self.file_name), df], ignore_index=True)  # то добавляем строки к нему
+            except (ImportError, ValueError) as e:
+                logger.warning(f'Журнал заявок {self.file_name} не прочитан: {e}')
+        try:
+            df.to_parquet(self.file_name, index=False)
+        except ImportError:  # Если нет pyarrow/fastparquet
+            file_name = f'{self.file_name[:-len(".parquet")]}.csv'
+            logger.warning(f'Для журнала Parquet нужен pyarrow. Журнал заявок записан в {file_name}')
+            df.to_csv(file_name, sep='\t', index=False, mode='a', header=not os.path.isfile(file_name))
+        self.rows = []
@@ -0,0 +1,272 @@
+from itertools import count  # Номер запроса для распределения по кругу
+from threading import Thread, Event, Lock  # Поток проверки терминалов. Блокировка переключения терминалов
+from time import perf_counter_ns  # Замер задержки проверки терминала
+
+from .logger_config import logger  # Будем вести лог
+from .QuikJuniorPy import QuikPy, RequestTimeoutError  # Запрос к QUIK# не выполнен за отведенное время
+
+
+class Endpoint:
+    """Экземпляр скрипта QUIK# (запись servers в lua/config.json) и его состояние"""
+    def __init__(self, name, host, requests_port, callbacks_port):
+        self.name = name  # Название
+        self.host = host  # IP адрес или название хоста
+        self.requests_port = requests_port  # Порт для отправки запросов и получения ответов
+        self.callbacks_port = callbacks_port  # Порт для функций обратного вызова
+        self.provider = None  # Подключение QuikPy
+        self.healthy = False  # Терминал доступен
+        self.failures = 0  # Кол-во ошибок соединения
+        self.last_error = None  # Последняя ошибка соединения
+        self.latency_us = None  # Задержка последней проверки ping в микросекундах
+
+    def connect(self) -> bool:
+        """Подключение к скрипту QUIK#. Результат: подключились или нет"""
+        try:
+            self.provider = QuikPy(host=self.host, requests_port=self.requests_port, callbacks_port=self.callbacks_port)
+            self.healthy = True
+        except OSError as e:  # Если скрипт не запущен / недоступен
+            self.fail(e)
+        return self.healthy
+
+    def reconnect(self) -> bool:
+        """Повторное подключение к скрипту QUIK# с возобновлением фильтров и подписок. Результат: подключились или нет"""
+        if self.provider is None:  # Если терминал не был доступен при создании пула
+            return self.connect()  # то подключаемся впервые
+        try:
+            self.provider.reconnect()
+            self.healthy = True
+            logger.info(f'Терминал {self.name} снова доступен')
+        except OSError as e:  # Если скрипт еще не запущен / недоступен
+            self.fail(e)
+        return self.healthy
+
+    def fail(self, error) -> None:
+        """Отметка ошибки соединения"""
+        self.healthy = False
+        self.failures += 1
+        self.last_error = str(error)
+        logger.error(f'Терминал {self.name} недоступен: {error}')
+
+    def state(self) -> dict:
+        """Состояние терминала"""
+        return dict(name=self.name, host=self.host, requests_port=self.requests_port, callbacks_port=self.callbacks_port,
+                    healthy=self.healthy, failures=self.failures, last_error=self.last_error, latency_us=self.latency_us)
+
+
+class QuikPool:
+    """Пул подключений к нескольким экземплярам скрипта QUIK# с маршрутизацией запросов
+    Заменяет QuikPy в QKStore(provider=QuikPool(...)). Заявки и состояние счетов идут через торговый терминал,
+    история, подписки и их функции обратного вызова - через терминал данных, поэтому загрузка истории не задерживает заявки.
+    Запросы только на чтение по возможности распределяются по кругу. При ошибке соединения запрос только на чтение / данных переходит на другой доступный терминал.
+    Транзакции и остальные запросы торгового терминала на другом терминале не повторяются: заявка могла уже уйти на биржу
+    """
+    data_methods = {'get_candles', 'get_candles_from_data_source', 'get_candles_from_data_source_bulk', 'get_num_candles', 'subscribe_to_candles', 'unsubscribe_from_candles', 'is_subscribed',
+                    'subscribe_level2_quotes', 'unsubscribe_level2_quotes', 'is_subscribed_level2_quotes', 'get_quote_level2',
+                    'param_request', 'cancel_param_request', 'param_request_bulk', 'cancel_param_request_bulk', 'get_all_trade',
+                    'set_callback_filter', 'reset_callback_filter', 'set_callback_batch', 'get_callback_counters'}  # Запросы терминала данных
+    read_only_methods = {'ping', 'echo', 'get_info_param', 'is_connected', 'get_param_ex', 'get_param_ex2', 'get_param_ex2_bulk',
+                         'get_security_info', 'get_security_info_bulk', 'get_security_class', 'get_classes_list', 'get_class_info', 'get_class_securities'}  # Запросы, которые можно распределять по кругу
+    data_callbacks = {'on_new_candle', 'on_candle_correction', 'on_quote', 'on_all_trade', 'on_param'}  # Функции обратного вызова терминала данных. Остальные - торгового терминала
+    profile_attributes = {'profiles', 'get_instrument_profile', 'invalidate_instrument_profile', 'invalidate_instrument_profiles', 'refresh_instrument_profiles',
+                          'price_to_valid_price', 'prices_to_valid_prices', 'price_to_quik_price', 'quik_price_to_price', 'lots_to_size', 'size_to_lots'}  # Профили инструментов хранятся в терминале данных, т.к. он получает OnParam
+
+    def __init__(self, servers=(('127.0.0.1', 34130, 34131), ('127.0.0.1', 34132, 34133)), trading=0, data=1, round_robin=True):
+        """Инициализация пула
+
+        :param servers: Экземпляры скрипта QUIK#: (хост, порт запросов, порт функций обратного вызова). По умолчанию, как в lua/config.json
+        :param int trading: Номер торгового терминала в servers
+        :param int data: Номер терминала данных в servers
+        :param bool round_robin: Распределять запросы только на чтение по кругу
+        """
+        object.__setattr__(self, 'handlers', {})  # Функции обратного вызова. Название → обработчик. До остальных атрибутов, т.к. используется в __setattr__
+        self.endpoints = [Endpoint(f'{host}:{requests_port}', host, requests_port, callbacks_port) for host, requests_port, callbacks_port in servers]  # Терминалы
+        self.roles = dict(trading=trading, data=data)  # Роль → номер терминала
+        self.round_robin = round_robin  # Распределение запросов только на чтение по кругу
+        self.counter = count()  # Номер запроса только на чтение
+        self.lock = Lock()  # Блокировка переключения терминалов
+        self.wrappers = {}  # Обертки запросов с маршрутизацией. Название → функция
+        self.heartbeat = None  # Период проверки терминалов в секундах
+        self.reconnect_handlers = []  # Обработчики после повторного подключения терминала. Например, сверка заявок брокера
+        self.exit_event = Event()  # Событие остановки проверки терминалов
+        self.thread = None  # Поток проверки терминалов
+        for endpoint in self.endpoints:  # Подключаемся ко всем терминалам
+            endpoint.connect()
+        if not any(endpoint.healthy for endpoint in self.endpoints):  # Если ни один терминал не доступен
+            raise ConnectionError('QuikPool: нет доступных терминалов QUIK#')
+        for role in self.roles:  # Если терминал роли недоступен
+            self.failover(role)  # то переключаем роль на доступный терминал
+
+    def endpoint(self, role) -> Endpoint:
+        """Терминал роли"""
+        return self.endpoints[self.roles[role]]
+
+    def role(self, name) -> str:
+        """Роль терминала для запроса/функции обратного вызова"""
+        return 'data' if name in self.data_methods or name in self.data_callbacks or name in self.profile_attributes else 'trading'
+
+    def failover(self, role) -> None:
+        """Переключение роли на доступный терминал, если текущий терминал роли недоступен
+        Функции обратного вызова роли переносятся на новый терминал. Подписки на новом терминале нужно оформить заново
+        """
+        with self.lock:
+            current = self.endpoint(role)
+            if current.healthy:  # Если терминал роли доступен
+                return  # то переключать нечего
+            index = next((i for i, endpoint in enumerate(self.endpoints) if endpoint.healthy), None)  # Первый доступный терминал
+            if index is None:  # Если доступных терминалов нет
+                return  # то переключать некуда
+            self.roles[role] = index
+            logger.warning(f'Роль {role} переключена с терминала {current.name} на {self.endpoints[index].name}')
+        for name, handler in self.handlers.items():  # Переносим функции обратного вызова роли
+            if self.role(name) == role:
+                self.bind(name, handler)
+
+    def bind(self, name, handler) -> None:
+        """Установка функции обратного вызова на терминал ее роли. На остальных терминалах ставится обработчик по умолчанию"""
+        target = self.endpoint(self.role(name))
+        for endpoint in self.endpoints:
+            if endpoint.provider is not None:
+                setattr(endpoint.provider, name, handler if endpoint is target else endpoint.provider.default_handler)
+
+    def route(self, name) -> Endpoint:
+        """Терминал для запроса"""
+        if self.round_robin and name in self.read_only_methods:  # Если запрос только на чтение
+            healthy = [endpoint for endpoint in self.endpoints if endpoint.healthy]
+            if healthy:
+                return healthy[next(self.counter) % len(healthy)]  # то берем следующий доступный терминал по кругу
+        return self.endpoint(self.role(name))
+
+    def call(self, name, *args, **kwargs):
+        """Выполнение запроса с переходом на другой терминал при ошибке соединения. Повторяются только запросы только на чтение и запросы данных.
+        Исключение последней попытки передается без изменений, поэтому у RequestTimeoutError сохраняется признак отправки sent
+        """
+        retry = name in self.read_only_methods or name in self.data_methods  # Запрос можно повторить на другом терминале
+        for attempt in range(len(self.endpoints), 0, -1):  # Пробуем не больше раз, чем есть терминалов
+            endpoint = self.route(name)
+            try:
+                return getattr(endpoint.provider, name)(*args, **kwargs)
+            except RequestTimeoutError as e:  # Если QUIK# не ответил за отведенное время
+                if e.sent:  # Если запрос был отправлен, то терминал не отвечает. Запрос мог быть выполнен, поэтому не повторяем его
+                    self.fail(endpoint, e)
+                raise
+            except OSError as e:  # Если соединение с терминалом потеряно / закрыто. ConnectionError - наследник OSError
+                self.fail(endpoint, e)
+                if not retry or attempt == 1:  # Если запрос нельзя повторять, или терминалы закончились
+                    raise
+
+    def fail(self, endpoint, error) -> None:
+        """Отметка ошибки терминала и переключение его ролей на доступные терминалы"""
+        endpoint.fail(error)
+        for role in self.roles:  # Переключаем роли этого терминала
+            self.failover(role)
+
+    def check_health(self) -> list:
+        """Проверка доступных терминалов запросом ping и повторное подключение недоступных. Недоступные роли переключаются
+
+        :return: Состояние всех терминалов
+        """
+        for endpoint in self.endpoints:
+            if not endpoint.healthy:  # Если терминал недоступен
+                if endpoint.reconnect():  # то подключаемся к нему снова. Подписки и фильтры терминала возобновляются
+                    for name, handler in self.handlers.items():  # Функции обратного вызова ставим и на новый провайдер
+                        self.bind(name, handler)
+                    self.reconnected()
+                continue
+            if endpoint.provider.connection_lost.is_set():  # Если поток функций обратного вызова уже отметил потерю соединения
+                endpoint.fail('соединение потеряно')
+                continue
+            start = perf_counter_ns()
+            try:
+                with endpoint.provider.deadline(self.heartbeat):  # Ответ на ping ждем не дольше периода проверки
+                    endpoint.provider.ping()
+                endpoint.latency_us = (perf_counter_ns() - start) // 1000
+            except RequestTimeoutError as e:  # Если ping не выполнен за отведенное время
+                if e.sent:  # Если соединение не занято долгим запросом, то скрипт QUIK# не отвечает
+                    endpoint.fail(e)
+            except OSError as e:
+                endpoint.fail(e)
+        for role in self.roles:
+            self.failover(role)
+        return self.health()
+
+    def reconnected(self) -> None:
+        """Сверка состояния после повторного подключения терминала"""
+        for handler in self.reconnect_handlers:
+            try:
+                handler()
+            except Exception as e:  # Ошибка сверки не должна останавливать проверку терминалов
+                logger.error(f'Ошибка сверки после повторного подключения: {e}')
+
+    def start_monitor(self, heartbeat=5, on_reconnected=()) -> None:
+        """Запуск потока проверки терминалов и повторного подключения недоступных
+
+        :param float heartbeat: Период проверки терминалов в секундах
+        :param on_reconnected: Обработчики после повторного подключения терминала
+        """
+        self.heartbeat = heartbeat
+        self.reconnect_handlers = on_reconnected
+        if self.thread is not None and self.thread.is_alive():  # Если проверка уже запущена
+            return  # то выходим, дальше не продолжаем
+        self.check_health()  # Терминалы, закрытые при остановке хранилища, подключаем сразу
+        self.exit_event.clear()
+        self.thread = Thread(target=self.monitor, name='PoolMonitorThread', daemon=True)
+        self.thread.start()
+
+    def stop_monitor(self) -> None:
+        """Остановка потока проверки терминалов"""
+        self.exit_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=(self.heartbeat or 0) + 1)
+            self.thread = None
+
+    def monitor(self) -> None:
+        """Поток проверки терминалов"""
+        while not self.exit_event.wait(self.heartbeat):
+            try:
+                self.check_health()
+            except Exception as e:  # Ошибка проверки не должна останавливать поток
+                logger.error(f'Ошибка проверки терминалов: {e}')
+
+    def health(self) -> list:
+        """Состояние всех терминалов и их роли"""
+        return [dict(endpoint.state(), roles=[role for role, index in self.roles.items() if index == i]) for i, endpoint in enumerate(self.endpoints)]
+
+    def __getattr__(self, name):
+        """Запросы QuikPy маршрутизируются по терминалам. Профили инструментов берутся из терминала данных, остальные атрибуты (счета, справочники) - из торгового терминала"""
+        if name.startswith('on_'):  # Функция обратного вызова
+            return self.handlers.get(name, self.endpoint(self.role(name)).provider.default_handler)
+        if name in self.profile_attributes:  # Профили обновляются по OnParam терминала данных
+            return getattr(self.endpoint('data').provider, name)
+        attribute = getattr(self.endpoint('trading').provider, name)
+        if name not in self.data_methods and name not in self.read_only_methods and not hasattr(QuikPy, name) or not callable(attribute):  # Атрибут экземпляра
+            return attribute
+        wrapper = self.wrappers.get(name)
+        if wrapper is None:  # Если обертки запроса еще нет
+            def wrapper(*args, **kwargs):
+                return self.call(name, *args, **kwargs)
+            self.wrappers[name] = wrapper
+        return wrapper
+
+    def __setattr__(self, name, value):
+        """Функции обратного вызова устанавливаются на терминал своей роли"""
+        if name.startswith('on_'):
+            self.handlers[name] = value
+            self.bind(name, value)
+        else:
+            object.__setattr__(self, name, value)
+
+    def close_connection_and_thread(self) -> None:
+        """Закрытие соединений со всеми терминалами"""
+        self.stop_monitor()  # Чтобы закрытые терминалы не подключались снова
+        for endpoint in self.endpoints:
+            if endpoint.provider is not None:
+                endpoint.provider.close_connection_and_thread()
+                endpoint.healthy = False
+
+    def close(self) -> None:
+        """Окончательное закрытие всех терминалов вместе с журналами сессий"""
+        self.stop_monitor()  # Чтобы закрытые терминалы не подключались снова
+        for endpoint in self.endpoints:
+            if endpoint.provider is not None:
+                endpoint.provider.close()
+                endpoint.healthy = False
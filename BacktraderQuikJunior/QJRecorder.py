@@ -0,0 +1,86 @@
+from struct import Struct  # Заголовок записи
+from threading import Lock  # Запись из потока функций обратного вызова и потоков запросов
+from time import time_ns  # Время получения
+
+from .logger_config import logger  # Будем вести лог
+
+
+class SessionRecorder:
+    """Запись сессии QUIK#: функции обратного вызова, запросы и ответы в том виде, в котором они пришли из соединения, со временем получения
+    Журнал двоичный, только на дозапись: заголовок записи (тип, время в нс с 01.01.1970, длина) и строка в кодировке Windows 1251 без перевода строки.
+    Воспроизведение: QKStore(provider=QuikReplay('session.qjr'))
+    """
+    magic = b'QJREC1\n'  # Начало журнала
+    header = Struct('<BqI')  # Заголовок записи: тип, время в нс, длина строки
+    CALLBACK, REQUEST, RESPONSE = 0, 1, 2  # Типы записей
+
+    def __init__(self, file_name, buffer_size=1048576):
+        """Инициализация записи
+
+        :param str file_name: Журнал сессии. Если файл есть, то записи добавляются в конец
+        :param int buffer_size: Размер буфера записи в байтах. Буфер сбрасывается при заполнении, отключении и закрытии
+        """
+        self.file_name = file_name  # Журнал сессии
+        self.file = open(file_name, 'ab', buffering=buffer_size)  # Дозапись. Позиция в конце файла
+        if self.file.tell() == 0:  # Если журнал новый
+            self.file.write(self.magic)  # то начинаем его с заголовка
+        self.lock = Lock()  # Записи разных потоков не перемешиваются
+        self.records = 0  # Кол-во записей
+
+    def callback(self, line) -> None:
+        """Запись функции обратного вызова
+
+        :param bytes line: Строка функции обратного вызова без перевода строки
+        """
+        record = self.header.pack(self.CALLBACK, time_ns(), len(line)) + line  # Заголовок и строку пишем одним вызовом
+        with self.lock:
+            self.file.write(record)
+            self.records += 1
+
+    def exchange(self, request, response, sent_ns) -> None:
+        """Запись запроса и ответа на него. Пишутся рядом, поэтому ответ находится по запросу без номеров
+
+        :param bytes request: Отправленный запрос
+        :param bytes response: Строка ответа без перевода строки
+        :param int sent_ns: Время отправки запроса в нс с 01.01.1970
+        """
+        request = request.rstrip(b'\r\n')  # Перевод строки не пишем
+        record = self.header.pack(self.REQUEST, sent_ns, len(request)) + request + self.header.pack(self.RESPONSE, time_ns(), len(response)) + response
+        with self.lock:
+            self.file.write(record)
+            self.records += 2
+
+    def flush(self) -> None:
+        """Сброс буфера в файл"""
+        with self.lock:
+            if not self.file.closed:
+                self.file.flush()
+
+    def close(self) -> None:
+        """Закрытие журнала"""
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+                logger.info(f'Журнал сессии {self.file_name} закрыт. Записей: {self.records}')
+
+
+def read_session(file_name):
+    """Чтение журнала сессии
+
+    :param str file_name: Журнал сессии
+    :return: Генератор записей (тип, время получения в нс с 01.01.1970, строка)
+    """
+    header = SessionRecorder.header  # Заголовок записи
+    with open(file_name, 'rb') as file:
+        if file.read(len(SessionRecorder.magic)) != SessionRecorder.magic:  # Если это не журнал сессии
+            raise ValueError(f'Файл {file_name} не является журналом сессии QUIK#')
+        while True:
+            head = file.read(header.size)
+            if len(head) < header.size:  # Если журнал закончился
+                return
+            kind, received_ns, length = header.unpack(head)
+            line = file.read(length)
+            if len(line) < length:  # Если последняя запись не дописана (процесс был прерван)
+                logger.warning(f'Журнал сессии {file_name} обрезан: последняя запись не дописана')
+                return
+            yield kind, received_ns, line
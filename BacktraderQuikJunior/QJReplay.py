@@ -0,0 +1,123 @@
+from collections import deque  # Записанные ответы на запрос
+from threading import Thread, Event, Condition  # Поток воспроизведения. Ожидание записанных запросов
+from time import monotonic  # Паузы между функциями обратного вызова
+
+from .logger_config import logger  # Будем вести лог
+from .QuikJuniorPy import QuikPy
+from .QJRecorder import SessionRecorder, read_session
+
+
+class QuikReplay(QuikPy):
+    """Воспроизведение журнала сессии без терминала QUIK. Провайдер хранилища: QKStore(provider=QuikReplay('session.qjr'), heartbeat=None)
+    Ответы на запросы берутся из журнала по тексту запроса. Если такого запроса не было, то берется первый неотданный ответ на команду.
+    Функции обратного вызова разбираются так же, как из соединения (process_callback), в порядке записи. Каждая отправляется только после того,
+    как воспроизведены записанные до нее запросы: свечи приходят после подписки, ответ на транзакцию - после ее отправки
+    """
+
+    def __init__(self, file_name, speed=1.0, sync_timeout=5, timeout=30):
+        """Инициализация. Счета и справочники берутся из журнала так же, как при подключении к QUIK
+
+        :param str file_name: Журнал сессии, записанный QuikPy(record=...) или QKStore(record=...)
+        :param float speed: Скорость воспроизведения: 1 - как в записи, N - в N раз быстрее, None или 0 - без пауз
+        :param float sync_timeout: Сколько секунд функция обратного вызова ждет записанные до нее запросы. Если ТС отправляет другие запросы, то воспроизведение продолжается
+        :param float timeout: Таймаут запросов по умолчанию в секундах
+        """
+        self.file_name = file_name  # Журнал сессии
+        self.speed = speed  # Скорость воспроизведения
+        self.sync_timeout = sync_timeout  # Ожидание записанных запросов
+        self.responses = {}  # Ответы по тексту запроса. Запрос → deque([ответ]). Ответ - список из одной строки, отданный ответ - [None]
+        self.command_responses = {}  # Ответы по команде в порядке записи. Команда → deque([ответ])
+        self.callbacks = []  # Функции обратного вызова: (время получения в нс, кол-во записанных до нее запросов, строка)
+        request = None  # Запрос, ответ на который идет следующей записью
+        requests = 0  # Кол-во записанных запросов
+        for kind, received_ns, line in read_session(file_name):
+            if kind == SessionRecorder.CALLBACK:
+                self.callbacks.append((received_ns, requests, line))
+            elif kind == SessionRecorder.REQUEST:
+                request = line
+            elif request is not None:  # Ответ на запрос
+                response = [line]  # Один ответ в обоих словарях
+                self.responses.setdefault(request, deque()).append(response)
+                self.command_responses.setdefault(self.command(request), deque()).append(response)
+                request = None
+                requests += 1
+        self.replayed = 0  # Кол-во воспроизведенных запросов
+        self.delivered = 0  # Кол-во отправленных функций обратного вызова
+        self.condition = Condition()  # Поток воспроизведения ждет запросы ТС
+        self.finished = Event()  # Все функции обратного вызова отправлены
+        logger.info(f'Журнал сессии {file_name}: запросов {requests}, функций обратного вызова {len(self.callbacks)}')
+        super().__init__(host=file_name, requests_port=0, callbacks_port=0, timeout=timeout)
+
+    @staticmethod
+    def command(request) -> bytes:
+        """Команда запроса без разбора JSON"""
+        start = request.find(b'"cmd":"')
+        return request[start + 7:request.find(b'"', start + 7)] if start >= 0 else b''
+
+    def take_response(self, raw_data):
+        """Первый неотданный ответ на запрос из журнала. Если ответа нет, то None
+
+        :param bytes raw_data: Запрос в кодировке Windows 1251
+        """
+        request = raw_data.rstrip(b'\r\n')
+        for responses in (self.responses.get(request), self.command_responses.get(self.command(request))):  # Сначала точно такой же запрос, затем та же команда
+            while responses:
+                response = responses.popleft()
+                if response[0] is not None:  # Если ответ еще не отдавали
+                    line, response[0] = response[0], None
+                    return line
+        return None
+
+    def connect(self):
+        """Вместо подключения к скрипту QUIK# запускаем поток воспроизведения функций обратного вызова"""
+        self.callback_exit_event = Event()  # Событие выхода для нового потока
+        self.connection_lost.clear()
+        self.callback_thread = Thread(target=self.replay_callbacks, args=(self.callback_exit_event,), name='ReplayThread', daemon=True)
+        self.callback_thread.start()
+
+    def close_connection_and_thread(self):
+        """Остановка потока воспроизведения"""
+        super().close_connection_and_thread()
+        with self.condition:
+            self.condition.notify_all()  # Поток воспроизведения может ждать запросы
+
+    def process_request(self, request, timeout=None):
+        """Ответ на запрос из журнала. Если ответ не записан, то ошибка lua_error, как от скрипта QUIK#"""
+        with self.lock:
+            line = self.take_response(self.codec.encode_request(request))
+        if line is None:  # Если ответ не записан
+            logger.debug(f'Ответ на запрос {request["cmd"]} в журнале {self.file_name} не найден')
+            return dict(request, cmd='lua_error', lua_error=f'QuikReplay: ответ на запрос {request["cmd"]} не записан')
+        with self.condition:
+            self.replayed += 1
+            self.condition.notify_all()  # Функции обратного вызова после этого запроса можно отправлять
+        return self.codec.decode(line)
+
+    def process_requests(self, requests, timeout=None):
+        """Ответы на пачку запросов из журнала по порядку"""
+        return [self.process_request(request, timeout) for request in requests]
+
+    def replay_callbacks(self, exit_event):
+        """Поток воспроизведения функций обратного вызова с паузами по времени записи, деленными на скорость
+
+        :param Event exit_event: Событие выхода из потока
+        """
+        base_ns = start = None  # Время записи и monotonic, от которых считаются паузы
+        for received_ns, requests, line in self.callbacks:
+            if self.replayed < requests:  # Если записанные до функции обратного вызова запросы еще не воспроизведены
+                with self.condition:
+                    if not self.condition.wait_for(lambda: self.replayed >= requests or exit_event.is_set(), self.sync_timeout):
+                        logger.debug(f'Запросы до функции обратного вызова не воспроизведены: {self.replayed} из {requests}')
+                base_ns = None  # Паузы считаем заново от этой функции обратного вызова
+            if exit_event.is_set():  # Если воспроизведение остановлено
+                return  # то выходим, дальше не продолжаем
+            if self.speed:  # Если воспроизводим с паузами
+                if base_ns is None:
+                    base_ns, start = received_ns, monotonic()
+                delay = start + (received_ns - base_ns) / 1_000_000_000 / self.speed - monotonic()  # Пауза до функции обратного вызова
+                if delay > 0 and exit_event.wait(delay):  # Если за время паузы воспроизведение остановили
+                    return  # то выходим, дальше не продолжаем
+            self.process_callback(line)
+            self.delivered += 1
+        self.finished.set()
+        logger.info(f'Воспроизведение журнала {self.file_name} завершено. Функций обратного вызова: {self.delivered}')
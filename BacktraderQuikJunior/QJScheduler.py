@@ -0,0 +1,113 @@
+from datetime import datetime  # Текущее время для расписания биржи
+from threading import Thread, Event, Lock  # Поток расписания. Пересчет расписания. Блокировка списка данных
+from time import monotonic, perf_counter_ns, sleep  # Точное ожидание времени запроса. Замеры задержек. Уступаем GIL при ожидании
+
+from .logger_config import logger  # Будем вести лог
+from .QJMetrics import metrics  # Метрики задержек
+from .QuikJuniorPy import RequestTimeoutError  # Запрос к QUIK# не уложился в срок
+
+
+class BarScheduler:
+    """Получение новых бар по расписанию биржи для всех данных хранилища одним потоком
+    Данные группируются по времени запроса бара. Поток просыпается один раз на каждое время запроса
+    и получает бары всех данных этого времени одной пачкой запросов к QUIK#
+    """
+    def __init__(self, store, precision=0.002):
+        """Инициализация расписания
+
+        :param QKStore store: Хранилище. Новые бары добавляются в очереди данных (QKData.new_bars)
+        :param float precision: За сколько секунд до времени запроса поток просыпается и дожидается его точно. Уменьшает разброс времени пробуждения
+        """
+        self.store = store  # Хранилище
+        self.precision = precision  # Точное ожидание времени запроса
+        self.feeds = {}  # Данные по расписанию. guid → QKData
+        self.lock = Lock()  # Блокировка списка данных
+        self.wakeup = Event()  # Список данных изменился. Нужно пересчитать расписание
+        self.exit_event = Event()  # Событие остановки
+        self.thread = None  # Поток расписания
+        self.boundaries = 0  # Кол-во обработанных времен запроса
+
+    def add(self, data) -> None:
+        """Добавление данных в расписание. Поток расписания запускается с первыми данными"""
+        with self.lock:
+            self.feeds[data.guid] = data
+            self.wakeup.set()  # Пересчитываем расписание
+            if self.thread is None or not self.thread.is_alive():  # Если поток расписания не запущен
+                self.exit_event.clear()
+                self.thread = Thread(target=self.run, name='SchedulerThread', daemon=True)  # то создаем
+                self.thread.start()  # и запускаем его
+        logger.debug(f'Получение новых бар по расписанию: {data.p.dataname}')
+
+    def remove(self, data) -> None:
+        """Удаление данных из расписания. Поток расписания останавливается с последними данными"""
+        with self.lock:
+            self.feeds.pop(data.guid, None)
+            empty = not self.feeds  # Данных по расписанию больше нет
+        if empty:
+            self.stop()
+        else:
+            self.wakeup.set()  # Пересчитываем расписание
+
+    def stop(self) -> None:
+        """Остановка потока расписания"""
+        self.exit_event.set()
+        self.wakeup.set()  # Прерываем ожидание
+        thread = self.thread
+        if thread is not None and thread.is_alive():
+            thread.join(timeout=5)
+        self.thread = None
+
+    def wheel(self) -> dict:
+        """Данные по времени запроса бара: {время запроса на бирже: [данные]}"""
+        with self.lock:
+            feeds = list(self.feeds.values())
+        slots = {}
+        for data in feeds:  # Время запроса считаем по расписанию каждых данных
+            market_datetime_now = data.p.schedule.utc_to_msk_datetime(datetime.utcnow())  # Текущее время на бирже
+            request_datetime = data.p.schedule.trade_bar_request_datetime(market_datetime_now, data.tf)  # Дата и время запроса бара на бирже
+            slots.setdefault(request_datetime, []).append(data)
+        return slots
+
+    def run(self) -> None:
+        """Поток расписания"""
+        while not self.exit_event.is_set():
+            self.wakeup.clear()  # Изменения списка данных после этого места приведут к пересчету расписания
+            slots = self.wheel()
+            if not slots:  # Если данных нет
+                self.wakeup.wait()  # то ждем их
+                continue
+            request_datetime = min(slots)  # Ближайшее время запроса
+            feeds = slots[request_datetime]  # Данные этого времени
+            market_datetime_now = feeds[0].p.schedule.utc_to_msk_datetime(datetime.utcnow())  # Текущее время на бирже
+            target = monotonic() + (request_datetime - market_datetime_now).total_seconds()  # Время запроса по монотонным часам
+            logger.debug(f'Получение {len(feeds)} бар по расписанию в {request_datetime:%d.%m.%Y %H:%M:%S}')
+            if self.wakeup.wait(max(target - monotonic() - self.precision, 0)):  # Если до времени запроса изменился список данных / остановка
+                continue  # то пересчитываем расписание
+            while monotonic() < target:  # Последние миллисекунды дожидаемся точно
+                sleep(0)  # не удерживая GIL, чтобы поток обратного вызова и ТС работали
+            jitter_us = int((monotonic() - target) * 1_000_000)  # Опоздание пробуждения
+            try:
+                self.fetch(feeds)
+            except Exception as e:  # Ошибка соединения / разбора не должна останавливать поток расписания. Бары получим в следующее время запроса
+                logger.error(f'Ошибка получения бар по расписанию в {request_datetime:%d.%m.%Y %H:%M:%S}: {e}')
+            self.boundaries += 1
+            if metrics.enabled:  # Если метрики включены
+                metrics.observe('schedule_jitter', jitter_us)  # Опоздание пробуждения от времени запроса
+
+    def fetch(self, feeds) -> None:
+        """Получение последних бар данных одной пачкой запросов. Одинаковые тикер/интервал запрашиваются один раз"""
+        start = perf_counter_ns()  # Начало получения бар
+        keys = list(dict.fromkeys((data.class_code, data.sec_code, data.quik_timeframe) for data in feeds))  # Тикеры/интервалы без повторов в порядке данных
+        deadlines = [data.p.deadline for data in feeds if data.p.deadline is not None]  # Крайние сроки данных
+        provider = self.store.provider
+        try:
+            with provider.deadline(min(deadlines) if deadlines else None):  # Бары должны прийти в самый ранний срок
+                responses = dict(zip(keys, provider.get_candles_from_data_source_bulk(keys, count=1)))  # Тикер/интервал → ответ
+        except RequestTimeoutError as e:  # Если бары не пришли в срок
+            logger.warning(f'Бары по расписанию не получены: {e}')
+            return
+        for data in feeds:  # Раздаем бары по данным
+            data.on_schedule_bar(responses[(data.class_code, data.sec_code, data.quik_timeframe)])
+        if metrics.enabled:  # Если метрики включены
+            metrics.observe_ns('schedule_fetch', start)  # Время от пробуждения до выдачи бар всех данных
+            metrics.inc('schedule_bars', len(feeds))  # Кол-во бар по расписанию
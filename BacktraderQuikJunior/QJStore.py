@@ -1,54 +1,117 @@
 from .logger_config import logger  # Будем вести лог
 from collections import deque
 from datetime import datetime
+from threading import Lock  # Блокировка создания провайдера из разных потоков
 
 from backtrader.metabase import MetaParams
 from backtrader.utils.py3 import with_metaclass
 
 from .QuikJuniorPy import QuikPy
-
-
-class MetaSingleton(MetaParams):
-    """Метакласс для создания Singleton классов"""
+from .QJPool import QuikPool
+from .QJOrderBook import OrderBookManager
+from .QJTicks import TickManager
+from .QJCandles import CandleManager
+from .QJSupervisor import ConnectionSupervisor
+from .QJScheduler import BarScheduler
+
+
+class MetaStore(MetaParams):
+    """Метакласс хранилищ: один экземпляр класса на ключ store
+    QKStore() - хранилище по умолчанию, QKStore(store='acc2', host=...) - отдельное хранилище со своим подключением
+    """
     def __init__(cls, *args, **kwargs):
         """Инициализация класса"""
-        super(MetaSingleton, cls).__init__(*args, **kwargs)
-        cls._singleton = None  # Экземпляра класса еще нет
+        super(MetaStore, cls).__init__(*args, **kwargs)
+        cls._stores = {}  # Экземпляры класса по ключам
 
-    def __call__(cls, *args, **kwargs):
+    def __call__(cls, *args, store='default', **kwargs):
         """Вызов класса"""
-        if not cls._singleton:  # Если класса нет в экземплярах класса
-            cls._singleton = super(MetaSingleton, cls).__call__(*args, **kwargs)  # то создаем зкземпляр класса
-        return cls._singleton  # Возвращаем экземпляр класса
+        if isinstance(store, cls):  # Если передали само хранилище (из данных/брокера)
+            return store  # то его и возвращаем
+        if store not in cls._stores:  # Если хранилища с таким ключом нет
+            cls._stores[store] = super(MetaStore, cls).__call__(*args, **kwargs)  # то создаем зкземпляр класса
+            cls._stores[store].key = store  # Запоминаем ключ хранилища
+        return cls._stores[store]  # Возвращаем экземпляр класса
 
 
-class QKStore(with_metaclass(MetaSingleton, object)):
+class QKStore(with_metaclass(MetaStore, object)):
     """Хранилище QUIK"""
     # logger = logging.getLogger('QKStore')  # Будем вести лог
 
     BrokerCls = None  # Класс брокера будет задан из брокера
     DataCls = None  # Класс данных будет задан из данных
 
-    @classmethod
-    def getdata(cls, *args, **kwargs):
-        """Возвращает новый экземпляр класса данных с заданными параметрами"""
-        return cls.DataCls(*args, **kwargs)
-
-    @classmethod
-    def getbroker(cls, *args, **kwargs):
-        """Возвращает новый экземпляр класса брокера с заданными параметрами"""
-        return cls.BrokerCls(*args, **kwargs)
-
-    def __init__(self, provider=QuikPy()):
+    def getdata(self, *args, **kwargs):
+        """Возвращает новый экземпляр класса данных с заданными параметрами, привязанный к этому хранилищу"""
+        return self.DataCls(*args, store=self, **kwargs)
+
+    def getbroker(self, *args, **kwargs):
+        """Возвращает новый экземпляр класса брокера с заданными параметрами, привязанный к этому хранилищу"""
+        return self.BrokerCls(*args, store=self, **kwargs)
+
+    def __init__(self, provider=None, host='127.0.0.1', requests_port=34130, callbacks_port=34131, heartbeat=5, timeout=30, boundary=False, callback_batch=10, record=None):
+        """Инициализация хранилища. К QUIK подключаемся при первом обращении к провайдеру (обычно при старте)
+
+        :param provider: Готовый провайдер QuikPy/QuikPool. Если не задан, то QuikPy создается при первом обращении
+        :param str host: IP адрес или название хоста
+        :param int requests_port: Порт для отправки запросов и получения ответов
+        :param int callbacks_port: Порт для функций обратного вызова
+        :param float heartbeat: Период проверки соединения с QUIK# в секундах. None - без контроля соединения и повторного подключения
+        :param float timeout: Таймаут запросов к QUIK# по умолчанию в секундах. None - без таймаута
+        :param bool boundary: Внутридневные бары по подписке приходят сразу после окончания интервала по времени сервера QUIK, а не с первой сделкой следующего бара
+        :param int callback_batch: Окно объединения изменений стаканов и текущих параметров в скрипте QUIK# в мс. 0 - изменения приходят сразу по одному
+        :param str record: Журнал сессии для воспроизведения QuikReplay. None - без записи
+        """
         super(QKStore, self).__init__()
+        self.key = None  # Ключ хранилища. Задается метаклассом
+        self.host = host  # IP адрес или название хоста
+        self.requests_port = requests_port  # Порт для отправки запросов и получения ответов
+        self.callbacks_port = callbacks_port  # Порт для функций обратного вызова
+        self.timeout = timeout  # Таймаут запросов к QUIK# по умолчанию
+        self.callback_batch = callback_batch  # Окно объединения OnQuote и OnParam
+        self.record = record  # Журнал сессии
+        self.lock = Lock()  # Блокировка создания провайдера
         self.notifs = deque()  # Уведомления хранилища
-        self.provider = provider  # Подключаемся к провайдеру QuikPy
-        self.new_bars = []  # Новые бары по всем подпискам на тикеры из QUIK
+        self.candles = CandleManager(provider, self.get_bar_open_date_time, boundary)  # Новые бары по подпискам на тикеры из QUIK. Одна подписка QUIK на тикер/интервал для всех данных
+        self.books = OrderBookManager(provider)  # Стаканы по подпискам на тикеры из QUIK. Провайдер задается при подключении
+        self.ticks = TickManager(provider=provider)  # Обезличенные сделки по подпискам на тикеры из QUIK. Провайдер задается при подключении
+        self.scheduler = BarScheduler(self)  # Получение новых бар по расписанию биржи для всех данных одним потоком
+        self.supervisor = ConnectionSupervisor(heartbeat) if heartbeat else None  # Контроль соединения. Сверка после подключения: self.supervisor.on_reconnected
+        self._provider = provider  # Провайдер QuikPy
+        self.external_provider = provider is not None  # Провайдер задан снаружи и не пересоздается
+
+    @property
+    def provider(self):
+        """Провайдер QuikPy. Подключение к QUIK выполняется при первом обращении"""
+        if self._provider is None:  # Если еще не подключились
+            with self.lock:
+                if self._provider is None:  # Если провайдер не создали в другом потоке
+                    self._provider = QuikPy(self.host, self.requests_port, self.callbacks_port, self.timeout, self.record)  # то подключаемся к QUIK
+                    self.books.provider = self.candles.provider = self.ticks.provider = self._provider
+        return self._provider
+
+    @property
+    def connected(self):
+        """Провайдер создан"""
+        return self._provider is not None
 
     def start(self):
         self.provider.on_connected = lambda data: logger.info(data)  # Соединение терминала с сервером QUIK
         self.provider.on_disconnected = lambda data: logger.info(data)  # Отключение терминала от сервера QUIK
-        self.provider.on_new_candle = self.on_new_candle  # Обработчик новых баров по подписке из QUIK
+        self.provider.on_new_candle = self.candles.on_new_candle  # Обработчик новых баров по подписке из QUIK
+        self.provider.on_candle_correction = self.candles.on_candle_correction  # Обработчик исправлений баров, отправленных по времени закрытия
+        self.provider.on_quote = self.books.on_quote  # Обработчик изменений стаканов по подписке из QUIK
+        self.provider.on_all_trade = self.ticks.on_all_trade  # Обработчик обезличенных сделок по подписке из QUIK
+        self.ticks.apply_filter()  # Скрипт QUIK# отправляет обезличенные сделки
+        self.books.apply_filter()  # и изменения стаканов только по подпискам
+        if getattr(self.provider.on_param, '__func__', None) is QuikPy.default_handler:  # Если изменения текущих параметров никто не обрабатывает
+            self.provider.set_callback_filter('OnParam', [key for key, profile in self.provider.profiles.items() if profile.kind == 'futures'])  # то скрипт QUIK# отправляет их только по фьючерсам для обновления стоимости шага цены
+        if self.callback_batch:  # Из изменения стакана/текущих параметров нужно только последнее
+            self.provider.set_callback_batch(self.callback_batch)  # Повторные изменения по тикеру объединяются и приходят пачками
+        if self.supervisor and isinstance(self.provider, QuikPy):  # Если нужен контроль соединения с одним скриптом QUIK#
+            self.supervisor.start(self.provider)  # то запускаем его
+        elif self.supervisor and isinstance(self.provider, QuikPool):  # Если нужен контроль соединения с пулом терминалов
+            self.provider.start_monitor(self.supervisor.heartbeat, self.supervisor.on_reconnected)  # то пул проверяет и подключает каждый терминал сам
 
     def put_notification(self, msg, *args, **kwargs):
         self.notifs.append((msg, args, kwargs))
@@ -59,19 +122,29 @@ class QKStore(with_metaclass(MetaSingleton, object)):
         return [notif for notif in iter(self.notifs.popleft, None)]
 
     def stop(self):
+        if not self.connected:  # Если к QUIK не подключались
+            return  # то останавливать нечего
+        if self.supervisor:  # Если был контроль соединения
+            self.supervisor.stop()  # то останавливаем его, чтобы он не подключился заново
         self.provider.on_new_candle = self.provider.default_handler  # Возвращаем обработчик по умолчанию
-        self.provider.close_connection_and_thread()  # Закрываем соединение для запросов и поток обработки функций обратного вызова
-
-    def on_new_candle(self, data):
-        bar = data['data']  # Данные бара
-        class_code = bar['class']  # Код режима торгов
-        sec_code = bar['sec']  # Тикер
-        interval = bar['interval']  # Временной интервал QUIK
-        guid = (class_code, sec_code, interval)  # Идентификатор подписки
-        bar = dict(datetime=self.get_bar_open_date_time(bar),  # Собираем дату и время открытия бара
-                   open=bar['open'], high=bar['high'], low=bar['low'], close=bar['close'],  # Цены QUIK
-                   volume=int(bar['volume']))  # Объем в лотах. Бар из подписки
-        self.new_bars.append(dict(guid=guid, data=bar))
+        self.provider.on_candle_correction = self.provider.default_handler  # Возвращаем обработчик по умолчанию
+        self.provider.on_quote = self.provider.default_handler  # Возвращаем обработчик по умолчанию
+        self.provider.on_all_trade = self.provider.default_handler  # Возвращаем обработчик по умолчанию
+        try:
+            for event in ('OnAllTrade', 'OnQuote', 'OnParam'):  # Скрипт QUIK# снова отправляет события по всем инструментам
+                self.provider.reset_callback_filter(event)
+            if self.callback_batch:  # и сразу по одному
+                self.provider.set_callback_batch(0)
+        except OSError as e:  # Соединение могло быть уже потеряно. ConnectionError и RequestTimeoutError - наследники OSError
+            logger.warning(f'Фильтры и объединение функций обратного вызова не отменены: {e}')
+        self.books.stop()  # Останавливаем поток обновления стаканов
+        self.scheduler.stop()  # Останавливаем поток расписания
+        self.candles.history.clear()  # Историю базовых интервалов при следующем старте загружаем заново
+        if self.external_provider:  # Если провайдер задан снаружи
+            self.provider.close_connection_and_thread()  # то закрываем соединение для запросов и поток обработки функций обратного вызова. Провайдер закроет тот, кто его создал
+        else:  # Если провайдер создали сами
+            self.provider.close()  # то закрываем его вместе с журналом сессии, чтобы при следующем старте на файл не было двух дескрипторов
+            self._provider = self.books.provider = self.candles.provider = self.ticks.provider = None  # При следующем старте подключимся заново
 
     @staticmethod
     def get_bar_open_date_time(bar):
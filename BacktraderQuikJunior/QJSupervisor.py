@@ -0,0 +1,98 @@
+from threading import Thread, Event  # Поток и событие остановки контроля соединения
+from time import monotonic  # Длительность простоя
+
+from .logger_config import logger  # Будем вести лог
+from .QJMetrics import metrics  # Метрики задержек
+from .QuikJuniorPy import RequestTimeoutError  # Запрос к QUIK# не выполнен за отведенное время
+
+
+class ConnectionSupervisor:
+    """Контроль соединения со скриптом QUIK#: проверка ping, повторное подключение с нарастающей паузой,
+    возобновление подписок и сверка состояния после подключения (обработчики on_reconnected)
+    """
+    def __init__(self, heartbeat=5, min_delay=0.5, max_delay=30):
+        """Инициализация контроля соединения
+
+        :param float heartbeat: Период проверки соединения в секундах
+        :param float min_delay: Первая пауза между попытками подключения в секундах
+        :param float max_delay: Максимальная пауза между попытками подключения в секундах
+        """
+        self.heartbeat = heartbeat  # Период проверки соединения
+        self.min_delay = min_delay  # Первая пауза между попытками подключения
+        self.max_delay = max_delay  # Максимальная пауза между попытками подключения
+        self.on_reconnected = []  # Обработчики после повторного подключения. Например, сверка заявок брокера
+        self.provider = None  # Провайдер QuikPy
+        self.exit_event = Event()  # Событие остановки
+        self.thread = None  # Поток контроля соединения
+        self.reconnects = 0  # Кол-во повторных подключений
+        self.downtime = 0.0  # Суммарное время без соединения в секундах
+
+    def start(self, provider) -> None:
+        """Запуск контроля соединения провайдера QuikPy"""
+        self.provider = provider
+        if self.thread is not None and self.thread.is_alive():  # Если контроль уже запущен
+            return  # то выходим, дальше не продолжаем
+        self.exit_event.clear()
+        self.thread = Thread(target=self.run, name='SupervisorThread', daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        """Остановка контроля соединения"""
+        self.exit_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=self.heartbeat + 1)
+            self.thread = None
+
+    def alive(self) -> bool:
+        """Проверка соединения запросом ping"""
+        if self.provider.connection_lost.is_set():  # Если поток функций обратного вызова уже отметил потерю соединения
+            return False
+        try:
+            with self.provider.deadline(self.heartbeat):  # Ответ на ping ждем не дольше периода проверки
+                self.provider.ping()
+            return True
+        except RequestTimeoutError as e:  # Если ping не выполнен за отведенное время
+            if not e.sent:  # Соединение занято долгим запросом (например, загрузкой истории)
+                return True  # Соединение есть
+            self.provider.on_connection_lost(e)  # Скрипт QUIK# не отвечает
+            return False
+        except OSError as e:  # ConnectionError - наследник OSError
+            self.provider.on_connection_lost(e)
+            return False
+
+    def run(self) -> None:
+        """Поток контроля соединения"""
+        while not self.exit_event.is_set():
+            if self.provider.connection_lost.wait(self.heartbeat):  # Потеря соединения отмечается сразу, не дожидаясь проверки
+                self.recover()
+            elif not self.exit_event.is_set() and not self.alive():  # Если ping не прошел
+                self.recover()
+            elif not self.exit_event.is_set():  # Если соединение есть
+                self.provider.refresh_instrument_profiles()  # то обновляем стоимость шага цены вне потока обратного вызова
+
+    def recover(self) -> None:
+        """Повторное подключение с нарастающей паузой, затем сверка состояния"""
+        lost_at = self.provider.lost_at or monotonic()  # Время потери соединения
+        delay = self.min_delay  # Пауза перед попыткой подключения
+        while not self.exit_event.is_set():
+            try:
+                self.provider.reconnect()  # Подключаемся и возобновляем подписки
+                break
+            except OSError as e:  # Если скрипт QUIK# еще недоступен
+                logger.warning(f'Подключение к QUIK# не выполнено: {e}. Следующая попытка через {delay} с')
+                self.exit_event.wait(delay)
+                delay = min(delay * 2, self.max_delay)
+        else:  # Если контроль остановили до подключения
+            return
+        downtime = monotonic() - lost_at  # Время без соединения
+        self.reconnects += 1
+        self.downtime += downtime
+        if metrics.enabled:  # Если метрики включены
+            metrics.observe('downtime', downtime * 1_000_000)  # Время без соединения
+            metrics.inc('reconnects')  # Кол-во повторных подключений
+        logger.info(f'Соединение с QUIK# восстановлено через {downtime:.1f} с')
+        for handler in self.on_reconnected:  # Сверяем состояние
+            try:
+                handler()
+            except Exception as e:  # Ошибка сверки не должна останавливать контроль соединения
+                logger.error(f'Ошибка сверки после повторного подключения: {e}')
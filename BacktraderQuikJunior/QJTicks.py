@@ -0,0 +1,244 @@
+from datetime import datetime, date, timedelta  # Дата и время тиков и бар
+from threading import Lock  # Блокировка подписок на тики
+
+import numpy as np  # Тики храним в кольцевых буферах массивов, бары собираем векторно
+
+from .logger_config import logger  # Будем вести лог
+
+EPOCH = datetime(1970, 1, 1)  # Начало отсчета времени тиков. Время МСК без часового пояса, как и у бар
+EPOCH_ORDINAL = EPOCH.toordinal()  # Номер дня начала отсчета
+DAY_US = 86_400_000_000  # Кол-во микросекунд в сутках
+
+
+def us_to_datetime(us) -> datetime:
+    """Перевод времени тика в микросекундах в дату и время
+
+    :param int us: Кол-во микросекунд от начала отсчета
+    :return: Дата и время МСК
+    """
+    return EPOCH + timedelta(microseconds=int(us))
+
+
+def datetime_to_us(dt) -> int:
+    """Перевод даты и времени в микросекунды от начала отсчета
+
+    :param datetime dt: Дата и время МСК
+    :return: Кол-во микросекунд от начала отсчета
+    """
+    return (dt - EPOCH) // timedelta(microseconds=1)
+
+
+class TickBuffer:
+    """Кольцевой буфер обезличенных сделок инструмента. Сделки хранятся в столбцах массивов, а не в словарях
+    Пишет только поток обратного вызова, читают потоки данных по своим курсорам
+    """
+
+    def __init__(self, class_code, sec_code, capacity=2 ** 18):
+        """Инициализация
+
+        :param str class_code: Код режима торгов
+        :param str sec_code: Тикер
+        :param int capacity: Размер буфера в сделках. Степень двойки
+        """
+        self.class_code = class_code  # Код режима торгов
+        self.sec_code = sec_code  # Тикер
+        self.capacity = 1 << max(capacity - 1, 1).bit_length()  # Округляем размер буфера до степени двойки
+        self.mask = self.capacity - 1  # Маска индекса в буфере
+        self.times = np.zeros(self.capacity, dtype=np.int64)  # Время сделки в микросекундах МСК
+        self.prices = np.zeros(self.capacity, dtype=np.float64)  # Цена сделки QUIK
+        self.quantities = np.zeros(self.capacity, dtype=np.float64)  # Кол-во в лотах
+        self.trade_nums = np.zeros(self.capacity, dtype=np.int64)  # Номер сделки на бирже
+        self.flags = np.zeros(self.capacity, dtype=np.int8)  # Направление сделки. 1 - продажа, 2 - покупка
+        self.seq = 0  # Кол-во записанных сделок. Индекс следующей сделки
+        self.day = None  # Дата последней сделки (год, месяц, день)
+        self.day_us = 0  # Начало дня последней сделки в микросекундах
+
+    def trade_time_us(self, dt) -> int:
+        """Время сделки QUIK в микросекундах от начала отсчета. Начало дня кэшируется
+
+        :param dict dt: Дата и время сделки QUIK (year, month, day, hour, min, sec, mcs)
+        :return: Кол-во микросекунд от начала отсчета
+        """
+        day = (dt['year'], dt['month'], dt['day'])  # Дата сделки
+        if day != self.day:  # Если сменился день
+            self.day = day  # то запоминаем его
+            self.day_us = (date(*day).toordinal() - EPOCH_ORDINAL) * DAY_US  # и считаем начало дня
+        return self.day_us + ((dt['hour'] * 60 + dt['min']) * 60 + dt['sec']) * 1_000_000 + dt.get('mcs', dt.get('ms', 0) * 1000)
+
+    def append(self, trade) -> None:
+        """Добавление обезличенной сделки QUIK в буфер
+
+        :param dict trade: Обезличенная сделка QUIK
+        """
+        i = self.seq & self.mask  # Индекс в буфере. Старые сделки перезаписываются
+        self.times[i] = self.trade_time_us(trade['datetime'])
+        self.prices[i] = trade['price']
+        self.quantities[i] = trade['qty']
+        self.trade_nums[i] = trade['trade_num']
+        self.flags[i] = trade['flags'] & 3
+        self.seq += 1  # Сделка записана. Увеличиваем счетчик последней
+
+    def extend(self, trades) -> None:
+        """Добавление списка обезличенных сделок QUIK в буфер
+
+        :param list trades: Обезличенные сделки QUIK
+        """
+        for trade in trades:  # Пробегаемся по всем сделкам
+            self.append(trade)  # Добавляем сделку в буфер
+
+    def read(self, cursor) -> tuple[int, tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+        """Сделки с курсора до последней записанной
+
+        :param int cursor: Номер первой сделки для чтения
+        :return: Новый курсор и копии массивов времени, цен, кол-ва и номеров сделок
+        """
+        seq = self.seq  # Запоминаем кол-во записанных сделок. Запись могла продолжиться во время чтения
+        start = max(cursor, seq - self.capacity)  # Если читатель отстал больше, чем на размер буфера, то читаем с самой старой сохраненной сделки
+        indexes = np.arange(start, seq) & self.mask  # Индексы сделок в буфере
+        columns = (self.times[indexes], self.prices[indexes], self.quantities[indexes], self.trade_nums[indexes])  # Копии столбцов
+        valid = max(start, self.seq + 1 - self.capacity)  # Первая сделка, которую поток обратного вызова не мог перезаписать во время копирования. Запись следующей сделки могла уже начаться
+        if valid > cursor:  # Если сделки пропущены / могли быть перезаписаны
+            logger.warning(f'Тики {self.class_code}.{self.sec_code}: пропущено {valid - cursor} сделок. Увеличьте размер буфера')
+            columns = tuple(column[valid - start:] for column in columns)  # то перезаписанные строки отбрасываем, чтобы не смешать столбцы разных сделок
+        return seq, columns
+
+
+class TickAggregator:
+    """Сборка бар из обезличенных сделок. Бары собираются векторно по пачкам сделок
+    Секундные бары закрываются по времени, тиковые бары - по кол-ву сделок
+    """
+
+    def __init__(self, seconds=None, ticks=None):
+        """Инициализация. Задается либо длительность бара в секундах, либо кол-во сделок в баре
+
+        :param int seconds: Длительность бара в секундах
+        :param int ticks: Кол-во сделок в баре
+        """
+        self.period_us = seconds * 1_000_000 if seconds else None  # Длительность бара в микросекундах
+        self.ticks = ticks  # Кол-во сделок в баре
+        self.last_trade_num = -1  # Номер последней учтенной сделки. Сделки с меньшими номерами пропускаем
+        self.count = 0  # Кол-во учтенных сделок. Для тиковых бар
+        self.bar = None  # Открытый бар [bucket, datetime us, open, high, low, close, volume]
+
+    def update(self, times, prices, quantities, trade_nums) -> list[dict]:
+        """Добавление пачки сделок
+
+        :param np.ndarray times: Время сделок в микросекундах
+        :param np.ndarray prices: Цены сделок QUIK
+        :param np.ndarray quantities: Кол-во в лотах
+        :param np.ndarray trade_nums: Номера сделок на бирже
+        :return: Закрытые бары
+        """
+        new = trade_nums > self.last_trade_num  # Пропускаем уже учтенные сделки (история и подписка пересекаются)
+        if not new.all():
+            times, prices, quantities, trade_nums = times[new], prices[new], quantities[new], trade_nums[new]
+        n = len(times)  # Кол-во новых сделок
+        if n == 0:  # Если новых сделок нет
+            return []  # то и новых бар нет
+        self.last_trade_num = int(trade_nums[-1])  # Номер последней учтенной сделки
+        if self.period_us:  # Для секундных бар
+            buckets = times // self.period_us  # Номер бара каждой сделки
+        else:  # Для тиковых бар
+            buckets = (self.count + np.arange(n, dtype=np.int64)) // self.ticks  # Номер бара по порядку сделки
+            self.count += n
+        starts = np.flatnonzero(buckets[1:] != buckets[:-1]) + 1  # Индексы первых сделок каждого бара, кроме первого
+        starts = np.concatenate(([0], starts))  # Индексы первых сделок всех бар
+        ends = np.concatenate((starts[1:], [n])) - 1  # Индексы последних сделок всех бар
+        highs = np.maximum.reduceat(prices, starts)  # Максимальные цены бар
+        lows = np.minimum.reduceat(prices, starts)  # Минимальные цены бар
+        volumes = np.add.reduceat(quantities, starts)  # Объемы бар
+        bars = []  # Закрытые бары
+        for k, (start, end) in enumerate(zip(starts.tolist(), ends.tolist())):  # Пробегаемся по барам. Бар намного меньше, чем сделок
+            bucket = int(buckets[start])  # Номер бара
+            bar = self.bar  # Открытый бар
+            if bar is not None and bar[0] == bucket:  # Если сделки продолжают открытый бар
+                bar[3] = max(bar[3], float(highs[k]))
+                bar[4] = min(bar[4], float(lows[k]))
+                bar[5] = float(prices[end])
+                bar[6] += float(volumes[k])
+            else:  # Если начался новый бар
+                if bar is not None:  # Если был открытый бар
+                    bars.append(self.bar_to_dict(bar))  # то закрываем его
+                dt_us = bucket * self.period_us if self.period_us else int(times[start])  # Секундный бар открывается на границе интервала, тиковый - временем первой сделки
+                self.bar = [bucket, dt_us, float(prices[start]), float(highs[k]), float(lows[k]), float(prices[end]), float(volumes[k])]
+        if self.ticks and self.count % self.ticks == 0:  # Если тиковый бар набрал все сделки
+            bars.append(self.bar_to_dict(self.bar))  # то закрываем его
+            self.bar = None
+        return bars
+
+    def close_due(self, now_us) -> list[dict]:
+        """Закрытие секундного бара по времени, если сделок после окончания бара не было
+
+        :param int now_us: Текущее время МСК в микросекундах
+        :return: Закрытый бар или пустой список
+        """
+        if self.bar is None or not self.period_us:  # Если открытого бара нет, или бары тиковые
+            return []
+        if (self.bar[0] + 1) * self.period_us > now_us:  # Если время бара еще не закончилось
+            return []
+        bar, self.bar = self.bar, None  # Закрываем бар
+        return [self.bar_to_dict(bar)]
+
+    @staticmethod
+    def bar_to_dict(bar) -> dict:
+        """Бар в формате QKData"""
+        return dict(datetime=us_to_datetime(bar[1]), open=bar[2], high=bar[3], low=bar[4], close=bar[5], volume=int(bar[6]))
+
+
+class TickManager:
+    """Подписки на обезличенные сделки. Сделки из OnAllTrade раскладываются по кольцевым буферам инструментов"""
+
+    def __init__(self, capacity=2 ** 18, provider=None):
+        """Инициализация
+
+        :param int capacity: Размер буфера инструмента в сделках
+        :param QuikPy provider: Провайдер QuikPy для фильтра OnAllTrade в скрипте QUIK#. Задается при подключении
+        """
+        self.capacity = capacity  # Размер буфера инструмента в сделках
+        self.provider = provider  # Провайдер QuikPy
+        self.buffers = {}  # Буферы сделок по подпискам. (class_code, sec_code) → TickBuffer
+        self.subscribers = {}  # Кол-во подписчиков на сделки. (class_code, sec_code) → кол-во
+        self.lock = Lock()  # Подписки меняются из потоков данных
+
+    def subscribe(self, class_code, sec_code) -> TickBuffer:
+        """Подписка на обезличенные сделки инструмента
+
+        :param str class_code: Код режима торгов
+        :param str sec_code: Тикер
+        :return: Буфер сделок
+        """
+        key = (class_code, sec_code)  # Ключ подписки
+        with self.lock:
+            self.subscribers[key] = self.subscribers.get(key, 0) + 1  # Добавляем подписчика
+            if key not in self.buffers:  # Если буфера еще нет
+                self.buffers[key] = TickBuffer(class_code, sec_code, self.capacity)  # то создаем его
+                self.apply_filter()  # и получаем сделки по инструменту из QUIK
+            return self.buffers[key]
+
+    def unsubscribe(self, class_code, sec_code) -> None:
+        """Отмена подписки на обезличенные сделки инструмента
+
+        :param str class_code: Код режима торгов
+        :param str sec_code: Тикер
+        """
+        key = (class_code, sec_code)  # Ключ подписки
+        with self.lock:
+            if key not in self.subscribers:  # Если подписки нет
+                return  # то выходим, дальше не продолжаем
+            self.subscribers[key] -= 1  # Убираем подписчика
+            if self.subscribers[key] == 0:  # Если подписчиков не осталось
+                del self.subscribers[key]
+                del self.buffers[key]  # то удаляем буфер
+                self.apply_filter()  # Сделки по инструменту из QUIK больше не нужны
+
+    def apply_filter(self) -> None:
+        """Фильтр OnAllTrade в скрипте QUIK#: сделки отправляются только по инструментам подписок"""
+        if self.provider is not None:  # Если подключились к QUIK
+            self.provider.set_callback_filter('OnAllTrade', list(self.buffers))
+
+    def on_all_trade(self, data) -> None:
+        """Обработчик новой обезличенной сделки (OnAllTrade). Выполняется в потоке обратного вызова"""
+        trade = data['data']  # Обезличенная сделка
+        buffer = self.buffers.get((trade['class_code'], trade['sec_code']))  # Буфер сделок по подписке
+        if buffer is not None:  # Если на сделки по инструменту подписаны
+            buffer.append(trade)  # то добавляем сделку в буфер
@@ -1,20 +1,39 @@
 from typing import Union  # Объединение типов
-from socket import socket, AF_INET, SOCK_STREAM  # Обращаться к LUA скриптам QUIK# будем через соединения
-from threading import Thread, Event, Lock  # Поток/событие выхода для обратного вызова. Блокировка process_request для многопоточных приложений
-from json import loads  # Принимать данные в QUIK будем через JSON
-from json.decoder import JSONDecodeError  # Ошибка декодирования JSON
+import re  # Коды инструментов OnParam без разбора JSON
+from socket import socket, AF_INET, SOCK_STREAM, SHUT_RDWR  # Обращаться к LUA скриптам QUIK# будем через соединения
+from threading import Thread, Event, Lock, local  # Поток/событие выхода для обратного вызова. Блокировка process_request для многопоточных приложений. Крайний срок запросов потока
+from contextlib import contextmanager  # Крайний срок запросов в блоке with
 from .logger_config import logger  # Будем вести лог
+from .QJInstrument import InstrumentProfile  # Профиль инструмента для конвертации цен и кол-ва
+from .QJMetrics import metrics  # Метрики задержек. Включаются metrics.enable()
+from .QJCodec import codec  # Обмен данными с QUIK# в формате JSON
+from .QJRecorder import SessionRecorder  # Запись сессии для воспроизведения
 
 from pytz import timezone  # Работаем с временнОй зоной
+from time import time, time_ns, perf_counter_ns, monotonic  # Замеры задержек для метрик. Время потери соединения. Время отправки запроса в журнал сессии
 from datetime import date, timedelta
 import pandas as pd
 
+
+class RequestTimeoutError(TimeoutError):
+    """Запрос к QUIK# не выполнен за отведенное время или отменен"""
+    def __init__(self, message, sent):
+        """
+        :param str message: Сообщение об ошибке
+        :param bool sent: Запрос отправлен в QUIK#. Если нет, то QUIK# его не выполнял
+        """
+        super().__init__(message)
+        self.sent = sent
+
+
 class QuikPy:
     """Работа с QUIK из Python через LUA скрипты QUIK# https://github.com/finsight/QUIKSharp/tree/master/src/QuikSharp/lua
      На основе Документации по языку LUA в QUIK из https://arqatech.com/ru/support/files/
      Маркировка функций по пунктам документа: Документация по языку LUA в QUIK и примеры - Интерпретатор языка Lua - Версия 11.2
      """
     buffer_size = 1048576  # Размер буфера приема в байтах (1 МБайт)
+    poll_interval = 0.1  # Период проверки отмены запроса при ожидании ответа в секундах
+    codec = codec  # Кодирование запросов и разбор ответов JSON. Библиотека JSON выбирается по наличию: orjson → ujson → json
     tz_msk = timezone('Europe/Moscow')  # QUIK работает по московскому времени
     currency = 'SUR'  # Суммы будем получать в рублях
     limit_kind = 1  # Основной режим торгов T1
@@ -22,12 +41,14 @@ class QuikPy:
     futures_cls_code = 'SPBFUT'  # Код фирмы для срочного рынка. Если ваш брокер поставил другую фирму для срочного рынка, то измените ее
     # logger = logging.getLogger('QuikPy')  # Будем вести лог
 
-    def __init__(self, host='127.0.0.1', requests_port=34130, callbacks_port=34131):
+    def __init__(self, host='127.0.0.1', requests_port=34130, callbacks_port=34131, timeout=30, record=None):
         """Инициализация
 
         :param str host: IP адрес или название хоста
         :param int requests_port: Порт для отправки запросов и получения ответов
         :param int callbacks_port: Порт для функций обратного вызова
+        :param float timeout: Таймаут запросов по умолчанию в секундах. None - без таймаута
+        :param str record: Журнал сессии: функции обратного вызова, запросы и ответы для воспроизведения QuikReplay. None - без записи
         """
         # 2.2 Функции обратного вызова
         self.on_firm = self.default_handler  # 2.2.1 Новая фирма
@@ -59,17 +80,28 @@ class QuikPy:
 
         # Функции обратного вызова QUIK#
         self.on_new_candle = self.default_handler  # Новая свечка
+        self.on_candle_correction = self.default_handler  # Исправление свечки, отправленной по времени закрытия
         self.on_error = self.default_handler  # Сообщение об ошибке
 
         self.host = host  # IP адрес или название хоста
         self.requests_port = requests_port  # Порт для отправки запросов и получения ответов
         self.callbacks_port = callbacks_port  # Порт для функций обратного вызова
-        self.socket_requests = socket(AF_INET, SOCK_STREAM)  # Создаем соединение для запросов
-        self.socket_requests.connect((self.host, self.requests_port))  # Открываем соединение для запросов
-
-        self.callback_exit_event = Event()  # Определяем событие выхода из потока
-        self.callback_thread = Thread(target=self.callback_handler, name='CallbackThread').start()  # Создаем и запускаем поток обработки функций обратного вызова
+        self.socket_requests = None  # Соединение для запросов
+        self.socket_callbacks = None  # Соединение для функций обратного вызова
+        self.callback_exit_event = Event()  # Событие выхода из потока обработки функций обратного вызова
+        self.callback_thread = None  # Поток обработки функций обратного вызова
+        self.connection_lost = Event()  # Соединение со скриптом QUIK# потеряно (скрипт или терминал перезапущен)
+        self.lost_at = None  # Время потери соединения monotonic
         self.lock = Lock()  # Блокировка process_request для многопоточных приложений
+        self.timeout = timeout  # Таймаут запросов по умолчанию
+        self.local = local()  # Крайний срок запросов потока (deadline)
+        self.cancel_event = Event()  # Отмена ожидания ответа на текущий запрос
+        self.response_buffer = bytearray()  # Принятые, но еще не разобранные ответы
+        self.abandoned = 0  # Кол-во ответов на отмененные/просроченные запросы, которые нужно пропустить
+        self.symbols = {}  # Справочник тикеров
+        self.profiles = {}  # Профили инструментов для конвертации цен и кол-ва. До подключения, т.к. OnParam помечает их к обновлению из потока обратного вызова
+        self.recorder = SessionRecorder(record) if record else None  # Запись сессии. До подключения, чтобы в журнал попали запросы счетов и справочников
+        self.connect()  # Подключаемся к скрипту QUIK#
 
         self.accounts = list()  # Счета
         '''
@@ -101,8 +133,57 @@ class QuikPy:
                 self.securities.setdefault(sec, set()).add(cls_code)
                 
         self.subscriptions = []  # Список подписок. Для возобновления всех подписок после повторного подключения к серверу QUIK
-        self.symbols = {}  # Справочник тикеров
+        self.callback_filters = {}  # Фильтры функций обратного вызова. Для восстановления после повторного подключения. Событие → [(class_code, sec_code)]
+        self.callback_batch_ms = 0  # Окно объединения OnParam и OnQuote в скрипте QUIK#. Для восстановления после повторного подключения
+
 
+    def connect(self):
+        """Подключение к скрипту QUIK#: соединение для запросов и поток обработки функций обратного вызова"""
+        self.socket_requests = socket(AF_INET, SOCK_STREAM)  # Создаем соединение для запросов
+        self.socket_requests.connect((self.host, self.requests_port))  # Открываем соединение для запросов
+        self.socket_requests.settimeout(self.poll_interval)  # Ответ ждем с периодической проверкой отмены и времени запроса
+        self.socket_timeout = self.poll_interval  # Текущий таймаут соединения. Меняем, только когда нужен другой
+        self.response_buffer = bytearray()  # Ответы старого соединения не нужны
+        self.abandoned = 0
+        self.callback_exit_event = Event()  # Событие выхода для нового потока. Старый поток завершается по своему событию
+        self.connection_lost.clear()  # Соединение есть
+        self.lost_at = None
+        self.callback_thread = Thread(target=self.callback_handler, args=(self.callback_exit_event,), name='CallbackThread', daemon=True)  # Поток обработки функций обратного вызова
+        self.callback_thread.start()  # Запускаем поток
+
+    def reconnect(self):
+        """Повторное подключение к скрипту QUIK# с возобновлением подписок. При ошибке подключения будет OSError"""
+        self.close_connection_and_thread()  # Закрываем старые соединения
+        with self.lock:  # Запросы других потоков ждут подключения
+            self.connect()
+        self.resubscribe()  # Возобновляем подписки
+        logger.info(f'Повторное подключение к QUIK# {self.host}:{self.requests_port} выполнено. Подписок возобновлено: {len(self.subscriptions)}')
+
+    def on_connection_lost(self, error):
+        """Отметка потери соединения со скриптом QUIK#"""
+        if not self.connection_lost.is_set():  # Если потерю еще не отмечали
+            self.lost_at = monotonic()  # то запоминаем время потери
+            self.connection_lost.set()
+            logger.error(f'Соединение с QUIK# {self.host}:{self.requests_port} потеряно: {error}')
+
+    def resubscribe(self):
+        """Возобновление фильтров функций обратного вызова и подписок на стаканы и свечи, которых нет в QUIK"""
+        for event, class_sec_codes in list(self.callback_filters.items()):  # Скрипт QUIK# мог быть перезапущен без фильтров
+            self.set_callback_filter(event, class_sec_codes)
+        if self.callback_batch_ms:  # Если события объединялись в пачки
+            self.set_callback_batch(self.callback_batch_ms)  # то объединяем их снова
+        for subscription in list(self.subscriptions):  # Пробегаемся по всем подпискам
+            class_code = subscription['class_code']  # Код режима торгов
+            sec_code = subscription['sec_code']  # Тикер
+            if subscription['subscription'] == 'quotes' and not self.is_subscribed_level2_quotes(class_code, sec_code)['data']:  # Если подписка на стакан и ее нет в QUIK
+                self.subscribe_level2_quotes(class_code, sec_code)  # то переподписываемся на стакан
+                logger.debug(f'Повторная подписка на стакан: {class_code}.{sec_code}')
+            elif subscription['subscription'] == 'candles':  # Если подписка на свечки
+                interval = subscription['interval']  # Кол-во в минутах
+                param = subscription['param']  # Необязательный параметр
+                if not self.is_subscribed(class_code, sec_code, interval, param)['data']:  # и ее нет в QUIK'
+                    self.subscribe_to_candles(class_code, sec_code, interval, param, boundary=subscription.get('boundary', False))  # то подписываемся на свечки в том же режиме закрытия
+                    logger.debug(f'Повторная подписка на бары: {class_code}.{sec_code} {interval} {param}')
 
     def __enter__(self):
         """Вход в класс, например, с with"""
@@ -222,6 +303,43 @@ class QuikPy:
         """
         return self.process_request({'data': message, 'id': trans_id, 'cmd': 'error_message', 't': ''})
 
+    def set_callback_filter(self, event, class_sec_codes, trans_id=0):  # QUIK#
+        """Фильтр функции обратного вызова по инструментам. Скрипт QUIK# не отправляет события по остальным инструментам
+
+        :param str event: Функция обратного вызова: OnAllTrade, OnQuote, OnParam
+        :param list class_sec_codes: Коды режимов торгов и тикеры [(class_code, sec_code)]. Пустой список - событие не отправляется
+        :param int trans_id: Код транзакции
+        """
+        class_sec_codes = sorted(set(class_sec_codes))  # Инструменты без повторов
+        self.callback_filters[event] = class_sec_codes  # Для восстановления фильтра после повторного подключения
+        return self.process_request({'data': '|'.join([event, *(code for class_sec_code in class_sec_codes for code in class_sec_code)]), 'id': trans_id, 'cmd': 'set_callback_filter', 't': ''})
+
+    def reset_callback_filter(self, event, trans_id=0):  # QUIK#
+        """Отмена фильтра функции обратного вызова. Скрипт QUIK# отправляет события по всем инструментам
+
+        :param str event: Функция обратного вызова: OnAllTrade, OnQuote, OnParam
+        :param int trans_id: Код транзакции
+        """
+        self.callback_filters.pop(event, None)
+        return self.process_request({'data': event, 'id': trans_id, 'cmd': 'reset_callback_filter', 't': ''})
+
+    def set_callback_batch(self, window_ms, trans_id=0):  # QUIK#
+        """Объединение OnParam и OnQuote в скрипте QUIK#. Повторные события по инструменту внутри окна заменяются последним,
+        события одного типа приходят одной пачкой Batch и раздаются в обработчики по одному
+
+        :param int window_ms: Окно объединения в мс. 0 - события приходят сразу по одному
+        :param int trans_id: Код транзакции
+        """
+        self.callback_batch_ms = window_ms  # Для восстановления после повторного подключения
+        return self.process_request({'data': str(window_ms), 'id': trans_id, 'cmd': 'set_callback_batch', 't': ''})
+
+    def get_callback_counters(self, trans_id=0):  # QUIK#
+        """Кол-во прошедших фильтр (sent), отфильтрованных (filtered) и объединенных (coalesced) скриптом QUIK# функций обратного вызова: {событие: {'sent': , 'filtered': , 'coalesced': }}
+
+        :param int trans_id: Код транзакции
+        """
+        return self.process_request({'data': '', 'id': trans_id, 'cmd': 'get_callback_counters', 't': ''})
+
     # 3.1. Функции для обращения к строкам произвольных таблиц
 
     # getItem - 3.1.1. Строка таблицы
@@ -578,7 +696,7 @@ class QuikPy:
         """
         return self.process_request({'data': f'{tag}|{line}|{first_candle}|{count}', 'id': trans_id, 'cmd': 'get_candles', 't': ''})
 
-    def get_candles_from_data_source(self, class_code, sec_code, interval, param='-', count=0):  # QUIK#
+    def get_candles_from_data_source(self, class_code, sec_code, interval, param='-', count=0, wait=10):  # QUIK#
         """Свечи
 
         :param str class_code: Код режима торгов
@@ -586,10 +704,23 @@ class QuikPy:
         :param int interval: Кол-во в минутах: 0 (тик), 1, 2, 3, 4, 5, 6, 10, 15, 20, 30, 60 (1 час), 120 (2 часа), 240 (4 часа), 1440 (день), 10080 (неделя), 23200 (месяц)
         :param str param: Если параметр не задан, то заказываются данные на основании Таблицы обезличенных сделок, если задан – данные по этому параметру
         :param int count: Кол-во свечей. 0 - все
+        :param float wait: Сколько секунд скрипт QUIK# ждет заполнения источника данных. Если не заполнился, то lua_create_data_source_error
+        """
+        return self.process_request({'data': f'{class_code}|{sec_code}|{interval}|{param}|{count}|{int(wait * 1000)}', 'id': '1', 'cmd': 'get_candles_from_data_source', 't': ''})
+
+    def get_candles_from_data_source_bulk(self, class_sec_codes_intervals, param='-', count=1, wait=10):  # QUIK#
+        """Последние свечи по нескольким инструментам/интервалам. Запросы отправляются в QUIK# одной пачкой, ответы приходят по порядку
+
+        :param list[tuple] class_sec_codes_intervals: Коды режимов торгов, тикеры, интервалы. Например: [('TQBR', 'SBER', 1), ('SPBFUT', 'SiZ6', 5)]
+        :param str param: Если параметр не задан, то заказываются данные на основании Таблицы обезличенных сделок, если задан – данные по этому параметру
+        :param int count: Кол-во свечей. 0 - все
+        :param float wait: Сколько секунд скрипт QUIK# ждет заполнения источника данных
+        :return: Ответы в порядке запросов
         """
-        return self.process_request({'data': f'{class_code}|{sec_code}|{interval}|{param}|{count}', 'id': '1', 'cmd': 'get_candles_from_data_source', 't': ''})
+        return self.process_requests([{'data': f'{class_code}|{sec_code}|{interval}|{param}|{count}|{int(wait * 1000)}', 'id': '1', 'cmd': 'get_candles_from_data_source', 't': ''}
+                                      for class_code, sec_code, interval in class_sec_codes_intervals])
 
-    def subscribe_to_candles(self, class_code, sec_code, interval, param='-', trans_id=0):  # QUIK#
+    def subscribe_to_candles(self, class_code, sec_code, interval, param='-', trans_id=0, boundary=False):  # QUIK#
         """Подписка на свечи
 
         :param str class_code: Код режима торгов
@@ -597,10 +728,13 @@ class QuikPy:
         :param int interval: Кол-во в минутах: 0 (тик), 1, 2, 3, 4, 5, 6, 10, 15, 20, 30, 60 (1 час), 120 (2 часа), 240 (4 часа), 1440 (день), 10080 (неделя), 23200 (месяц)
         :param str param: Если параметр не задан, то заказываются данные на основании Таблицы обезличенных сделок, если задан – данные по этому параметру
         :param int trans_id: Код транзакции
+        :param bool boundary: Внутридневная свечка отправляется сразу после окончания интервала по времени сервера (closed=True). Если потом пришли сделки, то приходит исправление CandleCorrection
         """
-        result = self.process_request({'data': f'{class_code}|{sec_code}|{interval}|{param}', 'id': trans_id, 'cmd': 'subscribe_to_candles', 't': ''})
+        result = self.process_request({'data': f'{class_code}|{sec_code}|{interval}|{param}{"|1" if boundary else ""}', 'id': trans_id, 'cmd': 'subscribe_to_candles', 't': ''})
         subscription = {'subscription': 'candles', 'class_code': class_code, 'sec_code': sec_code, 'interval': interval, 'param': param}  # Подписка
-        if self.is_subscribed(class_code, sec_code, interval, param) and subscription not in self.subscriptions:  # Если есть подписка на свечи, но ее нет в списке подписок
+        if boundary:  # Режим закрытия по времени нужно восстановить при повторной подписке
+            subscription['boundary'] = True
+        if result['cmd'] != 'lua_create_data_source_error' and subscription not in self.subscriptions:  # Если подписка на свечи создана, но ее нет в списке подписок. Без отдельного запроса is_subscribed
             self.subscriptions.append(subscription)  # то добавляем подписку
         return result
 
@@ -615,8 +749,8 @@ class QuikPy:
         """
         result = self.process_request({'data': f'{class_code}|{sec_code}|{interval}|{param}', 'id': trans_id, 'cmd': 'unsubscribe_from_candles', 't': ''})
         subscription = {'subscription': 'candles', 'class_code': class_code, 'sec_code': sec_code, 'interval': interval, 'param': param}  # Подписка
-        if not self.is_subscribed(class_code, sec_code, interval, param) and subscription in self.subscriptions:  # Если нет подписки на свечи, но она есть в списке подписок
-            self.subscriptions.remove(subscription)  # то удаляемподписку
+        for item in [item for item in self.subscriptions if item.items() >= subscription.items()]:  # Подписки из списка подписок в любом режиме закрытия. После отмены в QUIK их нет, отдельный запрос is_subscribed не нужен
+            self.subscriptions.remove(item)  # удаляем
         return result
 
     def is_subscribed(self, class_code, sec_code, interval, param='-', trans_id=0):  # QUIK#
@@ -847,139 +981,331 @@ class QuikPy:
 
     # Запросы
 
-    def process_request(self, request):
+    @contextmanager
+    def deadline(self, seconds):
+        """Крайний срок для всех запросов потока внутри блока with. Вложенные блоки могут только сократить срок
+
+        :param float seconds: Срок в секундах от текущего момента. None - без ограничения
+        """
+        saved = getattr(self.local, 'expires', None)  # Срок внешнего блока
+        if seconds is not None:  # Если срок задан
+            expires = monotonic() + seconds  # то считаем время его окончания
+            self.local.expires = expires if saved is None else min(saved, expires)
+        try:
+            yield
+        finally:
+            self.local.expires = saved  # Восстанавливаем срок внешнего блока
+
+    def cancel_request(self):
+        """Отмена ожидания ответа на текущий запрос из другого потока. Запрос завершится RequestTimeoutError, ответ на него будет пропущен"""
+        self.cancel_event.set()
+
+    def expires(self, timeout):
+        """Время окончания запроса monotonic по таймауту запроса и крайнему сроку потока. None - без ограничения"""
+        if timeout is None:  # Если таймаут запроса не задан
+            timeout = self.timeout  # то берем таймаут по умолчанию
+        expires = None if timeout is None else monotonic() + timeout
+        thread_expires = getattr(self.local, 'expires', None)  # Крайний срок потока
+        if thread_expires is not None and (expires is None or thread_expires < expires):
+            expires = thread_expires
+        return expires
+
+    def process_request(self, request, timeout=None):
         """Отправка запроса в виде словаря и получение ответа в виде JSON из QUIK
+        Ожидание ограничено таймаутом и крайним сроком потока (deadline), его можно отменить из другого потока (cancel_request)
+
         :param dict request: Запрос в виде словаря
+        :param float timeout: Таймаут запроса в секундах. По умолчанию, self.timeout
         :returns: Ответ JSON
         """
-        self.lock.acquire()  # Ставим блокировку. Если во время выполнения process_request к нему будет обращение из другого потока, то будем здесь ожидать, пока блокировка не будет снята
-        raw_data = f'{request}\r\n'.replace("'", '"').encode('cp1251')  # Переводим: словарь -> строка, одинарные кавычки -> двойные, кодировка UTF8 -> Windows 1251
-        self.socket_requests.sendall(raw_data)  # Отправляем запрос в QUIK
-        fragments = []  # Гораздо быстрее получать ответ в виде списка фрагментов
-        while True:  # Пока фрагменты есть в буфере
-            fragment = self.socket_requests.recv(self.buffer_size)  # Читаем фрагмент из буфера
-            fragments.append(fragment.decode('cp1251'))  # Переводим фрагмент в Windows кодировку 1251, добавляем в список
-            if len(fragment) < self.buffer_size:  # Если в принятом фрагменте данных меньше чем размер буфера
-                data = ''.join(fragments)  # Собираем список фрагментов в строку
-                try:  # Бывает ситуация, когда данных приходит меньше, но это еще не конец данных
-                    result = loads(data)  # Пробуем перевести ответ в формат JSON в кодировке Windows 1251
-                    # self.logger.debug(f'process_request: Запрос: {raw_data} Ответ: {result}')  # Для отладки
-                    self.lock.release()  # Снимаем блокировку с process_request
-                    return result
-                except JSONDecodeError:  # Если это еще не конец данных
-                    pass  # то ждем фрагментов в буфере дальше
+        enabled = metrics.enabled  # Метрики включены
+        if enabled:  # Если метрики включены
+            wait_start = perf_counter_ns()  # то замеряем ожидание блокировки
+        expires = self.expires(timeout)  # Время окончания запроса
+        if not self.lock.acquire(timeout=-1 if expires is None else max(expires - monotonic(), 0)):  # Ставим блокировку. Если во время выполнения process_request к нему будет обращение из другого потока, то будем здесь ожидать, пока блокировка не будет снята
+            raise RequestTimeoutError(f'Запрос {request["cmd"]} к QUIK# не отправлен: предыдущий запрос не завершился за отведенное время', False)
+        try:  # Блокировку снимаем при любой ошибке
+            if enabled:  # Если метрики включены
+                send_start = perf_counter_ns()  # то замеряем время сети (отправка запроса и получение ответа)
+            self.cancel_event.clear()  # Отмена относится только к текущему запросу
+            raw_data = self.codec.encode_request(request)  # Переводим: словарь -> строка JSON, кодировка UTF8 -> Windows 1251
+            sent_ns = time_ns() if self.recorder is not None else 0  # Время отправки для журнала сессии
+            self.socket_requests.sendall(raw_data)  # Отправляем запрос в QUIK. Запросы малы и сразу уходят в буфер соединения
+            line = self.receive_response(request['cmd'], expires)  # Ответ на запрос
+            if self.recorder is not None:  # Если сессия записывается
+                self.recorder.exchange(raw_data, line, sent_ns)  # то пишем запрос и ответ на него
+            if enabled:  # Если метрики включены
+                parse_start = perf_counter_ns()  # то замеряем время разбора ответа
+            result = self.codec.decode(line)  # Переводим ответ в формат JSON в кодировке Windows 1251
+            # self.logger.debug(f'process_request: Запрос: {raw_data} Ответ: {result}')  # Для отладки
+        finally:
+            self.lock.release()  # Снимаем блокировку с process_request
+        if enabled:  # Если метрики включены
+            cmd = request['cmd']  # Команда запроса
+            metrics.observe_ns('request_lock_wait', wait_start, send_start, cmd=cmd)  # Ожидание блокировки
+            metrics.observe_ns('request_network', send_start, parse_start, cmd=cmd)  # Отправка запроса и получение ответа
+            metrics.observe_ns('request_parse', parse_start, cmd=cmd)  # Разбор ответа
+            metrics.inc('requests', cmd=cmd)  # Кол-во запросов
+        return result
+
+    def process_requests(self, requests, timeout=None):
+        """Отправка пачки запросов одной посылкой и получение ответов по порядку (конвейер). Блокировка ставится один раз на всю пачку
+
+        :param list[dict] requests: Запросы в виде словарей
+        :param float timeout: Таймаут всей пачки в секундах. По умолчанию, self.timeout
+        :returns: Ответы JSON в порядке запросов
+        """
+        if not requests:  # Если запросов нет
+            return []  # то и ответов нет
+        enabled = metrics.enabled  # Метрики включены
+        expires = self.expires(timeout)  # Время окончания пачки запросов
+        if not self.lock.acquire(timeout=-1 if expires is None else max(expires - monotonic(), 0)):  # Ставим блокировку
+            raise RequestTimeoutError(f'Пачка из {len(requests)} запросов к QUIK# не отправлена: предыдущий запрос не завершился за отведенное время', False)
+        results = []  # Ответы
+        try:  # Блокировку снимаем при любой ошибке
+            if enabled:  # Если метрики включены
+                send_start = perf_counter_ns()  # то замеряем время всей пачки
+            self.cancel_event.clear()  # Отмена относится только к текущей пачке
+            raw_requests = [self.codec.encode_request(request) for request in requests]  # Запросы в кодировке Windows 1251
+            sent_ns = time_ns() if self.recorder is not None else 0  # Время отправки для журнала сессии
+            self.socket_requests.sendall(b''.join(raw_requests))  # Отправляем все запросы одной посылкой
+            try:
+                for request, raw_data in zip(requests, raw_requests):  # QUIK# отвечает на запросы по очереди
+                    line = self.receive_response(request['cmd'], expires)
+                    if self.recorder is not None:  # Если сессия записывается
+                        self.recorder.exchange(raw_data, line, sent_ns)  # то пишем запрос и ответ на него
+                    results.append(self.codec.decode(line))
+            except Exception:  # Если пачку не получили целиком
+                self.abandoned += len(requests) - len(results) - 1  # то оставшиеся ответы пропустим. Ответ, на котором прервались, уже учтен или получен
+                raise
+        finally:
+            self.lock.release()  # Снимаем блокировку с process_request
+        if enabled:  # Если метрики включены
+            metrics.observe_ns('request_batch', send_start)  # Время пачки запросов
+            for request in requests:
+                metrics.inc('requests', cmd=request['cmd'])  # Кол-во запросов
+        return results
+
+    def receive_response(self, cmd, expires):
+        """Получение строки ответа на запрос. QUIK# выполняет запросы по очереди и отвечает строками с переводом строки,
+        поэтому ответы на отмененные/просроченные запросы, пришедшие позже, пропускаются по счетчику
+
+        :param str cmd: Команда запроса
+        :param float expires: Время окончания запроса monotonic. None - без ограничения
+        :return: Строка ответа без перевода строки в кодировке Windows 1251
+        """
+        buffer = self.response_buffer  # Принятые данные
+        start = 0  # С какого места искать конец ответа. Уже просмотренные данные повторно не просматриваем
+        while True:
+            end = buffer.find(b'\n', start)  # Конец первого ответа в буфере
+            if end >= 0:  # Если ответ получен целиком
+                line = bytes(buffer[:end])
+                del buffer[:end + 1]  # Убираем ответ из буфера
+                start = 0
+                if self.abandoned:  # Если это ответ на отмененный/просроченный запрос
+                    self.abandoned -= 1  # то пропускаем его
+                    continue
+                if line.strip():  # Пустые строки пропускаем
+                    return line
+                continue
+            start = len(buffer)
+            if self.cancel_event.is_set():  # Если запрос отменили
+                self.abandoned += 1  # то ответ на него пропустим
+                raise RequestTimeoutError(f'Запрос {cmd} к QUIK# отменен', True)
+            remaining = None if expires is None else expires - monotonic()  # Оставшееся время запроса
+            if remaining is not None and remaining <= 0:  # Если время вышло
+                self.abandoned += 1  # то ответ на запрос пропустим
+                raise RequestTimeoutError(f'Запрос {cmd} к QUIK# не выполнен за отведенное время', True)
+            socket_timeout = self.poll_interval if remaining is None or remaining >= self.poll_interval else remaining  # Периодически проверяем отмену и время
+            if socket_timeout != self.socket_timeout:  # Если нужен другой таймаут соединения
+                self.socket_requests.settimeout(socket_timeout)
+                self.socket_timeout = socket_timeout
+            try:
+                fragment = self.socket_requests.recv(self.buffer_size)  # Читаем фрагмент из буфера
+            except TimeoutError:  # Если ответа пока нет
+                continue  # то проверяем отмену и время, ждем дальше
+            if not fragment:  # Если соединение закрыто со стороны QUIK#
+                self.on_connection_lost('соединение для запросов закрыто')
+                raise ConnectionError(f'Соединение с QUIK# {self.host}:{self.requests_port} закрыто')
+            buffer += fragment
 
     # Подписки (функции обратного вызова)
 
+    param_class_codes = re.compile(rb'"class_code":"([^"]*)"')  # Коды режимов торгов в строке OnParam / пачке OnParam
+    param_sec_codes = re.compile(rb'"sec_code":"([^"]*)"')  # Тикеры в строке OnParam / пачке OnParam
+    market_data_callbacks = {b'OnAllTrade': 'on_all_trade', b'OnQuote': 'on_quote', b'OnParam': 'on_param', b'NewCandle': 'on_new_candle', b'CandleCorrection': 'on_candle_correction'}  # Частые функции обратного вызова, которые без обработчика не разбираются
+
     def default_handler(self, data):
         """Пустой обработчик события по умолчанию. Его можно заменить на пользовательский"""
         pass
 
-    def callback_handler(self):
-        """Поток обработки результатов функций обратного вызова"""
-        callbacks = socket(AF_INET, SOCK_STREAM)  # Соединение для функций обратного вызова
-        callbacks.connect((self.host, self.callbacks_port))  # Открываем соединение для функций обратного вызова
-        fragments = []  # Будем получать ответ в виде списка фрагментов. Они могут быть разной длины. Ответ может состоять из нескольких фрагментов
+    def callbacks_connected(self, callbacks):
+        """Соединение для функций обратного вызова открыто. Наследники могут передать в него данные для сервера, например, код сессии шлюза
+
+        :param socket callbacks: Соединение для функций обратного вызова
+        """
+        pass
+
+    def callback_handler(self, exit_event):
+        """Поток обработки результатов функций обратного вызова
+
+        :param Event exit_event: Событие выхода из потока
+        """
+        callbacks = self.socket_callbacks = socket(AF_INET, SOCK_STREAM)  # Соединение для функций обратного вызова. Закрывается и из close_connection_and_thread
+        try:
+            callbacks.connect((self.host, self.callbacks_port))  # Открываем соединение для функций обратного вызова
+        except OSError as e:  # Если скрипт QUIK# не принимает соединение
+            self.on_connection_lost(e)
+            return  # Выходим, дальше не продолжаем
+        self.callbacks_connected(callbacks)  # Соединение открыто
+        tail = b''  # Неполная последняя строка. Функции обратного вызова приходят строками с переводом строки
         while True:  # Пока поток нужен
-            while True:  # Пока есть что-то в буфере ответов
-                if self.callback_exit_event.is_set():  # Если установлено событие выхода из потока
-                    callbacks.close()  # то закрываем соединение для функций обратного вызова
-                    return  # Выходим, дальше не продолжаем
+            if exit_event.is_set():  # Если установлено событие выхода из потока
+                callbacks.close()  # то закрываем соединение для функций обратного вызова
+                return  # Выходим, дальше не продолжаем
+            try:
                 fragment = callbacks.recv(self.buffer_size)  # Читаем фрагмент из буфера
-                fragments.append(fragment.decode('cp1251'))  # Переводим фрагмент в Windows кодировку 1251, добавляем в список
-                if len(fragment) < self.buffer_size:  # Если в принятом фрагменте данных меньше чем размер буфера
-                    break  # то, возможно, это был последний фрагмент, выходим из чтения буфера
-            data = ''.join(fragments)  # Собираем список фрагментов в строку
-            data_list = data.split('\n')  # Одновременно могут прийти несколько функций обратного вызова, разбираем их по одной
-            fragments = []  # Сбрасываем фрагменты. Если последнюю строку не сможем разобрать, то занесем ее сюда
-            for data in data_list:  # Пробегаемся по всем функциям обратного вызова
-                if data == '':  # Если функция обратного вызова пустая
+            except OSError as e:  # Если соединение разорвано
+                fragment = b''
+                logger.debug(f'Ошибка соединения для функций обратного вызова: {e}')
+            if not fragment:  # Если соединение закрыто со стороны QUIK#
+                callbacks.close()  # то закрываем соединение
+                if not exit_event.is_set():  # Если поток не останавливали
+                    self.on_connection_lost('соединение для функций обратного вызова закрыто')
+                return  # Выходим. Новый поток запускается при повторном подключении
+            lines = (tail + fragment).split(b'\n') if tail else fragment.split(b'\n')  # Одновременно могут прийти несколько функций обратного вызова, разбираем их по одной
+            tail = lines.pop()  # Последняя строка без перевода строки еще не пришла целиком. Если все строки полные, то это пустая строка
+            recorder = self.recorder  # Запись сессии
+            for line in lines:  # Пробегаемся по всем функциям обратного вызова
+                if not line:  # Если функция обратного вызова пустая
                     continue  # то ее не разбираем, переходим на следующую функцию, дальше не продолжаем
-                try:  # Пробуем разобрать функцию обратного вызова
-                    data = loads(data)  # Возвращаем полученный ответ в формате JSON
-                except JSONDecodeError:  # Если разобрать не смогли (пришла не вся строка)
-                    fragments.append(data)  # то, что не разобрали ставим в список фрагментов
-                    break  # т.к. неполной может быть только последняя строка, то выходим из разбора функций обратного вызова
-                # self.logger.debug(f'callback_handler: Пришли данные подписки {data["cmd"]} {data}')  # Для отладки
-                # Разбираем функцию обратного вызова QUIK LUA
-                if data['cmd'] == 'OnFirm':  # 1. Новая фирма
-                    self.on_firm(data)
-                elif data['cmd'] == 'OnAllTrade':  # 2. Получение обезличенной сделки
-                    self.on_all_trade(data)
-                elif data['cmd'] == 'OnTrade':  # 3. Получение новой / изменение существующей сделки
-                    self.on_trade(data)
-                elif data['cmd'] == 'OnOrder':  # 4. Получение новой / изменение существующей заявки
-                    self.on_order(data)
-                elif data['cmd'] == 'OnAccountBalance':  # 5. Изменение позиций по счету
-                    self.on_account_balance(data)
-                elif data['cmd'] == 'OnFuturesLimitChange':  # 6. Изменение ограничений по срочному рынку
-                    self.on_futures_limit_change(data)
-                elif data['cmd'] == 'OnFuturesLimitDelete':  # 7. Удаление ограничений по срочному рынку
-                    self.on_futures_limit_delete(data)
-                elif data['cmd'] == 'OnFuturesClientHolding':  # 8. Изменение позиции по срочному рынку
-                    self.on_futures_client_holding(data)
-                elif data['cmd'] == 'OnMoneyLimit':  # 9. Изменение денежной позиции
-                    self.on_money_limit(data)
-                elif data['cmd'] == 'OnMoneyLimitDelete':  # 10. Удаление денежной позиции
-                    self.on_money_limit_delete(data)
-                elif data['cmd'] == 'OnDepoLimit':  # 11. Изменение позиций по инструментам
-                    self.on_depo_limit(data)
-                elif data['cmd'] == 'OnDepoLimitDelete':  # 12. Удаление позиции по инструментам
-                    self.on_depo_limit_delete(data)
-                elif data['cmd'] == 'OnAccountPosition':  # 13. Изменение денежных средств
-                    self.on_account_position(data)
-                # on_neg_deal - 14. Получение новой / изменение существующей внебиржевой заявки
-                # on_neg_trade - 15. Получение новой / изменение существующей сделки для исполнения
-                elif data['cmd'] == 'OnStopOrder':  # 16. Получение новой / изменение существующей стоп заявки
-                    self.on_stop_order(data)
-                elif data['cmd'] == 'OnTransReply':  # 17. Ответ на транзакцию пользователя
-                    self.on_trans_reply(data)
-                elif data['cmd'] == 'OnParam':  # 18. Изменение текущих параметров
-                    self.on_param(data)
-                elif data['cmd'] == 'OnQuote':  # 19. Изменение стакана котировок
-                    self.on_quote(data)
-                elif data['cmd'] == 'OnDisconnected':  # 20. Отключение терминала от сервера QUIK
-                    self.on_disconnected(data)
-                elif data['cmd'] == 'OnConnected':  # 21. Соединение терминала с сервером QUIK
-                    for subscription in self.subscriptions:  # Пробегаемся по всем подпискам
-                        class_code = subscription['class_code']  # Код режима торгов
-                        sec_code = subscription['sec_code']  # Тикер
-                        if subscription['subscription'] == 'quotes' and not self.is_subscribed_level2_quotes(class_code, sec_code)['data']:  # Если подписка на стакан и ее нет в QUIK
-                            self.subscribe_level2_quotes(class_code, sec_code)  # то переподписываемся на стакан
-                            logger.debug(f'Повторная подписка на стакан: {class_code}.{sec_code}')
-                        elif subscription['subscription'] == 'candles':  # Если подписка на свечки
-                            interval = subscription['interval']  # Кол-во в минутах
-                            param = subscription['param']  # Необязательный параметр
-                            if not self.is_subscribed(class_code, sec_code, interval, param)['data']:  # и ее нет в QUIK'
-                                self.subscribe_to_candles(class_code, sec_code, interval, param)  # то подписываемся на свечки
-                                logger.debug(f'Повторная подписка на бары: {class_code}.{sec_code} {interval} {param}')
-                    self.on_connected(data)
-                # on_clean_up - 22. Смена сервера QUIK / Пользователя / Сессии
-                elif data['cmd'] == 'OnClose':  # 23. Закрытие терминала QUIK
-                    self.on_close(data)
-                elif data['cmd'] == 'OnStop':  # 24. Остановка LUA скрипта в терминале QUIK / закрытие терминала QUIK
-                    self.on_stop(data)
-                elif data['cmd'] == 'OnInit':  # 25. Запуск LUA скрипта в терминале QUIK
-                    self.on_init(data)
-                # Разбираем функции обратного вызова QUIK#
-                elif data['cmd'] == 'NewCandle':  # Получение новой свечки
-                    self.on_new_candle(data)
-                elif data['cmd'] == 'lua_error':  # Получено сообщение об ошибке
-                    self.on_error(data)
+                if recorder is not None:  # Если сессия записывается
+                    recorder.callback(line)  # то пишем функцию обратного вызова до разбора
+                self.process_callback(line)
+
+    def process_callback(self, line):
+        """Разбор строки функции обратного вызова и передача в обработчик. Частые функции обратного вызова без обработчика не разбираются
+
+        :param bytes line: Строка функции обратного вызова без перевода строки в кодировке Windows 1251
+        """
+        start = line.find(b'"cmd":"')  # Название функции обратного вызова ищем без разбора JSON
+        if start >= 0:  # Если название нашли
+            cmd = line[start + 7:line.find(b'"', start + 7)]  # Название функции обратного вызова
+            if cmd == b'Batch':  # Если пришла пачка событий одного типа
+                start = line.find(b'"event":"')  # то проверяем обработчик события пачки
+                cmd = line[start + 9:line.find(b'"', start + 9)] if start >= 0 else cmd
+            attribute = self.market_data_callbacks.get(cmd)  # Обработчик частой функции обратного вызова
+            if attribute is not None and getattr(self, attribute) == self.default_handler:  # Если обработчика нет
+                if cmd == b'OnParam' and self.profiles:  # Профили инструментов обновляются по OnParam и без обработчика
+                    self.invalidate_instrument_profiles(line)
+                if metrics.enabled:  # Если метрики включены
+                    metrics.inc('callbacks_skipped', cmd=cmd.decode())  # Кол-во неразобранных функций обратного вызова
+                return  # то функцию обратного вызова не разбираем
+        try:  # Пробуем разобрать функцию обратного вызова
+            data = self.codec.decode(line)  # Возвращаем полученный ответ в формате JSON
+        except ValueError as e:  # Ошибки разбора всех библиотек JSON - наследники ValueError
+            logger.error(f'Функция обратного вызова не разобрана: {e}')
+            return  # Выходим, дальше не продолжаем
+        # self.logger.debug(f'process_callback: Пришли данные подписки {data["cmd"]} {data}')  # Для отладки
+        if metrics.enabled and isinstance(data.get('t'), (int, float)):  # Если метрики включены, и QUIK передал время отправки в мс
+            metrics.observe('callback_lag', time() * 1_000_000 - data['t'] * 1000, cmd=data['cmd'])  # Задержка от отправки в QUIK до разбора
+            metrics.inc('callbacks', cmd=data['cmd'])  # Кол-во функций обратного вызова
+        if data['cmd'] == 'Batch':  # Пачка объединенных событий одного типа: {cmd: 'Batch', event: событие, t: время, data: [данные по инструментам]}
+            for item in data['data']:  # Каждое событие передаем в обработчик так же, как отдельную функцию обратного вызова
+                self.dispatch_callback({'cmd': data['event'], 't': data.get('t'), 'data': item})
+        else:
+            self.dispatch_callback(data)
+
+    def dispatch_callback(self, data):
+        """Передача разобранной функции обратного вызова в ее обработчик
+
+        :param dict data: Функция обратного вызова: {cmd: название, t: время, data: данные}
+        """
+        # Разбираем функцию обратного вызова QUIK LUA
+        if data['cmd'] == 'OnFirm':  # 1. Новая фирма
+            self.on_firm(data)
+        elif data['cmd'] == 'OnAllTrade':  # 2. Получение обезличенной сделки
+            self.on_all_trade(data)
+        elif data['cmd'] == 'OnTrade':  # 3. Получение новой / изменение существующей сделки
+            self.on_trade(data)
+        elif data['cmd'] == 'OnOrder':  # 4. Получение новой / изменение существующей заявки
+            self.on_order(data)
+        elif data['cmd'] == 'OnAccountBalance':  # 5. Изменение позиций по счету
+            self.on_account_balance(data)
+        elif data['cmd'] == 'OnFuturesLimitChange':  # 6. Изменение ограничений по срочному рынку
+            self.on_futures_limit_change(data)
+        elif data['cmd'] == 'OnFuturesLimitDelete':  # 7. Удаление ограничений по срочному рынку
+            self.on_futures_limit_delete(data)
+        elif data['cmd'] == 'OnFuturesClientHolding':  # 8. Изменение позиции по срочному рынку
+            self.on_futures_client_holding(data)
+        elif data['cmd'] == 'OnMoneyLimit':  # 9. Изменение денежной позиции
+            self.on_money_limit(data)
+        elif data['cmd'] == 'OnMoneyLimitDelete':  # 10. Удаление денежной позиции
+            self.on_money_limit_delete(data)
+        elif data['cmd'] == 'OnDepoLimit':  # 11. Изменение позиций по инструментам
+            self.on_depo_limit(data)
+        elif data['cmd'] == 'OnDepoLimitDelete':  # 12. Удаление позиции по инструментам
+            self.on_depo_limit_delete(data)
+        elif data['cmd'] == 'OnAccountPosition':  # 13. Изменение денежных средств
+            self.on_account_position(data)
+        # on_neg_deal - 14. Получение новой / изменение существующей внебиржевой заявки
+        # on_neg_trade - 15. Получение новой / изменение существующей сделки для исполнения
+        elif data['cmd'] == 'OnStopOrder':  # 16. Получение новой / изменение существующей стоп заявки
+            self.on_stop_order(data)
+        elif data['cmd'] == 'OnTransReply':  # 17. Ответ на транзакцию пользователя
+            self.on_trans_reply(data)
+        elif data['cmd'] == 'OnParam':  # 18. Изменение текущих параметров
+            self.invalidate_instrument_profile(data['data']['class_code'], data['data']['sec_code'])  # Профиль инструмента нужно будет обновить
+            self.on_param(data)
+        elif data['cmd'] == 'OnQuote':  # 19. Изменение стакана котировок
+            self.on_quote(data)
+        elif data['cmd'] == 'OnDisconnected':  # 20. Отключение терминала от сервера QUIK
+            self.on_disconnected(data)
+        elif data['cmd'] == 'OnConnected':  # 21. Соединение терминала с сервером QUIK
+            self.resubscribe()  # Возобновляем подписки
+            self.on_connected(data)
+        # on_clean_up - 22. Смена сервера QUIK / Пользователя / Сессии
+        elif data['cmd'] == 'OnClose':  # 23. Закрытие терминала QUIK
+            self.on_close(data)
+        elif data['cmd'] == 'OnStop':  # 24. Остановка LUA скрипта в терминале QUIK / закрытие терминала QUIK
+            self.on_stop(data)
+        elif data['cmd'] == 'OnInit':  # 25. Запуск LUA скрипта в терминале QUIK
+            self.on_init(data)
+        # Разбираем функции обратного вызова QUIK#
+        elif data['cmd'] == 'NewCandle':  # Получение новой свечки
+            self.on_new_candle(data)
+        elif data['cmd'] == 'CandleCorrection':  # Исправление свечки, отправленной по времени закрытия
+            self.on_candle_correction(data)
+        elif data['cmd'] == 'lua_error':  # Получено сообщение об ошибке
+            self.on_error(data)
 
     # Выход и закрытие
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         """Выход из класса, например, с with"""
-        self.close_connection_and_thread()  # Закрываем соединение для запросов и поток обработки функций обратного вызова
+        self.close()  # Закрываем соединения, поток обработки функций обратного вызова и журнал сессии
 
     def __del__(self):
+        self.close()  # Закрываем соединения, поток обработки функций обратного вызова и журнал сессии
+
+    def close(self):
+        """Окончательное закрытие: соединения, поток обработки функций обратного вызова и журнал сессии. После него провайдер не используется"""
         self.close_connection_and_thread()  # Закрываем соединение для запросов и поток обработки функций обратного вызова
+        if getattr(self, 'recorder', None) is not None:  # Если сессия записывалась
+            self.recorder.close()  # то закрываем журнал. Новый провайдер с тем же журналом откроет его на дозапись
 
     def close_connection_and_thread(self):
         """Закрытие соединения для запросов и потока обработки функций обратного вызова"""
-        self.socket_requests.close()  # Закрываем соединение для запросов
         self.callback_exit_event.set()  # Останавливаем поток обработки функций обратного вызова
+        if getattr(self, 'recorder', None) is not None:  # Если сессия записывается
+            self.recorder.flush()  # то сбрасываем журнал в файл. Запись продолжится после повторного подключения
+        for connection in (self.socket_requests, self.socket_callbacks):  # Соединения для запросов и функций обратного вызова
+            if connection is not None:  # Если соединение открывали
+                try:
+                    connection.shutdown(SHUT_RDWR)  # то прерываем его. Поток функций обратного вызова выйдет из ожидания recv
+                except OSError:  # Соединение уже разорвано
+                    pass
+                connection.close()  # Закрываем соединение
 
     # Функции конвертации
 
@@ -1080,6 +1406,45 @@ class QuikPy:
             return f'M{tf}', True
         raise NotImplementedError  # С остальными временнЫми интервалами не работаем , в т.ч. и с тиками (интервал = 0)
 
+    def get_instrument_profile(self, class_code, sec_code) -> InstrumentProfile:
+        """Профиль инструмента. Создается один раз и хранится в справочнике профилей
+
+        :param str class_code: Код режима торгов
+        :param str sec_code: Тикер
+        :return: Профиль инструмента
+        """
+        profile = self.profiles.get((class_code, sec_code))  # Ищем профиль в справочнике
+        if profile is None or not profile.found:  # Если профиля нет, или тикер не был найден
+            profile = InstrumentProfile(self, class_code, sec_code)  # то создаем профиль
+            self.profiles[(class_code, sec_code)] = profile  # и заносим его в справочник
+            on_params = self.callback_filters.get('OnParam')  # Фильтр OnParam в скрипте QUIK#
+            if profile.kind == 'futures' and on_params is not None and (class_code, sec_code) not in on_params:  # Если изменения стоимости шага цены фьючерса отфильтрованы
+                self.set_callback_filter('OnParam', on_params + [(class_code, sec_code)])  # то добавляем фьючерс в фильтр
+        return profile
+
+    def invalidate_instrument_profiles(self, line) -> None:
+        """Пометка профилей инструментов к обновлению по строке OnParam или пачке OnParam без разбора JSON
+
+        :param bytes line: Строка функции обратного вызова в кодировке Windows 1251
+        """
+        for class_code, sec_code in zip(self.param_class_codes.findall(line), self.param_sec_codes.findall(line)):  # В каждом событии пачки есть оба кода
+            self.invalidate_instrument_profile(class_code.decode(self.codec.encoding), sec_code.decode(self.codec.encoding))
+
+    def invalidate_instrument_profile(self, class_code, sec_code) -> None:
+        """Пометка профиля инструмента к обновлению при изменении текущих параметров (OnParam)
+
+        :param str class_code: Код режима торгов
+        :param str sec_code: Тикер
+        """
+        profile = self.profiles.get((class_code, sec_code))  # Ищем профиль в справочнике
+        if profile is not None:  # Если профиль есть
+            profile.stale = True  # то обновим его в refresh_instrument_profiles. Запрос в QUIK из потока обратного вызова не делаем
+
+    def refresh_instrument_profiles(self) -> None:
+        """Обновление профилей инструментов, помеченных по OnParam. Вызывается контролем соединения и брокером, не из потока обратного вызова"""
+        for profile in list(self.profiles.values()):  # Профили могут добавляться из других потоков
+            profile.check_refresh()  # Запросы в QUIK только для устаревших профилей, не чаще раза в refresh_interval
+
     def price_to_valid_price(self, class_code, sec_code, quik_price) -> Union[int, float]:
         """Перевод цены в цену, которую примет QUIK в заявке
 
@@ -1088,13 +1453,17 @@ class QuikPy:
         :param float quik_price: Цена в QUIK
         :return: Цена, которую примет QUIK в заявке
         """
-        si = self.get_symbol_info(class_code, sec_code)  # Спецификация тикера
-        min_price_step = si['min_price_step']  # Шаг цены
-        valid_price = quik_price // min_price_step * min_price_step  # Цена должна быть кратна шагу цены
-        scale = si['scale']  # Кол-во десятичных знаков
-        if scale > 0:  # Если задано кол-во десятичных знаков
-            return round(valid_price, scale)  # то округляем цену кратно шага цены, возвращаем ее
-        return int(valid_price)  # Если кол-во десятичных знаков = 0, то переводим цену в целое число
+        return self.get_instrument_profile(class_code, sec_code).valid_price(quik_price)
+
+    def prices_to_valid_prices(self, class_code, sec_code, quik_prices):
+        """Перевод массива цен в массив цен, которые примет QUIK в заявке. Например, для лестницы заявок
+
+        :param str class_code: Код режима торгов
+        :param str sec_code: Тикер
+        :param quik_prices: Цены в QUIK
+        :return: Массив цен, кратных шагу цены
+        """
+        return self.get_instrument_profile(class_code, sec_code).valid_prices(quik_prices)
 
     def price_to_quik_price(self, class_code, sec_code, price) -> Union[int, float]:
         """Перевод цены в рублях за штуку в цену QUIK
@@ -1104,20 +1473,7 @@ class QuikPy:
         :param float price: Цена в рублях за штуку
         :return: Цена в QUIK
         """
-        si = self.get_symbol_info(class_code, sec_code)  # Спецификация тикера
-        if not si:  # Если тикер не найден
-            return price  # то цена не изменяется
-        min_price_step = si['min_price_step']  # Шаг цены
-        quik_price = price  # Изначально считаем, что цена не изменится
-        if class_code in ('TQOB', 'TQCB', 'TQRD', 'TQIR'):  # Для облигаций (Т+ Гособлигации, Т+ Облигации, Т+ Облигации Д, Т+ Облигации ПИР)
-            quik_price = price * 100 / si['face_value']  # Пункты цены для котировок облигаций представляют собой проценты номинала облигации
-        elif class_code == self.futures_cls_code:  # Для рынка фьючерсов
-            lot_size = si['lot_size']  # Лот
-            step_price = float(self.get_param_ex(class_code, sec_code, 'STEPPRICE')['data']['param_value'])  # Стоимость шага цены
-            if lot_size > 1 and step_price:  # Если есть лот и стоимость шага цены
-                lot_price = price * lot_size  # Цена в рублях за лот
-                quik_price = lot_price * min_price_step / step_price  # Цена в рублях за штуку
-        return self.price_to_valid_price(class_code, sec_code, quik_price)  # Возращаем цену, которую примет QUIK в заявке
+        return self.get_instrument_profile(class_code, sec_code).price_to_quik_price(price)
 
     def quik_price_to_price(self, class_code, sec_code, quik_price) -> float:
         """Перевод цены QUIK в цену в рублях за штуку
@@ -1127,20 +1483,7 @@ class QuikPy:
         :param float quik_price: Цена в QUIK
         :return: Цена в рублях за штуку
         """
-        si = self.get_symbol_info(class_code, sec_code)  # Спецификация тикера
-        if not si:  # Если тикер не найден
-            return quik_price  # то цена не изменяется
-        if class_code in ('TQOB', 'TQCB', 'TQRD', 'TQIR'):  # Для облигаций (Т+ Гособлигации, Т+ Облигации, Т+ Облигации Д, Т+ Облигации ПИР)
-            return quik_price / 100 * si['face_value']  # Пункты цены для котировок облигаций представляют собой проценты номинала облигации
-        elif class_code == self.futures_cls_code:  # Для рынка фьючерсов
-            lot_size = si['lot_size']  # Лот
-            step_price = float(self.get_param_ex(class_code, sec_code, 'STEPPRICE')['data']['param_value'])  # Стоимость шага цены
-            if lot_size > 1 and step_price:  # Если есть лот и стоимость шага цены
-                min_price_step = si['min_price_step']  # Шаг цены
-                lot_price = quik_price // min_price_step * step_price  # Цена за лот
-                logger.info(f'{class_code = }, {sec_code = }, {step_price = }, {lot_size = }, {min_price_step = }, {lot_price = }, {quik_price = }')
-                return lot_price / lot_size  # Цена за штуку
-        return quik_price  # В остальных случаях цена не изменяется
+        return self.get_instrument_profile(class_code, sec_code).quik_price_to_price(quik_price)
 
     def lots_to_size(self, class_code, sec_code, lots) -> int:
         """Перевод лотов в штуки
@@ -1150,12 +1493,7 @@ class QuikPy:
         :param int lots: Кол-во лотов
         :return: Кол-во штук
         """
-        si = self.get_symbol_info(class_code, sec_code)  # Спецификация тикера
-        if si:  # Если тикер найден
-            lot_size = si['lot_size']  # Кол-во штук в лоте
-            if lot_size:  # Если задано кол-во штук в лоте
-                return int(lots * lot_size)  # то возвращаем кол-во в штуках
-        return lots  # В остальных случаях возвращаем кол-во в лотах
+        return self.get_instrument_profile(class_code, sec_code).lots_to_size(lots)
 
     def size_to_lots(self, class_code, sec_code, size) -> int:
         """Перевод штуки в лоты
@@ -1165,12 +1503,4 @@ class QuikPy:
         :param int size: Кол-во штук
         :return: Кол-во лотов
         """
-        si = self.get_symbol_info(class_code, sec_code)  # Спецификация тикера
-        if si:  # Если тикер найден
-            lot_size = int(si['lot_size'])  # Кол-во штук в лоте
-            if lot_size:  # Если задано кол-во штук
-                return size // lot_size  # то возвращаем кол-во в лотах
-        return size  # В остальных случаях возвращаем кол-во в штуках
-
-
-
+        return self.get_instrument_profile(class_code, sec_code).size_to_lots(size)
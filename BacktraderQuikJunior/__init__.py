@@ -2,4 +2,10 @@ from .QJStore import *
 from .QJData import *  # Также подключает данные в хранилище
 from .QJBroker import *  # Также подключает брокера в хранилище
 from .QuikJuniorPy import QuikPy
+from .QJPool import QuikPool
+from .QJGateway import QuikGateway, QuikGatewayClient
+from .QJRecorder import SessionRecorder, read_session
+from .QJReplay import QuikReplay
+from .QJInstrument import InstrumentProfile
 from .logger_config import logger
+from .QJMetrics import metrics
@@ -2,6 +2,8 @@ import logging
 from logging import handlers
 from datetime import datetime
 from pathlib import Path
+from queue import SimpleQueue  # Очередь записей для фонового потока логов
+import json  # Логи в формате JSON lines
 
 
 # ── каталог для логов рядом с logger_config.py ────────────────────────────────
@@ -35,6 +37,10 @@ def set_file_logging(enable: bool = True) -> None:
     >>> lc.set_file_logging(False)   # только терминал
     >>> lc.set_file_logging(True)    # снова в файл + терминал
     """
+    if queue_listener is not None:  # В режиме production файл пишется в фоновом потоке
+        targets = [handler for handler in queue_listener.handlers if handler is not file_handler]
+        queue_listener.handlers = tuple(targets + [file_handler] if enable else targets)
+        return
     if enable:
         if file_handler not in logger.handlers:
             logger.addHandler(file_handler)
@@ -43,3 +49,78 @@ def set_file_logging(enable: bool = True) -> None:
         if file_handler in logger.handlers:
             logger.removeHandler(file_handler)
             logger.debug("Файловый лог отключён")
+
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога одной строкой JSON. Удобно для разбора сборщиками логов"""
+    def format(self, record):
+        entry = dict(time=datetime.fromtimestamp(record.created).isoformat(timespec='microseconds'),
+                     level=record.levelname, file=record.filename, func=record.funcName, line=record.lineno,
+                     thread=record.threadName, message=record.getMessage())
+        if record.exc_info:  # Если есть исключение
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:  # Если исключение отформатировано при передаче в фоновый поток
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class LazyQueueHandler(handlers.QueueHandler):
+    """Передача записей в фоновый поток. В вызывающем потоке только подставляются аргументы сообщения,
+    время, форматирование и запись в файл/консоль выполняются в потоке QueueListener
+    """
+    def prepare(self, record):
+        record.msg = record.getMessage()  # Аргументы могут измениться до записи, поэтому подставляем их сразу
+        record.args = None
+        if record.exc_info:  # Если есть исключение
+            record.exc_text = logging.Formatter().formatException(record.exc_info)  # то форматируем его сразу
+            record.exc_info = None
+        return record
+
+
+queue_listener = None  # Фоновый поток записи логов в режиме production
+saved_state = None  # Уровень и формат файла до включения режима production
+
+
+def set_production_mode(enable: bool = True, level: str = 'INFO', json_lines: bool = False) -> None:
+    """
+    Режим production: логи пишутся в фоновом потоке и не блокируют поток функций обратного вызова и цикл Cerebro.
+    Отладочные сообщения горячих путей отбрасываются уровнем логгера до форматирования. Например:
+    >>> from BacktraderQuikJunior import logger_config as lc
+    >>> lc.set_file_logging(True)
+    >>> lc.set_production_mode(True, json_lines=True)  # INFO и выше, файл в формате JSON lines
+    >>> lc.set_production_mode(False)                  # обратно к записи в вызывающем потоке
+
+    :param bool enable: Включить/выключить режим
+    :param str level: Уровень логгера в режиме production
+    :param bool json_lines: Писать файл лога строками JSON
+    """
+    global queue_listener, saved_state
+    if enable:
+        if queue_listener is not None:  # Если режим уже включен
+            return  # то выходим, дальше не продолжаем
+        targets = list(logger.handlers)  # Обработчики переходят в фоновый поток
+        saved_state = (logger.level, file_handler.formatter)
+        if json_lines:  # Если нужны строки JSON
+            file_handler.setFormatter(JsonFormatter())  # то меняем формат файла лога
+        queue = SimpleQueue()
+        for handler in targets:
+            logger.removeHandler(handler)
+        logger.addHandler(LazyQueueHandler(queue))
+        queue_listener = handlers.QueueListener(queue, *targets, respect_handler_level=True)
+        queue_listener.start()
+        logger.setLevel(level)
+    else:
+        if queue_listener is None:  # Если режим не включен
+            return  # то выходим, дальше не продолжаем
+        level, formatter = saved_state
+        targets = queue_listener.handlers  # Текущие обработчики с учетом set_file_logging в режиме production
+        for handler in list(logger.handlers):
+            if isinstance(handler, LazyQueueHandler):
+                logger.removeHandler(handler)
+        queue_listener.stop()  # Дописываем оставшиеся записи
+        queue_listener = None
+        file_handler.setFormatter(formatter)
+        for handler in targets:
+            logger.addHandler(handler)
+        logger.setLevel(level)
@@ -66,17 +66,33 @@ local response_host = '127.0.0.1'
 local response_port = 34130
 local callback_host = '127.0.0.1'
 local callback_port = response_port + 1
+-- the longest wait for requests in ms, so that is_started is checked regularly
+local max_wait = 100
+
+--- time to wait for requests in seconds: until the nearest timer (candles closed by server time, coalesced callbacks) or max_wait
+local function request_wait(...)
+    local wait = max_wait
+    for _, due in ipairs({...}) do
+        if due and due < wait then
+            wait = due
+        end
+    end
+    return math.max(wait, 0) / 1000
+end
 
 function do_main()
     log("Entered main function", 0)
+    local boundary_due, callbacks_due
     while is_started do
         -- if not connected, connect
         util.connect(response_host, response_port, callback_host, callback_port)
-        -- when connected, process queue
-        -- receive message,
-        local requestMsg = receiveRequest()
-        if requestMsg then
-            -- if ok, process message
+        if not is_connected then
+            delay(1)
+        end
+        -- when connected, wait on the socket until requests arrive or the nearest timer is due,
+        -- then process all received requests. Callbacks to coalesce may arrive while waiting, so the wait is not longer than the window
+        local batch_due = callback_batch_ms > 0 and callback_batch_ms or nil
+        for _, requestMsg in ipairs(receiveRequests(request_wait(boundary_due, callbacks_due or batch_due))) do
             -- dispatch_and_process never throws, it returns lua errors wrapped as a message
             local responseMsg, err = qf.dispatch_and_process(requestMsg)
             if responseMsg then
@@ -85,9 +101,11 @@ function do_main()
             else
                 log("Could not dispatch and process request: " .. err, 3)
             end
-        else
-            delay(1)
         end
+        -- send candles closed by server time
+        boundary_due = check_candle_boundaries()
+        -- send coalesced OnParam/OnQuote batches
+        callbacks_due = flush_callbacks()
     end
 end
 
@@ -5,6 +5,104 @@ package.path = package.path..";"..".\\?.lua;"..".\\?.luac"
 
 local qscallbacks = {}
 
+--- Фильтры функций обратного вызова по инструментам: событие -> {["class|sec"] = true}. Если фильтра нет, то отправляются все события
+callback_filters = {}
+--- Счетчики функций обратного вызова с фильтром: событие -> {sent = отправлено, filtered = отфильтровано}
+callback_counters = {}
+
+--- Нужно ли отправлять событие по инструменту. Отфильтрованные события не переводятся в JSON
+local function callback_allowed(event, class_code, sec_code)
+    local counter = callback_counters[event]
+    if counter == nil then
+        counter = {sent = 0, filtered = 0}
+        callback_counters[event] = counter
+    end
+    local filter = callback_filters[event]
+    if filter == nil or filter[class_code .. "|" .. sec_code] then
+        counter.sent = counter.sent + 1
+        return true
+    end
+    counter.filtered = counter.filtered + 1
+    return false
+end
+
+--- Окно объединения OnParam и OnQuote в мс. 0 - события отправляются сразу по одному
+callback_batch_ms = 0
+--- Ожидающие отправки события: {first = время первого события в мс, order = {"событие|class|sec"}, items = {["событие|class|sec"] = {event, class_code, sec_code}}}
+local pending_callbacks = {first = nil, order = {}, items = {}}
+
+--- Событие ставится в очередь на отправку пачкой. Повторное событие по тому же инструменту заменяет ожидающее
+local function batch_callback(event, class_code, sec_code)
+    local key = event .. "|" .. class_code .. "|" .. sec_code
+    local pending = pending_callbacks
+    if pending.items[key] then
+        local counter = callback_counters[event]
+        counter.coalesced = (counter.coalesced or 0) + 1
+        return
+    end
+    pending.items[key] = {event = event, class_code = class_code, sec_code = sec_code}
+    pending.order[#pending.order + 1] = key
+    if pending.first == nil then
+        pending.first = timemsec()
+    end
+end
+
+--- Данные события OnQuote: стакан на момент отправки
+local function quote_data(class_code, sec_code, server_time)
+    local status, ql2 = pcall(getQuoteLevel2, class_code, sec_code)
+    if not status then
+        OnError(ql2)
+        return nil
+    end
+    ql2.class_code = class_code
+    ql2.sec_code = sec_code
+    ql2.server_time = server_time
+    return ql2
+end
+
+--- Отправка ожидающих событий, если окно объединения закончилось. Вызывается из основного цикла скрипта
+--- События одного типа отправляются одной пачкой: {cmd = "Batch", event = событие, data = {данные по инструментам}}
+--- Возвращает время до окончания окна в мс или nil, если ожидающих событий нет
+function flush_callbacks()
+    local pending = pending_callbacks
+    if pending.first == nil then
+        return nil
+    end
+    local left = pending.first + callback_batch_ms - timemsec()
+    if left > 0 then
+        return left
+    end
+    pending_callbacks = {first = nil, order = {}, items = {}}
+    if not is_connected then
+        return
+    end
+    local t = timemsec()
+    local server_time = getInfoParam("SERVERTIME")
+    local batches = {}
+    local events = {}
+    for _, key in ipairs(pending.order) do
+        local item = pending.items[key]
+        local data
+        if item.event == "OnQuote" then
+            data = quote_data(item.class_code, item.sec_code, server_time)
+        else
+            data = {class_code = item.class_code, sec_code = item.sec_code}
+        end
+        if data then
+            local batch = batches[item.event]
+            if batch == nil then
+                batch = {}
+                batches[item.event] = batch
+                events[#events + 1] = item.event
+            end
+            batch[#batch + 1] = data
+        end
+    end
+    for _, event in ipairs(events) do
+        sendCallback({cmd = "Batch", event = event, t = t, data = batches[event]})
+    end
+end
+
 local function CleanUp()
     closeLog()
 end
@@ -40,7 +138,7 @@ function OnConnected()
 end
 
 function OnAllTrade(alltrade)
-    if is_connected then
+    if is_connected and callback_allowed("OnAllTrade", alltrade.class_code, alltrade.sec_code) then
         local msg = {}
         msg.t = timemsec()
         msg.cmd = "OnAllTrade"
@@ -81,20 +179,17 @@ function OnOrder(order)
 end
 
 function OnQuote(class_code, sec_code)
-    if is_connected then
+    if is_connected and callback_allowed("OnQuote", class_code, sec_code) then
+        if callback_batch_ms > 0 then
+            batch_callback("OnQuote", class_code, sec_code)
+            return
+        end
         local msg = {}
         msg.cmd = "OnQuote"
         msg.t = timemsec()
-        local server_time = getInfoParam("SERVERTIME")
-        local status, ql2 = pcall(getQuoteLevel2, class_code, sec_code)
-        if status then
-            msg.data = ql2
-            msg.data.class_code = class_code
-            msg.data.sec_code = sec_code
-            msg.data.server_time = server_time
+        msg.data = quote_data(class_code, sec_code, getInfoParam("SERVERTIME"))
+        if msg.data then
             sendCallback(msg)
-        else
-            OnError(ql2)
         end
     end
 end
@@ -142,6 +237,13 @@ function OnStopOrder(stop_order)
 end
 
 function OnParam(class_code, sec_code)
+    if not callback_allowed("OnParam", class_code, sec_code) then
+        return
+    end
+    if callback_batch_ms > 0 then
+        batch_callback("OnParam", class_code, sec_code)
+        return
+    end
     local msg = {}
     msg.cmd = "OnParam"
     msg.t = timemsec()
@@ -961,7 +961,20 @@ function qsfunctions.get_candles_from_data_source(msg)
 	local ds, is_error = create_data_source(msg)
 	if not is_error then
 		--- датасорс изначально приходит пустой, нужно некоторое время подождать пока он заполниться данными
-		repeat sleep(1) until ds:Size() > 0
+		--- ждем не дольше wait мс (6-й параметр, по умолчанию 10 с), чтобы зависший источник не блокировал все остальные запросы
+		local wait = tonumber(split(msg.data, "|")[6]) or 10000
+		local waited = 0
+		while ds:Size() == 0 and waited < wait do
+			sleep(10)
+			waited = waited + 10
+		end
+		if ds:Size() == 0 then
+			ds:Close()
+			local class, sec, interval, param = get_candles_param(msg)
+			msg.cmd = "lua_create_data_source_error"
+			msg.lua_error = "Data source for " .. class .. ", " .. sec .. ", " .. tostring(interval) .. " is empty after " .. tostring(wait) .. " ms"
+			return msg
+		end
 
 		local count = tonumber(split(msg.data, "|")[5]) --- возвращаем последние count свечей. Если равен 0, то возвращаем все доступные свечи.
 		local class, sec, interval, param = get_candles_param(msg)
@@ -1013,9 +1026,49 @@ function fetch_candle(data_source, index)
 	return candle
 end
 
+--- Фильтр функций обратного вызова OnAllTrade, OnQuote, OnParam по инструментам. data: событие|class1|sec1|class2|sec2...
+--- Отправляются события только по перечисленным инструментам. Без инструментов событие не отправляется
+function qsfunctions.set_callback_filter(msg)
+	local spl = split(msg.data, "|")
+	local filter = {}
+	for i = 2, #spl - 1, 2 do
+		filter[spl[i] .. "|" .. spl[i + 1]] = true
+	end
+	callback_filters[spl[1]] = filter
+	msg.data = true
+	return msg
+end
+
+--- Отмена фильтра функции обратного вызова. data: событие. Отправляются события по всем инструментам
+function qsfunctions.reset_callback_filter(msg)
+	callback_filters[msg.data] = nil
+	msg.data = true
+	return msg
+end
+
+--- Счетчики отправленных, отфильтрованных и объединенных функций обратного вызова: событие -> {sent, filtered, coalesced}
+function qsfunctions.get_callback_counters(msg)
+	msg.data = callback_counters
+	return msg
+end
+
+--- Окно объединения OnParam и OnQuote в мс. data: окно. 0 - события отправляются сразу по одному
+--- Повторные события по инструменту внутри окна объединяются, события отправляются пачками Batch
+function qsfunctions.set_callback_batch(msg)
+	callback_batch_ms = tonumber(msg.data) or 0
+	msg.data = true
+	return msg
+end
+
 --- Словарь открытых подписок (datasources) на свечи
 data_sources = {}
 last_indexes = {}
+--- Подписки с закрытием свечи по времени: key -> {interval, emitted = индекс последней отправленной свечи, candle = отправленная по времени свеча}
+boundary_sources = {}
+--- Время следующей проверки закрытия свечей по времени в мс
+local next_boundary_check = 0
+--- Период проверки закрытия свечей по времени в мс
+local boundary_check_period = 100
 
 --- Подписаться на получения свечей по заданному инструмент и интервалу
 function qsfunctions.subscribe_to_candles(msg)
@@ -1025,6 +1078,11 @@ function qsfunctions.subscribe_to_candles(msg)
 		local key = get_key(class, sec, interval, param)
 		data_sources[key] = ds
 		last_indexes[key] = ds:Size()
+		local boundary = split(msg.data, "|")[5]
+		if boundary == "1" and interval > 0 and interval < 1440 then
+			-- Внутридневная свеча отправляется сразу после окончания интервала по времени сервера, не дожидаясь первой сделки следующей свечи
+			boundary_sources[key] = {interval = interval, emitted = ds:Size() - 1}
+		end
 		ds:SetUpdateCallback(
 			function(index)
 				data_source_callback(index, class, sec, interval, param)
@@ -1042,15 +1100,82 @@ function data_source_callback(index, class, sec, interval, param)
 		candle.sec = sec
 		candle.class = class
 		candle.interval = interval
+		candle.param = param
 
 		local msg = {}
         msg.t = timemsec()
         msg.cmd = "NewCandle"
+		local boundary = boundary_sources[key]
+		if boundary then
+			if boundary.emitted >= index - 1 then
+				-- Свеча уже отправлена по времени. Если после этого пришли сделки, то отправляем исправление
+				if not boundary.candle or candle_equals(boundary.candle, candle) then
+					return
+				end
+				msg.cmd = "CandleCorrection"
+			end
+			boundary.emitted = math.max(boundary.emitted, index - 1)
+			boundary.candle = nil
+			candle.closed = true
+		end
         msg.data = candle
         sendCallback(msg)
 	end
 end
 
+--- Совпадают ли цены и объем свечей
+function candle_equals(a, b)
+	return a.open == b.open and a.high == b.high and a.low == b.low and a.close == b.close and a.volume == b.volume
+end
+
+--- Отправка свечей, время которых закончилось по времени сервера. Вызывается из основного цикла скрипта
+--- Возвращает время до следующей проверки в мс или nil, если подписок с закрытием по времени нет
+function check_candle_boundaries()
+	if next(boundary_sources) == nil then
+		return nil
+	end
+	local now = timemsec()
+	if now < next_boundary_check then
+		return next_boundary_check - now
+	end
+	next_boundary_check = now + boundary_check_period
+	local server_time = getInfoParam("SERVERTIME")
+	if server_time == nil or server_time == "" then
+		return boundary_check_period -- Нет соединения с сервером
+	end
+	local h, m, sec = string.match(server_time, "(%d+):(%d+):(%d+)")
+	if not h then
+		return boundary_check_period
+	end
+	local server_seconds = tonumber(h) * 3600 + tonumber(m) * 60 + tonumber(sec)
+	for key, boundary in pairs(boundary_sources) do
+		local ds = data_sources[key]
+		local size = ds and ds:Size() or 0
+		if size > 0 and size > boundary.emitted then
+			local t = ds:T(size)
+			local open_seconds = t.hour * 3600 + t.min * 60 + t.sec
+			-- Свеча закрыта, если время сервера дошло до ее окончания, или сервер уже в следующих сутках
+			if server_seconds >= open_seconds + boundary.interval * 60 or server_seconds < open_seconds - 43200 then
+				local class, sec_code, _, param = string.match(key, "^(.-)|(.-)|(.-)|(.*)$")
+				local candle = fetch_candle(ds, size)
+				candle.sec = sec_code
+				candle.class = class
+				candle.interval = boundary.interval
+				candle.param = param
+				candle.closed = true
+				boundary.emitted = size
+				boundary.candle = candle
+				local msg = {}
+				msg.t = timemsec()
+				msg.cmd = "NewCandle"
+				msg.data = candle
+				sendCallback(msg)
+			end
+		end
+	end
+	return boundary_check_period
+end
+
 --- Отписать от получения свечей по заданному инструменту и интервалу
 function qsfunctions.unsubscribe_from_candles(msg)
 	local class, sec, interval, param = get_candles_param(msg)
@@ -1058,6 +1183,7 @@ function qsfunctions.unsubscribe_from_candles(msg)
 	data_sources[key]:Close()
 	data_sources[key] = nil
 	last_indexes[key] = nil
+	boundary_sources[key] = nil
 	return msg
 end
 
@@ -275,6 +275,30 @@ function receiveRequest()
     end
 end
 
+--- wait up to timeout seconds for requests and return all of them that are already received as decoded tables
+--- socket.select wakes up as soon as a request arrives, and also reports a socket with buffered lines,
+--- so requests sent together are processed in one wake-up without waiting again
+function receiveRequests(timeout)
+    local requests = {}
+    if not is_connected then
+        return requests
+    end
+    local wait = timeout
+    while true do
+        local status, readable = pcall(socket.select, {response_client}, nil, wait)
+        if not status or not readable or #readable == 0 then
+            return requests
+        end
+        local msg_table, err = receiveRequest()
+        if msg_table then
+            requests[#requests + 1] = msg_table
+        elseif not is_connected then
+            return requests
+        end
+        wait = 0
+    end
+end
+
 function sendResponse(msg_table)
     -- if not set explicitly then set CreatedTime "t" property here
     -- if not msg_table.t then msg_table.t = timemsec() end
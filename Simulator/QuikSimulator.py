@@ -0,0 +1,772 @@
+"""Имитатор QUIK# для тестов и замеров без терминала QUIK
+
+Реализует протокол LUA скриптов QUIK# (lua/qsutils.lua): два TCP соединения (запросы/ответы и функции обратного вызова),
+сообщения JSON в кодировке Windows 1251, по одному в строке. Имитатор принимает то же подключение, что и QuikPy:
+
+    from Simulator.QuikSimulator import QuikSimulator
+
+    with QuikSimulator(candle_rate=10, trade_rate=1000) as simulator:  # Запускаем имитатор на портах 34130/34131
+        ...  # Работаем с QuikPy / QKStore как с терминалом QUIK
+
+Запуск из командной строки: python -m Simulator.QuikSimulator --candle-rate 10 --trade-rate 1000
+"""
+from socket import socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR, IPPROTO_TCP, TCP_NODELAY, SHUT_RDWR  # Имитируем сервер QUIK#
+from select import select  # Проверка наличия запросов в режиме опроса
+from threading import Thread, Event, Lock  # Потоки приема запросов, отправки функций обратного вызова и генерации событий
+from queue import Queue, Empty  # Очередь функций обратного вызова
+from json import dumps, loads  # Сообщения QUIK# в формате JSON
+from json.decoder import JSONDecodeError  # Ошибка декодирования JSON
+from datetime import datetime, timedelta, timezone  # Дата и время свечей, сделок и сервера
+from time import perf_counter, sleep, time  # Генерация событий с заданной частотой
+from random import Random  # Воспроизводимое случайное блуждание цен
+from collections import deque  # Последние обезличенные сделки
+import argparse  # Запуск из командной строки
+import logging  # Будем вести лог
+
+logger = logging.getLogger('QuikSimulator')  # Лог имитатора отделен от лога библиотеки
+tz_msk = timezone(timedelta(hours=3), 'MSK')  # QUIK работает по московскому времени
+
+
+def msk_now() -> datetime:
+    """Текущие дата и время МСК без часового пояса, как в QUIK"""
+    return datetime.now(tz_msk).replace(tzinfo=None)
+
+
+class SimInstrument:
+    """Инструмент имитатора: спецификация и случайное блуждание цены по сетке шага цены"""
+
+    def __init__(self, class_code, sec_code, price, min_price_step, scale, lot_size=1, face_value=0.0, step_price=None, seed=None):
+        """Инициализация
+
+        :param str class_code: Код режима торгов
+        :param str sec_code: Тикер
+        :param float price: Начальная цена QUIK
+        :param float min_price_step: Шаг цены
+        :param int scale: Кол-во десятичных знаков
+        :param int lot_size: Кол-во штук в лоте
+        :param float face_value: Номинал облигации
+        :param float step_price: Стоимость шага цены фьючерса
+        :param int seed: Начальное значение генератора случайных чисел
+        """
+        self.class_code = class_code  # Код режима торгов
+        self.sec_code = sec_code  # Тикер
+        self.min_price_step = min_price_step  # Шаг цены
+        self.scale = scale  # Кол-во десятичных знаков
+        self.lot_size = lot_size  # Кол-во штук в лоте
+        self.face_value = face_value  # Номинал облигации
+        self.step_price = step_price if step_price is not None else min_price_step  # Стоимость шага цены
+        self.ticks = round(price / min_price_step)  # Текущая цена в шагах цены
+        self.random = Random(seed if seed is not None else hash((class_code, sec_code)) & 0xFFFF)  # Свой генератор у каждого инструмента
+
+    @property
+    def price(self) -> float:
+        """Текущая цена QUIK"""
+        return round(self.ticks * self.min_price_step, self.scale)
+
+    def step(self, max_ticks=3) -> float:
+        """Случайный шаг цены
+
+        :param int max_ticks: Максимальное изменение цены в шагах цены
+        :return: Новая цена QUIK
+        """
+        self.ticks = max(1, self.ticks + self.random.randint(-max_ticks, max_ticks))  # Цена не может стать меньше шага цены
+        return self.price
+
+    def candle(self, dt, interval) -> dict:
+        """Новая свеча QUIK#
+
+        :param datetime dt: Дата и время открытия свечи
+        :param int interval: Временной интервал QUIK в минутах
+        :return: Свеча в формате QUIK#
+        """
+        open_price = self.price  # Цена открытия
+        prices = [self.step() for _ in range(4)]  # Цены внутри свечи
+        return dict(open=open_price, high=max(open_price, *prices), low=min(open_price, *prices), close=prices[-1],
+                    volume=self.random.randint(1, 1000), datetime=datetime_to_quik(dt),
+                    sec=self.sec_code, **{'class': self.class_code}, interval=interval)
+
+    def info(self) -> dict:
+        """Спецификация тикера в формате getSecurityInfo"""
+        return dict(class_code=self.class_code, sec_code=self.sec_code, code=self.sec_code, name=self.sec_code, short_name=self.sec_code,
+                    lot_size=self.lot_size, min_price_step=self.min_price_step, scale=self.scale,
+                    face_value=self.face_value, face_unit='SUR', isin_code='', mat_date=0, class_name=self.class_code)
+
+
+def datetime_to_quik(dt) -> dict:
+    """Дата и время в формате QUIK
+
+    :param datetime dt: Дата и время
+    :return: Составное значение даты и времени QUIK
+    """
+    return dict(year=dt.year, month=dt.month, day=dt.day, hour=dt.hour, min=dt.minute, sec=dt.second,
+                ms=dt.microsecond // 1000, mcs=dt.microsecond, week_day=dt.isoweekday() % 7)
+
+
+class QuikSimulator:
+    """Имитатор сервера QUIK# на портах запросов и функций обратного вызова"""
+    futures_cls_code = 'SPBFUT'  # Код режима торгов фьючерсов
+    stock_firm_id = 'MC0000000000'  # Фирма фондового рынка
+    futures_firm_id = 'SPBFUT000000'  # Фирма срочного рынка
+    client_code = '10000'  # Код клиента
+    stock_account = 'L01-00000F00'  # Торговый счет фондового рынка
+    futures_account = 'SPBFUT00001'  # Торговый счет срочного рынка
+    buffer_size = 65536  # Размер буфера приема запросов
+
+    def __init__(self, host='127.0.0.1', requests_port=34130, callbacks_port=34131,
+                 instruments=None, history_bars=500, candle_rate=0.0, trade_rate=0.0, quote_rate=0.0, param_rate=0.0,
+                 reply_delay=0.0, cash=1_000_000.0, seed=1, request_loop='select'):
+        """Инициализация
+
+        :param str host: IP адрес или название хоста
+        :param int requests_port: Порт для запросов и ответов
+        :param int callbacks_port: Порт для функций обратного вызова
+        :param list[SimInstrument] instruments: Инструменты. По умолчанию акция, облигация и фьючерс
+        :param int history_bars: Кол-во свечей истории на каждый временной интервал
+        :param float candle_rate: Кол-во новых свечей NewCandle в секунду на каждую подписку. 0 - новых свечей нет
+        :param float trade_rate: Кол-во обезличенных сделок OnAllTrade в секунду на каждый инструмент. 0 - сделок нет
+        :param float quote_rate: Кол-во изменений стакана OnQuote в секунду на каждую подписку. 0 - изменений нет
+        :param float param_rate: Кол-во изменений текущих параметров OnParam в секунду на каждый инструмент. 0 - изменений нет
+        :param float reply_delay: Задержка в секундах ответа на транзакцию и сделки
+        :param float cash: Свободные средства на каждом счете
+        :param int seed: Начальное значение генератора случайных чисел
+        :param str request_loop: Цикл приема запросов, как в QuikSharp.lua: select - ожидание на соединении, poll - опрос с паузой 1 мс (delay(1) прежних версий)
+        """
+        self.host = host  # IP адрес или название хоста
+        self.requests_port = requests_port  # Порт для запросов и ответов
+        self.callbacks_port = callbacks_port  # Порт для функций обратного вызова
+        if instruments is None:  # Если инструменты не заданы
+            instruments = [SimInstrument('TQBR', 'SBER', 300.0, 0.01, 2, lot_size=10, seed=seed),
+                           SimInstrument('TQOB', 'SU26238RMFS4', 60.0, 0.001, 3, face_value=1000.0, seed=seed + 1),
+                           SimInstrument(self.futures_cls_code, 'SiZ6', 90_000.0, 1.0, 0, step_price=1.0, seed=seed + 2)]
+        self.instruments = {(instrument.class_code, instrument.sec_code): instrument for instrument in instruments}  # Инструменты по кодам
+        self.history_bars = history_bars  # Кол-во свечей истории
+        self.candle_rate = candle_rate  # Частота новых свечей
+        self.trade_rate = trade_rate  # Частота обезличенных сделок
+        self.quote_rate = quote_rate  # Частота изменений стакана
+        self.param_rate = param_rate  # Частота изменений текущих параметров
+        self.reply_delay = reply_delay  # Задержка ответа на транзакцию
+        self.request_loop = request_loop  # Цикл приема запросов. Можно менять на ходу
+        self.cash = cash  # Свободные средства на каждом счете
+        self.clock = msk_now().replace(second=0, microsecond=0)  # Время сервера. Сдвигается вперед новыми свечами
+        self.candle_subscriptions = {}  # Подписки на свечи. (class_code, sec_code, interval, param) → дата и время открытия следующей свечи
+        self.boundary_subscriptions = set()  # Подписки на свечи с закрытием по времени. (class_code, sec_code, interval, param)
+        self.quote_subscriptions = set()  # Подписки на стакан. (class_code, sec_code)
+        self.param_subscriptions = set()  # Подписки на текущие параметры. (class_code, sec_code, param_name)
+        self.callback_filters = {}  # Фильтры функций обратного вызова, как в qscallbacks.lua. Событие → {(class_code, sec_code)}
+        self.callback_counters = {}  # Счетчики функций обратного вызова с фильтром. Событие → {'sent': , 'filtered': , 'coalesced': }
+        self.callback_batch_ms = 0  # Окно объединения OnParam и OnQuote в мс, как в qscallbacks.lua. 0 - без объединения
+        self.pending_callbacks = {}  # Ожидающие отправки события. (событие, class_code, sec_code) → данные. Порядок добавления сохраняется
+        self.pending_since = None  # Время первого ожидающего события
+        self.all_trades = deque(maxlen=100_000)  # Последние обезличенные сделки
+        self.orders = {}  # Активные заявки. Номер заявки → транзакция
+        self.stop_orders = {}  # Активные стоп заявки. Номер стоп заявки → транзакция
+        self.canceled_orders = set()  # Номера снятых заявок
+        self.trades = {}  # Сделки по заявкам. Номер заявки → список сделок
+        self.order_num = 1_000_000  # Последний номер заявки
+        self.trade_num = 1_000_000  # Последний номер сделки
+        self.state_lock = Lock()  # Состояние меняют поток запросов и поток генерации событий
+        self.callbacks = Queue()  # Очередь закодированных функций обратного вызова
+        self.exit_event = Event()  # Событие остановки имитатора
+        self.connected = Event()  # Клиент подключен к обоим портам
+        self.request_server = self.callback_server = None  # Серверные соединения
+        self.request_client = self.callback_client = None  # Клиентские соединения
+        self.threads = []  # Потоки имитатора
+        self.requests = 0  # Кол-во обработанных запросов
+        self.callbacks_sent = 0  # Кол-во отправленных функций обратного вызова
+        self.handlers = {  # Обработчики запросов. Имена совпадают с функциями qsfunctions.lua
+            'ping': lambda msg: 'Pong' if msg['data'] == 'Ping' else msg['data'],
+            'echo': lambda msg: msg['data'],
+            'is_quik': lambda msg: 1,
+            'isConnected': lambda msg: 1,
+            'getInfoParam': self.get_info_param,
+            'message': lambda msg: 1,
+            'warning_message': lambda msg: 1,
+            'error_message': lambda msg: 1,
+            'sleep': lambda msg: sleep(int(msg['data']) / 1000) or 1,  # Как и в QUIK, скрипт приостанавливается, остальные запросы ждут
+            'getTradeAccounts': self.get_trade_accounts,
+            'getMoneyLimits': self.get_money_limits,
+            'getFuturesLimit': self.get_futures_limit,
+            'getFuturesClientHoldings': lambda msg: [],
+            'get_depo_limits': lambda msg: [],
+            'getClassesList': lambda msg: ','.join(sorted({class_code for class_code, _ in self.instruments})) + ',',
+            'getClassInfo': lambda msg: dict(code=msg['data'], name=msg['data'], nsecs=len(self.class_securities(msg['data']))),
+            'getClassSecurities': lambda msg: ','.join(self.class_securities(msg['data'])) + ',',
+            'getSecurityInfo': self.get_security_info,
+            'getSecurityClass': self.get_security_class,
+            'getParamEx': self.get_param_ex,
+            'getParamEx2': self.get_param_ex,
+            'paramRequest': self.param_request,
+            'cancelParamRequest': self.cancel_param_request,
+            'GetQuoteLevel2': self.get_quote_level2,
+            'Subscribe_Level_II_Quotes': self.subscribe_level2_quotes,
+            'Unsubscribe_Level_II_Quotes': self.unsubscribe_level2_quotes,
+            'IsSubscribed_Level_II_Quotes': lambda msg: tuple(msg['data'].split('|')[:2]) in self.quote_subscriptions,
+            'get_candles_from_data_source': self.get_candles_from_data_source,
+            'subscribe_to_candles': self.subscribe_to_candles,
+            'unsubscribe_from_candles': self.unsubscribe_from_candles,
+            'is_subscribed': lambda msg: self.candle_key(msg) in self.candle_subscriptions,
+            'get_all_trades': self.get_all_trades,
+            'getOrder_by_Number': self.get_order_by_number,
+            'get_Trades_by_OrderNumber': lambda msg: self.trades.get(int(msg['data']), []),
+            'sendTransaction': self.send_transaction,
+            'set_callback_filter': self.set_callback_filter,
+            'reset_callback_filter': self.reset_callback_filter,
+            'set_callback_batch': self.set_callback_batch,
+            'get_callback_counters': lambda msg: self.callback_counters or [],  # Пустую таблицу dkjson кодирует как массив
+        }
+
+    def __enter__(self):
+        """Вход в класс, например, с with. Запуск имитатора"""
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Выход из класса, например, с with. Остановка имитатора"""
+        self.stop()
+
+    # Сервер
+
+    def start(self) -> None:
+        """Запуск имитатора"""
+        self.request_server = self.listen(self.requests_port)  # Открываем порт запросов
+        self.callback_server = self.listen(self.callbacks_port)  # Открываем порт функций обратного вызова
+        for target, name in ((self.serve, 'SimRequestThread'), (self.send_callbacks, 'SimCallbackThread'), (self.generate_events, 'SimEventsThread')):
+            thread = Thread(target=target, name=name, daemon=True)  # Создаем поток имитатора
+            thread.start()  # и запускаем его
+            self.threads.append(thread)
+        logger.info(f'Имитатор QUIK# запущен на {self.host}:{self.requests_port}/{self.callbacks_port}')
+
+    def listen(self, port) -> socket:
+        """Серверное соединение на порту
+
+        :param int port: Порт
+        :return: Серверное соединение
+        """
+        server = socket(AF_INET, SOCK_STREAM)  # Создаем соединение
+        server.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)  # Порт можно занять сразу после остановки предыдущего имитатора
+        server.bind((self.host, port))  # Привязываем соединение к порту
+        server.listen(1)  # Как и QUIK#, обслуживаем одного клиента
+        server.settimeout(0.1)  # Чтобы поток мог проверять событие остановки
+        return server
+
+    def accept(self, server) -> socket:
+        """Ожидание подключения клиента
+
+        :param socket server: Серверное соединение
+        :return: Клиентское соединение или None, если имитатор остановлен
+        """
+        while not self.exit_event.is_set():  # Пока имитатор работает
+            try:
+                client, _ = server.accept()  # Ждем подключения клиента
+            except TimeoutError:  # Если клиент еще не подключился
+                continue  # то ждем дальше
+            except OSError:  # Если серверное соединение закрыто
+                return None
+            client.settimeout(None)  # Клиентское соединение блокирующее
+            client.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)  # Ответы отправляем без задержки
+            return client
+        return None
+
+    def serve(self) -> None:
+        """Поток приема запросов. Как и QUIK#, сначала подключается клиент запросов, затем клиент функций обратного вызова"""
+        while not self.exit_event.is_set():  # Пока имитатор работает
+            self.request_client = self.accept(self.request_server)  # Ждем клиента запросов
+            self.callback_client = self.accept(self.callback_server)  # Ждем клиента функций обратного вызова
+            if self.request_client is None or self.callback_client is None:  # Если имитатор остановлен
+                return  # то выходим, дальше не продолжаем
+            self.connected.set()  # Клиент подключен
+            logger.info('Клиент QUIK# подключен')
+            tail = b''  # Неполная последняя строка. Запросы приходят строками с переводом строки
+            try:
+                while not self.exit_event.is_set():  # Пока клиент присылает запросы
+                    if self.request_loop == 'poll' and not select([self.request_client], [], [], 0)[0]:  # Если запросов нет
+                        sleep(0.001)  # то, как delay(1), ждем 1 мс и проверяем снова
+                        continue
+                    fragment = self.request_client.recv(self.buffer_size)  # Ждем запросы на соединении, как socket.select в QuikSharp.lua
+                    if not fragment:  # Если клиент закрыл соединение
+                        break
+                    *lines, tail = (tail + fragment).split(b'\n')  # Все пришедшие запросы обрабатываем за одно пробуждение
+                    for line in lines:
+                        if line.strip():  # Пустые строки пропускаем
+                            self.request_client.sendall(self.process(line))  # Отправляем ответ на запрос
+            except (OSError, ValueError):  # Если клиент или имитатор закрыл соединение
+                pass
+            self.connected.clear()  # Клиент отключен
+            logger.info('Клиент QUIK# отключен')
+            for client in (self.request_client, self.callback_client):  # Закрываем клиентские соединения
+                try:
+                    client.close()
+                except OSError:
+                    pass
+
+    def process(self, line) -> bytes:
+        """Обработка запроса. Повторяет qsfunctions.dispatch_and_process
+
+        :param bytes line: Запрос в кодировке Windows 1251
+        :return: Ответ в кодировке Windows 1251 с переводом строки
+        """
+        self.requests += 1  # Кол-во обработанных запросов
+        try:
+            msg = loads(line.decode('cp1251'))  # Разбираем запрос
+        except (JSONDecodeError, UnicodeDecodeError) as e:  # Если запрос разобрать не смогли
+            logger.error(f'Ошибка разбора запроса {line!r}: {e}')
+            return b''  # то, как и QUIK#, ничего не отвечаем
+        handler = self.handlers.get(msg.get('cmd'))  # Обработчик запроса
+        if handler is None:  # Если запрос не поддерживается
+            msg['lua_error'] = f'Command not implemented in Lua qsfunctions module: {msg.get("cmd")}'
+            msg['cmd'] = 'lua_error'
+        else:
+            try:
+                result = handler(msg)  # Выполняем запрос
+                if result is not msg:  # Обработчик может сам изменить сообщение (ошибки транзакций и свечей)
+                    msg['data'] = result  # Результат запроса
+            except Exception as e:  # Ошибку выполнения возвращаем так же, как QUIK#
+                msg['lua_error'] = f'Lua error: {e}'
+                msg['cmd'] = 'lua_error'
+        return self.encode(msg)
+
+    @staticmethod
+    def encode(msg) -> bytes:
+        """Сообщение QUIK# в кодировке Windows 1251 с переводом строки"""
+        return (dumps(msg, ensure_ascii=False, separators=(',', ':')) + '\n').encode('cp1251')
+
+    def send_callback(self, cmd, data) -> None:
+        """Постановка функции обратного вызова в очередь на отправку
+
+        :param str cmd: Название функции обратного вызова
+        :param data: Данные функции обратного вызова
+        """
+        if self.connected.is_set() and self.callback_allowed(cmd, data):  # Как и QUIK#, функции обратного вызова отправляем только подключенному клиенту
+            if self.callback_batch_ms and cmd in ('OnQuote', 'OnParam'):  # Если изменения объединяются
+                self.batch_callback(cmd, data)  # то ставим их в очередь
+                return
+            self.callbacks.put(self.encode({'cmd': cmd, 't': int(time() * 1000), 'data': data}))
+
+    def batch_callback(self, cmd, data) -> None:
+        """Постановка изменения в очередь на отправку пачкой. Повторное изменение по тикеру заменяет ожидающее, как batch_callback в qscallbacks.lua"""
+        key = (cmd, data['class_code'], data['sec_code'])  # Событие и тикер
+        if key in self.pending_callbacks:  # Если изменение уже ждет отправки
+            counter = self.callback_counters[cmd]
+            counter['coalesced'] = counter.get('coalesced', 0) + 1
+        elif self.pending_since is None:  # Если это первое ожидающее изменение
+            self.pending_since = perf_counter()  # то запоминаем время начала окна
+        self.pending_callbacks[key] = data  # Порядок тикеров сохраняется, данные берем последние
+
+    def flush_callbacks(self) -> None:
+        """Отправка ожидающих изменений пачками Batch по событиям, если окно объединения закончилось, как flush_callbacks в qscallbacks.lua"""
+        if self.pending_since is None or (perf_counter() - self.pending_since) * 1000 < self.callback_batch_ms:
+            return
+        pending, self.pending_callbacks, self.pending_since = self.pending_callbacks, {}, None
+        batches = {}  # Событие → [данные по тикерам]
+        for (cmd, _, _), data in pending.items():
+            batches.setdefault(cmd, []).append(data)
+        for cmd, batch in batches.items():
+            self.callbacks.put(self.encode({'cmd': 'Batch', 'event': cmd, 't': int(time() * 1000), 'data': batch}))
+
+    def burst(self, cmd, data, count, **fields) -> None:
+        """Пачка одинаковых функций обратного вызова для замера скорости разбора на стороне клиента
+
+        :param str cmd: Название функции обратного вызова
+        :param data: Данные функции обратного вызова
+        :param int count: Кол-во сообщений
+        :param fields: Дополнительные поля сообщения. Например, event для пачки Batch
+        """
+        message = self.encode({'cmd': cmd, 't': int(time() * 1000), 'data': data, **fields})  # Кодируем сообщение один раз
+        for _ in range(count):
+            if self.callback_allowed(cmd, data):
+                self.callbacks.put(message)
+
+    def callback_allowed(self, cmd, data) -> bool:
+        """Нужно ли отправлять функцию обратного вызова с учетом фильтра по инструментам, как callback_allowed в qscallbacks.lua"""
+        if cmd not in ('OnAllTrade', 'OnQuote', 'OnParam'):  # Фильтруются только события по инструментам
+            return True
+        counter = self.callback_counters.setdefault(cmd, {'sent': 0, 'filtered': 0})
+        instruments = self.callback_filters.get(cmd)  # Фильтр события
+        if instruments is None or (data.get('class_code'), data.get('sec_code')) in instruments:  # Если фильтра нет, или инструмент в фильтре
+            counter['sent'] += 1
+            return True
+        counter['filtered'] += 1
+        return False
+
+    def send_callbacks(self) -> None:
+        """Поток отправки функций обратного вызова. Накопившиеся сообщения отправляются одним пакетом"""
+        while not self.exit_event.is_set():  # Пока имитатор работает
+            try:
+                batch = [self.callbacks.get(timeout=0.1)]  # Ждем первое сообщение
+            except Empty:  # Если сообщений нет
+                continue  # то ждем дальше
+            while len(batch) < 1000:  # Добираем накопившиеся сообщения
+                try:
+                    batch.append(self.callbacks.get_nowait())
+                except Empty:
+                    break
+            try:
+                self.callback_client.sendall(b''.join(batch))  # Отправляем пакет
+                self.callbacks_sent += len(batch)  # Кол-во отправленных функций обратного вызова
+            except (OSError, AttributeError):  # Если клиент отключился
+                pass  # то сообщения теряются, как и в QUIK#
+
+    def stop(self) -> None:
+        """Остановка имитатора"""
+        self.exit_event.set()  # Останавливаем потоки
+        for connection in (self.request_client, self.callback_client, self.request_server, self.callback_server):  # Закрываем все соединения
+            if connection is not None:
+                try:
+                    connection.close()
+                except OSError:
+                    pass
+        for thread in self.threads:  # Дожидаемся завершения потоков
+            thread.join(timeout=1)
+        self.threads = []
+        logger.info('Имитатор QUIK# остановлен')
+
+    def disconnect(self) -> None:
+        """Разрыв соединения с клиентом, как при перезапуске скрипта QUIK#. Имитатор ждет нового подключения"""
+        for client in (self.request_client, self.callback_client):
+            if client is not None:
+                try:
+                    client.shutdown(SHUT_RDWR)  # Клиент получит пустой ответ / конец потока
+                except OSError:
+                    pass
+
+    # Генерация событий
+
+    def generate_events(self) -> None:
+        """Поток генерации событий с заданной частотой: NewCandle, OnAllTrade, OnQuote, OnParam"""
+        start = perf_counter()  # Время начала генерации
+        sent = dict(candle=0, trade=0, quote=0, param=0)  # Кол-во сгенерированных пачек событий по видам
+        rates = dict(candle=self.candle_rate, trade=self.trade_rate, quote=self.quote_rate, param=self.param_rate)  # Частоты событий
+        generators = dict(candle=self.emit_candles, trade=self.emit_trades, quote=self.emit_quotes, param=self.emit_params)  # Генераторы событий
+        while not self.exit_event.wait(0.001):  # Раз в миллисекунду, пока имитатор работает
+            if not self.connected.is_set():  # Если клиент не подключен
+                continue  # то события не генерируем
+            elapsed = perf_counter() - start  # Прошло времени с начала генерации
+            for kind, rate in rates.items():  # Пробегаемся по всем видам событий
+                if rate <= 0:  # Если события этого вида не нужны
+                    continue
+                due = int(elapsed * rate) - sent[kind]  # Кол-во событий, которые должны были произойти к этому времени
+                if due > 0:  # Если есть события к отправке
+                    with self.state_lock:
+                        generators[kind](due)  # то генерируем их
+                    sent[kind] += due
+            with self.state_lock:
+                self.flush_callbacks()  # Отправляем объединенные изменения
+
+    def emit_candles(self, count) -> None:
+        """Новые свечи по всем подпискам. Время сервера сдвигается на интервал свечи"""
+        for _ in range(count):
+            for key, dt_open in list(self.candle_subscriptions.items()):  # Пробегаемся по всем подпискам
+                class_code, sec_code, interval, param = key
+                instrument = self.instruments.get((class_code, sec_code))
+                if instrument is None:
+                    continue
+                candle = dict(instrument.candle(dt_open, interval), param=param)  # Свеча закрыта
+                if key in self.boundary_subscriptions:  # Если подписка с закрытием по времени
+                    candle['closed'] = True  # то отмечаем, как это делает check_candle_boundaries
+                self.send_callback('NewCandle', candle)  # Отправляем свечу
+                self.candle_subscriptions[key] = dt_open + timedelta(minutes=interval)  # Следующая свеча
+                self.clock = max(self.clock, self.candle_subscriptions[key])  # Время сервера - время закрытия свечи
+                self.match_orders(instrument)  # Цена изменилась. Проверяем заявки
+
+    def emit_trades(self, count) -> None:
+        """Обезличенные сделки по всем инструментам"""
+        now = msk_now()  # Время сделок
+        for instrument in self.instruments.values():  # Пробегаемся по всем инструментам
+            for _ in range(count):
+                self.trade_num += 1  # Номер сделки
+                trade = dict(trade_num=self.trade_num, flags=instrument.random.choice((1, 2)), price=instrument.step(1),
+                             qty=instrument.random.randint(1, 10), value=0.0, datetime=datetime_to_quik(now),
+                             class_code=instrument.class_code, sec_code=instrument.sec_code, open_interest=0.0)
+                self.all_trades.append(trade)  # Запоминаем сделку для get_all_trades
+                self.send_callback('OnAllTrade', trade)
+            self.match_orders(instrument)  # Цена изменилась. Проверяем заявки
+
+    def emit_quotes(self, count) -> None:
+        """Изменения стаканов по всем подпискам"""
+        for _ in range(count):
+            for class_code, sec_code in list(self.quote_subscriptions):  # Пробегаемся по всем подпискам
+                quote = self.quote_level2(class_code, sec_code)  # Снимок стакана
+                quote.update(class_code=class_code, sec_code=sec_code, server_time=self.clock.strftime('%H:%M:%S'))
+                self.send_callback('OnQuote', quote)
+
+    def emit_params(self, count) -> None:
+        """Изменения текущих параметров по всем инструментам"""
+        for _ in range(count):
+            for instrument in self.instruments.values():  # Пробегаемся по всем инструментам
+                self.send_callback('OnParam', dict(class_code=instrument.class_code, sec_code=instrument.sec_code))
+
+    # Торговля
+
+    def send_transaction(self, msg):
+        """Транзакция. Ответ на транзакцию и сделки приходят функциями обратного вызова"""
+        transaction = msg['data']  # Транзакция. Все значения строками
+        action = transaction.get('ACTION', '')  # Действие
+        key = (transaction.get('CLASSCODE'), transaction.get('SECCODE'))  # Инструмент
+        if key not in self.instruments or 'TRANS_ID' not in transaction:  # Если транзакцию нельзя отправить
+            msg['cmd'] = 'lua_transaction_error'  # то ошибка, как в qsfunctions.sendTransaction
+            msg['lua_error'] = f'Неверные параметры транзакции {action} {key[0]}.{key[1]}'
+            return msg
+        with self.state_lock:
+            if action in ('NEW_ORDER', 'NEW_STOP_ORDER'):  # Новая заявка / стоп заявка
+                self.order_num += 1  # Номер заявки
+                order_num = self.order_num
+                (self.orders if action == 'NEW_ORDER' else self.stop_orders)[order_num] = transaction  # Заявка активна
+                self.trans_reply(transaction, order_num, 3, f'Заявка N{order_num} успешно зарегистрирована.')
+                self.match_orders(self.instruments[key])  # Рыночные и пересекающие рынок заявки исполняем сразу
+            elif action in ('KILL_ORDER', 'KILL_STOP_ORDER'):  # Снятие заявки / стоп заявки
+                orders = self.orders if action == 'KILL_ORDER' else self.stop_orders
+                order_num = int(transaction.get('ORDER_KEY', transaction.get('STOP_ORDER_KEY', 0)))  # Номер снимаемой заявки
+                if orders.pop(order_num, None) is None:  # Если заявки нет
+                    self.trans_reply(transaction, order_num, 4, f'Не найдена заявка для удаления {order_num}.')
+                else:
+                    self.canceled_orders.add(order_num)
+                    self.trans_reply(transaction, order_num, 3, f'Заявка N{order_num} успешно снята.')
+            else:  # Остальные транзакции принимаем без действий
+                self.trans_reply(transaction, 0, 3, 'Транзакция выполнена.')
+        return True
+
+    def trans_reply(self, transaction, order_num, status, result_msg) -> None:
+        """Ответ на транзакцию OnTransReply"""
+        reply = dict(trans_id=int(transaction['TRANS_ID']), order_num=order_num, status=status, result_msg=result_msg,
+                     class_code=transaction['CLASSCODE'], sec_code=transaction['SECCODE'], flags=0,
+                     quantity=float(transaction.get('QUANTITY', 0)), price=float(transaction.get('PRICE', 0) or 0),
+                     account=transaction.get('ACCOUNT', ''), client_code=transaction.get('CLIENT_CODE', ''))
+        self.delayed_callback('OnTransReply', reply)
+
+    def delayed_callback(self, cmd, data) -> None:
+        """Функция обратного вызова с задержкой ответа на транзакцию"""
+        if self.reply_delay > 0:  # Если задана задержка
+            Thread(target=lambda: (sleep(self.reply_delay), self.send_callback(cmd, data)), daemon=True).start()
+        else:
+            self.send_callback(cmd, data)
+
+    def match_orders(self, instrument) -> None:
+        """Исполнение заявок по текущей цене инструмента"""
+        last = instrument.price  # Последняя цена
+        key = (instrument.class_code, instrument.sec_code)  # Инструмент
+        for order_num, transaction in list(self.stop_orders.items()):  # Стоп заявки
+            if (transaction['CLASSCODE'], transaction['SECCODE']) != key:
+                continue
+            stop_price = float(transaction['STOPPRICE'])  # Стоп цена
+            if transaction['OPERATION'] == 'B' and last >= stop_price or transaction['OPERATION'] == 'S' and last <= stop_price:  # Если стоп цена достигнута
+                del self.stop_orders[order_num]
+                self.fill(order_num, transaction, stop_price)  # то исполняем по стоп цене
+        for order_num, transaction in list(self.orders.items()):  # Заявки
+            if (transaction['CLASSCODE'], transaction['SECCODE']) != key:
+                continue
+            price = float(transaction.get('PRICE', 0) or 0)  # Цена заявки
+            if transaction.get('TYPE') == 'M' or price == 0:  # Рыночная заявка
+                self.fill(order_num, transaction, last)  # исполняется по последней цене
+            elif transaction['OPERATION'] == 'B' and last <= price or transaction['OPERATION'] == 'S' and last >= price:  # Лимитная заявка пересекает рынок
+                self.fill(order_num, transaction, price)  # исполняется по цене заявки
+            else:
+                continue
+            del self.orders[order_num]
+
+    def fill(self, order_num, transaction, price) -> None:
+        """Сделка OnTrade на все кол-во заявки"""
+        self.trade_num += 1  # Номер сделки
+        trade = dict(trade_num=self.trade_num, order_num=order_num, trans_id=int(transaction['TRANS_ID']),
+                     class_code=transaction['CLASSCODE'], sec_code=transaction['SECCODE'], price=price,
+                     qty=int(transaction.get('QUANTITY', 0)), flags=0b100 if transaction['OPERATION'] == 'S' else 0,  # Бит 2 - продажа
+                     account=transaction.get('ACCOUNT', ''), client_code=transaction.get('CLIENT_CODE', ''),
+                     datetime=datetime_to_quik(msk_now()))
+        self.trades.setdefault(order_num, []).append(trade)  # Для запроса сделок по заявке
+        self.delayed_callback('OnTrade', trade)
+
+    def get_order_by_number(self, msg):
+        """Заявка по номеру. Для стоп заявок и неизвестных номеров QUIK# возвращает число. Флаги: бит 0 - активна, бит 1 - снята"""
+        order_num = int(str(msg['data']).split('|')[-1])  # Номер заявки
+        transaction = self.orders.get(order_num)  # Активная заявка
+        if transaction is not None:
+            return dict(order_num=order_num, trans_id=int(transaction['TRANS_ID']), class_code=transaction['CLASSCODE'], sec_code=transaction['SECCODE'], flags=0b1)
+        if order_num in self.canceled_orders:  # Снятая заявка
+            return dict(order_num=order_num, flags=0b10)
+        if order_num in self.trades:  # Исполненная заявка
+            return dict(order_num=order_num, flags=0)
+        return 0
+
+    # Справочники и параметры
+
+    def class_securities(self, class_code) -> list[str]:
+        """Тикеры режима торгов"""
+        return [sec_code for cls, sec_code in self.instruments if cls == class_code]
+
+    def get_info_param(self, msg):
+        """Параметры информационного окна. Время сервера - время имитатора"""
+        param = msg['data']
+        if param == 'TRADEDATE':
+            return self.clock.strftime('%d.%m.%Y')
+        if param == 'SERVERTIME':
+            return self.clock.strftime('%H:%M:%S')
+        return ''
+
+    def get_trade_accounts(self, msg):
+        """Торговые счета фондового и срочного рынков"""
+        stock_classes = '|'.join(sorted({class_code for class_code, _ in self.instruments if class_code != self.futures_cls_code}))  # Режимы торгов фондового рынка
+        return [dict(firmid=self.stock_firm_id, trdaccid=self.stock_account, class_codes=f'|{stock_classes}|', description=''),
+                dict(firmid=self.futures_firm_id, trdaccid=self.futures_account, class_codes=f'|{self.futures_cls_code}|', description='')]
+
+    def get_money_limits(self, msg):
+        """Денежные лимиты фондового рынка"""
+        return [dict(client_code=self.client_code, firmid=self.stock_firm_id, currcode='SUR', tag='EQTV', limit_kind=limit_kind,
+                     currentbal=self.cash, openbal=self.cash, currentlimit=0.0, locked=0.0) for limit_kind in (0, 1, 2)]
+
+    def get_futures_limit(self, msg):
+        """Фьючерсные лимиты по денежным средствам"""
+        return dict(firmid=self.futures_firm_id, trdaccid=self.futures_account, cbplimit=self.cash, varmargin=0.0, accruedint=0.0, limit_type=0)
+
+    def get_security_info(self, msg):
+        """Спецификация тикера"""
+        class_code, sec_code = msg['data'].split('|')[:2]
+        instrument = self.instruments.get((class_code, sec_code))
+        if instrument is None:  # Если тикера нет
+            raise ValueError(f'Тикер {class_code}.{sec_code} не найден')  # то ошибка, как в QUIK#
+        return instrument.info()
+
+    def get_security_class(self, msg):
+        """Режим торгов тикера из списка режимов"""
+        classes_list, sec_code = msg['data'].split('|')[:2]
+        return next((class_code for class_code in classes_list.split(',') if (class_code, sec_code) in self.instruments), '')
+
+    def get_param_ex(self, msg):
+        """Текущий параметр тикера"""
+        class_code, sec_code, param_name = msg['data'].split('|')[:3]
+        instrument = self.instruments.get((class_code, sec_code))
+        if instrument is None:
+            return dict(param_type='0', param_value='0', param_image='', result='0')
+        values = dict(LAST=instrument.price, STEPPRICE=instrument.step_price, SEC_PRICE_STEP=instrument.min_price_step,
+                      LOTSIZE=instrument.lot_size, SEC_SCALE=instrument.scale,
+                      BID=instrument.price - instrument.min_price_step, OFFER=instrument.price + instrument.min_price_step)
+        value = values.get(param_name.upper(), 0)  # Значение параметра
+        return dict(param_type='1', param_value=f'{value:.{instrument.scale}f}' if isinstance(value, float) else str(value), param_image=str(value), result='1')
+
+    def param_request(self, msg):
+        """Заказ текущего параметра"""
+        self.param_subscriptions.add(tuple(msg['data'].split('|')[:3]))
+        return True
+
+    def cancel_param_request(self, msg):
+        """Отмена заказа текущего параметра"""
+        self.param_subscriptions.discard(tuple(msg['data'].split('|')[:3]))
+        return True
+
+    # Стаканы
+
+    def quote_level2(self, class_code, sec_code, depth=10) -> dict:
+        """Снимок стакана вокруг текущей цены в формате QUIK: уровни по возрастанию цены, значения строками"""
+        instrument = self.instruments[(class_code, sec_code)]
+        step, ticks, scale = instrument.min_price_step, instrument.ticks, instrument.scale
+        bids = [dict(price=f'{(ticks - depth + i) * step:.{scale}f}', quantity=str(instrument.random.randint(1, 100))) for i in range(depth)]  # Лучшая покупка последняя
+        offers = [dict(price=f'{(ticks + 1 + i) * step:.{scale}f}', quantity=str(instrument.random.randint(1, 100))) for i in range(depth)]  # Лучшая продажа первая
+        return dict(bid_count=f'{depth}.000000', offer_count=f'{depth}.000000', bid=bids, offer=offers)
+
+    def get_quote_level2(self, msg):
+        """Снимок стакана"""
+        class_code, sec_code = msg['data'].split('|')[:2]
+        return self.quote_level2(class_code, sec_code)
+
+    def subscribe_level2_quotes(self, msg):
+        """Подписка на стакан"""
+        self.quote_subscriptions.add(tuple(msg['data'].split('|')[:2]))
+        return True
+
+    def unsubscribe_level2_quotes(self, msg):
+        """Отмена подписки на стакан"""
+        self.quote_subscriptions.discard(tuple(msg['data'].split('|')[:2]))
+        return True
+
+    # Свечи
+
+    @staticmethod
+    def candle_key(msg) -> tuple:
+        """Ключ подписки на свечи. Повторяет get_key из qsfunctions.lua"""
+        class_code, sec_code, interval, param = msg['data'].split('|')[:4]
+        return class_code, sec_code, int(interval), param
+
+    def history_start(self, interval) -> datetime:
+        """Дата и время открытия первой свечи истории. Последняя свеча истории закрывается временем сервера"""
+        return self.clock - timedelta(minutes=interval * self.history_bars)
+
+    def get_candles_from_data_source(self, msg):
+        """Свечи истории. Последние count свечей, 0 - все"""
+        class_code, sec_code, interval, param = self.candle_key(msg)
+        count = int(msg['data'].split('|')[4])  # Кол-во свечей
+        instrument = self.instruments.get((class_code, sec_code))
+        if instrument is None or interval <= 0:  # Если свечи получить нельзя
+            msg['cmd'] = 'lua_create_data_source_error'  # то ошибка, как в create_data_source
+            msg['lua_error'] = f"Can't create data source for {class_code}, {sec_code}, {interval}, {param}"
+            return msg
+        bars = self.history_bars if count == 0 else min(count, self.history_bars)  # Кол-во свечей
+        first = self.clock - timedelta(minutes=interval * bars)  # Дата и время открытия первой свечи
+        saved_ticks = instrument.ticks  # Историю строим от текущей цены назад, цену инструмента не сдвигаем
+        instrument.ticks = max(1, saved_ticks - bars)
+        candles = [instrument.candle(first + timedelta(minutes=interval * i), interval) for i in range(bars)]
+        instrument.ticks = saved_ticks
+        return candles
+
+    def set_callback_filter(self, msg) -> bool:
+        """Фильтр функции обратного вызова по инструментам. data: событие|class1|sec1|class2|sec2..."""
+        event, *codes = msg['data'].split('|')
+        self.callback_filters[event] = set(zip(codes[::2], codes[1::2]))
+        return True
+
+    def set_callback_batch(self, msg) -> bool:
+        """Окно объединения OnParam и OnQuote в мс. data: окно"""
+        with self.state_lock:
+            self.callback_batch_ms = int(msg['data'] or 0)
+            self.flush_callbacks()  # Если объединение выключено, то ожидающие изменения отправляем сразу
+        return True
+
+    def reset_callback_filter(self, msg) -> bool:
+        """Отмена фильтра функции обратного вызова. data: событие"""
+        self.callback_filters.pop(msg['data'], None)
+        return True
+
+    def subscribe_to_candles(self, msg):
+        """Подписка на свечи. Первой придет свеча, открывающаяся временем сервера"""
+        with self.state_lock:
+            key = self.candle_key(msg)  # Ключ подписки
+            self.candle_subscriptions[key] = self.clock
+            if msg['data'].split('|')[4:5] == ['1']:  # Если свечи нужно закрывать по времени
+                self.boundary_subscriptions.add(key)
+        return msg['data']
+
+    def unsubscribe_from_candles(self, msg):
+        """Отмена подписки на свечи"""
+        with self.state_lock:
+            self.candle_subscriptions.pop(self.candle_key(msg), None)
+            self.boundary_subscriptions.discard(self.candle_key(msg))
+        return msg['data']
+
+    def get_all_trades(self, msg):
+        """Обезличенные сделки, сгенерированные имитатором, по инструменту или все"""
+        if not msg['data']:
+            return list(self.all_trades)
+        class_code, sec_code = msg['data'].split('|')[:2]
+        return [trade for trade in self.all_trades if trade['class_code'] == class_code and trade['sec_code'] == sec_code]
+
+
+if __name__ == '__main__':  # Точка входа при запуске этого скрипта
+    parser = argparse.ArgumentParser(description='Имитатор QUIK#')
+    parser.add_argument('--host', default='127.0.0.1', help='IP адрес или название хоста')
+    parser.add_argument('--requests-port', type=int, default=34130, help='Порт для запросов и ответов')
+    parser.add_argument('--callbacks-port', type=int, default=34131, help='Порт для функций обратного вызова')
+    parser.add_argument('--history-bars', type=int, default=500, help='Кол-во свечей истории')
+    parser.add_argument('--candle-rate', type=float, default=0.0, help='Новых свечей в секунду на подписку')
+    parser.add_argument('--trade-rate', type=float, default=0.0, help='Обезличенных сделок в секунду на инструмент')
+    parser.add_argument('--quote-rate', type=float, default=0.0, help='Изменений стакана в секунду на подписку')
+    parser.add_argument('--param-rate', type=float, default=0.0, help='Изменений текущих параметров в секунду на инструмент')
+    parser.add_argument('--reply-delay', type=float, default=0.0, help='Задержка ответа на транзакцию в секундах')
+    parser.add_argument('--request-loop', choices=('select', 'poll'), default='select', help='Цикл приема запросов: ожидание на соединении или опрос с паузой 1 мс')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    simulator = QuikSimulator(args.host, args.requests_port, args.callbacks_port, history_bars=args.history_bars,
+                              candle_rate=args.candle_rate, trade_rate=args.trade_rate, quote_rate=args.quote_rate,
+                              param_rate=args.param_rate, reply_delay=args.reply_delay, request_loop=args.request_loop)
+    simulator.start()
+    try:
+        while True:
+            sleep(1)
+    except KeyboardInterrupt:  # Остановка по Ctrl+C
+        simulator.stop()
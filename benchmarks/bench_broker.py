@@ -0,0 +1,39 @@
+"""Замеры QKBroker: обработка сделок и проверка связанных заявок в зависимости от длины сессии"""
+from backtrader import Order, BuyOrder, TimeFrame  # Заявки BackTrader
+
+from BacktraderQuikJunior import QKBroker, QKData
+from benchmarks.harness import benchmark, per_call
+
+
+def make_broker_and_order(context):
+    """Брокер и большая рыночная заявка на фьючерс, которая исполняется частями"""
+    broker = QKBroker()
+    data = QKData(dataname='SPBFUT.SiZ6', timeframe=TimeFrame.Minutes, compression=1)
+    data._name = 'SPBFUT.SiZ6'  # Название тикера задает cerebro при добавлении данных
+    order = BuyOrder(owner=None, data=data, size=10 ** 9, price=None, exectype=Order.Market, simulated=True)  # Цена заявки не берется из пустых данных
+    order.addinfo(account=broker.accounts[-1])
+    broker.orders[order.ref] = order  # Заявка отправлена на биржу
+    order.submit(broker)
+    order.accept(broker)
+    return broker, order
+
+
+@benchmark('broker.on_trade', params=(100, 1000, 10000, 100000))
+def on_trade(context, session_trades):
+    """Время обработки одной сделки при session_trades сделках за сессию"""
+    broker, order = make_broker_and_order(context)
+    broker.trade_nums['SPBFUT.SiZ6'] = set(range(session_trades))  # Сделки за сессию
+    trade_num = [session_trades]
+
+    def trade():
+        trade_num[0] += 1
+        broker.on_trade({'data': dict(trade_num=trade_num[0], order_num=1, trans_id=order.ref, class_code='SPBFUT', sec_code='SiZ6', price=90000.0, qty=1, flags=0)})
+    return per_call(trade, 500)
+
+
+@benchmark('broker.oco_pc_check', params=(100, 1000, 10000))
+def oco_pc_check(context, session_orders):
+    """Время проверки связанных и родительских/дочерних заявок при session_orders заявках со связями за сессию"""
+    broker, order = make_broker_and_order(context)
+    broker.ocos = {-i: -i - 1 for i in range(1, session_orders + 1)}  # Связанные заявки, не относящиеся к проверяемой
+    return per_call(lambda: broker.oco_pc_check(order), 500)
@@ -0,0 +1,51 @@
+"""Замеры кодирования запросов и разбора ответов/функций обратного вызова JSON по библиотекам orjson, ujson, json"""
+from BacktraderQuikJunior.QJCodec import JsonCodec, orjson, ujson
+from benchmarks.harness import benchmark, per_call
+
+backends = tuple(name for name, module in (('orjson', orjson), ('ujson', ujson), ('json', True)) if module is not None)  # Установленные библиотеки JSON
+
+all_trade = dict(cmd='OnAllTrade', t=1767600000000, data=dict(
+    class_code='SPBFUT', sec_code='SiZ6', trade_num=1234567890, flags=1, price=90000.0, qty=1, value=90000.0, open_interest=0.0,
+    datetime=dict(year=2026, month=1, day=5, hour=10, min=0, sec=0, ms=0, mcs=0, week_day=1)))  # Обезличенная сделка
+candles = dict(cmd='get_candles_from_data_source', id='1', t='', data=[dict(
+    open=300.1, high=301.5, low=299.8, close=300.9, volume=123, sec='SBER', interval=1, **{'class': 'TQBR'},
+    datetime=dict(year=2026, month=1, day=5, hour=10, min=i % 60, sec=0, ms=0, mcs=0, week_day=1)) for i in range(10_000)])  # Ответ на запрос 10000 свечей
+transaction = dict(TRANS_ID='123', CLIENT_CODE='10001', ACCOUNT='SPBFUT000', ACTION='NEW_ORDER', CLASSCODE='SPBFUT', SECCODE='SiZ6',
+                   OPERATION='B', QUANTITY='1', TYPE='L', PRICE='90000', COMMENT='Заявка')  # Транзакция новой заявки
+
+
+def encoded(codec, message) -> bytes:
+    """Сообщение в кодировке Windows 1251, как оно приходит из QUIK#"""
+    return codec.dumps(message).encode(codec.encoding)
+
+
+@benchmark('codec.encode.get_param_ex', params=backends, unit='ops/s')
+def encode_get_param_ex(context, backend):
+    """Кол-во кодирований запроса текущего параметра в секунду (запрос повторяется, берется из кэша)"""
+    codec = JsonCodec(backend)
+    request = {'data': 'SPBFUT|SiZ6|LAST', 'id': 0, 'cmd': 'getParamEx', 't': ''}
+    return 1 / per_call(lambda: codec.encode_request(request), 100_000)
+
+
+@benchmark('codec.encode.send_transaction', params=backends, unit='ops/s')
+def encode_send_transaction(context, backend):
+    """Кол-во кодирований транзакции в секунду"""
+    codec = JsonCodec(backend)
+    request = {'data': transaction, 'id': 0, 'cmd': 'sendTransaction', 't': ''}
+    return 1 / per_call(lambda: codec.encode_request(request), 100_000)
+
+
+@benchmark('codec.decode.on_all_trade', params=backends, unit='ops/s')
+def decode_on_all_trade(context, backend):
+    """Кол-во разобранных обезличенных сделок в секунду"""
+    codec = JsonCodec(backend)
+    line = encoded(codec, all_trade)
+    return 1 / per_call(lambda: codec.decode(line), 100_000)
+
+
+@benchmark('codec.decode.candles_10000', params=backends)
+def decode_candles(context, backend):
+    """Время разбора ответа на запрос 10000 свечей"""
+    codec = JsonCodec(backend)
+    line = encoded(codec, candles)
+    return per_call(lambda: codec.decode(line), 20)
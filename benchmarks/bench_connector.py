@@ -0,0 +1,158 @@
+"""Замеры QuikPy: запросы и функции обратного вызова"""
+from threading import Event  # Ожидание разбора всех функций обратного вызова
+from time import perf_counter, sleep, time_ns  # Время замеров. Время записи в журнал сессии
+from tempfile import TemporaryDirectory  # Журнал сессии замера
+import os
+
+from BacktraderQuikJunior.QJRecorder import SessionRecorder
+from BacktraderQuikJunior.QJReplay import QuikReplay
+from benchmarks.harness import benchmark, per_call, percentile
+
+
+@benchmark('connector.process_request.ping_latency')
+def ping_latency(context, param):
+    """Время запроса и ответа на самый короткий запрос"""
+    provider = context['store'].provider
+    return per_call(provider.ping, 2000)
+
+
+def ping_round_trips(context, request_loop, number=1000) -> list[float]:
+    """Время запроса и ответа ping в секундах при заданном цикле приема запросов имитатора
+
+    :param dict context: Контекст замеров
+    :param str request_loop: Цикл приема запросов: poll - опрос с паузой 1 мс (прежний QuikSharp.lua), select - ожидание на соединении
+    :param int number: Кол-во запросов
+    """
+    provider = context['store'].provider
+    simulator = context['simulator']
+    saved_loop, simulator.request_loop = simulator.request_loop, request_loop
+    samples = []
+    for _ in range(number):
+        sleep(0.0002)  # Между запросами скрипт QUIK# успевает уйти в ожидание
+        start = perf_counter()
+        provider.ping()
+        samples.append(perf_counter() - start)
+    simulator.request_loop = saved_loop
+    return samples
+
+
+@benchmark('connector.process_request.ping_rtt_p50', params=('poll', 'select'))
+def ping_rtt_p50(context, request_loop):
+    """Медиана времени запроса и ответа ping: опрос с паузой 1 мс против ожидания на соединении"""
+    return percentile(ping_round_trips(context, request_loop), 50)
+
+
+@benchmark('connector.process_request.ping_rtt_p99', params=('poll', 'select'))
+def ping_rtt_p99(context, request_loop):
+    """99-й процентиль времени запроса и ответа ping: опрос с паузой 1 мс против ожидания на соединении"""
+    return percentile(ping_round_trips(context, request_loop), 99)
+
+
+@benchmark('connector.process_request.get_param_ex_throughput', unit='ops/s')
+def get_param_ex_throughput(context, param):
+    """Кол-во запросов текущего параметра в секунду"""
+    provider = context['store'].provider
+    return 1 / per_call(lambda: provider.get_param_ex('SPBFUT', 'SiZ6', 'LAST'), 2000)
+
+
+@benchmark('connector.process_request.candles_latency', params=(100, 1000, 10000))
+def candles_latency(context, count):
+    """Время получения count свечей одним запросом (большой ответ из нескольких фрагментов)"""
+    provider = context['store'].provider
+    simulator = context['simulator']
+    simulator.history_bars = count
+    return per_call(lambda: provider.get_candles_from_data_source('TQBR', 'SBER', 1, count=count), 5)
+
+
+def all_trade() -> dict:
+    """Обезличенная сделка OnAllTrade с полным набором полей"""
+    return dict(class_code='SPBFUT', sec_code='SiZ6', trade_num=1, flags=1, price=90000.0, qty=1, value=90000.0, open_interest=0.0,
+                datetime=dict(year=2026, month=1, day=5, hour=10, min=0, sec=0, ms=0, mcs=0, week_day=1))
+
+
+@benchmark('connector.callback_handler.dispatch_rate', params=('OnAllTrade', 'OnParam'), unit='ops/s')
+def dispatch_rate(context, cmd):
+    """Кол-во разобранных и переданных в обработчики функций обратного вызова в секунду"""
+    provider = context['store'].provider
+    simulator = context['simulator']
+    count = 50_000  # Кол-во сообщений в пачке
+    data = all_trade() if cmd == 'OnAllTrade' else dict(class_code='SPBFUT', sec_code='SiZ6')  # Данные функции обратного вызова
+    attribute = {'OnAllTrade': 'on_all_trade', 'OnParam': 'on_param'}[cmd]  # Обработчик функции обратного вызова
+    received = [0]  # Кол-во полученных сообщений
+    done = Event()  # Все сообщения получены
+
+    def handler(_):
+        received[0] += 1
+        if received[0] == count:
+            done.set()
+    saved_handler = getattr(provider, attribute)
+    setattr(provider, attribute, handler)
+    start = perf_counter()
+    simulator.burst(cmd, data, count)  # Отправляем пачку сообщений
+    done.wait(60)  # Ждем, пока все сообщения будут разобраны
+    elapsed = perf_counter() - start
+    setattr(provider, attribute, saved_handler)
+    return received[0] / elapsed
+
+
+@benchmark('connector.callback_handler.batch_rate', params=(1, 10, 100), unit='ops/s')
+def batch_rate(context, size):
+    """Кол-во разобранных и переданных в обработчик изменений текущих параметров в секунду, когда они приходят пачками Batch по size тикеров"""
+    provider = context['store'].provider
+    simulator = context['simulator']
+    count = 50_000  # Кол-во изменений
+    batch = [dict(class_code='SPBFUT', sec_code=f'Si{i}') for i in range(size)]  # Изменения по size тикерам
+    received = [0]  # Кол-во полученных изменений
+    done = Event()  # Все изменения получены
+
+    def handler(_):
+        received[0] += 1
+        if received[0] == count // size * size:
+            done.set()
+    saved_handler = provider.on_param
+    provider.on_param = handler
+    start = perf_counter()
+    simulator.burst('Batch', batch, count // size, event='OnParam')  # Отправляем пачку сообщений
+    done.wait(60)  # Ждем, пока все изменения будут разобраны
+    elapsed = perf_counter() - start
+    provider.on_param = saved_handler
+    return received[0] / elapsed
+
+
+@benchmark('connector.callback_handler.record_rate', params=('off', 'on'), unit='ops/s')
+def record_rate(context, record):
+    """Кол-во разобранных обезличенных сделок в секунду без записи и с записью сессии в журнал"""
+    provider = context['store'].provider
+    with TemporaryDirectory() as folder:
+        if record == 'on':  # Если сессию записываем
+            provider.recorder = SessionRecorder(os.path.join(folder, 'session.qjr'))
+        try:
+            return dispatch_rate(context, 'OnAllTrade')
+        finally:
+            if provider.recorder is not None:
+                provider.recorder.close()
+                provider.recorder = None
+
+
+@benchmark('connector.replay.callback_rate', unit='ops/s')
+def replay_rate(context, param):
+    """Кол-во воспроизведенных обезличенных сделок в секунду из журнала сессии без пауз"""
+    count = 50_000  # Кол-во функций обратного вызова в журнале
+    line = QuikReplay.codec.dumps(dict(cmd='OnAllTrade', t=0, data=all_trade())).encode(QuikReplay.codec.encoding)  # Строка функции обратного вызова
+    request = dict(data='Ping', id=0, cmd='ping', t='')  # Запрос, после которого записаны функции обратного вызова
+    received = [0]  # Кол-во полученных сделок
+    with TemporaryDirectory() as folder:
+        file_name = os.path.join(folder, 'session.qjr')  # Журнал сессии
+        recorder = SessionRecorder(file_name)
+        recorder.exchange(QuikReplay.codec.encode_request(request), QuikReplay.codec.dumps(dict(request, data='Pong')).encode(), time_ns())
+        for _ in range(count):
+            recorder.callback(line)
+        recorder.close()
+        replay = QuikReplay(file_name, speed=None)
+        replay.on_all_trade = lambda _: received.__setitem__(0, received[0] + 1)
+        start = perf_counter()
+        replay.ping()  # Функции обратного вызова отправляются после воспроизведения ping
+        replay.finished.wait(60)  # Ждем, пока все функции обратного вызова будут разобраны
+        elapsed = perf_counter() - start
+        replay.close_connection_and_thread()
+    return received[0] / elapsed
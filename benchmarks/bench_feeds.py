@@ -0,0 +1,110 @@
+"""Замеры QKData: загрузка истории из файла и QUIK, выдача новых бар"""
+from datetime import timedelta  # Время новых бар
+from time import perf_counter  # Время замеров
+import os
+
+from backtrader import TimeFrame  # Временной интервал данных
+
+from BacktraderQuikJunior import QKData
+from benchmarks.harness import benchmark
+
+
+def make_data(context, **kwargs):
+    """Новые данные QKData с файлами истории во временном каталоге"""
+    QKData.datapath = os.path.join(context['tmpdir'], '')  # Файлы истории во временном каталоге
+    return QKData(dataname='TQBR.SBER', timeframe=TimeFrame.Minutes, compression=1, **kwargs)
+
+
+def clear_files(context) -> None:
+    """Удаление файлов истории"""
+    for file_name in os.listdir(context['tmpdir']):
+        os.remove(os.path.join(context['tmpdir'], file_name))
+
+
+@benchmark('feeds.history.from_quik', params=(1000, 10000))
+def history_from_quik(context, bars):
+    """Время старта данных с получением bars бар из QUIK и записью их в файл"""
+    clear_files(context)
+    context['simulator'].history_bars = bars
+    data = make_data(context)
+    start = perf_counter()
+    data.start()
+    elapsed = perf_counter() - start
+    data.stop()
+    return elapsed
+
+
+@benchmark('feeds.history.from_file', params=(1000, 10000))
+def history_from_file(context, bars):
+    """Время старта данных с чтением bars бар из файла. Из QUIK новых бар не приходит"""
+    clear_files(context)
+    context['simulator'].history_bars = bars
+    data = make_data(context)
+    data.start()  # Первый старт записывает файл истории
+    data.stop()
+    context['simulator'].history_bars = 0  # Второй старт получает бары только из файла
+    data = make_data(context)
+    start = perf_counter()
+    data.start()
+    elapsed = perf_counter() - start
+    data.stop()
+    return elapsed
+
+
+@benchmark('feeds.history.from_file_tail', params=(1000, 10000))
+def history_from_file_tail(context, bars):
+    """Время старта данных с чтением последних 500 из bars бар файла (warmup_bars). Из QUIK новых бар не приходит"""
+    clear_files(context)
+    context['simulator'].history_bars = bars
+    data = make_data(context)
+    data.start()  # Первый старт записывает файл истории
+    data.stop()
+    context['simulator'].history_bars = 0  # Второй старт получает бары только из файла
+    data = make_data(context, warmup_bars=500)
+    start = perf_counter()
+    data.start()
+    elapsed = perf_counter() - start
+    data.stop()
+    return elapsed
+
+
+@benchmark('feeds.load.history_per_bar')
+def load_history_per_bar(context, param):
+    """Время выдачи одного исторического бара в _load"""
+    clear_files(context)
+    context['simulator'].history_bars = 10000
+    data = make_data(context)
+    data.start()
+    count = 0
+    start = perf_counter()
+    while True:
+        data.forward()
+        if not data._load():
+            break
+        count += 1
+    elapsed = perf_counter() - start
+    data.stop()
+    return elapsed / count
+
+
+@benchmark('feeds.load.live_per_bar', params=(100, 1000))
+def load_live_per_bar(context, bars):
+    """Время выдачи одного нового бара в _load в режиме live_bars. Новые бары уже лежат в очереди данных"""
+    clear_files(context)
+    simulator = context['simulator']
+    simulator.history_bars = 10
+    data = make_data(context, live_bars=True)
+    data.start()
+    while data.history_index < len(data.history_bars):  # Пропускаем историю
+        data.forward()
+        data._load()
+    last = data.dt_last_open  # Дата и время открытия последнего бара истории
+    simulator.clock += timedelta(minutes=bars + 1)  # Сдвигаем время сервера, чтобы все новые бары были закрыты
+    data.new_bars.extend(dict(data=dict(datetime=last + timedelta(minutes=i + 1), open=300.0, high=301.0, low=299.0, close=300.5, volume=10)) for i in range(bars))
+    start = perf_counter()
+    for _ in range(bars):
+        data.forward()
+        data._load()
+    elapsed = perf_counter() - start
+    data.stop()
+    return elapsed / bars
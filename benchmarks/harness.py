@@ -0,0 +1,114 @@
+"""Простая обвязка замеров в стиле asv: регистрация замеров, повторы, статистика, сохранение и сравнение результатов в JSON"""
+from time import perf_counter  # Точное время замеров
+from statistics import median, mean  # Статистика замеров
+import platform  # Описание машины в результатах
+import subprocess  # Номер коммита в результатах
+import json  # Результаты замеров храним в JSON
+
+BENCHMARKS = []  # Зарегистрированные замеры в порядке объявления
+
+
+def benchmark(name, params=(None,), unit='s', repeat=5):
+    """Регистрация замера. Функция замера получает контекст и параметр, и возвращает одно значение замера
+
+    :param str name: Название замера
+    :param tuple params: Параметры замера. Замер выполняется для каждого параметра
+    :param str unit: Единица измерения: s - секунды (меньше лучше), ops/s - операций в секунду (больше лучше)
+    :param int repeat: Кол-во повторов замера
+    """
+    def decorator(func):
+        BENCHMARKS.append(dict(name=name, func=func, params=params, unit=unit, repeat=repeat))
+        return func
+    return decorator
+
+
+def per_call(func, number) -> float:
+    """Среднее время одного вызова функции в секундах
+
+    :param func: Функция без параметров
+    :param int number: Кол-во вызовов
+    """
+    start = perf_counter()
+    for _ in range(number):
+        func()
+    return (perf_counter() - start) / number
+
+
+def percentile(values, q) -> float:
+    """Процентиль значений по ближайшему рангу
+
+    :param list values: Значения
+    :param float q: Процентиль от 0 до 100
+    """
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(q / 100 * len(values) + 0.5) - 1))]
+
+
+def run(context, name_filter='', quick=False) -> dict:
+    """Выполнение всех зарегистрированных замеров
+
+    :param dict context: Контекст замеров: имитатор, хранилище, временный каталог
+    :param str name_filter: Выполнять только замеры, в названии которых есть эта строка
+    :param bool quick: Один повтор каждого замера
+    :return: Результаты замеров по названиям
+    """
+    results = {}
+    for bench in BENCHMARKS:  # Пробегаемся по всем замерам
+        for param in bench['params']:  # и по всем параметрам замера
+            key = bench['name'] if param is None else f'{bench["name"]}[{param}]'  # Название замера с параметром
+            if name_filter not in key:  # Если замер не нужен
+                continue
+            samples = [bench['func'](context, param) for _ in range(1 if quick else bench['repeat'])]  # Повторяем замер
+            results[key] = dict(unit=bench['unit'], samples=samples, median=median(samples), mean=mean(samples),
+                                min=min(samples), max=max(samples), p95=percentile(samples, 95))
+            print(f'{key:<55} {format_value(results[key]["median"], bench["unit"]):>16}')
+    return results
+
+
+def format_value(value, unit) -> str:
+    """Значение замера для вывода"""
+    if unit == 's':  # Время выводим в удобных единицах
+        for scale, suffix in ((1, 's'), (1e-3, 'ms'), (1e-6, 'us')):
+            if value >= scale:
+                return f'{value / scale:.3f} {suffix}'
+        return f'{value * 1e9:.1f} ns'
+    return f'{value:,.0f} {unit}'
+
+
+def machine_info() -> dict:
+    """Описание машины и версии кода для сравнения результатов"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):  # Если git недоступен
+        commit = ''
+    return dict(commit=commit, python=platform.python_version(), platform=platform.platform(), machine=platform.machine(), processor=platform.processor())
+
+
+def save(results, file_name) -> None:
+    """Сохранение результатов замеров в JSON"""
+    with open(file_name, 'w', encoding='utf-8') as file:
+        json.dump(dict(machine=machine_info(), results=results), file, ensure_ascii=False, indent=2)
+
+
+def compare(results, file_name, threshold=0.1) -> list[str]:
+    """Сравнение результатов с сохраненными ранее
+
+    :param dict results: Текущие результаты
+    :param str file_name: Файл с прошлыми результатами
+    :param float threshold: Допустимое ухудшение медианы в долях
+    :return: Названия замеров с ухудшением больше допустимого
+    """
+    with open(file_name, encoding='utf-8') as file:
+        baseline = json.load(file)['results']
+    regressions = []
+    print(f'\n{"Замер":<55} {"Было":>16} {"Стало":>16} {"Изменение":>10}')
+    for key, result in results.items():
+        if key not in baseline:  # Нового замера в прошлых результатах нет
+            continue
+        before, after = baseline[key]['median'], result['median']
+        change = (after - before) / before if before else 0.0  # Относительное изменение медианы
+        worse = change > threshold if result['unit'] == 's' else -change > threshold  # Для времени хуже рост, для скорости - падение
+        if worse:
+            regressions.append(key)
+        print(f'{key:<55} {format_value(before, result["unit"]):>16} {format_value(after, result["unit"]):>16} {change:>+9.1%}{" !" if worse else ""}')
+    return regressions
@@ -0,0 +1,62 @@
+"""Запуск замеров против имитатора QUIK#
+
+    python -m benchmarks.run                                   # Все замеры, результаты в benchmarks/results
+    python -m benchmarks.run --filter broker --quick           # Только замеры брокера, один повтор
+    python -m benchmarks.run --compare benchmarks/results/baseline.json  # Сравнение с прошлыми результатами
+
+Имитатор занимает порты QUIK# 34130/34131, поэтому терминал QUIK со скриптом QuikSharp.lua на этой машине должен быть остановлен
+"""
+from datetime import datetime  # Имя файла результатов
+from importlib import import_module  # Модули замеров регистрируются при подключении
+import argparse
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))  # Корень репозитория: пакет, имитатор и замеры
+
+from BacktraderQuikJunior import QKStore  # Хранилище подключается к QUIK при первом обращении к провайдеру
+from Simulator.QuikSimulator import QuikSimulator  # Имитатор QUIK#
+from benchmarks import harness  # Обвязка замеров
+
+modules = ('bench_connector', 'bench_feeds', 'bench_broker', 'bench_codec')  # Модули замеров
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Замеры BacktraderQuikJunior')
+    parser.add_argument('--filter', default='', help='Выполнять только замеры, в названии которых есть эта строка')
+    parser.add_argument('--quick', action='store_true', help='Один повтор каждого замера')
+    parser.add_argument('--output', default=None, help='Файл результатов JSON. По умолчанию benchmarks/results/<дата>-<коммит>.json')
+    parser.add_argument('--compare', default=None, help='Файл прошлых результатов JSON для сравнения')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Допустимое ухудшение медианы в долях')
+    args = parser.parse_args()
+
+    simulator = QuikSimulator()  # Имитатор на портах QUIK# по умолчанию
+    simulator.start()
+    try:
+        for module in modules:  # Регистрируем замеры
+            import_module(f'benchmarks.{module}')
+        with tempfile.TemporaryDirectory() as tmpdir:  # Файлы истории замеров не смешиваем с рабочими
+            context = dict(simulator=simulator, store=QKStore(), tmpdir=tmpdir)  # Контекст замеров
+            results = harness.run(context, args.filter, args.quick)
+            context['store'].provider.close_connection_and_thread()  # Закрываем соединение с имитатором
+    finally:
+        simulator.stop()
+
+    output = args.output
+    if output is None:  # Если файл результатов не задан
+        results_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'results')
+        os.makedirs(results_dir, exist_ok=True)
+        output = os.path.join(results_dir, f'{datetime.now():%Y%m%d-%H%M%S}-{harness.machine_info()["commit"] or "nocommit"}.json')
+    harness.save(results, output)
+    print(f'\nРезультаты сохранены в {output}')
+    if args.compare:  # Если нужно сравнение
+        regressions = harness.compare(results, args.compare, args.threshold)
+        if regressions:  # Если есть ухудшения
+            print(f'\nУхудшение больше {args.threshold:.0%}: {", ".join(regressions)}')
+            return 1
+    return 0
+
+
+if __name__ == '__main__':  # Точка входа при запуске этого скрипта
+    sys.exit(main())
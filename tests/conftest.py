@@ -0,0 +1,78 @@
+from socket import socket
+from time import monotonic, sleep
+
+import pytest
+
+from BacktraderQuikJunior import QKStore
+from BacktraderQuikJunior.QuikJuniorPy import QuikPy
+from Simulator.QuikSimulator import QuikSimulator
+
+
+def free_ports(count=2) -> list[int]:
+    """Разные свободные порты. Стандартные порты QUIK# могут быть заняты терминалом"""
+    sockets = [socket() for _ in range(count)]
+    for sock in sockets:  # Порты занимаем одновременно, чтобы они не совпали
+        sock.bind(('127.0.0.1', 0))
+    ports = [sock.getsockname()[1] for sock in sockets]
+    for sock in sockets:
+        sock.close()
+    return ports
+
+
+@pytest.fixture
+def simulator():
+    """Запуск имитатора QUIK# на свободных портах: simulator(**параметры имитатора). Имитаторы останавливаются после теста"""
+    simulators = []
+
+    def start(**kwargs) -> QuikSimulator:
+        requests_port, callbacks_port = free_ports()
+        sim = QuikSimulator(requests_port=requests_port, callbacks_port=callbacks_port, **kwargs)
+        sim.start()
+        simulators.append(sim)
+        return sim
+
+    yield start
+    for sim in simulators:
+        sim.stop()
+
+
+@pytest.fixture
+def connect():
+    """Подключение QuikPy к имитатору: connect(sim, **параметры QuikPy). Провайдеры закрываются после теста"""
+    providers = []
+
+    def open_provider(sim, **kwargs) -> QuikPy:
+        provider = QuikPy(requests_port=sim.requests_port, callbacks_port=sim.callbacks_port, **kwargs)
+        providers.append(provider)
+        return provider
+
+    yield open_provider
+    for provider in providers:
+        provider.close()
+
+
+@pytest.fixture
+def store():
+    """Хранилище, подключенное к имитатору: store(sim, **параметры QKStore). Хранилища останавливаются и удаляются после теста"""
+    stores = []
+
+    def open_store(sim, **kwargs) -> QKStore:
+        kwargs.setdefault('heartbeat', None)  # Без контроля соединения, если тест его не проверяет
+        qk_store = QKStore(requests_port=sim.requests_port, callbacks_port=sim.callbacks_port, store=f'test{sim.requests_port}', **kwargs)  # Отдельное хранилище на каждый имитатор
+        stores.append(qk_store)
+        return qk_store
+
+    yield open_store
+    for qk_store in stores:
+        qk_store.stop()
+        del QKStore._stores[qk_store.key]
+
+
+def wait_until(predicate, timeout=5.0) -> bool:
+    """Ожидание условия, которое выполнит поток обратного вызова или имитатор"""
+    deadline = monotonic() + timeout
+    while not predicate():
+        if monotonic() > deadline:
+            return False
+        sleep(0.01)
+    return True
@@ -0,0 +1,48 @@
+from datetime import datetime
+
+import pytest
+from backtrader import TimeFrame
+
+from BacktraderQuikJunior.QJCandles import BarResampler
+
+
+@pytest.mark.parametrize('dt, start, end', [
+    (datetime(2025, 1, 15, 10, 0), datetime(2025, 1, 1), datetime(2025, 2, 1)),
+    (datetime(2025, 11, 30, 23, 59), datetime(2025, 11, 1), datetime(2025, 12, 1)),
+    (datetime(2025, 12, 1), datetime(2025, 12, 1), datetime(2026, 1, 1)),  # Переход через год
+    (datetime(2025, 12, 31, 23, 59), datetime(2025, 12, 1), datetime(2026, 1, 1)),
+    (datetime(2024, 2, 29, 18, 45), datetime(2024, 2, 1), datetime(2024, 3, 1)),  # Високосный год
+])
+def test_month_bounds(dt, start, end):
+    assert BarResampler(TimeFrame.Months).bounds(dt) == (start, end)
+
+
+@pytest.mark.parametrize('dt, start, end', [
+    (datetime(2025, 12, 31, 12, 0), datetime(2025, 12, 29), datetime(2026, 1, 5)),  # Неделя переходит через год
+    (datetime(2026, 1, 4, 23, 59), datetime(2025, 12, 29), datetime(2026, 1, 5)),
+    (datetime(2026, 1, 5), datetime(2026, 1, 5), datetime(2026, 1, 12)),
+])
+def test_week_bounds(dt, start, end):
+    assert BarResampler(TimeFrame.Weeks).bounds(dt) == (start, end)
+
+
+def test_day_bounds():
+    assert BarResampler(TimeFrame.Days).bounds(datetime(2025, 12, 31, 23, 59)) == (datetime(2025, 12, 31), datetime(2026, 1, 1))
+
+
+@pytest.mark.parametrize('compression, dt, start, end', [
+    (5, datetime(2025, 12, 31, 10, 7), datetime(2025, 12, 31, 10, 5), datetime(2025, 12, 31, 10, 10)),
+    (60, datetime(2025, 12, 31, 23, 30), datetime(2025, 12, 31, 23, 0), datetime(2026, 1, 1)),
+    (120, datetime(2025, 12, 31, 23, 30), datetime(2025, 12, 31, 22, 0), datetime(2026, 1, 1)),
+    (7, datetime(2025, 12, 31, 23, 58), datetime(2025, 12, 31, 23, 55), datetime(2026, 1, 1)),  # Бар не переходит через сутки
+])
+def test_minute_bounds(compression, dt, start, end):
+    assert BarResampler(TimeFrame.Minutes, compression).bounds(dt) == (start, end)
+
+
+def test_month_bars_over_year():
+    resampler = BarResampler(TimeFrame.Months, base_minutes=1440)
+    closed = []
+    for dt, price in ((datetime(2025, 12, 30), 10), (datetime(2025, 12, 31), 12), (datetime(2026, 1, 5), 11)):
+        closed += resampler.update(dict(datetime=dt, open=price, high=price, low=price, close=price, volume=1))
+    assert [(bar['datetime'], bar['open'], bar['close'], bar['volume']) for bar in closed] == [(datetime(2025, 12, 1), 10, 12, 2)]
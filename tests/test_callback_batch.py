@@ -0,0 +1,35 @@
+from conftest import wait_until
+
+params = [dict(class_code='TQBR', sec_code='SBER'), dict(class_code='SPBFUT', sec_code='SiZ6')]  # Изменения параметров в одной пачке
+
+
+def test_batch_is_dispatched_item_by_item(simulator, connect):
+    sim = simulator(history_bars=10)
+    provider = connect(sim)
+    received = []
+    provider.on_param = received.append
+    sim.burst('Batch', params, 3, event='OnParam')
+    assert wait_until(lambda: len(received) == 6)
+    assert [data['data'] for data in received] == params * 3  # Порядок событий внутри пачки сохраняется
+    assert all(data['cmd'] == 'OnParam' and data['t'] for data in received)  # Обработчик получает событие так же, как отдельную функцию обратного вызова
+
+
+def test_batch_without_handler_invalidates_profiles(simulator, connect):
+    sim = simulator(history_bars=10)
+    provider = connect(sim)
+    futures = provider.get_instrument_profile('SPBFUT', 'SiZ6')
+    sim.burst('Batch', params, 1, event='OnParam')
+    assert wait_until(lambda: futures.stale)  # Пачка без обработчика не разбирается, но профили по ней помечаются к обновлению
+
+
+def test_store_coalesces_quotes(simulator, store):
+    sim = simulator(history_bars=10, quote_rate=2000)
+    qk_store = store(sim, callback_batch=20)
+    qk_store.start()
+    assert sim.callback_batch_ms == 20
+    book = qk_store.books.subscribe('TQBR', 'SBER')
+    assert wait_until(lambda: book.updates >= 5)  # Стакан обновляется из пачек
+    counters = qk_store.provider.get_callback_counters()['data']
+    assert counters['OnQuote']['coalesced'] > 0  # Повторные изменения стакана в окне объединены
+    qk_store.stop()
+    assert sim.callback_batch_ms == 0  # После остановки события снова приходят по одному
@@ -0,0 +1,55 @@
+from BacktraderQuikJunior.QJMetrics import metrics
+from conftest import wait_until
+
+sber, si = ('TQBR', 'SBER'), ('SPBFUT', 'SiZ6')  # Акция и фьючерс имитатора
+
+
+def test_store_filters_follow_subscriptions(simulator, store):
+    sim = simulator(history_bars=10)
+    qk_store = store(sim)
+    qk_store.start()
+    assert sim.callback_filters == {'OnAllTrade': set(), 'OnQuote': set(), 'OnParam': set()}  # Без подписок события по инструментам не отправляются
+    qk_store.ticks.subscribe(*si)
+    qk_store.books.subscribe(*sber)
+    assert sim.callback_filters['OnAllTrade'] == {si} and sim.callback_filters['OnQuote'] == {sber}
+    qk_store.ticks.unsubscribe(*si)
+    qk_store.books.unsubscribe(*sber)
+    assert sim.callback_filters['OnAllTrade'] == set() and sim.callback_filters['OnQuote'] == set()
+    qk_store.stop()
+    assert sim.callback_filters == {}  # После остановки скрипт QUIK# снова отправляет все события
+
+
+def test_filtered_trades(simulator, store):
+    sim = simulator(history_bars=10, trade_rate=200)
+    qk_store = store(sim)
+    qk_store.start()
+    buffer = qk_store.ticks.subscribe(*si)
+    assert wait_until(lambda: buffer.seq >= 20)
+    counters = qk_store.provider.get_callback_counters()['data']
+    assert counters['OnAllTrade']['sent'] >= 20 and counters['OnAllTrade']['filtered'] > 0  # Сделки по остальным инструментам отфильтрованы в скрипте QUIK#
+
+
+def test_futures_profiles_receive_params(simulator, store):
+    sim = simulator(history_bars=10, param_rate=50)
+    qk_store = store(sim)
+    qk_store.start()
+    futures = qk_store.provider.get_instrument_profile(*si)
+    stock = qk_store.provider.get_instrument_profile(*sber)
+    assert sim.callback_filters['OnParam'] == {si}  # Стоимость шага цены меняется только у фьючерсов
+    assert wait_until(lambda: futures.stale)  # OnParam без обработчика помечает профиль к обновлению
+    assert not stock.stale
+
+
+def test_callbacks_without_handler_are_not_parsed(simulator, connect, monkeypatch):
+    monkeypatch.setattr(metrics, 'enabled', True)
+    monkeypatch.setattr(metrics, 'counters', {})
+    sim = simulator(history_bars=10, trade_rate=200)
+    provider = connect(sim)
+    decoded = []
+    decode = provider.codec.decode
+    monkeypatch.setattr(provider.codec, 'decode', lambda line: decoded.append(line) or decode(line))
+    assert wait_until(lambda: sum(value for (name, _), value in list(metrics.counters.items()) if name == 'callbacks_skipped') >= 20)
+    assert not any(b'OnAllTrade' in line for line in decoded)  # Сделки без обработчика пропущены без разбора JSON
+    trades = []
+    provider.on_all_trade = trades.append
+    assert wait_until(lambda: trades)  # С обработчиком сделки разбираются
@@ -0,0 +1,99 @@
+from threading import Thread
+from time import sleep
+
+import pytest
+
+from BacktraderQuikJunior.QJCandles import CandleManager
+from BacktraderQuikJunior.QJStore import QKStore
+from conftest import wait_until
+
+key = ('TQBR', 'SBER', 1, '-')  # Подписка на минутные свечи
+
+
+def count_subscriptions(sim, delay=0.0, fail=0) -> list:
+    """Подсчет запросов подписки на свечи в имитаторе. Первые fail запросов возвращают ошибку источника данных"""
+    calls = []
+    handler = sim.handlers['subscribe_to_candles']
+
+    def subscribe_to_candles(msg):
+        calls.append(msg['data'])
+        sleep(delay)  # Подписка оформляется долго, остальные подписчики приходят во время нее
+        if len(calls) <= fail:
+            msg['cmd'] = 'lua_create_data_source_error'
+            msg['lua_error'] = "Can't create data source"
+            return msg
+        return handler(msg)
+
+    sim.handlers['subscribe_to_candles'] = subscribe_to_candles
+    return calls
+
+
+def subscribe_in_threads(manager, count) -> list:
+    """Одновременная подписка из нескольких потоков данных. Результат: очереди или ошибки"""
+    results = []
+
+    def subscribe():
+        try:
+            results.append(manager.subscribe(*key))
+        except ConnectionError as e:
+            results.append(e)
+
+    threads = [Thread(target=subscribe) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+@pytest.fixture
+def manager(simulator, connect):
+    sim = simulator(history_bars=10, candle_rate=50)
+    provider = connect(sim)
+    candles = CandleManager(provider, QKStore.get_bar_open_date_time)
+    provider.on_new_candle = candles.on_new_candle
+    return sim, candles
+
+
+def test_one_quik_subscription_for_all_subscribers(manager):
+    sim, candles = manager
+    calls = count_subscriptions(sim)
+    first, second = candles.subscribe(*key), candles.subscribe(*key)
+    assert len(calls) == 1 and candles.subscribers(*key) == 2
+    assert wait_until(lambda: first and second)  # Новые свечи раздаются всем подписчикам
+    assert first[0] is second[0]
+    candles.unsubscribe(first)
+    assert key in sim.candle_subscriptions  # Подписка в QUIK остается, пока есть подписчики
+    candles.unsubscribe(second)
+    candles.unsubscribe(second)  # Повторная отмена ничего не меняет
+    assert wait_until(lambda: key not in sim.candle_subscriptions)
+    assert candles.subscribers(*key) == 0 and not candles.keys
+
+
+def test_subscribers_wait_for_pending_subscription(manager):
+    sim, candles = manager
+    calls = count_subscriptions(sim, delay=0.2)
+    results = subscribe_in_threads(candles, 4)
+    assert len(calls) == 1  # Пока подписка оформляется, остальные подписчики ее ждут
+    assert len({id(queue) for queue in results}) == 4  # У каждого подписчика своя очередь
+    assert candles.subscribers(*key) == 4 and not candles.pending
+
+
+def test_failed_subscription_is_rolled_back(manager):
+    sim, candles = manager
+    calls = count_subscriptions(sim, delay=0.2, fail=1)
+    results = subscribe_in_threads(candles, 3)
+    errors = [result for result in results if isinstance(result, ConnectionError)]
+    assert len(errors) == 1  # Ошибку получает только подписчик, оформлявший подписку
+    assert len(calls) == 2  # Следующий подписчик подписывается снова
+    assert candles.subscribers(*key) == 2 and len(candles.keys) == 2 and not candles.pending
+
+
+def test_failed_subscription_without_other_subscribers(manager):
+    sim, candles = manager
+    count_subscriptions(sim, fail=1)
+    with pytest.raises(ConnectionError):
+        candles.subscribe(*key)
+    assert candles.subscribers(*key) == 0 and not candles.keys and not candles.pending  # Подписчика нет, свечи ему не раздаются
+    queue = candles.subscribe(*key)  # Следующая подписка оформляется заново
+    assert wait_until(lambda: queue)
@@ -0,0 +1,68 @@
+import pytest
+
+from BacktraderQuikJunior import QuikGateway, QuikGatewayClient
+from conftest import free_ports, wait_until
+
+candle_key = ('TQBR', 'SBER', 1, '-')  # Подписка на минутные свечи
+
+
+@pytest.fixture
+def gateway(simulator):
+    """Шлюз к имитатору и подключение его клиентов: gateway() → клиент. Клиенты отключаются до остановки шлюза"""
+    sim = simulator(history_bars=10, candle_rate=20, trade_rate=100)
+    requests_port, callbacks_port = free_ports()
+    quik_gateway = QuikGateway(requests_port=requests_port, callbacks_port=callbacks_port, quik_requests_port=sim.requests_port, quik_callbacks_port=sim.callbacks_port, heartbeat=None)
+    quik_gateway.start()
+    clients = []
+
+    def open_client() -> QuikGatewayClient:
+        client = QuikGatewayClient(requests_port=requests_port, callbacks_port=callbacks_port)
+        clients.append(client)
+        return client
+
+    yield sim, quik_gateway, open_client
+    for client in clients:
+        client.close()
+    quik_gateway.stop()
+
+
+def test_one_quik_candle_subscription_for_all_clients(gateway):
+    sim, quik_gateway, open_client = gateway
+    first, second = open_client(), open_client()
+    candles = {id(first): [], id(second): []}
+    for client in (first, second):
+        client.on_new_candle = lambda data, client=client: candles[id(client)].append(data['data']['sec'])
+        client.subscribe_to_candles(*candle_key)
+    assert list(sim.candle_subscriptions) == [candle_key]  # В QUIK одна подписка на всех клиентов
+    assert wait_until(lambda: all(candles.values()))  # Свечи получают оба клиента
+    first.unsubscribe_from_candles(*candle_key)
+    assert not first.is_subscribed(*candle_key)['data'] and second.is_subscribed(*candle_key)['data']  # Подписка считается по клиентам
+    assert candle_key in sim.candle_subscriptions
+    second.close()  # Отключение последнего подписчика отменяет подписку в QUIK
+    assert wait_until(lambda: candle_key not in sim.candle_subscriptions)
+
+
+def test_transaction_replies_go_to_sender(gateway):
+    sim, quik_gateway, open_client = gateway
+    clients = [open_client(), open_client()]
+    replies = {i: [] for i in range(len(clients))}
+    for i, client in enumerate(clients):
+        client.on_trans_reply = lambda data, i=i: replies[i].append(data['data']['trans_id'])
+        client.send_transaction({'TRANS_ID': '7', 'ACTION': 'NEW_ORDER', 'CLASSCODE': 'TQBR', 'SECCODE': 'SBER', 'OPERATION': 'B', 'PRICE': '1', 'QUANTITY': '1', 'TYPE': 'L'})  # Одинаковые номера транзакций у разных клиентов
+    assert wait_until(lambda: all(replies.values()))
+    assert replies == {0: [7], 1: [7]}  # Каждый клиент получает только свой ответ со своим номером транзакции
+    assert len({transaction['TRANS_ID'] for transaction in sim.orders.values()}) == 2  # В QUIK номера транзакций шлюза разные
+
+
+def test_callback_filters_are_merged(gateway):
+    sim, quik_gateway, open_client = gateway
+    first, second = open_client(), open_client()
+    trades = []
+    first.on_all_trade = lambda data: trades.append((data['data']['class_code'], data['data']['sec_code']))
+    first.set_callback_filter('OnAllTrade', [('TQBR', 'SBER')])
+    second.set_callback_filter('OnAllTrade', [('SPBFUT', 'SiZ6')])
+    assert sim.callback_filters['OnAllTrade'] == {('TQBR', 'SBER'), ('SPBFUT', 'SiZ6')}  # В QUIK объединение фильтров клиентов
+    assert wait_until(lambda: len(trades) >= 10)
+    assert set(trades) == {('TQBR', 'SBER')}  # Клиент получает сделки только по своему фильтру
+    second.close()
+    assert wait_until(lambda: sim.callback_filters['OnAllTrade'] == {('TQBR', 'SBER')})  # Фильтр отключенного клиента убран
@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from BacktraderQuikJunior.QJData import QKData
+
+
+class HistoryFile:
+    """Чтение и запись файла истории функциями QKData без хранилища и подключения к QUIK"""
+    delimiter = QKData.delimiter
+    dt_format = QKData.dt_format
+    block_size = 16  # Маленький блок, чтобы строки переходили через границы блоков
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+
+    save_bars_to_file = QKData.save_bars_to_file
+    read_bars_from_file = QKData.read_bars_from_file
+    seek_date_time = QKData.seek_date_time
+    seek_last_rows = QKData.seek_last_rows
+
+
+start = datetime(2025, 12, 31, 23, 50)  # Бары переходят через конец года
+
+
+def make_history(tmp_path, rows) -> HistoryFile:
+    """Файл истории из rows минутных бар"""
+    history = HistoryFile(str(tmp_path / f'TQBR.SBER_M1_{rows}.txt'))
+    history.save_bars_to_file([dict(datetime=start + timedelta(minutes=i), open=100 + i, high=101 + i, low=99 + i, close=100.5 + i, volume=i + 1) for i in range(rows)])
+    return history
+
+
+@pytest.mark.parametrize('rows', [1, 2, 50])
+def test_read_all_rows(tmp_path, rows):
+    history = make_history(tmp_path, rows)
+    bars = list(history.read_bars_from_file(history.file_name))
+    assert [bar['datetime'] for bar in bars] == [start + timedelta(minutes=i) for i in range(rows)]
+    assert bars[-1]['volume'] == rows
+
+
+@pytest.mark.parametrize('rows', [1, 2, 50])
+@pytest.mark.parametrize('offset', [-5, 0, 1, 10, 49, 50, 60])
+def test_seek_date_time(tmp_path, rows, offset):
+    history = make_history(tmp_path, rows)
+    dt_from = start + timedelta(minutes=offset)  # Бары до начала файла, внутри и после конца
+    bars = list(history.read_bars_from_file(history.file_name, dt_from=dt_from))
+    assert [bar['datetime'] for bar in bars] == [start + timedelta(minutes=i) for i in range(max(offset, 0), rows)]
+
+
+def test_seek_date_time_between_rows(tmp_path):
+    history = make_history(tmp_path, 50)
+    bars = list(history.read_bars_from_file(history.file_name, dt_from=start + timedelta(minutes=10, seconds=30)))
+    assert bars[0]['datetime'] == start + timedelta(minutes=11)
+
+
+@pytest.mark.parametrize('rows', [1, 2, 50])
+@pytest.mark.parametrize('count', [1, 2, 3, 49, 50, 100])
+def test_seek_last_rows(tmp_path, rows, count):
+    history = make_history(tmp_path, rows)
+    bars = list(history.read_bars_from_file(history.file_name, count=count))
+    assert [bar['datetime'] for bar in bars] == [start + timedelta(minutes=i) for i in range(max(rows - count, 0), rows)]
+
+
+def test_seek_date_time_and_last_rows(tmp_path):
+    history = make_history(tmp_path, 50)
+    bars = list(history.read_bars_from_file(history.file_name, dt_from=start + timedelta(minutes=45), count=10))  # Берется более поздняя граница
+    assert [bar['datetime'] for bar in bars] == [start + timedelta(minutes=i) for i in range(45, 50)]
+    bars = list(history.read_bars_from_file(history.file_name, dt_from=start + timedelta(minutes=5), count=3))
+    assert [bar['datetime'] for bar in bars] == [start + timedelta(minutes=i) for i in range(47, 50)]
@@ -0,0 +1,83 @@
+from time import sleep
+
+import pytest
+
+from BacktraderQuikJunior import QuikPool
+from BacktraderQuikJunior.QuikJuniorPy import RequestTimeoutError
+from conftest import wait_until
+
+transaction = {'TRANS_ID': '1', 'ACTION': 'NEW_ORDER', 'CLASSCODE': 'TQBR', 'SECCODE': 'SBER', 'OPERATION': 'B', 'PRICE': '0', 'QUANTITY': '1', 'TYPE': 'M'}
+
+
+@pytest.fixture
+def pool(simulator):
+    """Пул из торгового терминала (0) и терминала данных (1). Результат: пул, имитаторы терминалов"""
+    sims = [simulator(history_bars=10), simulator(history_bars=10)]
+    quik_pool = QuikPool(servers=[(sim.host, sim.requests_port, sim.callbacks_port) for sim in sims])
+    yield quik_pool, sims
+    quik_pool.close()
+
+
+def count_transactions(sims, delay=0.0) -> list:
+    """Номера имитаторов, получивших транзакцию. Первый имитатор отвечает с задержкой"""
+    calls = []
+    for i, sim in enumerate(sims):
+        sim.handlers['sendTransaction'] = lambda msg, i=i: calls.append(i) or sleep(delay if i == 0 else 0) or 1
+    return calls
+
+
+def test_sent_transaction_is_not_retried(pool):
+    quik_pool, sims = pool
+    calls = count_transactions(sims, delay=0.5)
+    with pytest.raises(RequestTimeoutError) as e:
+        with quik_pool.endpoint('trading').provider.deadline(0.2):
+            quik_pool.send_transaction(transaction)
+    assert e.value.sent  # Признак отправки сохраняется
+    sleep(0.5)
+    assert calls == [0]  # Заявка могла уйти на биржу, на другом терминале она не повторяется
+    assert not quik_pool.endpoints[0].healthy and quik_pool.roles['trading'] == 1  # Терминал не отвечает, роль переключена
+
+
+def test_transaction_is_not_retried_after_connection_error(pool):
+    quik_pool, sims = pool
+    calls = count_transactions(sims)
+    sims[0].disconnect()
+    with pytest.raises(OSError) as e:
+        quik_pool.send_transaction(transaction)
+    assert not isinstance(e.value, RequestTimeoutError)  # Исключение соединения передается без изменений
+    assert 1 not in calls
+
+
+def test_data_request_fails_over(pool):
+    quik_pool, sims = pool
+    sims[1].disconnect()
+    assert len(quik_pool.get_candles_from_data_source('TQBR', 'SBER', 1)['data']) == 10  # Запрос данных выполнен на торговом терминале
+    assert quik_pool.roles == dict(trading=0, data=0)
+
+
+def test_no_healthy_endpoints(pool):
+    quik_pool, sims = pool
+    for sim in sims:
+        sim.disconnect()
+    with pytest.raises(OSError):
+        quik_pool.get_candles_from_data_source('TQBR', 'SBER', 1)
+    assert not any(endpoint.healthy for endpoint in quik_pool.endpoints)
+
+
+def test_monitor_reconnects_endpoint(pool):
+    quik_pool, sims = pool
+    reconnected = []
+    quik_pool.start_monitor(0.1, [lambda: reconnected.append(True)])
+    quik_pool.set_callback_filter('OnParam', [('SPBFUT', 'SiZ6')])
+    sims[1].disconnect()
+    assert wait_until(lambda: quik_pool.endpoints[1].failures and quik_pool.endpoints[1].healthy and reconnected)  # Терминал подключен снова, сверка выполнена
+    assert wait_until(lambda: sims[1].callback_filters.get('OnParam') == {('SPBFUT', 'SiZ6')})  # Фильтры возобновлены на новом подключении
+    quik_pool.stop_monitor()
+    assert quik_pool.thread is None
+
+
+def test_profiles_live_on_data_endpoint(pool):
+    quik_pool, sims = pool
+    profile = quik_pool.get_instrument_profile('SPBFUT', 'SiZ6')
+    assert profile is quik_pool.endpoints[1].provider.profiles[('SPBFUT', 'SiZ6')]  # Профиль обновляется по OnParam терминала данных
+    assert ('SPBFUT', 'SiZ6') not in quik_pool.endpoints[0].provider.profiles
@@ -0,0 +1,101 @@
+from threading import Thread
+from types import SimpleNamespace
+
+import pytest
+from backtrader import BuyOrder, Order
+from backtrader.position import Position
+
+from BacktraderQuikJunior.QJSupervisor import ConnectionSupervisor
+from conftest import wait_until
+
+
+def restart_script(sim) -> None:
+    """Перезапуск скрипта QUIK#: соединение разрывается, подписки и фильтры скрипта теряются"""
+    sim.disconnect()
+    with sim.state_lock:
+        sim.candle_subscriptions.clear()
+        sim.quote_subscriptions.clear()
+        sim.callback_filters.clear()
+
+
+def test_supervisor_restores_subscriptions(simulator, connect):
+    sim = simulator(history_bars=10)
+    provider = connect(sim)
+    provider.subscribe_to_candles('TQBR', 'SBER', 1)
+    provider.subscribe_level2_quotes('SPBFUT', 'SiZ6')
+    provider.set_callback_filter('OnQuote', [('SPBFUT', 'SiZ6')])
+    supervisor = ConnectionSupervisor(heartbeat=0.1, min_delay=0.05)
+    reconnected = []
+    supervisor.on_reconnected.append(lambda: reconnected.append(True))
+    supervisor.start(provider)
+    restart_script(sim)
+    assert wait_until(lambda: reconnected)  # Сверка после повторного подключения
+    supervisor.stop()
+    assert supervisor.reconnects == 1
+    assert ('TQBR', 'SBER', 1, '-') in sim.candle_subscriptions  # Подписки возобновлены
+    assert ('SPBFUT', 'SiZ6') in sim.quote_subscriptions
+    assert sim.callback_filters['OnQuote'] == {('SPBFUT', 'SiZ6')}  # Фильтр возобновлен до подписок
+    assert provider.ping()['data'] == 'Pong'
+
+
+@pytest.fixture
+def broker(simulator, store):
+    """Брокер без cerebro, подключенный к имитатору. Функции обратного вызова сделок не назначены, как во время простоя"""
+    sim = simulator(history_bars=10)
+    return sim, store(sim).getbroker()
+
+
+def buy_order(broker, trans_id, size=10) -> Order:
+    """Принятая заявка на покупку size штук SBER, отправленная на биржу с номером транзакции trans_id"""
+    data = SimpleNamespace(_name='TQBR.SBER', derivative=False, datetime={0: 0})  # Последний бар данных
+    order = BuyOrder(owner=None, data=None, size=size, price=None, exectype=Order.Market, simulated=True)
+    order.data = data
+    order.accept()
+    broker.orders[trans_id] = order
+    return order
+
+
+def send_market_order(sim, broker, trans_id) -> int:
+    """Заявка исполняется в имитаторе, но сделку брокер не получает. Результат: номер заявки на бирже"""
+    broker.store.provider.send_transaction({'TRANS_ID': str(trans_id), 'ACTION': 'NEW_ORDER', 'CLASSCODE': 'TQBR', 'SECCODE': 'SBER', 'OPERATION': 'B', 'PRICE': '0', 'QUANTITY': '1', 'TYPE': 'M'})
+    return max(sim.trades)
+
+
+def test_reconcile_applies_missed_trades_and_positions(broker):
+    sim, qk_broker = broker
+    order = buy_order(qk_broker, 7)
+    order.addinfo(order_num=send_market_order(sim, qk_broker, 7))
+    sim.handlers['get_depo_limits'] = lambda msg: [dict(client_code=sim.client_code, firmid=sim.stock_firm_id, sec_code='SBER', limit_kind=2, currentbal=10, wa_position_price=300.0)]
+    qk_broker.positions['TQBR.GAZP'] = Position(5, 100.0)  # Позиция закрыта в QUIK за время простоя
+    qk_broker.reconcile()
+    qk_broker.reconcile()  # Повторная сверка сделки не дублирует
+    assert order.status == Order.Completed and order.executed.size == 10  # 1 лот = 10 штук
+    assert len(qk_broker.trade_nums['TQBR.SBER']) == 1
+    assert qk_broker.positions['TQBR.SBER'].size == 10  # Позиции берутся из QUIK
+    assert qk_broker.positions['TQBR.GAZP'].size == 0
+
+
+def test_reconcile_cancels_orders_canceled_during_downtime(broker):
+    sim, qk_broker = broker
+    order = buy_order(qk_broker, 8)
+    order.addinfo(order_num=12345)
+    sim.canceled_orders.add(12345)  # Заявку сняли в терминале за время простоя
+    qk_broker.reconcile()
+    assert order.status == Order.Canceled
+
+
+def test_duplicate_trades_are_applied_once(broker):
+    sim, qk_broker = broker
+    order = buy_order(qk_broker, 9, size=1000)  # Заявка исполняется частями
+    trade = dict(order_num=1, trans_id=9, class_code='TQBR', sec_code='SBER', qty=1, flags=0, price=300.0)
+
+    def replay():  # Поток обратного вызова и сверка получают одни и те же сделки
+        for trade_num in range(50):
+            qk_broker.on_trade({'data': dict(trade, trade_num=trade_num)})
+
+    threads = [Thread(target=replay) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert order.executed.size == 500 and qk_broker.positions['TQBR.SBER'].size == 500  # Каждая сделка учтена один раз
@@ -0,0 +1,60 @@
+from BacktraderQuikJunior import QuikReplay, SessionRecorder, read_session
+from conftest import wait_until
+
+
+def test_recorder_appends_and_stops_at_truncated_record(tmp_path):
+    file_name = str(tmp_path / 'session.qjr')
+    for _ in range(2):  # Второй журнал дописывается в тот же файл
+        recorder = SessionRecorder(file_name)
+        recorder.callback(b'{"cmd":"OnParam"}')
+        recorder.exchange(b'{"cmd":"ping"}\r\n', b'{"cmd":"ping","data":"Pong"}', 1)
+        recorder.close()
+    records = list(read_session(file_name))
+    assert [kind for kind, _, _ in records] == [SessionRecorder.CALLBACK, SessionRecorder.REQUEST, SessionRecorder.RESPONSE] * 2  # Заголовок журнала записан один раз
+    assert records[1][1:] == (1, b'{"cmd":"ping"}')  # Запрос без перевода строки со временем отправки
+    with open(file_name, 'r+b') as file:  # Процесс прерван во время записи
+        file.truncate(file.seek(0, 2) - 3)
+    assert len(list(read_session(file_name))) == 5
+
+
+def run_session(provider, wait) -> list:
+    """Подписка на свечи и заявка. Результат: функции обратного вызова в порядке получения"""
+    events = []
+    provider.on_new_candle = lambda data: events.append(('NewCandle', data['data']['datetime']['min']))
+    provider.on_trans_reply = lambda data: events.append(('OnTransReply', data['data']['trans_id']))
+    provider.on_trade = lambda data: events.append(('OnTrade', data['data']['trade_num']))
+    provider.subscribe_to_candles('TQBR', 'SBER', 1)
+    wait(lambda: len(events) >= 3)
+    provider.send_transaction({'TRANS_ID': '7', 'ACTION': 'NEW_ORDER', 'CLASSCODE': 'TQBR', 'SECCODE': 'SBER', 'OPERATION': 'B', 'PRICE': '0', 'QUANTITY': '1', 'TYPE': 'M'})
+    wait(lambda: ('OnTransReply', 7) in events and any(cmd == 'OnTrade' for cmd, _ in events))
+    provider.unsubscribe_from_candles('TQBR', 'SBER', 1)
+    return events
+
+
+def test_replay_reproduces_recorded_session(simulator, connect, tmp_path):
+    file_name = str(tmp_path / 'session.qjr')
+    sim = simulator(history_bars=10, candle_rate=20)
+    live = connect(sim, record=file_name)
+    recorded = run_session(live, wait_until)
+    live.close()
+    assert len(recorded) >= 5 and ('OnTransReply', 7) in recorded
+    for speed in (10, None):  # Ускоренное воспроизведение и без пауз
+        replay = QuikReplay(file_name, speed=speed)
+        replayed = run_session(replay, lambda predicate: None)  # Функции обратного вызова ждут записанные до них запросы
+        assert replay.finished.wait(5)
+        replay.close()
+        assert replayed == recorded
+        assert replay.echo('not recorded')['cmd'] == 'lua_error'  # Незаписанный запрос получает ошибку, как от скрипта QUIK#
+
+
+def test_store_restart_reopens_journal(simulator, store, tmp_path):
+    file_name = str(tmp_path / 'session.qjr')
+    sim = simulator(history_bars=10)
+    qk_store = store(sim, record=file_name)
+    recorders = []
+    for _ in range(2):  # Перезапуск хранилища с тем же журналом
+        qk_store.start()
+        recorders.append(qk_store.provider.recorder)
+        qk_store.stop()
+    assert recorders[0] is not recorders[1] and all(recorder.file.closed for recorder in recorders)  # Журнал закрыт при каждой остановке
+    assert len(list(read_session(file_name))) == sum(recorder.records for recorder in recorders)  # Записи обеих сессий в одном журнале
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from BacktraderQuikJunior.QJInstrument import TickGrid
+
+
+@pytest.mark.parametrize('step, scale, price, floor, ceil, nearest', [
+    (0.25, 2, 100.3, 401, 402, 401),  # Шаг не степень 10
+    (0.25, 2, -100.3, -402, -401, -401),  # Отрицательная цена (спред)
+    (5, 0, 1003, 200, 201, 201),  # Целый шаг больше 1
+    (5, 0, -1003, -201, -200, -201),
+    (0.0025, 4, 1.2345, 493, 494, 494),
+    (0.2, 0, 10.3, 51, 52, 52),  # Кол-во десятичных знаков меньше, чем у шага цены
+    (0.5, 2, 100.25, 200, 201, 200),  # Половина шага округляется до четного тика
+    (0.5, 2, 100.75, 201, 202, 202),
+    (0.01, 2, 0.1 + 0.2, 30, 30, 30),  # Погрешность float (0.30000000000000004) округлением не считается
+    (0.00001, 5, 98765.43219, 9876543219, 9876543219, 9876543219),  # Большое кол-во тиков
+])
+def test_price_to_ticks(step, scale, price, floor, ceil, nearest):
+    grid = TickGrid(step, scale)
+    assert grid.price_to_ticks(price, TickGrid.FLOOR) == floor
+    assert grid.price_to_ticks(price, TickGrid.CEIL) == ceil
+    assert grid.price_to_ticks(price, TickGrid.NEAREST) == nearest
+    prices = [price, price, price]
+    assert grid.prices_to_ticks(prices, TickGrid.FLOOR).tolist() == [floor] * 3  # Пакетный перевод совпадает с поштучным
+    assert grid.prices_to_ticks(prices, TickGrid.CEIL).tolist() == [ceil] * 3
+    assert grid.prices_to_ticks(prices, TickGrid.NEAREST).tolist() == [nearest] * 3
+
+
+@pytest.mark.parametrize('step, scale, price', [(0.1, 1, 100.3), (0.01, 2, 0.29), (0.25, 2, -100.25), (0.0025, 4, 1.2325), (5, 0, -1005)])
+def test_price_on_grid_is_not_rounded(step, scale, price):
+    grid = TickGrid(step, scale)  # Погрешность float (1002.9999999999999 вместо 1003) округлением не считается
+    assert grid.is_on_grid(price)
+    ticks = grid.price_to_ticks(price, TickGrid.FLOOR)
+    assert ticks == grid.price_to_ticks(price, TickGrid.CEIL)
+    assert grid.ticks_to_price(ticks) == price
+
+
+@pytest.mark.parametrize('step, scale, ticks, text, price', [
+    (0.25, 2, -402, '-100.50', -100.5),
+    (0.25, 2, -1, '-0.25', -0.25),
+    (0.0025, 4, 493, '1.2325', 1.2325),
+    (0.2, 0, 51, '10.2', 10.2),
+    (5, 0, -201, '-1005', -1005),
+])
+def test_ticks_to_price(step, scale, ticks, text, price):
+    grid = TickGrid(step, scale)
+    assert grid.ticks_to_str(ticks) == text
+    assert grid.ticks_to_price(ticks) == price
+    assert grid.ticks_to_prices([ticks]).tolist() == [price]
+
+
+def test_integer_prices():
+    grid = TickGrid(5, 0)
+    assert isinstance(grid.ticks_to_price(200), int)  # Цена без десятичных знаков остается целой
+    assert grid.valid_prices(np.array([1003.0, -1003.0])).tolist() == [1000, -1005]
+
+
+def test_ladder_down():
+    grid = TickGrid(0.25, 2)
+    assert grid.ladder(-100.3, 3, step_ticks=-2) == [-100.5, -101.0, -101.5]
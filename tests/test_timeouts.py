@@ -0,0 +1,62 @@
+from threading import Thread, Timer
+from time import monotonic, sleep
+
+import pytest
+
+from BacktraderQuikJunior.QuikJuniorPy import RequestTimeoutError
+
+
+def sleep_request(ms) -> dict:
+    """Запрос, на время которого скрипт QUIK# приостанавливается"""
+    return {'data': ms, 'id': 0, 'cmd': 'sleep', 't': ''}
+
+
+@pytest.fixture
+def provider(simulator, connect):
+    return connect(simulator(history_bars=10), timeout=5)
+
+
+def test_timeout_skips_late_response(provider):
+    start = monotonic()
+    with pytest.raises(RequestTimeoutError) as e:
+        provider.process_request(sleep_request(500), timeout=0.1)
+    assert e.value.sent and monotonic() - start < 0.4  # Запрос отправлен, ответа не ждали
+    assert provider.echo('after')['data'] == 'after'  # Поздний ответ пропущен, следующий запрос получает свой ответ
+    assert provider.abandoned == 0
+
+
+def test_deadline_while_lock_is_held(provider):
+    thread = Thread(target=provider.process_request, args=(sleep_request(500),))
+    thread.start()
+    sleep(0.05)
+    with pytest.raises(RequestTimeoutError) as e:
+        with provider.deadline(0.1):
+            provider.ping()
+    assert not e.value.sent  # Запрос не отправлен, соединение занято долгим запросом
+    thread.join()
+    assert provider.ping()['data'] == 'Pong'
+
+
+def test_nested_deadline_only_shortens(provider):
+    with provider.deadline(0.1):
+        with provider.deadline(10):  # Вложенный блок не продлевает срок внешнего
+            with pytest.raises(RequestTimeoutError):
+                provider.process_request(sleep_request(300))
+    with provider.deadline(10):
+        assert provider.process_request(sleep_request(10))['data'] == 1  # После блока срок восстановлен
+
+
+def test_cancel_request(provider):
+    Timer(0.1, provider.cancel_request).start()
+    start = monotonic()
+    with pytest.raises(RequestTimeoutError, match='отменен'):
+        provider.process_request(sleep_request(500))
+    assert monotonic() - start < 0.4
+    assert provider.echo('after')['data'] == 'after'
+
+
+def test_batch_timeout_skips_remaining_responses(provider):
+    requests = [{'data': 'first', 'id': 0, 'cmd': 'echo', 't': ''}, sleep_request(300), {'data': 'last', 'id': 0, 'cmd': 'echo', 't': ''}]
+    with pytest.raises(RequestTimeoutError):
+        provider.process_requests(requests, timeout=0.1)
+    assert [result['data'] for result in provider.process_requests(requests[::2])] == ['first', 'last']  # Ответы прерванной пачки пропущены